@@ -0,0 +1,495 @@
+import os
+import json
+import time
+import random
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import block_device
+from storage_bench import aligned_buffer, open_direct, pread_into, write_journal, restore_journal, MiB
+
+logger = logging.getLogger(__name__)
+
+# 只读扫描
+MODE_READ = 'read'
+# 读出原数据、写入测试数据、读回比较、再写回原数据
+MODE_NONDESTRUCTIVE = 'nondestructive'
+# 依次用几种图案写满整个设备再读回比较，清除所有数据
+MODE_DESTRUCTIVE = 'destructive'
+MODES = (MODE_READ, MODE_NONDESTRUCTIVE, MODE_DESTRUCTIVE)
+
+DEFAULT_CHUNK_SIZE = 4 * MiB
+# 出错的块先按这么多份拆分，再逐级缩小到扇区
+LOCATE_SPLIT = 16
+DESTRUCTIVE_PATTERNS = (0xAA, 0x55, 0xFF, 0x00)
+# 断点文件的保存间隔（秒）
+STATE_INTERVAL = 5.0
+# 抽样检查：读取的位置数和每处读取的字节数
+SAMPLE_COUNT = 64
+SAMPLE_SIZE = 1 * MiB
+
+GRADE_GOOD = '良好'
+GRADE_FAIR = '一般'
+GRADE_POOR = '较差'
+# 坏扇区占比不超过这个值时评为“一般”
+FAIR_BAD_RATIO = 0.0001
+
+
+class BadRanges:
+    """坏扇区的行程编码：按起始LBA排序的 [起始LBA, 连续扇区数] 列表，相邻区间自动合并"""
+
+    def __init__(self, ranges=()):
+        self.ranges = []
+        for start, count in ranges:
+            self.add(start, count)
+
+    def add(self, lba, count=1):
+        ranges = self.ranges
+        end = lba + count
+        index = 0
+        while index < len(ranges) and ranges[index][0] + ranges[index][1] < lba:
+            index += 1
+        # 合并所有与 [lba, end) 重叠或相邻的区间
+        while index < len(ranges) and ranges[index][0] <= end:
+            start, length = ranges.pop(index)
+            lba = min(lba, start)
+            end = max(end, start + length)
+        ranges.insert(index, [lba, end - lba])
+
+    def __contains__(self, lba):
+        return any(start <= lba < start + count for start, count in self.ranges)
+
+    def __len__(self):
+        """坏扇区总数"""
+        return sum(count for _, count in self.ranges)
+
+    def __iter__(self):
+        return iter(self.ranges)
+
+    def __repr__(self):
+        return f"BadRanges({self.ranges!r})"
+
+    def to_list(self):
+        return [list(item) for item in self.ranges]
+
+
+class ScanResult:
+    """坏块扫描结果，LBA 以逻辑扇区为单位"""
+    __slots__ = ('path', 'mode', 'size', 'sector_size', 'bad', 'read_errors', 'write_errors', 'corruption_errors',
+                 'scanned', 'elapsed', 'complete')
+
+    def __init__(self, path, mode, size, sector_size, bad=None, read_errors=0, write_errors=0,
+                 corruption_errors=0, scanned=0, elapsed=0.0, complete=False):
+        """
+        :param bad: BadRanges
+        :param scanned: 已检查的字节数
+        :param complete: 扫描是否全部完成（取消或中断时为False，可以续扫）
+        """
+        self.path = path
+        self.mode = mode
+        self.size = size
+        self.sector_size = sector_size
+        self.bad = bad if bad is not None else BadRanges()
+        self.read_errors = read_errors
+        self.write_errors = write_errors
+        self.corruption_errors = corruption_errors
+        self.scanned = scanned
+        self.elapsed = elapsed
+        self.complete = complete
+
+    def __repr__(self):
+        return f"ScanResult({self.path!r}, mode={self.mode!r}, bad={len(self.bad)}, complete={self.complete})"
+
+    @property
+    def bad_sectors(self):
+        return len(self.bad)
+
+    @property
+    def grade(self):
+        """按坏扇区占比评级"""
+        if not self.bad_sectors:
+            return GRADE_GOOD
+        sectors = max(self.size // self.sector_size, 1)
+        return GRADE_FAIR if self.bad_sectors / sectors <= FAIR_BAD_RATIO else GRADE_POOR
+
+    def to_dict(self):
+        result = {name: getattr(self, name) for name in self.__slots__}
+        result['bad'] = self.bad.to_list()
+        result['bad_sectors'] = self.bad_sectors
+        result['grade'] = self.grade
+        return result
+
+    @classmethod
+    def from_dict(cls, data):
+        values = {name: data[name] for name in cls.__slots__ if name in data}
+        values['bad'] = BadRanges(data.get('bad', ()))
+        return cls(**values)
+
+
+class BadBlockScanner:
+    """
+    坏块扫描：大块对齐缓冲区、后台线程预读下一块（双缓冲），
+    出错的块逐级拆分定位到扇区；可取消，断点保存在状态文件中下次续扫
+    """
+
+    def __init__(self, path, mode=MODE_READ, chunk_size=DEFAULT_CHUNK_SIZE, state_path=None, direct=True,
+                 cancel_check=None, progress=None, identity=None):
+        """
+        :param mode: MODE_READ、MODE_NONDESTRUCTIVE 或 MODE_DESTRUCTIVE
+        :param state_path: 断点文件；非破坏模式还会在旁边保存当前块原数据的恢复日志
+        :param identity: 设备身份（如 DeviceIdentity.key），保存在断点中，续扫时按身份而不是设备路径匹配，
+                         重新插拔后设备名变了也能续扫；None时按路径匹配
+        :param progress: progress(已完成字节, 总字节, 当前坏扇区数) 回调
+        """
+        if mode not in MODES:
+            raise ValueError(f"未知的扫描模式: {mode}")
+        self.path = path
+        self.mode = mode
+        self.state_path = state_path
+        self.identity = identity
+        self.direct = direct
+        self.cancel_check = cancel_check or (lambda: False)
+        self.progress = progress or (lambda done, total, bad: None)
+        info = block_device.probe(path)
+        self.sector_size = max(info.logical_sector_size, 512)
+        # 直接I/O要求长度和偏移按扇区（及最小I/O大小）对齐
+        self.alignment = info.alignment
+        self.chunk_size = max(chunk_size // self.alignment, 1) * self.alignment
+        self.size = info.size // self.alignment * self.alignment
+        self._last_state = 0.0
+
+    @property
+    def journal_path(self):
+        return self.state_path + '.journal' if self.state_path else None
+
+    # ---- 底层读写 ----
+
+    def _pread(self, fd, buf, offset):
+        return pread_into(fd, buf, offset)
+
+    def _pwrite(self, fd, data, offset):
+        return os.pwrite(fd, data, offset)
+
+    def _read_ok(self, fd, offset, length):
+        buf = aligned_buffer(length)
+        try:
+            return self._pread(fd, buf, offset) == length
+        except OSError:
+            return False
+        finally:
+            buf.close()
+
+    def _locate(self, fd, offset, length, result):
+        """逐级拆分读不出的区域，把读不出的扇区记为坏块"""
+        if length <= self.alignment:
+            if not self._read_ok(fd, offset, length):
+                result.bad.add(offset // self.sector_size, length // self.sector_size)
+            return
+        part = max(length // LOCATE_SPLIT // self.alignment, 1) * self.alignment
+        for start in range(offset, offset + length, part):
+            size = min(part, offset + length - start)
+            if self.cancel_check():
+                return
+            if not self._read_ok(fd, start, size):
+                self._locate(fd, start, size, result)
+
+    def _compare(self, data, expected, offset, result):
+        """逐扇区比较读回的数据，不一致的扇区记为坏块"""
+        if data == expected:
+            return
+        step = self.alignment
+        for position in range(0, len(expected), step):
+            if data[position:position + step] != expected[position:position + step]:
+                result.corruption_errors += 1
+                result.bad.add((offset + position) // self.sector_size, step // self.sector_size)
+
+    def _chunks(self, fd, start, end):
+        """
+        双缓冲顺序读取：处理当前块时后台线程已在读下一块
+        :return: 生成 (偏移, 长度, 数据视图或None)，None表示该块读取出错
+        """
+        buffers = [aligned_buffer(self.chunk_size), aligned_buffer(self.chunk_size)]
+
+        def read(offset, buf):
+            length = min(self.chunk_size, end - offset)
+            try:
+                with memoryview(buf) as view:
+                    return length, self._pread(fd, view[:length], offset) == length
+            except OSError:
+                return length, False
+
+        pool = ThreadPoolExecutor(max_workers=1)
+        future = pool.submit(read, start, buffers[0]) if start < end else None
+        offset = start
+        index = 0
+        try:
+            while future is not None:
+                length, ok = future.result()
+                following = offset + length
+                future = None
+                if following < end and not self.cancel_check():
+                    future = pool.submit(read, following, buffers[(index + 1) % 2])
+                with memoryview(buffers[index % 2]) as view:
+                    with view[:length] as data:
+                        yield offset, length, data if ok else None
+                offset = following
+                index += 1
+        finally:
+            if future is not None:
+                future.result()
+            pool.shutdown()
+            for buf in buffers:
+                buf.close()
+
+    def _write_chunk(self, fd, offset, data, result):
+        try:
+            if self._pwrite(fd, data, offset) == len(data):
+                return True
+        except OSError as e:
+            logger.debug(f"偏移 {offset} 写入失败: {e}")
+        result.write_errors += 1
+        result.bad.add(offset // self.sector_size, len(data) // self.sector_size)
+        return False
+
+    # ---- 断点 ----
+
+    def _load_state(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return None
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取扫描断点失败，重新开始: {e}")
+            return None
+        if self.identity is not None:
+            same_device = state.get('identity') == self.identity
+        else:
+            same_device = state.get('path') == os.path.abspath(self.path)
+        if (not same_device or state.get('mode') != self.mode
+                or state.get('size') != self.size or state.get('chunk_size') != self.chunk_size):
+            logger.info("设备或扫描参数已变化，不使用旧断点")
+            return None
+        return state
+
+    def _save_state(self, result, position, pass_index=0, phase='read', force=False):
+        if not self.state_path:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_state < STATE_INTERVAL:
+            return
+        self._last_state = now
+        state = dict(result.to_dict(), path=os.path.abspath(self.path), identity=self.identity,
+                     chunk_size=self.chunk_size,
+                     position=position, pass_index=pass_index, phase=phase)
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        with open(self.state_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(self.state_path + '.tmp', self.state_path)
+
+    def _clear_state(self):
+        for path in (self.state_path, self.journal_path):
+            if path and os.path.exists(path):
+                os.remove(path)
+
+    # ---- 扫描 ----
+
+    def scan(self, resume=True):
+        """
+        :param resume: 有匹配的断点时从断点继续
+        :return: ScanResult
+        """
+        started = time.monotonic()
+        state = self._load_state() if resume else None
+        if state:
+            result = ScanResult.from_dict(state)
+            result.path = os.path.abspath(self.path)
+            result.complete = False
+            position, pass_index, phase = state['position'], state.get('pass_index', 0), state.get('phase', 'read')
+            logger.info(f"从 {position} 字节处继续扫描 {self.path}")
+        else:
+            result = ScanResult(os.path.abspath(self.path), self.mode, self.size, self.sector_size)
+            position, pass_index, phase = 0, 0, 'read' if self.mode != MODE_DESTRUCTIVE else 'write'
+        previous_elapsed = result.elapsed
+
+        fd, direct_io = open_direct(self.path, self.mode != MODE_READ, self.direct)
+        try:
+            # 非破坏扫描上次在写入测试数据和写回原数据之间中断
+            if self.mode == MODE_NONDESTRUCTIVE and self.journal_path and os.path.exists(self.journal_path):
+                restored = restore_journal(self.journal_path, self.path)
+                logger.info(f"已写回上次中断时的 {restored} 字节原数据")
+            if self.mode == MODE_READ:
+                position = self._scan_read(fd, position, result)
+            elif self.mode == MODE_NONDESTRUCTIVE:
+                position = self._scan_nondestructive(fd, position, result, direct_io)
+            else:
+                position, pass_index, phase = self._scan_destructive(fd, position, pass_index, phase, result,
+                                                                     direct_io)
+        finally:
+            os.close(fd)
+        # 出错中断时保留最近一次定期保存的断点
+        result.elapsed = previous_elapsed + time.monotonic() - started
+        result.complete = position >= self.size
+        if result.complete:
+            self._clear_state()
+        else:
+            self._save_state(result, position, pass_index, phase, force=True)
+        return result
+
+    def sample(self, count=SAMPLE_COUNT, sample_size=SAMPLE_SIZE):
+        """
+        抽样只读检查：把设备均分为 count 段，每段随机读取一处（首尾两处固定），读不出时定位到扇区
+        耗时与设备大小无关，适合健康检查；不使用也不影响断点，完整结果仍需 scan()
+        :return: ScanResult，scanned 为实际读取的字节数，complete 为False
+        """
+        started = time.monotonic()
+        result = ScanResult(os.path.abspath(self.path), self.mode, self.size, self.sector_size)
+        length = min(max(sample_size // self.alignment, 1) * self.alignment, self.size)
+        slots = self.size // self.alignment
+        # 设备小于 count 处抽样的总量时相当于读完整个设备
+        count = max(min(count, self.size // length if length else 1), 1)
+        offsets = set()
+        for index in range(count):
+            low = slots * index // count
+            high = max(slots * (index + 1) // count - length // self.alignment, low)
+            offsets.add(min(random.randint(low, high) * self.alignment, self.size - length))
+        offsets.update((0, self.size - length))
+        fd, _ = open_direct(self.path, False, self.direct)
+        buf = aligned_buffer(length)
+        try:
+            for done, offset in enumerate(sorted(offsets), 1):
+                if self.cancel_check():
+                    break
+                try:
+                    with memoryview(buf) as view:
+                        ok = self._pread(fd, view[:length], offset) == length
+                except OSError:
+                    ok = False
+                if not ok:
+                    result.read_errors += 1
+                    self._locate(fd, offset, length, result)
+                result.scanned += length
+                self.progress(done, len(offsets), result.bad_sectors)
+        finally:
+            buf.close()
+            os.close(fd)
+        result.elapsed = time.monotonic() - started
+        return result
+
+    def _scan_read(self, fd, position, result):
+        for offset, length, data in self._chunks(fd, position, self.size):
+            if data is None:
+                result.read_errors += 1
+                self._locate(fd, offset, length, result)
+            position = offset + length
+            result.scanned = position
+            self.progress(position, self.size, result.bad_sectors)
+            self._save_state(result, position)
+            if self.cancel_check():
+                break
+        return position
+
+    def _scan_nondestructive(self, fd, position, result, direct_io):
+        pattern = aligned_buffer(self.chunk_size)
+        check = aligned_buffer(self.chunk_size)
+        pattern.write(os.urandom(self.chunk_size))
+        if self.journal_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.journal_path)), exist_ok=True)
+        try:
+            for offset, length, original in self._chunks(fd, position, self.size):
+                if original is None:
+                    # 读不出的区域不写入，只定位坏扇区
+                    result.read_errors += 1
+                    self._locate(fd, offset, length, result)
+                else:
+                    if self.journal_path:
+                        write_journal(self.journal_path, self.path, offset, original)
+                    with memoryview(pattern) as expected, memoryview(check) as readback:
+                        if self._write_chunk(fd, offset, expected[:length], result):
+                            if not direct_io:
+                                os.fsync(fd)
+                            try:
+                                ok = self._pread(fd, readback[:length], offset) == length
+                            except OSError:
+                                ok = False
+                            if ok:
+                                self._compare(readback[:length], expected[:length], offset, result)
+                            else:
+                                result.read_errors += 1
+                                result.bad.add(offset // self.sector_size, length // self.sector_size)
+                        # 无论测试结果如何都写回原数据
+                        if not self._write_chunk(fd, offset, original, result):
+                            raise IOError(f"无法写回偏移 {offset} 的原数据，恢复日志: {self.journal_path}")
+                        if not direct_io:
+                            os.fsync(fd)
+                position = offset + length
+                result.scanned = position
+                self.progress(position, self.size, result.bad_sectors)
+                self._save_state(result, position)
+                if self.cancel_check():
+                    break
+        finally:
+            pattern.close()
+            check.close()
+        return position
+
+    def _scan_destructive(self, fd, position, pass_index, phase, result, direct_io):
+        """每种图案先写满整个设备再统一读回，能发现地址回绕"""
+        total = self.size * 2 * len(DESTRUCTIVE_PATTERNS)
+        chunk = aligned_buffer(self.chunk_size)
+        try:
+            while pass_index < len(DESTRUCTIVE_PATTERNS):
+                value = DESTRUCTIVE_PATTERNS[pass_index]
+                chunk.seek(0)
+                chunk.write(bytes([value]) * self.chunk_size)
+                base = pass_index * 2 * self.size
+                if phase == 'write':
+                    with memoryview(chunk) as view:
+                        while position < self.size and not self.cancel_check():
+                            length = min(self.chunk_size, self.size - position)
+                            self._write_chunk(fd, position, view[:length], result)
+                            position += length
+                            self.progress(base + position, total, result.bad_sectors)
+                            self._save_state(result, position, pass_index, phase)
+                    if position < self.size:
+                        return position, pass_index, phase
+                    if not direct_io:
+                        os.fsync(fd)
+                    position, phase = 0, 'read'
+                with memoryview(chunk) as expected:
+                    for offset, length, data in self._chunks(fd, position, self.size):
+                        if data is None:
+                            result.read_errors += 1
+                            self._locate(fd, offset, length, result)
+                        else:
+                            self._compare(data, expected[:length], offset, result)
+                        position = offset + length
+                        result.scanned = max(result.scanned, position)
+                        self.progress(base + self.size + position, total, result.bad_sectors)
+                        self._save_state(result, position, pass_index, phase)
+                        if self.cancel_check():
+                            break
+                if position < self.size:
+                    return position, pass_index, phase
+                pass_index += 1
+                if pass_index < len(DESTRUCTIVE_PATTERNS):
+                    position, phase = 0, 'write'
+        finally:
+            chunk.close()
+        return self.size, pass_index, phase
+
+
+def scan(path, mode=MODE_READ, resume=True, **options):
+    """
+    扫描坏块
+    :return: ScanResult
+    """
+    return BadBlockScanner(path, mode, **options).scan(resume)
+
+
+def sample(path, count=SAMPLE_COUNT, sample_size=SAMPLE_SIZE, **options):
+    """
+    抽样只读检查坏块，见 BadBlockScanner.sample
+    :return: ScanResult
+    """
+    return BadBlockScanner(path, MODE_READ, **options).sample(count, sample_size)
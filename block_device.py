@@ -0,0 +1,183 @@
+import os
+import stat
+import struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+SYS_CLASS_BLOCK = '/sys/class/block'
+
+# linux/fs.h
+BLKROGET = 0x125E
+BLKSSZGET = 0x1268
+BLKIOMIN = 0x1278
+BLKIOOPT = 0x1279
+BLKPBSZGET = 0x127B
+BLKGETSIZE64 = 0x80081272
+
+DEFAULT_IO_SIZE = 1024 * 1024
+MAX_IO_SIZE = 64 * 1024 * 1024
+
+
+class BlockDeviceInfo:
+    """块设备（或镜像文件）的容量和I/O特性"""
+    __slots__ = ('path', 'size', 'logical_sector_size', 'physical_sector_size', 'minimum_io_size',
+                 'optimal_io_size', 'max_request_size', 'rotational', 'discard', 'discard_granularity',
+                 'removable', 'read_only', 'is_partition')
+
+    def __init__(self, path, size=0, logical_sector_size=512, physical_sector_size=512, minimum_io_size=0,
+                 optimal_io_size=0, max_request_size=0, rotational=None, discard=False, discard_granularity=0,
+                 removable=False, read_only=False, is_partition=False):
+        """
+        :param optimal_io_size: 设备报告的最佳I/O大小，0表示未报告
+        :param max_request_size: 内核单个请求的最大字节数（max_sectors_kb）
+        :param rotational: 是否为机械盘，None表示未知
+        :param discard: 是否支持TRIM/discard
+        """
+        self.path = path
+        self.size = size
+        self.logical_sector_size = logical_sector_size
+        self.physical_sector_size = physical_sector_size
+        self.minimum_io_size = minimum_io_size
+        self.optimal_io_size = optimal_io_size
+        self.max_request_size = max_request_size
+        self.rotational = rotational
+        self.discard = discard
+        self.discard_granularity = discard_granularity
+        self.removable = removable
+        self.read_only = read_only
+        self.is_partition = is_partition
+
+    def __repr__(self):
+        return (f"BlockDeviceInfo({self.path!r}, size={self.size}, sectors={self.logical_sector_size}/"
+                f"{self.physical_sector_size}, optimal_io={self.optimal_io_size})")
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @property
+    def alignment(self):
+        """写入偏移和长度应对齐的字节数"""
+        return max(self.logical_sector_size, self.physical_sector_size, self.minimum_io_size, 512)
+
+
+def _read_int(path, default=0):
+    try:
+        with open(path, 'r') as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return default
+
+
+def sysfs_dir(path):
+    """设备节点对应的 /sys/class/block/<名称> 目录，不是块设备时返回None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISBLK(st.st_mode):
+        return None
+    # 按设备号定位，符号链接和 /dev/disk/by-* 路径同样适用
+    by_devno = f'/sys/dev/block/{os.major(st.st_rdev)}:{os.minor(st.st_rdev)}'
+    if os.path.isdir(by_devno):
+        return os.path.realpath(by_devno)
+    candidate = os.path.join(SYS_CLASS_BLOCK, os.path.basename(os.path.realpath(path)))
+    return os.path.realpath(candidate) if os.path.isdir(candidate) else None
+
+
+def _ioctl_values(path):
+    """用ioctl读取容量和扇区大小，没有权限打开设备时返回空字典"""
+    import fcntl
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+    except OSError:
+        return {}
+    values = {}
+    try:
+        for name, request, fmt in (('size', BLKGETSIZE64, 'Q'),
+                                   ('logical_sector_size', BLKSSZGET, 'i'),
+                                   ('physical_sector_size', BLKPBSZGET, 'I'),
+                                   ('minimum_io_size', BLKIOMIN, 'I'),
+                                   ('optimal_io_size', BLKIOOPT, 'I'),
+                                   ('read_only', BLKROGET, 'i')):
+            try:
+                buf = fcntl.ioctl(fd, request, bytes(struct.calcsize(fmt)))
+                values[name] = struct.unpack(fmt, buf)[0]
+            except OSError:
+                pass
+    finally:
+        os.close(fd)
+    if 'read_only' in values:
+        values['read_only'] = bool(values['read_only'])
+    return values
+
+
+def probe_linux(path):
+    """
+    读取Linux块设备信息：sysfs 的 size/removable/queue/*，再用 BLKGETSIZE64 等ioctl校正
+    :param path: 设备节点，如 /dev/sdb 或 /dev/sdb1
+    :return: BlockDeviceInfo
+    """
+    directory = sysfs_dir(path)
+    if directory is None:
+        raise ValueError(f"{path} 不是块设备")
+    is_partition = os.path.exists(os.path.join(directory, 'partition'))
+    # 分区没有自己的 queue 目录，队列参数和可移动标志取自所属整盘
+    disk_dir = os.path.dirname(directory) if is_partition else directory
+    queue = os.path.join(disk_dir, 'queue')
+
+    rotational = _read_int(os.path.join(queue, 'rotational'), -1)
+    discard_max = _read_int(os.path.join(queue, 'discard_max_bytes'))
+    info = BlockDeviceInfo(
+        path,
+        size=_read_int(os.path.join(directory, 'size')) * 512,
+        logical_sector_size=_read_int(os.path.join(queue, 'logical_block_size'), 512),
+        physical_sector_size=_read_int(os.path.join(queue, 'physical_block_size'), 512),
+        minimum_io_size=_read_int(os.path.join(queue, 'minimum_io_size')),
+        optimal_io_size=_read_int(os.path.join(queue, 'optimal_io_size')),
+        max_request_size=_read_int(os.path.join(queue, 'max_sectors_kb')) * 1024,
+        rotational=None if rotational < 0 else bool(rotational),
+        discard=discard_max > 0,
+        discard_granularity=_read_int(os.path.join(queue, 'discard_granularity')),
+        removable=_read_int(os.path.join(disk_dir, 'removable')) == 1,
+        read_only=_read_int(os.path.join(directory, 'ro')) == 1,
+        is_partition=is_partition
+    )
+    for name, value in _ioctl_values(path).items():
+        setattr(info, name, value)
+    return info
+
+
+def probe(path):
+    """
+    获取设备或镜像文件的I/O特性；非Linux块设备只返回容量和默认扇区大小
+    :return: BlockDeviceInfo
+    """
+    st = os.stat(path)
+    if stat.S_ISREG(st.st_mode):
+        return BlockDeviceInfo(path, size=st.st_size, minimum_io_size=getattr(st, 'st_blksize', 0))
+    if os.path.isdir('/sys/dev/block'):
+        return probe_linux(path)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = os.lseek(fd, 0, os.SEEK_END)
+    finally:
+        os.close(fd)
+    return BlockDeviceInfo(path, size=size)
+
+
+def aligned_io_size(info, requested=None):
+    """
+    选择对齐的写入块大小
+    :param info: BlockDeviceInfo
+    :param requested: 期望大小（字节），None时使用设备的最佳I/O大小或1MB
+    :return: 物理扇区（及最佳I/O大小）整数倍的字节数
+    """
+    unit = info.alignment
+    if info.optimal_io_size and info.optimal_io_size % unit == 0:
+        unit = info.optimal_io_size
+    size = requested or max(info.optimal_io_size, DEFAULT_IO_SIZE)
+    size = max(unit, -(-size // unit) * unit)
+    if size > MAX_IO_SIZE and unit <= MAX_IO_SIZE:
+        size = MAX_IO_SIZE // unit * unit
+    return size
@@ -0,0 +1,526 @@
+import os
+import re
+import logging
+
+from fat_volume import FatVolume, is_fat_boot_sector
+from iso_reader import ISOReader
+from partition_table import read_partition_table, SECTOR_SIZE
+
+logger = logging.getLogger(__name__)
+
+GRUB_CONFIG_PATHS = ('boot/grub/grub.cfg', 'EFI/BOOT/grub.cfg', 'boot/grub2/grub.cfg', 'grub/grub.cfg')
+SYSLINUX_CONFIG_PATHS = ('syslinux.cfg', 'syslinux/syslinux.cfg', 'boot/syslinux/syslinux.cfg',
+                         'isolinux/isolinux.cfg', 'boot/isolinux/isolinux.cfg', 'isolinux.cfg')
+
+_GRUB_SET = re.compile(r'^(?P<indent>\s*)set\s+(?P<key>[A-Za-z_][A-Za-z0-9_]*)=(?P<value>.*?)(?P<tail>\s*(?:[;#].*)?)$')
+_GRUB_BLOCK = re.compile(r'^\s*(?P<kind>menuentry|submenu)\s+(?P<rest>.*)$')
+_GRUB_KERNEL = ('linux', 'linuxefi', 'linux16')
+
+
+def _split_grub_word(text):
+    """读取GRUB语句中的第一个词（可带引号）-> (去引号后的值, 引号字符)"""
+    text = text.strip()
+    if text[:1] in ('"', "'"):
+        end = text.find(text[0], 1)
+        if end > 0:
+            return text[1:end], text[0]
+    return (text.split()[0] if text.split() else ''), ''
+
+
+def _quote(value, quote):
+    value = str(value)
+    if not quote and re.search(r'[\s;&|<>"\'$]', value):
+        quote = '"'
+    if quote == "'":
+        return "'" + value.replace("'", "'\\''") + "'"
+    if quote == '"':
+        return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return value
+
+
+class GrubConfig:
+    """
+    保留注释和格式的GRUB配置：每行原样保存，只重写被修改的行
+    """
+    kind = 'grub'
+
+    def __init__(self, text):
+        self.lines = text.split('\n')
+        self.original = text
+
+    @classmethod
+    def parse(cls, text):
+        return cls(text)
+
+    def __str__(self):
+        return '\n'.join(self.lines)
+
+    @property
+    def modified(self):
+        return str(self) != self.original
+
+    def _scan(self):
+        """产出 (行号, 花括号深度, 所属顶层菜单项序号或None)"""
+        depth = 0
+        item = -1
+        current = None
+        for index, line in enumerate(self.lines):
+            code = '' if line.lstrip().startswith('#') else line
+            if depth == 0:
+                current = None
+                if _GRUB_BLOCK.match(code):
+                    item += 1
+                    current = item
+            yield index, depth, current if depth > 0 else None
+            depth = max(depth + code.count('{') - code.count('}'), 0)
+
+    def entries(self):
+        """顶层菜单项（submenu 算作一项）-> [{'index', 'title', 'kind', 'line'}]"""
+        result = []
+        for index, depth, _ in self._scan():
+            match = _GRUB_BLOCK.match(self.lines[index])
+            if depth == 0 and match:
+                title, _ = _split_grub_word(match.group('rest'))
+                result.append({'index': len(result), 'title': title,
+                               'kind': match.group('kind'), 'line': index})
+        return result
+
+    def _global_sets(self, key):
+        for index, depth, _ in self._scan():
+            if depth == 0:
+                match = _GRUB_SET.match(self.lines[index])
+                if match and match.group('key') == key:
+                    yield index, match
+
+    def get(self, key):
+        """读取顶层 set key=value 的值（最后一次赋值）"""
+        value = None
+        for _, match in self._global_sets(key):
+            value, _ = _split_grub_word(match.group('value')) if match.group('value').strip() else ('', '')
+        return value
+
+    def set(self, key, value):
+        """修改所有顶层 set key=...（包括 if/else 分支中的），没有时插入到开头注释之后"""
+        found = False
+        for index, match in list(self._global_sets(key)):
+            _, quote = _split_grub_word(match.group('value')) if match.group('value').strip() else ('', '')
+            self.lines[index] = (f"{match.group('indent')}set {key}={_quote(value, quote)}"
+                                 f"{match.group('tail')}")
+            found = True
+        if not found:
+            position = 0
+            while position < len(self.lines) and self.lines[position].lstrip().startswith('#'):
+                position += 1
+            self.lines.insert(position, f"set {key}={_quote(value, '')}")
+
+    def resolve_entry(self, entry):
+        """把序号或标题解析为菜单项"""
+        entries = self.entries()
+        if isinstance(entry, int) or (isinstance(entry, str) and entry.isdigit()):
+            index = int(entry)
+            return entries[index] if 0 <= index < len(entries) else None
+        return next((e for e in entries if e['title'] == entry), None)
+
+    def set_timeout(self, seconds):
+        self.set('timeout', int(seconds))
+
+    def set_default(self, entry):
+        """设置默认启动项：序号写成数字，其余按标题写入"""
+        item = self.resolve_entry(entry)
+        if item is None:
+            raise ValueError(f"找不到启动项: {entry}")
+        if isinstance(entry, int) or str(entry).isdigit():
+            self.set('default', item['index'])
+        else:
+            self.set('default', item['title'])
+
+    def kernel_lines(self, entry=None):
+        """菜单项（None表示全部）中的 linux 命令行号"""
+        wanted = None if entry is None else self.resolve_entry(entry)
+        if entry is not None and wanted is None:
+            raise ValueError(f"找不到启动项: {entry}")
+        for index, depth, item in self._scan():
+            words = self.lines[index].split()
+            if depth > 0 and words and words[0] in _GRUB_KERNEL:
+                if wanted is None or item == wanted['index']:
+                    yield index
+
+    def update_kernel_args(self, add=(), remove=(), entry=None):
+        """
+        修改内核参数
+        :param add: 要追加的参数（同名 key=value 会被替换）
+        :param remove: 要删除的参数或参数名
+        :param entry: 菜单项序号或标题，None表示全部菜单项
+        """
+        for index in list(self.kernel_lines(entry)):
+            self.lines[index] = _edit_line(self.lines[index], 2, add, remove)
+
+
+def _arg_name(arg):
+    return arg.split('=', 1)[0]
+
+
+def _edit_args(args, add, remove):
+    drop = set(remove) | {_arg_name(a) for a in add if '=' in a} | set(a for a in add if '=' not in a)
+    kept = [a for a in args if a not in drop and _arg_name(a) not in drop]
+    # '---' 之后的参数只传给用户空间
+    split = kept.index('---') if '---' in kept else len(kept)
+    return kept[:split] + list(add) + kept[split:]
+
+
+def _edit_line(line, head_count, add, remove):
+    """修改一行的参数部分，行首缩进、前 head_count 个词及其后的分隔符原样保留"""
+    match = re.match(r'\s*' + r'\S+\s*' * head_count, line)
+    prefix = match.group(0) if match else line
+    args = _edit_args(line[len(prefix):].split(), add, remove)
+    if args and prefix and not prefix[-1].isspace():
+        prefix += ' '
+    return (prefix + ' '.join(args)).rstrip() if args else prefix.rstrip()
+
+
+class SyslinuxConfig:
+    """保留注释和格式的syslinux/isolinux配置，关键字不区分大小写"""
+    kind = 'syslinux'
+
+    def __init__(self, text):
+        self.lines = text.split('\n')
+        self.original = text
+
+    @classmethod
+    def parse(cls, text):
+        return cls(text)
+
+    def __str__(self):
+        return '\n'.join(self.lines)
+
+    @property
+    def modified(self):
+        return str(self) != self.original
+
+    @staticmethod
+    def _keyword(line):
+        words = line.split(None, 2)
+        if not words or words[0].startswith('#'):
+            return None, []
+        if words[0].lower() == 'menu' and len(words) > 1:
+            return 'menu ' + words[1].lower(), line.split()[2:]
+        return words[0].lower(), line.split()[1:]
+
+    def _find(self, keyword, global_only=True):
+        in_label = False
+        for index, line in enumerate(self.lines):
+            key, args = self._keyword(line)
+            if key == 'label':
+                in_label = True
+            if key == keyword and not (global_only and in_label):
+                yield index, args
+
+    def get(self, keyword):
+        value = None
+        for _, args in self._find(keyword.lower()):
+            value = ' '.join(args)
+        return value
+
+    def set(self, keyword, value):
+        """修改全局关键字（在第一个LABEL之前），没有时插入到第一个LABEL之前"""
+        keyword = keyword.lower()
+        found = False
+        for index, _ in list(self._find(keyword)):
+            line = self.lines[index]
+            indent = line[:len(line) - len(line.lstrip())]
+            self.lines[index] = f"{indent}{line.split()[0]} {value}"
+            found = True
+        if not found:
+            position = next((i for i, line in enumerate(self.lines) if self._keyword(line)[0] == 'label'),
+                            len(self.lines))
+            self.lines.insert(position, f"{keyword.upper()} {value}")
+
+    def entries(self):
+        result = []
+        for index, line in enumerate(self.lines):
+            key, args = self._keyword(line)
+            if key == 'label' and args:
+                result.append({'index': len(result), 'label': args[0], 'title': args[0], 'line': index})
+            elif key == 'menu label' and result:
+                result[-1]['title'] = ' '.join(args).replace('^', '')
+        return result
+
+    def _label_range(self, item):
+        entries = self.entries()
+        end = entries[item['index'] + 1]['line'] if item['index'] + 1 < len(entries) else len(self.lines)
+        return item['line'], end
+
+    def resolve_entry(self, entry):
+        entries = self.entries()
+        if isinstance(entry, int) or (isinstance(entry, str) and entry.isdigit()):
+            index = int(entry)
+            return entries[index] if 0 <= index < len(entries) else None
+        key = str(entry).lower()
+        return next((e for e in entries if e['label'].lower() == key or e['title'].lower() == key), None)
+
+    def set_timeout(self, seconds):
+        # syslinux的TIMEOUT单位是0.1秒
+        self.set('timeout', int(seconds * 10))
+
+    def set_default(self, entry):
+        """
+        设置默认启动项；DEFAULT 指向菜单模块(.c32)时改为移动 MENU DEFAULT 标记
+        """
+        item = self.resolve_entry(entry)
+        if item is None:
+            raise ValueError(f"找不到启动项: {entry}")
+        current = self.get('default') or ''
+        if current.lower().endswith('.c32') or any(True for _ in self._find('menu default', False)):
+            # 从后往前删除，前面的行号不受影响
+            for index, _ in reversed(list(self._find('menu default', False))):
+                del self.lines[index]
+            item = self.resolve_entry(item['label'])
+            line = self.lines[item['line']]
+            indent = line[:len(line) - len(line.lstrip())] + '  '
+            self.lines.insert(item['line'] + 1, f"{indent}MENU DEFAULT")
+            if not current.lower().endswith('.c32'):
+                self.set('default', item['label'])
+        else:
+            self.set('default', item['label'])
+
+    def update_kernel_args(self, add=(), remove=(), entry=None):
+        items = self.entries() if entry is None else [self.resolve_entry(entry)]
+        if None in items:
+            raise ValueError(f"找不到启动项: {entry}")
+        for item in items:
+            start, end = self._label_range(item)
+            for index in range(start, end):
+                key, args = self._keyword(self.lines[index])
+                if key == 'append':
+                    self.lines[index] = _edit_line(self.lines[index], 1, add, remove)
+
+
+def parse_config(kind, text):
+    return GrubConfig.parse(text) if kind == 'grub' else SyslinuxConfig.parse(text)
+
+
+class DirectoryVolume:
+    """已挂载的目录"""
+    readonly = False
+
+    def __init__(self, root):
+        self.root = root
+        self.name = root
+
+    def read_file(self, path):
+        full = os.path.join(self.root, *path.split('/'))
+        if not os.path.isfile(full):
+            return None
+        with open(full, 'rb') as f:
+            return f.read()
+
+    def listdir(self, path):
+        full = os.path.join(self.root, *path.split('/'))
+        return os.listdir(full) if os.path.isdir(full) else None
+
+    def replace_file(self, path, data):
+        full = os.path.join(self.root, *path.split('/'))
+        tmp_path = full + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, full)
+
+    def close(self):
+        pass
+
+
+class IsoVolume:
+    """混合镜像中的ISO9660文件系统，只读"""
+    readonly = True
+
+    def __init__(self, path):
+        self.reader = ISOReader(path)
+        self.name = f"{path} (ISO9660)"
+
+    def read_file(self, path):
+        entry = self.reader.lookup(path)
+        if entry is None or entry.is_dir:
+            return None
+        return b''.join(self.reader.read_chunks(entry))
+
+    def listdir(self, path):
+        entry = self.reader.lookup(path)
+        if entry is None or not entry.is_dir:
+            return None
+        return [e.name for e in self.reader.iterdir(entry)]
+
+    def replace_file(self, path, data):
+        raise IOError("ISO9660文件系统是只读的")
+
+    def close(self):
+        self.reader.close()
+
+
+class FatPartitionVolume:
+    """设备或镜像文件中的FAT卷"""
+    readonly = False
+
+    def __init__(self, path, offset, writable=True):
+        self.volume = FatVolume(path, offset, writable)
+        self.name = f"{path}@{offset}"
+
+    def read_file(self, path):
+        return self.volume.read_file(path)
+
+    def listdir(self, path):
+        entry = self.volume.lookup(path)
+        if entry is None or not entry.is_dir:
+            return None
+        return [e.name for e in self.volume.listdir(entry)]
+
+    def replace_file(self, path, data):
+        self.volume.replace_file(path, data)
+
+    def close(self):
+        self.volume.close()
+
+
+def open_volumes(target, writable=True, mountpoints=None):
+    """
+    打开目标上所有可能存放启动配置的卷
+    :param target: 已挂载目录、设备或镜像文件
+    :param mountpoints: {分区序号: 挂载目录}，0 表示 target 本身；已挂载的卷改为通过挂载目录读写，
+                        不在已挂载的文件系统底下直接改写FAT
+    :return: 卷对象列表
+    """
+    if os.path.isdir(target):
+        return [DirectoryVolume(target)]
+    mountpoints = mountpoints or {}
+
+    volumes = []
+    with open(target, 'rb') as f:
+        head = f.read(SECTOR_SIZE)
+        f.seek(16 * 2048)
+        iso_descriptor = f.read(8)
+
+    if 0 in mountpoints:
+        volumes.append(DirectoryVolume(mountpoints[0]))
+    elif is_fat_boot_sector(head):
+        volumes.append(FatPartitionVolume(target, 0, writable))
+    else:
+        try:
+            table = read_partition_table(target)
+        except ValueError:
+            table = {'partitions': []}
+        with open(target, 'rb') as f:
+            for part in table['partitions']:
+                offset = part['start_lba'] * SECTOR_SIZE
+                if offset == 0:
+                    continue
+                if part['index'] in mountpoints:
+                    volumes.append(DirectoryVolume(mountpoints[part['index']]))
+                    continue
+                f.seek(offset)
+                if is_fat_boot_sector(f.read(SECTOR_SIZE)):
+                    try:
+                        volumes.append(FatPartitionVolume(target, offset, writable))
+                    except (ValueError, OSError) as e:
+                        logger.debug(f"跳过分区 {part['index']}: {e}")
+    if iso_descriptor[1:6] == b'CD001':
+        volumes.append(IsoVolume(target))
+    return volumes
+
+
+class BootConfigTransaction:
+    """
+    启动配置事务：一次读取目标上的全部配置，修改都在内存中进行，
+    提交时只写入发生变化的文件，每个文件写一次
+    """
+
+    def __init__(self, target, writable=True, mountpoints=None):
+        """
+        :param mountpoints: 见 open_volumes
+        """
+        self.target = target
+        self.writable = writable
+        self.mountpoints = mountpoints
+        self.volumes = []
+        self.configs = []
+
+    def __enter__(self):
+        self.load()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None and self.writable:
+            self.commit()
+        self.close()
+
+    def load(self):
+        self.volumes = open_volumes(self.target, self.writable, self.mountpoints)
+        self.configs = []
+        for volume in self.volumes:
+            for kind, paths in (('grub', GRUB_CONFIG_PATHS), ('syslinux', SYSLINUX_CONFIG_PATHS)):
+                for path in paths:
+                    data = volume.read_file(path)
+                    if data is not None:
+                        config = parse_config(kind, data.decode('utf-8', 'replace'))
+                        self.configs.append((volume, path, config))
+        return self.configs
+
+    def close(self):
+        for volume in self.volumes:
+            volume.close()
+        self.volumes = []
+
+    def grub_configs(self):
+        return [config for _, _, config in self.configs if config.kind == 'grub']
+
+    def syslinux_configs(self):
+        return [config for _, _, config in self.configs if config.kind == 'syslinux']
+
+    def set_timeout(self, seconds):
+        for _, _, config in self.configs:
+            config.set_timeout(seconds)
+
+    def set_default(self, entry):
+        """在能找到该启动项的配置中设置默认项"""
+        applied = False
+        for _, _, config in self.configs:
+            if config.resolve_entry(entry) is not None:
+                config.set_default(entry)
+                applied = True
+        if not applied:
+            raise ValueError(f"找不到启动项: {entry}")
+
+    def update_kernel_args(self, add=(), remove=(), entry=None, writable_only=False):
+        """
+        :param writable_only: 只修改可写卷上的配置，跳过ISO9660等只读卷
+        """
+        for volume, _, config in self.configs:
+            if writable_only and volume.readonly:
+                continue
+            if entry is None or config.resolve_entry(entry) is not None:
+                config.update_kernel_args(add, remove, entry)
+
+    def apply(self, updates):
+        """
+        批量应用修改
+        :param updates: {'timeout'/'grub_timeout': 秒, 'default_entry': 序号或标题,
+                         'kernel_args_add': [...], 'kernel_args_remove': [...]}
+        """
+        timeout = updates.get('timeout', updates.get('grub_timeout'))
+        if timeout is not None:
+            self.set_timeout(timeout)
+        if updates.get('default_entry') is not None:
+            self.set_default(updates['default_entry'])
+        if updates.get('kernel_args_add') or updates.get('kernel_args_remove'):
+            self.update_kernel_args(updates.get('kernel_args_add', ()), updates.get('kernel_args_remove', ()))
+
+    def commit(self):
+        """写入修改过的配置；任何一个位于只读卷上时不写入任何文件"""
+        changed = [(volume, path, config) for volume, path, config in self.configs if config.modified]
+        readonly = [f"{volume.name}:{path}" for volume, path, _ in changed if volume.readonly]
+        if readonly:
+            raise IOError(f"以下配置位于只读文件系统中: {', '.join(readonly)}")
+        for volume, path, config in changed:
+            volume.replace_file(path, str(config).encode('utf-8'))
+            config.original = str(config)
+        return [path for _, path, _ in changed]
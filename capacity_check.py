@@ -0,0 +1,347 @@
+import os
+import time
+import random
+import struct
+import logging
+
+import block_device
+from storage_bench import aligned_buffer, open_direct, pread_into, MiB
+
+logger = logging.getLogger(__name__)
+
+# 每个探测块的头部：魔数、本次检查的随机标识、块自身的偏移
+TAG_MAGIC = b'ZTCAPCHK'
+TAG_FORMAT = '<8s16sQ'
+TAG_SIZE = struct.calcsize(TAG_FORMAT)
+PROBE_BLOCK_SIZE = 4096
+# 2的幂边界之外再加的随机探测点数
+RANDOM_PROBES = 32
+# 二分查找真实容量边界的精度
+BOUNDARY_GRANULARITY = MiB
+FULL_CHUNK_SIZE = 4 * MiB
+
+STATUS_OK = 'ok'
+# 读回的是另一个偏移写入的标记：两个地址共用同一块物理存储
+STATUS_ALIASED = 'aliased'
+# 读回的不是写入的数据（全零、0xFF或旧数据）
+STATUS_LOST = 'lost'
+STATUS_ERROR = 'error'
+
+
+class CapacityReport:
+    """容量检查结果"""
+    __slots__ = ('path', 'reported_size', 'usable_size', 'mode', 'probes', 'bad_blocks', 'aliased_blocks',
+                 'elapsed', 'complete')
+
+    def __init__(self, path, reported_size, usable_size=None, mode='sparse', probes=0, bad_blocks=0,
+                 aliased_blocks=0, elapsed=0.0, complete=True):
+        """
+        :param usable_size: 验证可用的字节数
+        :param mode: 'sparse' 稀疏探测或 'full' 全盘写读
+        :param probes: 写读过的块数
+        :param complete: 被取消时为False，结果只反映已检查的部分
+        """
+        self.path = path
+        self.reported_size = reported_size
+        self.usable_size = reported_size if usable_size is None else usable_size
+        self.mode = mode
+        self.probes = probes
+        self.bad_blocks = bad_blocks
+        self.aliased_blocks = aliased_blocks
+        self.elapsed = elapsed
+        self.complete = complete
+
+    def __repr__(self):
+        return f"CapacityReport({self.path!r}, reported={self.reported_size}, usable={self.usable_size})"
+
+    @property
+    def is_fake(self):
+        """标称容量大于实际可用容量（扩容盘）"""
+        return self.usable_size < self.reported_size
+
+    def to_dict(self):
+        result = {name: getattr(self, name) for name in self.__slots__}
+        result['is_fake'] = self.is_fake
+        return result
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data[name] for name in cls.__slots__ if name in data})
+
+
+def make_block(nonce, offset, pattern):
+    """带标记的探测块：头部记录自身偏移，其余为本次检查的随机数据"""
+    block = bytearray(pattern)
+    struct.pack_into(TAG_FORMAT, block, 0, TAG_MAGIC, nonce, offset)
+    return block
+
+
+def read_tag(data, nonce, pattern):
+    """
+    :return: (状态, 块中记录的偏移)
+    """
+    magic, tag_nonce, offset = struct.unpack_from(TAG_FORMAT, data, 0)
+    if magic != TAG_MAGIC or tag_nonce != nonce or data[TAG_SIZE:] != pattern[TAG_SIZE:]:
+        return STATUS_LOST, None
+    return STATUS_OK, offset
+
+
+def probe_offsets(size, block_size=PROBE_BLOCK_SIZE, random_probes=RANDOM_PROBES, rng=None):
+    """
+    稀疏探测点：第一块、最后一块、从1MB起每个2的幂边界及其前一块，再加随机偏移
+    扩容盘通常在2的幂处回绕，边界前后各放一个探测点
+    """
+    rng = rng or random.Random()
+    blocks = size // block_size
+    offsets = {0, (blocks - 1) * block_size}
+    boundary = MiB
+    while boundary < size:
+        offsets.add(boundary)
+        offsets.add(boundary - block_size)
+        boundary *= 2
+    for _ in range(random_probes):
+        offsets.add(rng.randrange(blocks) * block_size)
+    return sorted(offset for offset in offsets if 0 <= offset <= size - block_size)
+
+
+class CapacityChecker:
+    """
+    扩容盘检测：在不同偏移写入带标记的块再读回，读到别的偏移的标记说明地址回绕，
+    读不回写入的数据说明该处没有真实存储
+    稀疏模式默认不破坏数据：写入前保存各探测块，结束后按相反顺序写回；
+    它能发现在2的幂处回绕和丢弃写入的扩容盘，在任意位置回绕的需要全盘检查
+    """
+
+    def __init__(self, path, block_size=PROBE_BLOCK_SIZE, direct=True, cancel_check=None, progress=None,
+                 seed=None):
+        """
+        :param progress: progress(已完成, 总数, 阶段) 回调
+        :param cancel_check: 返回True时尽快结束
+        """
+        self.path = path
+        self.direct = direct
+        self.cancel_check = cancel_check or (lambda: False)
+        self.progress = progress or (lambda done, total, phase: None)
+        self._random = random.Random(seed)
+        info = block_device.probe(path)
+        self.block_size = max(block_size, info.alignment)
+        self.size = info.size // self.block_size * self.block_size
+        if self.size < self.block_size:
+            raise ValueError(f"{path} 容量太小，无法检查")
+        self.nonce = os.urandom(16)
+        self.pattern = os.urandom(self.block_size)
+        self._saved = []
+
+    # ---- 单块读写 ----
+
+    def _pread(self, fd, buf, offset):
+        return pread_into(fd, buf, offset)
+
+    def _pwrite(self, fd, data, offset):
+        return os.pwrite(fd, data, offset)
+
+    def _read(self, fd, offset):
+        buf = aligned_buffer(self.block_size)
+        try:
+            if self._pread(fd, buf, offset) != self.block_size:
+                raise IOError(f"偏移 {offset} 读取不完整")
+            return bytes(buf)
+        finally:
+            buf.close()
+
+    def _write(self, fd, offset, data):
+        buf = aligned_buffer(len(data))
+        try:
+            buf.write(data)
+            if self._pwrite(fd, buf, offset) != len(data):
+                raise IOError(f"偏移 {offset} 写入不完整")
+        finally:
+            buf.close()
+
+    def _write_tag(self, fd, offset, preserve):
+        if preserve:
+            self._saved.append((offset, self._read(fd, offset)))
+        self._write(fd, offset, make_block(self.nonce, offset, self.pattern))
+
+    def _check(self, fd, offset):
+        """
+        :return: (状态, 块中记录的偏移)
+        """
+        try:
+            return read_tag(self._read(fd, offset), self.nonce, self.pattern)
+        except OSError as e:
+            logger.debug(f"读取偏移 {offset} 失败: {e}")
+            return STATUS_ERROR, None
+
+    def _restore(self, fd):
+        """按写入的相反顺序写回，即使地址回绕也能还原"""
+        failed = 0
+        while self._saved:
+            offset, data = self._saved.pop()
+            try:
+                self._write(fd, offset, data)
+            except OSError as e:
+                failed += 1
+                logger.error(f"恢复偏移 {offset} 的原始数据失败: {e}")
+        os.fsync(fd)
+        if failed:
+            raise IOError(f"{failed} 个探测块的原始数据未能恢复")
+
+    # ---- 稀疏检查 ----
+
+    def _verify(self, fd, offsets):
+        """
+        读回一组探测块
+        读到同一个标记的偏移共用同一块物理存储，其中只有最低的地址是真实的
+        :return: (坏块偏移集合, 回绕的块数)
+        """
+        bad = set()
+        groups = {}
+        for offset in offsets:
+            status, tagged = self._check(fd, offset)
+            if status == STATUS_OK:
+                groups.setdefault(tagged, {tagged}).add(offset)
+            else:
+                bad.add(offset)
+        aliased = 0
+        for members in groups.values():
+            if len(members) > 1:
+                aliased += len(members) - 1
+                bad.update(sorted(members)[1:])
+        return bad, aliased
+
+    def check_sparse(self, preserve=True):
+        """
+        稀疏探测，通常几秒内完成
+        :param preserve: 是否保存并恢复探测块原有数据
+        :return: CapacityReport
+        """
+        started = time.monotonic()
+        offsets = probe_offsets(self.size, self.block_size, rng=self._random)
+        fd, _ = open_direct(self.path, True, self.direct)
+        complete = True
+        written = []
+        try:
+            try:
+                # 从低到高写完所有探测块再统一读回，高地址回绕时会覆盖先写入的低地址块
+                for offset in offsets:
+                    if self.cancel_check():
+                        complete = False
+                        break
+                    self._write_tag(fd, offset, preserve)
+                    written.append(offset)
+                    self.progress(len(written), len(offsets), 'write')
+                os.fsync(fd)
+                bad, aliased = self._verify(fd, written)
+                probes = len(written)
+
+                usable = min(bad) if bad else (self.size if complete else written[-1] if written else 0)
+                if bad and complete:
+                    good = [offset for offset in written if offset < usable and offset not in bad]
+                    low = max(good) if good else None
+                    # 在最后一个好块和第一个坏块之间二分，找到真实容量边界
+                    while low is not None and usable - low > max(BOUNDARY_GRANULARITY, self.block_size):
+                        if self.cancel_check():
+                            complete = False
+                            break
+                        middle = (low + usable) // 2 // self.block_size * self.block_size
+                        self._write_tag(fd, middle, preserve)
+                        os.fsync(fd)
+                        probes += 1
+                        if self._verify(fd, good + [middle])[0]:
+                            usable = middle
+                        else:
+                            good.append(middle)
+                            low = middle
+            finally:
+                if preserve:
+                    self._restore(fd)
+        finally:
+            os.close(fd)
+        return CapacityReport(self.path, self.size, usable, 'sparse', probes, len(bad), aliased,
+                              time.monotonic() - started, complete)
+
+    # ---- 全盘检查 ----
+
+    def _chunk(self, offset, length):
+        chunk = bytearray(length)
+        for position in range(0, length, self.block_size):
+            chunk[position:position + self.block_size] = make_block(self.nonce, offset + position, self.pattern)
+        return chunk
+
+    def check_full(self):
+        """
+        全盘写入后读回，破坏设备上的所有数据
+        :return: CapacityReport，可用容量为读回正确的块的总大小
+        """
+        started = time.monotonic()
+        chunk_size = max(FULL_CHUNK_SIZE // self.block_size, 1) * self.block_size
+        fd, _ = open_direct(self.path, True, self.direct)
+        bad_blocks = 0
+        aliased = 0
+        checked = 0
+        complete = True
+        try:
+            buf = aligned_buffer(chunk_size)
+            try:
+                written = 0
+                while written < self.size:
+                    if self.cancel_check():
+                        complete = False
+                        break
+                    length = min(chunk_size, self.size - written)
+                    buf.seek(0)
+                    buf.write(self._chunk(written, length))
+                    try:
+                        self._pwrite(fd, memoryview(buf)[:length], written)
+                    except OSError as e:
+                        # 写不进去的区域读回时会计为坏块
+                        logger.debug(f"偏移 {written} 写入失败: {e}")
+                    written += length
+                    self.progress(written, self.size * 2, 'write')
+                os.fsync(fd)
+
+                offset = 0
+                while offset < written:
+                    if self.cancel_check():
+                        complete = False
+                        break
+                    length = min(chunk_size, written - offset)
+                    view = memoryview(buf)[:length]
+                    try:
+                        data = view.tobytes() if self._pread(fd, view, offset) == length else b''
+                    except OSError:
+                        data = b''
+                    for position in range(0, length, self.block_size):
+                        block = data[position:position + self.block_size]
+                        if len(block) == self.block_size:
+                            status, tagged = read_tag(block, self.nonce, self.pattern)
+                            if status == STATUS_OK and tagged != offset + position:
+                                status = STATUS_ALIASED
+                        else:
+                            status = STATUS_ERROR
+                        if status != STATUS_OK:
+                            bad_blocks += 1
+                            aliased += status == STATUS_ALIASED
+                    view.release()
+                    offset += length
+                    checked = offset
+                    self.progress(self.size + offset, self.size * 2, 'read')
+            finally:
+                buf.close()
+        finally:
+            os.close(fd)
+        # 回绕时每块物理存储只保留最后写入的标记，读回正确的块数就是真实容量
+        usable = checked - bad_blocks * self.block_size
+        return CapacityReport(self.path, self.size, usable, 'full', checked // self.block_size, bad_blocks,
+                              aliased, time.monotonic() - started, complete)
+
+
+def check_capacity(path, full=False, **options):
+    """
+    检查设备真实容量
+    :param full: True时全盘写读（破坏数据），否则稀疏探测并恢复原有数据
+    :return: CapacityReport
+    """
+    checker = CapacityChecker(path, **options)
+    return checker.check_full() if full else checker.check_sparse()
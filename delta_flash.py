@@ -0,0 +1,314 @@
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from partition_table import target_size
+
+logger = logging.getLogger(__name__)
+
+# 比较粒度：1MB既接近闪存擦除块，又让清单保持很小
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+DIGEST_SIZE = 16
+DEFAULT_WORKERS = 4
+# 使用旧清单前抽查的“未变化”块数量，发现不一致说明设备在上次写入后被改动过
+SPOT_CHECK_BLOCKS = 16
+# 连续变化块合并后一次写入的最大长度
+MAX_RUN_BYTES = 32 * 1024 * 1024
+
+MODE_AUTO = 'auto'
+MODE_MANIFEST = 'manifest'
+MODE_DEVICE = 'device'
+
+
+def block_digest(data):
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+
+class BlockHasher:
+    """把任意长度的数据流切成固定大小的块并逐块计算摘要"""
+
+    def __init__(self, block_size=DEFAULT_BLOCK_SIZE):
+        self.block_size = block_size
+        self.digests = []
+        self.size = 0
+        self._pending = bytearray()
+
+    def update(self, data):
+        self.size += len(data)
+        self._pending += data
+        if len(self._pending) >= self.block_size:
+            view = memoryview(self._pending)
+            end = len(view) // self.block_size * self.block_size
+            for pos in range(0, end, self.block_size):
+                self.digests.append(block_digest(view[pos:pos + self.block_size]))
+            view.release()
+            del self._pending[:end]
+
+    def finish(self):
+        if self._pending:
+            self.digests.append(block_digest(bytes(self._pending)))
+            self._pending = bytearray()
+        return self.digests
+
+
+class FlashManifestStore:
+    """
+    保存每个设备上次写入内容的块摘要清单
+    传入设备身份（DeviceIdentity.key）时按身份保存：同一设备节点上换了一个同样大小的U盘，
+    不会误用前一个U盘的清单；无法识别设备时按设备路径保存
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, device, identity=None):
+        if identity:
+            name = 'id-' + hashlib.sha1(identity.encode('utf-8')).hexdigest()[:20]
+        else:
+            name = re.sub(r'[^A-Za-z0-9_.-]', '_', os.path.abspath(device).strip('/'))
+        return os.path.join(self.directory, name + '.json')
+
+    def load(self, device, block_size=DEFAULT_BLOCK_SIZE, identity=None):
+        """读取设备的清单，设备身份、大小或块大小不一致时视为无效"""
+        try:
+            with open(self._path(device, identity), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('identity') != identity:
+                return None
+            if manifest['device_size'] != target_size(device) or manifest['block_size'] != block_size:
+                return None
+            manifest['digests'] = [bytes.fromhex(d) for d in manifest['digests']]
+            return manifest
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, device, image, image_size, digests, block_size=DEFAULT_BLOCK_SIZE, identity=None):
+        manifest = {
+            'device': device,
+            'identity': identity,
+            'device_size': target_size(device),
+            'image': image,
+            'image_size': image_size,
+            'block_size': block_size,
+            'flashed': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'digests': [d.hex() for d in digests]
+        }
+        path = self._path(device, identity)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(path + '.tmp', path)
+
+    def forget(self, device, identity=None):
+        """删除设备的清单（包括按路径保存的旧清单）"""
+        for path in {self._path(device, identity), self._path(device)}:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def _pread_full(fd, size, offset):
+    chunks = []
+    while size > 0:
+        data = os.pread(fd, size, offset)
+        if not data:
+            break
+        chunks.append(data)
+        offset += len(data)
+        size -= len(data)
+    return b''.join(chunks)
+
+
+def changed_runs(new_digests, old_digests, block_size, image_size):
+    """
+    找出摘要不同的块并合并为连续区间
+    :return: [(offset, length), ...]
+    """
+    runs = []
+    for index, digest in enumerate(new_digests):
+        if index < len(old_digests) and old_digests[index] == digest:
+            continue
+        offset = index * block_size
+        length = min(block_size, image_size - offset)
+        if runs and runs[-1][0] + runs[-1][1] == offset and runs[-1][1] + length <= MAX_RUN_BYTES:
+            runs[-1] = (runs[-1][0], runs[-1][1] + length)
+        else:
+            runs.append((offset, length))
+    return runs
+
+
+class DeltaFlasher:
+    """
+    增量写入：只写与设备现有内容不同的块，并只校验这些区域
+    设备现有内容的摘要来自上次写入时记录的清单，或并行读取设备计算
+    """
+
+    def __init__(self, device, manifest_store=None, block_size=DEFAULT_BLOCK_SIZE,
+                 workers=DEFAULT_WORKERS, progress_callback=None, status_callback=None, cancel_check=None,
+                 identity=None):
+        """
+        :param device: 目标设备或镜像文件路径
+        :param manifest_store: FlashManifestStore，None时只能读取设备比较
+        :param identity: 设备身份（DeviceIdentity.key），清单按身份保存和匹配
+        :param block_size: 比较粒度（字节）
+        :param workers: 并行读取设备的线程数
+        :param progress_callback: 进度回调 callback(已完成字节, 总字节)
+        :param status_callback: 阶段回调 callback(消息)
+        :param cancel_check: 返回True时取消
+        """
+        self.device = device
+        self.identity = identity
+        self.manifest_store = manifest_store
+        self.block_size = block_size
+        self.workers = max(workers, 1)
+        self.progress_callback = progress_callback
+        self.status_callback = status_callback
+        self.cancel_check = cancel_check
+
+    def _status(self, message):
+        logger.info(message)
+        if self.status_callback:
+            self.status_callback(message)
+
+    def _progress(self, done, total):
+        if self.progress_callback:
+            self.progress_callback(done, total)
+
+    def _check_cancel(self):
+        if self.cancel_check and self.cancel_check():
+            raise InterruptedError("写入已取消")
+
+    def hash_image(self, source, image_size):
+        """顺序读取新镜像并计算块摘要"""
+        hasher = BlockHasher(self.block_size)
+        source.seek(0)
+        while hasher.size < image_size:
+            self._check_cancel()
+            data = source.read(min(8 * self.block_size, image_size - hasher.size))
+            if not data:
+                raise IOError("源镜像提前结束")
+            hasher.update(data)
+            self._progress(hasher.size, image_size)
+        return hasher.finish()
+
+    def hash_device(self, fd, size):
+        """多线程按块读取设备并计算摘要"""
+        count = -(-size // self.block_size)
+        digests = [None] * count
+
+        def work(index):
+            self._check_cancel()
+            offset = index * self.block_size
+            digests[index] = block_digest(_pread_full(fd, min(self.block_size, size - offset), offset))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for i, _ in enumerate(pool.map(work, range(count)), 1):
+                if i % 64 == 0 or i == count:
+                    self._progress(min(i * self.block_size, size), size)
+        return digests
+
+    def _manifest_is_current(self, fd, manifest):
+        """
+        抽查清单中的块，确认设备自上次写入后没有被改动
+        第一块和最后一块总是检查：格式化、重写分区表等改动都集中在设备开头
+        """
+        old = manifest['digests']
+        if not old:
+            return False
+        last = len(old) - 1
+        indexes = {0, last}
+        indexes.update(random.sample(range(len(old)), min(SPOT_CHECK_BLOCKS, len(old))))
+        for index in sorted(indexes):
+            offset = index * self.block_size
+            data = _pread_full(fd, min(self.block_size, manifest['image_size'] - offset), offset)
+            if block_digest(data) != old[index]:
+                return False
+        return True
+
+    def flash(self, source, image_size, image_name=None, mode=MODE_AUTO, verify=True):
+        """
+        增量写入镜像
+        :param source: 可读、可seek的二进制文件对象
+        :param image_size: 镜像字节数
+        :param image_name: 记录到清单中的镜像名称
+        :param mode: auto/manifest/device
+        :param verify: 是否回读校验写入的区域
+        :return: 统计信息字典
+        """
+        start_time = time.time()
+        if target_size(self.device) < image_size:
+            raise ValueError("目标设备容量小于镜像大小")
+
+        self._status("正在计算镜像块摘要...")
+        new_digests = self.hash_image(source, image_size)
+
+        fd = os.open(self.device, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+        try:
+            old_digests = None
+            used_mode = MODE_DEVICE
+            if mode in (MODE_AUTO, MODE_MANIFEST) and self.manifest_store:
+                manifest = self.manifest_store.load(self.device, self.block_size, self.identity)
+                if manifest and self._manifest_is_current(fd, manifest):
+                    old_digests = manifest['digests']
+                    used_mode = MODE_MANIFEST
+                elif mode == MODE_MANIFEST:
+                    raise ValueError("没有可用的写入清单，或设备内容已被改动")
+                else:
+                    self._status("写入清单不可用，改为读取设备比较")
+
+            if old_digests is None:
+                self._status("正在读取设备内容...")
+                old_digests = self.hash_device(fd, image_size)
+
+            # 开始写入前删除旧清单，写入失败或取消时不会留下与设备内容不符的清单
+            if self.manifest_store:
+                self.manifest_store.forget(self.device, self.identity)
+
+            runs = changed_runs(new_digests, old_digests, self.block_size, image_size)
+            changed = sum(length for _, length in runs)
+            self._status(f"需要写入 {len(runs)} 个区域，共 {changed} 字节")
+
+            written = 0
+            for offset, length in runs:
+                self._check_cancel()
+                source.seek(offset)
+                data = source.read(length)
+                if len(data) != length:
+                    raise IOError("源镜像提前结束")
+                os.pwrite(fd, data, offset)
+                written += length
+                self._progress(written, changed)
+            os.fsync(fd)
+
+            if verify and runs:
+                self._status("正在校验写入的区域...")
+                verified = 0
+                for offset, length in runs:
+                    self._check_cancel()
+                    data = _pread_full(fd, length, offset)
+                    for pos in range(0, length, self.block_size):
+                        index = (offset + pos) // self.block_size
+                        if block_digest(data[pos:pos + self.block_size]) != new_digests[index]:
+                            raise IOError(f"校验失败: 偏移 {offset + pos}")
+                    verified += length
+                    self._progress(verified, changed)
+        finally:
+            os.close(fd)
+
+        if self.manifest_store:
+            self.manifest_store.save(self.device, image_name, image_size, new_digests, self.block_size,
+                                     self.identity)
+
+        return {
+            'mode': used_mode,
+            'regions': len(runs),
+            'changed_bytes': changed,
+            'image_bytes': image_size,
+            'elapsed': time.time() - start_time
+        }
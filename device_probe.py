@@ -0,0 +1,125 @@
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+# 一次枚举等待所有探测完成的最长时间（秒）
+DEFAULT_TIMEOUT = 2.0
+
+STATE_READY = 'ready'
+STATE_PROBING = 'probing'
+STATE_ERROR = 'error'
+
+
+class DeviceProber:
+    """
+    在有界线程池中并行探测各设备的详细信息
+    超过期限仍未完成的设备以 probing 状态返回，完成后通过 on_update 通知，
+    下一次枚举直接使用已完成的结果；卡死的设备不会被重复提交，占满线程池
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT, on_update=None):
+        """
+        :param workers: 线程数
+        :param timeout: 每次 probe_all 的等待期限（秒）
+        :param on_update: 超时的探测完成后回调 on_update(drive)，在工作线程中调用
+        """
+        self.timeout = timeout
+        self.on_update = on_update
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._pending = {}
+        self._overdue = set()
+        self._late = {}
+        self._lock = threading.Lock()
+
+    def probe_all(self, drives, probe):
+        """
+        并行探测
+        :param drives: 只含基本信息的 Drive 列表
+        :param probe: probe(drive) -> 带详细信息的 Drive
+        :return: 与 drives 顺序相同的 Drive 列表
+        """
+        deadline = time.monotonic() + self.timeout
+        futures = {}
+        results = {}
+        submitted = []
+        with self._lock:
+            # 上次已经超时的设备不再等待
+            stalled = set(self._overdue)
+            for drive in drives:
+                if drive.path in self._late and drive.path not in self._pending:
+                    results[drive.path] = self._late.pop(drive.path)
+                    continue
+                future = self._pending.get(drive.path)
+                if future is None:
+                    future = self._pool.submit(probe, drive)
+                    self._pending[drive.path] = future
+                    submitted.append((drive, future))
+                futures[drive.path] = future
+        # 在锁外注册回调：已完成的 future 会立即在当前线程调用回调
+        for drive, future in submitted:
+            future.add_done_callback(lambda f, drive=drive: self._finished(drive, f))
+
+        overdue = []
+        for drive in drives:
+            if drive.path in results:
+                continue
+            wait = 0 if drive.path in stalled else max(0, deadline - time.monotonic())
+            try:
+                results[drive.path] = futures[drive.path].result(timeout=wait)
+            except FutureTimeout:
+                drive.state = STATE_PROBING
+                results[drive.path] = drive
+                overdue.append(drive.path)
+            except Exception as e:
+                logger.warning(f"探测设备 {drive.path} 失败: {e}")
+                drive.state = STATE_ERROR
+                results[drive.path] = drive
+        if overdue:
+            finished = []
+            with self._lock:
+                for path in overdue:
+                    if path in self._pending:
+                        self._overdue.add(path)
+                    else:
+                        # 超时判断之后、登记之前刚好完成
+                        finished.append(path)
+            logger.info(f"设备探测超时，稍后更新: {', '.join(overdue)}")
+            for path in finished:
+                self._deliver(results[path], futures[path])
+        return [results[drive.path] for drive in drives]
+
+    def _finished(self, drive, future):
+        with self._lock:
+            self._pending.pop(drive.path, None)
+            if drive.path not in self._overdue:
+                return
+            self._overdue.discard(drive.path)
+        self._deliver(drive, future)
+
+    def _deliver(self, drive, future):
+        """保存超时后才完成的结果并通知"""
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.warning(f"探测设备 {drive.path} 失败: {e}")
+            drive.state = STATE_ERROR
+            result = drive
+        with self._lock:
+            self._late[drive.path] = result
+        if self.on_update:
+            try:
+                self.on_update(result)
+            except Exception as e:
+                logger.error(f"设备探测回调出错: {e}")
+
+    def pending(self):
+        """仍在探测中的设备路径"""
+        with self._lock:
+            return sorted(self._pending)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
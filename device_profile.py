@@ -0,0 +1,308 @@
+import os
+import re
+import json
+import time
+import hashlib
+import plistlib
+import platform
+import threading
+import subprocess
+import logging
+
+import block_device
+import drive_enum
+
+logger = logging.getLogger(__name__)
+
+# 吞吐量的指数滑动平均系数，新测量值所占权重
+THROUGHPUT_WEIGHT = 0.3
+MAX_FAILURES = 20
+USB_PORT_PATTERN = re.compile(r'^\d+-[\d.]+$')
+
+
+class DeviceIdentity:
+    """
+    与设备节点名无关的设备身份：同一个U盘换个接口、或重新插拔变成 /dev/sdc 仍能对应到同一份档案
+    """
+    __slots__ = ('vendor', 'model', 'serial', 'capacity', 'port_path')
+
+    def __init__(self, vendor='', model='', serial='', capacity=0, port_path=''):
+        """
+        :param serial: USB序列号，部分廉价U盘没有
+        :param capacity: 字节数
+        :param port_path: USB拓扑路径，如 1-1.4（Hub上的第4口）
+        """
+        self.vendor = vendor
+        self.model = model
+        self.serial = serial
+        self.capacity = capacity
+        self.port_path = port_path
+
+    def __repr__(self):
+        return f"DeviceIdentity({self.key!r})"
+
+    @property
+    def key(self):
+        """档案键：有序列号时不含端口，没有序列号时用端口+容量区分同型号设备"""
+        parts = [self.vendor, self.model, str(self.capacity)]
+        parts.append(f'sn={self.serial}' if self.serial else f'port={self.port_path}')
+        return '|'.join(part.strip() for part in parts)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data[name] for name in cls.__slots__ if name in data})
+
+
+def _read_text(path):
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            return f.read().strip()
+    except OSError:
+        return ''
+
+
+def identify_linux(path):
+    """从sysfs和udev数据库读取设备身份"""
+    # 分区归属于所在整盘的身份
+    disk = drive_enum.parent_disk(path)
+    directory = block_device.sysfs_dir(disk)
+    if directory is None:
+        raise ValueError(f"{path} 不是块设备")
+    info = block_device.probe_linux(disk)
+
+    properties = {}
+    dev = _read_text(os.path.join(directory, 'dev'))
+    for line in _read_text(os.path.join(drive_enum.UDEV_DATA, f'b{dev}')).split('\n'):
+        if line.startswith('E:') and '=' in line:
+            key, value = line[2:].split('=', 1)
+            properties[key] = value
+
+    # 沿sysfs设备路径向上找USB设备目录（如 .../usb1/1-1/1-1.4），其中有序列号
+    serial = properties.get('ID_SERIAL_SHORT', '')
+    port_path = ''
+    current = os.path.realpath(os.path.join(directory, 'device'))
+    while current not in ('/', '/sys', '/sys/devices'):
+        name = os.path.basename(current)
+        if USB_PORT_PATTERN.match(name):
+            port_path = port_path or name
+            serial = serial or _read_text(os.path.join(current, 'serial'))
+            break
+        current = os.path.dirname(current)
+
+    return DeviceIdentity(
+        vendor=properties.get('ID_VENDOR') or _read_text(os.path.join(directory, 'device', 'vendor')),
+        model=properties.get('ID_MODEL') or _read_text(os.path.join(directory, 'device', 'model')),
+        serial=serial,
+        capacity=info.size,
+        port_path=port_path
+    )
+
+
+def _ioreg_contains(entry, bsd_name):
+    if entry.get('BSD Name') == bsd_name:
+        return True
+    return any(_ioreg_contains(child, bsd_name) for child in entry.get('IORegistryEntryChildren', ()))
+
+
+def find_usb_device(entries, bsd_name):
+    """
+    在 ioreg -a 输出的USB设备树中查找包含该磁盘的USB设备
+    :param entries: plistlib 解析后的 IOUSBHostDevice 列表
+    :param bsd_name: 磁盘的BSD名称，如 disk4
+    :return: 最内层的USB设备属性字典，找不到时返回None
+    """
+    for entry in entries:
+        if _ioreg_contains(entry, bsd_name):
+            # Hub 下面还可能有更具体的USB设备
+            inner = find_usb_device([child for child in entry.get('IORegistryEntryChildren', ())
+                                     if 'locationID' in child], bsd_name)
+            return inner or entry
+    return None
+
+
+def identify_darwin(path):
+    """
+    从IORegistry读取USB序列号和厂商，diskutil 补充型号和容量
+    diskutil 中的 MediaUUID/DiskUUID 是分区表或卷的ID，重新写入后就会变化，不能作为设备身份
+    """
+    disk = drive_enum.parent_disk(path)
+    info = plistlib.loads(subprocess.check_output(['diskutil', 'info', '-plist', disk], timeout=15))
+    usb = None
+    try:
+        output = subprocess.check_output(['ioreg', '-r', '-c', 'IOUSBHostDevice', '-l', '-a'], timeout=15)
+        usb = find_usb_device(plistlib.loads(output) if output.strip() else [], os.path.basename(disk))
+    except (OSError, subprocess.SubprocessError, ValueError) as e:
+        logger.debug(f"读取 {disk} 的USB信息失败: {e}")
+    usb = usb or {}
+    location = usb.get('locationID')
+    return DeviceIdentity(
+        vendor=usb.get('USB Vendor Name') or usb.get('kUSBVendorString') or '',
+        model=usb.get('USB Product Name') or info.get('MediaName') or info.get('IORegistryEntryName', ''),
+        serial=usb.get('USB Serial Number') or usb.get('kUSBSerialNumberString') or '',
+        capacity=info.get('TotalSize') or info.get('Size', 0),
+        port_path=f'{location:08x}' if isinstance(location, int) else info.get('DeviceTreePath', '')
+    )
+
+
+def identify(path):
+    """
+    获取设备身份；镜像文件以路径作为身份
+    :return: DeviceIdentity
+    """
+    if os.path.isfile(path):
+        return DeviceIdentity(model='image', serial=os.path.abspath(path), capacity=os.path.getsize(path))
+    system = platform.system().lower()
+    if system == 'linux':
+        return identify_linux(path)
+    if system == 'darwin':
+        return identify_darwin(path)
+    raise OSError(f"不支持的操作系统: {system}")
+
+
+def image_digest(block_digests):
+    """由逐块摘要得到整个镜像的摘要，无需再次读取镜像"""
+    return hashlib.blake2b(b''.join(block_digests), digest_size=16).hexdigest()
+
+
+class DeviceProfileStore:
+    """
+    每个设备的档案：实测写入速度、各块大小的速度、失败记录、上次写入的镜像
+    保存为一个JSON文件，写入时先写临时文件再替换
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._profiles = None
+
+    def _load(self):
+        if self._profiles is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._profiles = json.load(f)
+            except FileNotFoundError:
+                self._profiles = {}
+            except (OSError, ValueError) as e:
+                logger.warning(f"读取设备档案失败，将重新创建: {e}")
+                self._profiles = {}
+        return self._profiles
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self._profiles, f, ensure_ascii=False, indent=2)
+        os.replace(self.path + '.tmp', self.path)
+
+    def get(self, identity):
+        """
+        :return: 档案字典的副本，没有记录时返回None
+        """
+        with self._lock:
+            profile = self._load().get(identity.key)
+            return json.loads(json.dumps(profile)) if profile else None
+
+    def _update(self, identity, change):
+        with self._lock:
+            profiles = self._load()
+            profile = profiles.setdefault(identity.key, {
+                'identity': identity.to_dict(),
+                'first_seen': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'flash_count': 0,
+                'failures': [],
+                'block_sizes': {}
+            })
+            profile['identity'] = identity.to_dict()
+            profile['last_seen'] = time.strftime('%Y-%m-%d %H:%M:%S')
+            change(profile)
+            self._save()
+            return profile
+
+    @staticmethod
+    def _blend(old, new):
+        return new if not old else old + THROUGHPUT_WEIGHT * (new - old)
+
+    @classmethod
+    def _record_block_size(cls, profile, block_size, bytes_per_second):
+        sizes = profile.setdefault('block_sizes', {})
+        key = str(block_size)
+        sizes[key] = cls._blend(sizes.get(key), bytes_per_second)
+        profile['best_block_size'] = int(max(sizes, key=sizes.get))
+
+    def record_throughput(self, identity, bytes_per_second, block_size=None):
+        """记录一次实测写入速度（滑动平均），并按块大小分别统计"""
+        def change(profile):
+            profile['write_throughput'] = self._blend(profile.get('write_throughput'), bytes_per_second)
+            if block_size:
+                self._record_block_size(profile, block_size, bytes_per_second)
+        return self._update(identity, change)
+
+    def record_benchmark(self, identity, summary, block_sizes=None):
+        """
+        记录一次性能测试
+        :param summary: storage_bench.summarize() 的结果
+        :param block_sizes: {块大小: 顺序写入字节/秒}，计入各块大小的速度统计
+        """
+        def change(profile):
+            profile['benchmark'] = dict(summary, time=time.strftime('%Y-%m-%d %H:%M:%S'))
+            for block_size, bytes_per_second in (block_sizes or {}).items():
+                self._record_block_size(profile, block_size, bytes_per_second)
+        return self._update(identity, change)
+
+    def record_failure(self, identity, operation, message):
+        def change(profile):
+            profile['failures'].append({
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'operation': operation,
+                'message': message
+            })
+            del profile['failures'][:-MAX_FAILURES]
+        return self._update(identity, change)
+
+    def record_flash(self, identity, image, digest, size):
+        """记录成功写入的镜像"""
+        def change(profile):
+            profile['flash_count'] = profile.get('flash_count', 0) + 1
+            profile['last_image'] = {
+                'image': image,
+                'digest': digest,
+                'size': size,
+                'time': time.strftime('%Y-%m-%d %H:%M:%S')
+            }
+        return self._update(identity, change)
+
+    def record_capacity(self, identity, report):
+        """
+        记录扩容盘检查结果
+        :param report: CapacityReport.to_dict()
+        """
+        def change(profile):
+            profile['capacity'] = dict(report, time=time.strftime('%Y-%m-%d %H:%M:%S'))
+        return self._update(identity, change)
+
+    def record_bad_blocks(self, identity, result):
+        """
+        记录坏块扫描结果（坏扇区以行程编码保存）
+        :param result: ScanResult.to_dict()
+        """
+        def change(profile):
+            profile['bad_blocks'] = dict(result, time=time.strftime('%Y-%m-%d %H:%M:%S'))
+        return self._update(identity, change)
+
+    def record_health(self, identity, status, bad_blocks, write_speed):
+        """记录最近一次健康检查结果"""
+        def change(profile):
+            profile['last_health'] = {
+                'status': status,
+                'bad_blocks': bad_blocks,
+                'write_speed': write_speed,
+                'time': time.strftime('%Y-%m-%d %H:%M:%S')
+            }
+        return self._update(identity, change)
+
+    def forget(self, identity):
+        with self._lock:
+            if self._load().pop(identity.key, None) is not None:
+                self._save()
@@ -0,0 +1,319 @@
+import os
+import time
+import platform
+import threading
+import logging
+
+import drive_enum
+from device_probe import DeviceProber
+
+logger = logging.getLogger(__name__)
+
+# 一次插拔会连续产生整盘和各分区的多个事件，等待这么久再统一重新枚举
+SETTLE_DELAY = 0.3
+DEFAULT_POLL_INTERVAL = 2.0
+
+
+class DeviceEvents:
+    """事件类型常量"""
+    Add = 'added'
+    Remove = 'removed'
+    Change = 'changed'
+
+
+class EventSource:
+    """
+    热插拔事件源：检测到块设备变化时调用 notify()，由注册表重新枚举并比较差异
+    """
+    name = 'base'
+
+    def enumerate(self, prober=None):
+        return drive_enum.enumerate_drives(prober=prober)
+
+    def start(self, notify):
+        raise NotImplementedError
+
+    def stop(self):
+        pass
+
+
+class UdevSource(EventSource):
+    """Linux：pyudev 监听内核 netlink 上的 block 子系统事件"""
+    name = 'udev'
+
+    def __init__(self):
+        import pyudev
+        self._context = pyudev.Context()
+        self._monitor = pyudev.Monitor.from_netlink(self._context)
+        self._monitor.filter_by(subsystem='block')
+        self._observer = None
+
+    def start(self, notify):
+        import pyudev
+        self._observer = pyudev.MonitorObserver(self._monitor, callback=lambda device: notify())
+        self._observer.daemon = True
+        self._observer.start()
+
+    def stop(self):
+        if self._observer:
+            self._observer.send_stop()
+            self._observer = None
+
+
+class DiskArbitrationSource(EventSource):
+    """macOS：通过 pyobjc 注册 DiskArbitration 的磁盘出现/消失/描述变化回调"""
+    name = 'diskarbitration'
+
+    def __init__(self):
+        import DiskArbitration
+        self._da = DiskArbitration
+        self._session = DiskArbitration.DASessionCreate(None)
+        self._loop = None
+        self.thread = None
+
+    def start(self, notify):
+        from CoreFoundation import CFRunLoopGetCurrent, CFRunLoopRun, kCFRunLoopDefaultMode
+
+        def callback(disk, *args):
+            notify()
+
+        # 回调对象需要一直被引用，否则会被回收
+        self._callback = callback
+        self._da.DARegisterDiskAppearedCallback(self._session, None, callback, None)
+        self._da.DARegisterDiskDisappearedCallback(self._session, None, callback, None)
+        self._da.DARegisterDiskDescriptionChangedCallback(self._session, None, None, callback, None)
+        ready = threading.Event()
+
+        def run_loop():
+            self._loop = CFRunLoopGetCurrent()
+            self._da.DASessionScheduleWithRunLoop(self._session, self._loop, kCFRunLoopDefaultMode)
+            ready.set()
+            CFRunLoopRun()
+
+        self.thread = threading.Thread(target=run_loop, daemon=True)
+        self.thread.start()
+        ready.wait(5)
+
+    def stop(self):
+        if self._loop is not None:
+            from CoreFoundation import CFRunLoopStop, kCFRunLoopDefaultMode
+            self._da.DASessionUnscheduleFromRunLoop(self._session, self._loop, kCFRunLoopDefaultMode)
+            CFRunLoopStop(self._loop)
+            self._loop = None
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+
+class PollingSource(EventSource):
+    """
+    轮询后备方案：Linux只比较 /sys/block 的设备名和容量，其他系统定期完整枚举
+    """
+    name = 'polling'
+
+    def __init__(self, interval=DEFAULT_POLL_INTERVAL):
+        self.interval = interval
+        self._stop = threading.Event()
+        self.thread = None
+
+    @staticmethod
+    def _signature():
+        if not os.path.isdir(drive_enum.SYS_BLOCK):
+            return None
+        signature = []
+        for name in sorted(os.listdir(drive_enum.SYS_BLOCK)):
+            try:
+                with open(os.path.join(drive_enum.SYS_BLOCK, name, 'size')) as f:
+                    signature.append((name, f.read().strip()))
+            except OSError:
+                signature.append((name, None))
+        return signature
+
+    def start(self, notify):
+        self._stop.clear()
+
+        def poll():
+            last = self._signature()
+            while not self._stop.wait(self.interval):
+                current = self._signature()
+                # 没有sysfs时每次都重新枚举，由注册表比较差异
+                if current is None or current != last:
+                    last = current
+                    notify()
+
+        self.thread = threading.Thread(target=poll, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+
+class FakeEventSource(EventSource):
+    """测试用事件源：手动添加/移除/修改设备"""
+    name = 'fake'
+
+    def __init__(self, drives=()):
+        self._drives = {drive.path: drive for drive in drives}
+        self._notify = None
+
+    def enumerate(self, prober=None):
+        return list(self._drives.values())
+
+    def start(self, notify):
+        self._notify = notify
+
+    def stop(self):
+        self._notify = None
+
+    def _fire(self):
+        if self._notify:
+            self._notify()
+
+    def add(self, drive):
+        self._drives[drive.path] = drive
+        self._fire()
+
+    def remove(self, path):
+        self._drives.pop(path, None)
+        self._fire()
+
+    def change(self, drive):
+        self.add(drive)
+
+
+def default_source(poll_interval=DEFAULT_POLL_INTERVAL):
+    """按平台选择事件源，不可用时退回轮询"""
+    system = platform.system().lower()
+    try:
+        if system == 'linux':
+            return UdevSource()
+        if system == 'darwin':
+            return DiskArbitrationSource()
+    except (ImportError, OSError) as e:
+        logger.info(f"热插拔事件不可用，改用轮询: {e}")
+    return PollingSource(poll_interval)
+
+
+class DeviceRegistry:
+    """
+    常驻的U盘注册表：内存中保存当前已连接的设备，热插拔时增量更新并通知订阅者
+    """
+
+    def __init__(self, source=None, settle_delay=SETTLE_DELAY, prober=None):
+        """
+        :param source: EventSource，None时按平台自动选择
+        :param settle_delay: 收到事件后等待多久再重新枚举（秒）
+        :param prober: DeviceProber；慢速设备探测完成后需调用本注册表的 notify()
+        """
+        self.source = source or default_source()
+        self.settle_delay = settle_delay
+        self.prober = prober or DeviceProber(on_update=lambda drive: self.notify())
+        self._drives = {}
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = None
+
+    # ---- 查询 ----
+
+    def get(self, path):
+        return self._drives.get(path)
+
+    def drives(self):
+        """当前设备列表（按路径排序）"""
+        drives = self._drives
+        return [drives[path] for path in sorted(drives)]
+
+    def __contains__(self, path):
+        return path in self._drives
+
+    def __len__(self):
+        return len(self._drives)
+
+    # ---- 订阅 ----
+
+    def subscribe(self, callback):
+        """
+        :param callback: callback(event, drive)，event 为 DeviceEvents 常量；在后台线程中调用
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def _publish(self, event, drive):
+        for callback in list(self._subscribers):
+            try:
+                callback(event, drive)
+            except Exception as e:
+                logger.error(f"设备事件回调出错: {e}")
+
+    # ---- 更新 ----
+
+    def refresh(self):
+        """
+        重新枚举并与当前内容比较，发布差异
+        :return: [(event, drive), ...]
+        """
+        with self._lock:
+            current = {drive.path: drive for drive in self.source.enumerate(self.prober)}
+            previous = self._drives
+            events = []
+            for path in sorted(previous.keys() - current.keys()):
+                events.append((DeviceEvents.Remove, previous[path]))
+            for path in sorted(current):
+                if path not in previous:
+                    events.append((DeviceEvents.Add, current[path]))
+                elif current[path].to_dict() != previous[path].to_dict():
+                    events.append((DeviceEvents.Change, current[path]))
+            # 整体替换字典，读取方无需加锁
+            self._drives = current
+        for event, drive in events:
+            self._publish(event, drive)
+        return events
+
+    def notify(self):
+        """事件源回调：唤醒工作线程"""
+        self._wakeup.set()
+
+    def _worker(self):
+        while self._running:
+            self._wakeup.wait()
+            if not self._running:
+                break
+            time.sleep(self.settle_delay)
+            self._wakeup.clear()
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"刷新设备列表失败: {e}")
+
+    def start(self):
+        """初次枚举并开始监听热插拔事件"""
+        if self._running:
+            return
+        self._running = True
+        self.refresh()
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+        self.source.start(self.notify)
+        logger.info(f"设备注册表已启动，事件源: {self.source.name}")
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        self.source.stop()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    @property
+    def running(self):
+        return self._running
@@ -0,0 +1,317 @@
+import os
+import re
+import time
+import queue
+import fnmatch
+import threading
+import subprocess
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+# 默认跳过的目录：应用程序包、依赖和版本库目录、系统元数据
+DEFAULT_EXCLUDES = (
+    '*.app', '*.framework', '*.bundle', 'node_modules', '.git', '.svn', '.hg', '__pycache__',
+    '.Trash', '.Trashes', '.Spotlight-V100', '.fseventsd', '.DocumentRevisions-V100', '.TemporaryItems',
+)
+NETWORK_FILESYSTEMS = frozenset((
+    'nfs', 'nfs4', 'cifs', 'smb', 'smbfs', 'smb3', 'afpfs', 'webdav', 'ncpfs', 'davfs', 'fuse.sshfs', 'sshfs',
+    'fuse.rclone', '9p',
+))
+
+
+def mount_table():
+    """
+    读取挂载表
+    :return: [(挂载点, 文件系统类型), ...]
+    """
+    mounts = []
+    try:
+        if os.path.exists('/proc/mounts'):
+            with open('/proc/mounts', 'r', encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) >= 3:
+                        # 空格等字符写作八进制转义，如 \040
+                        mount_point = re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), fields[1])
+                        mounts.append((mount_point, fields[2].lower()))
+        else:
+            output = subprocess.check_output(['mount'], universal_newlines=True, timeout=5)
+            for line in output.splitlines():
+                match = re.match(r'.+? on (.+) \(([\w.]+)', line)
+                if match:
+                    mounts.append((match.group(1), match.group(2).lower()))
+    except Exception as e:
+        logger.warning(f"读取挂载信息失败: {e}")
+    return mounts
+
+
+def network_mounts():
+    """:return: 网络文件系统的挂载点集合"""
+    return {mount_point for mount_point, fstype in mount_table() if fstype in NETWORK_FILESYSTEMS}
+
+
+def is_excluded(name, path, patterns):
+    """
+    :param patterns: 通配符列表；含路径分隔符的匹配完整路径，否则只匹配目录名
+    """
+    for pattern in patterns:
+        if fnmatch.fnmatch(path if os.sep in pattern else name, pattern):
+            return True
+    return False
+
+
+class _WorkQueues:
+    """
+    每个工作线程一个双端队列：自己从尾部取（深度优先，局部性好），
+    空闲时从其他线程的头部窃取（取走的是较浅、通常更大的子树）
+    """
+
+    def __init__(self, workers):
+        self._queues = [collections.deque() for _ in range(workers)]
+        self._condition = threading.Condition()
+        # 已入队但尚未处理完的任务数，为0时所有线程退出
+        self._pending = 0
+        self._stopped = False
+
+    def put(self, worker, tasks):
+        with self._condition:
+            self._queues[worker].extend(tasks)
+            self._pending += len(tasks)
+            if tasks:
+                # 只唤醒需要的线程数，避免所有空闲线程争抢
+                self._condition.notify(len(tasks))
+
+    def get(self, worker):
+        """:return: 任务，没有剩余任务时返回None"""
+        with self._condition:
+            while True:
+                if self._stopped:
+                    return None
+                own = self._queues[worker]
+                if own:
+                    return own.pop()
+                for other in self._queues:
+                    if other:
+                        return other.popleft()
+                if not self._pending:
+                    return None
+                self._condition.wait()
+
+    def done(self):
+        with self._condition:
+            self._pending -= 1
+            if not self._pending:
+                self._condition.notify_all()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+
+class DirCrawler:
+    """
+    基于 os.scandir 的并行目录遍历：多个线程窃取彼此的子目录任务，
+    找到的文件立即通过 crawl() 逐个产出，不必等整棵树遍历完
+
+    可选的 cache 对象让调用方跳过没有变化的目录：
+      cache.lookup(path, st) -> (子目录名列表, {文件名: [大小, 修改时间]}) 或 None（需要列出目录）
+      cache.store(path, st, subdirs, files) 保存新列出的结果
+      cache.discard(path) 目录已不存在或无法访问
+    """
+
+    def __init__(self, roots, match=None, excludes=DEFAULT_EXCLUDES, max_depth=None, same_filesystem=False,
+                 follow_symlinks=False, skip_network=True, time_budget=None, workers=DEFAULT_WORKERS,
+                 cache=None, cancel_check=None):
+        """
+        :param roots: 根目录列表
+        :param match: match(文件名) -> bool，只产出匹配的文件，None表示所有文件
+        :param excludes: 跳过的目录通配符
+        :param max_depth: 最多进入根目录以下几层，None表示不限
+        :param same_filesystem: 不进入与根目录不同文件系统的子目录（挂载点）
+        :param follow_symlinks: 是否进入指向目录的符号链接，已访问过的目录不会重复进入
+        :param skip_network: 不进入网络文件系统（NFS、SMB、AFP等）
+        :param time_budget: 每个根目录最多遍历多少秒，超时后放弃该根目录剩余的子目录
+        :param cancel_check: 返回True时尽快结束
+        """
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.match = match or (lambda name: True)
+        self.excludes = list(excludes or ())
+        self.max_depth = max_depth
+        self.same_filesystem = same_filesystem
+        self.follow_symlinks = follow_symlinks
+        self.skip_network = skip_network
+        self.time_budget = time_budget
+        self.workers = max(1, workers)
+        self.cache = cache
+        self.cancel_check = cancel_check or (lambda: False)
+        self.stats = {'listed': 0, 'cached': 0, 'excluded': 0, 'errors': 0, 'files': 0}
+        # 超过时间预算或被取消、没有遍历完的根目录
+        self.truncated = set()
+        self._lock = threading.Lock()
+        self._visited = set()
+        self._network = set()
+        self._root_devices = {}
+        self._deadlines = {}
+        self._cancelled = False
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def _first_visit(self, st):
+        key = (st.st_dev, st.st_ino)
+        with self._lock:
+            if key in self._visited:
+                return False
+            self._visited.add(key)
+            return True
+
+    def _list(self, path):
+        subdirs = []
+        files = {}
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=self.follow_symlinks):
+                        subdirs.append(entry.name)
+                    elif self.match(entry.name) and entry.is_file():
+                        st = entry.stat()
+                        files[entry.name] = [st.st_size, st.st_mtime]
+                except OSError:
+                    continue
+        return sorted(subdirs), files
+
+    def _visit(self, task, emit):
+        """
+        处理一个目录
+        :return: 子目录任务列表
+        """
+        path, depth, root = task
+        if self._deadlines.get(root) is not None and time.monotonic() > self._deadlines[root]:
+            with self._lock:
+                self.truncated.add(root)
+            return []
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._count('errors')
+            if self.cache:
+                self.cache.discard(path)
+            return []
+        if depth == 0:
+            self._root_devices[root] = st.st_dev
+        elif self.same_filesystem and st.st_dev != self._root_devices.get(root):
+            self._count('excluded')
+            return []
+        if path in self._network or not self._first_visit(st):
+            self._count('excluded')
+            return []
+
+        listing = self.cache.lookup(path, st) if self.cache else None
+        if listing is None:
+            try:
+                listing = self._list(path)
+            except OSError as e:
+                logger.debug(f"无法列出目录 {path}: {e}")
+                self._count('errors')
+                if self.cache:
+                    self.cache.discard(path)
+                return []
+            self._count('listed')
+            if self.cache:
+                self.cache.store(path, st, *listing)
+        else:
+            self._count('cached')
+        subdirs, files = listing
+
+        for name, (size, mtime) in files.items():
+            emit((os.path.join(path, name), size, mtime))
+        self._count('files', len(files))
+
+        if self.max_depth is not None and depth >= self.max_depth:
+            return []
+        tasks = []
+        for name in subdirs:
+            child = os.path.join(path, name)
+            if is_excluded(name, child, self.excludes):
+                self._count('excluded')
+            else:
+                tasks.append((child, depth + 1, root))
+        # 反转后自己从尾部取时按名称顺序遍历
+        tasks.reverse()
+        return tasks
+
+    def _worker(self, index, work, results):
+        try:
+            while True:
+                task = work.get(index)
+                if task is None:
+                    break
+                try:
+                    if self.cancel_check():
+                        self._cancelled = True
+                        work.stop()
+                        break
+                    work.put(index, self._visit(task, results.put))
+                except Exception as e:
+                    self._count('errors')
+                    logger.error(f"遍历目录 {task[0]} 时出错: {e}")
+                finally:
+                    work.done()
+        finally:
+            # 每个线程结束时放一个None，crawl() 收齐后结束
+            results.put(None)
+
+    def crawl(self):
+        """
+        遍历所有根目录
+        :return: 生成器，逐个产出 (文件路径, 大小, 修改时间)；提前停止迭代时工作线程随之结束
+        """
+        if self.skip_network:
+            self._network = network_mounts()
+        now = time.monotonic()
+        roots = []
+        for root in self.roots:
+            if root in roots:
+                continue
+            roots.append(root)
+            self._deadlines[root] = now + self.time_budget if self.time_budget else None
+
+        work = _WorkQueues(self.workers)
+        # 根目录轮流分给各线程，多个根目录从一开始就并行
+        for i, root in enumerate(roots):
+            work.put(i % self.workers, [(root, 0, root)])
+        results = queue.Queue()
+        threads = [threading.Thread(target=self._worker, args=(i, work, results), daemon=True)
+                   for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        finished = 0
+        try:
+            while finished < len(threads):
+                item = results.get()
+                if item is None:
+                    finished += 1
+                else:
+                    yield item
+        finally:
+            work.stop()
+            for thread in threads:
+                thread.join(timeout=5)
+            if self._cancelled or finished < len(threads):
+                # 被取消或调用方提前停止迭代，所有根目录都可能没有遍历完
+                with self._lock:
+                    self.truncated.update(roots)
+
+    def run(self):
+        """:return: 按路径排序的 (文件路径, 大小, 修改时间) 列表"""
+        return sorted(self.crawl())
+
+
+def crawl(roots, **options):
+    """遍历目录，逐个产出 (文件路径, 大小, 修改时间)，选项同 DirCrawler"""
+    return DirCrawler(roots, **options).crawl()
@@ -0,0 +1,330 @@
+import os
+import re
+import platform
+import plistlib
+import subprocess
+import logging
+
+import block_device
+
+logger = logging.getLogger(__name__)
+
+SYS_BLOCK = '/sys/block'
+PROC_MOUNTS = '/proc/mounts'
+UDEV_DATA = '/run/udev/data'
+# diskutil 偶尔会被无响应的设备卡住
+DARWIN_LIST_TIMEOUT = 15
+
+# diskutil 分区内容类型 → 文件系统显示名
+DARWIN_CONTENT_FS = {
+    'DOS_FAT_12': 'FAT12',
+    'DOS_FAT_16': 'FAT16',
+    'DOS_FAT_32': 'FAT32',
+    'Windows_FAT_32': 'FAT32',
+    'Microsoft Basic Data': 'FAT/exFAT/NTFS',
+    'Windows_NTFS': 'NTFS/exFAT',
+    'Apple_HFS': 'HFS+',
+    'Apple_APFS': 'APFS',
+    'Linux': 'Linux',
+    'Linux Filesystem': 'Linux',
+    'EFI': 'EFI',
+}
+
+# udev/blkid 的 ID_FS_TYPE → 显示名
+LINUX_FS_NAMES = {
+    'vfat': 'FAT32',
+    'exfat': 'exFAT',
+    'ntfs': 'NTFS',
+    'iso9660': 'ISO9660',
+    'ext2': 'EXT2',
+    'ext3': 'EXT3',
+    'ext4': 'EXT4',
+    'hfsplus': 'HFS+',
+    'btrfs': 'Btrfs',
+}
+
+
+class Drive:
+    """一次枚举得到的磁盘信息"""
+    __slots__ = ('path', 'name', 'vendor', 'model', 'size', 'removable', 'bus',
+                 'filesystem', 'mountpoints', 'partitions', 'read_only', 'state')
+
+    def __init__(self, path, name=None, vendor='', model='', size=0, removable=False, bus='',
+                 filesystem=None, mountpoints=(), partitions=(), read_only=False, state='ready'):
+        """
+        :param path: 整盘设备路径，如 /dev/sdb、/dev/disk4
+        :param name: 卷名
+        :param size: 字节数
+        :param mountpoints: 该盘各分区的挂载点
+        :param partitions: 分区设备路径
+        :param read_only: 是否写保护
+        :param state: ready/probing/error，详见 device_probe
+        """
+        self.path = path
+        self.name = name
+        self.vendor = vendor
+        self.model = model
+        self.size = size
+        self.removable = removable
+        self.bus = bus
+        self.filesystem = filesystem
+        self.mountpoints = tuple(mountpoints)
+        self.partitions = tuple(partitions)
+        self.read_only = read_only
+        self.state = state
+
+    def __repr__(self):
+        return f"Drive({self.path!r}, name={self.name!r}, size={self.size}, bus={self.bus!r})"
+
+    @property
+    def label(self):
+        if self.name:
+            return self.name
+        if self.mountpoints:
+            return os.path.basename(self.mountpoints[0].rstrip('/')) or self.mountpoints[0]
+        return ' '.join(part for part in (self.vendor, self.model) if part) or 'Unnamed'
+
+    @property
+    def display_name(self):
+        size = format_size(self.size) if self.size else '未知大小'
+        if self.state == 'probing':
+            return f"{self.path} - {size} [正在探测...]"
+        if self.state == 'error':
+            return f"{self.path} - {size} [无法读取设备信息]"
+        suffix = ' [写保护]' if self.read_only else ''
+        return f"{self.label} ({self.path}) - {size} [{self.filesystem or 'Unknown'}]{suffix}"
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def format_size(size):
+    """按厂商标称方式（十进制）格式化容量"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1000:
+            return f"{size:.2f} {unit}" if unit != 'B' else f"{size} B"
+        size /= 1000
+    return f"{size:.2f} TB"
+
+
+def _read_text(path, default=''):
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def _unescape_mount(field):
+    # /proc/mounts 中空格等字符写作八进制转义，如 \040
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), field)
+
+
+def read_mounts(path=PROC_MOUNTS):
+    """
+    一次读取挂载表
+    :return: {设备路径: [(挂载点, 文件系统), ...]}
+    """
+    mounts = {}
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            lines = f.readlines()
+    except OSError:
+        return mounts
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 3 or not fields[0].startswith('/dev/'):
+            continue
+        device = os.path.realpath(_unescape_mount(fields[0]))
+        mounts.setdefault(device, []).append((_unescape_mount(fields[1]), fields[2]))
+    return mounts
+
+
+def _udev_properties(dev_numbers, udev_dir=UDEV_DATA):
+    """读取udev数据库中已探测的文件系统信息（不需要调用blkid）"""
+    properties = {}
+    for line in _read_text(os.path.join(udev_dir, f'b{dev_numbers}')).split('\n'):
+        if line.startswith('E:') and '=' in line:
+            key, value = line[2:].split('=', 1)
+            properties[key] = value
+    return properties
+
+
+def list_linux_disks(removable_only=True, sys_block=SYS_BLOCK):
+    """
+    快速列出磁盘：只读 /sys/block 中内核缓存的属性，不访问设备本身
+    :return: 只含路径、容量、可移动标志和总线的 Drive 列表，详细信息由 probe_linux_drive 补全
+    """
+    drives = []
+    for name in sorted(os.listdir(sys_block)):
+        base = os.path.join(sys_block, name)
+        # 没有 device 链接的是 loop、ram、dm 等虚拟设备
+        if not os.path.exists(os.path.join(base, 'device')):
+            continue
+        removable = _read_text(os.path.join(base, 'removable')) == '1'
+        bus = 'usb' if '/usb' in os.path.realpath(base) else ''
+        if removable_only and not (removable or bus == 'usb'):
+            continue
+        try:
+            size = int(_read_text(os.path.join(base, 'size'), '0')) * 512
+        except ValueError:
+            size = 0
+        # 可移动读卡器未插卡时容量为0
+        if removable_only and size == 0:
+            continue
+        drives.append(Drive(path=f'/dev/{name}', size=size, removable=removable, bus=bus))
+    return drives
+
+
+def probe_linux_drive(drive, mounts, sys_block=SYS_BLOCK, udev_dir=UDEV_DATA):
+    """
+    补全一个磁盘的分区、卷标、文件系统、厂商型号，并打开设备确认容量和写保护状态
+    打开设备可能因读卡器或坏盘而长时间阻塞，应放在 device_probe 的线程池中执行
+    :param mounts: read_mounts() 的结果
+    :return: 新的 Drive
+    """
+    name = os.path.basename(drive.path)
+    base = os.path.join(sys_block, name)
+    partitions = sorted((entry for entry in os.listdir(base)
+                         if os.path.exists(os.path.join(base, entry, 'partition'))),
+                        key=lambda entry: [int(n) if n.isdigit() else n for n in re.split(r'(\d+)', entry)])
+    labels = []
+    filesystem = None
+    mountpoints = []
+    for node in [name] + partitions:
+        node_dir = base if node == name else os.path.join(base, node)
+        node_mounts = mounts.get(f'/dev/{node}', [])
+        for mountpoint, fstype in node_mounts:
+            mountpoints.append(mountpoint)
+            filesystem = filesystem or LINUX_FS_NAMES.get(fstype, fstype)
+        properties = _udev_properties(_read_text(os.path.join(node_dir, 'dev')), udev_dir)
+        if properties.get('ID_FS_LABEL'):
+            labels.append((not node_mounts, properties['ID_FS_LABEL']))
+        if properties.get('ID_FS_TYPE') and not filesystem:
+            filesystem = LINUX_FS_NAMES.get(properties['ID_FS_TYPE'], properties['ID_FS_TYPE'])
+    # 优先使用已挂载分区的卷标，其次是挂载点名称（Drive.label），最后才是未挂载分区的卷标
+    label = min(labels)[1] if labels and (not min(labels)[0] or not mountpoints) else None
+
+    size = drive.size
+    read_only = _read_text(os.path.join(base, 'ro')) == '1'
+    if os.path.exists(drive.path):
+        try:
+            info = block_device.probe_linux(drive.path)
+            size, read_only = info.size, info.read_only
+        except (OSError, ValueError) as e:
+            logger.debug(f"读取 {drive.path} 的块设备信息失败: {e}")
+
+    return Drive(
+        path=drive.path,
+        name=label,
+        vendor=_read_text(os.path.join(base, 'device', 'vendor')),
+        model=_read_text(os.path.join(base, 'device', 'model')),
+        size=size,
+        removable=drive.removable,
+        bus=drive.bus,
+        filesystem=filesystem,
+        mountpoints=mountpoints,
+        partitions=[f'/dev/{p}' for p in partitions],
+        read_only=read_only
+    )
+
+
+def enumerate_linux(removable_only=True, sys_block=SYS_BLOCK, mounts_path=PROC_MOUNTS, udev_dir=UDEV_DATA,
+                    prober=None):
+    """
+    从 /sys/block 和 /proc/mounts 读取所有磁盘，不启动任何子进程
+    :param removable_only: 只返回可移动或USB磁盘
+    :param prober: device_probe.DeviceProber，提供时并行探测并限制等待时间
+    """
+    mounts = read_mounts(mounts_path)
+    drives = list_linux_disks(removable_only, sys_block)
+
+    def probe(drive):
+        return probe_linux_drive(drive, mounts, sys_block, udev_dir)
+
+    if prober is not None:
+        return prober.probe_all(drives, probe)
+    return [probe(drive) for drive in drives]
+
+
+def parse_diskutil_plist(data):
+    """
+    解析 `diskutil list -plist` 的输出
+    :param data: plist字节串
+    :return: Drive 列表
+    """
+    info = plistlib.loads(data)
+    drives = []
+    for disk in info.get('AllDisksAndPartitions', []):
+        identifier = disk.get('DeviceIdentifier')
+        if not identifier:
+            continue
+        # 整盘直接带文件系统（无分区表）时，自身就是唯一的“分区”
+        partitions = disk.get('Partitions') or disk.get('APFSVolumes') or ([disk] if disk.get('Content') else [])
+        label = None
+        filesystem = None
+        mountpoints = []
+        for part in partitions:
+            content = part.get('Content', '')
+            if content == 'EFI':
+                continue
+            if part.get('MountPoint'):
+                mountpoints.append(part['MountPoint'])
+            label = label or part.get('VolumeName')
+            filesystem = filesystem or DARWIN_CONTENT_FS.get(content, content or None)
+        drives.append(Drive(
+            path=f'/dev/{identifier}',
+            name=label,
+            size=disk.get('Size', 0),
+            removable=True,
+            bus='external',
+            filesystem=filesystem,
+            mountpoints=mountpoints,
+            partitions=[f"/dev/{p['DeviceIdentifier']}" for p in disk.get('Partitions', [])
+                        if p.get('DeviceIdentifier')]
+        ))
+    return drives
+
+
+def enumerate_darwin(removable_only=True, timeout=DARWIN_LIST_TIMEOUT):
+    """一次 diskutil 调用取得所有外置物理磁盘及其分区"""
+    command = ['diskutil', 'list', '-plist']
+    command += ['external', 'physical'] if removable_only else ['physical']
+    try:
+        return parse_diskutil_plist(subprocess.check_output(command, timeout=timeout))
+    except subprocess.TimeoutExpired:
+        raise OSError(f"diskutil 在 {timeout} 秒内没有响应，可能有设备无响应")
+
+
+def enumerate_drives(removable_only=True, prober=None):
+    """
+    枚举磁盘
+    :param removable_only: 只返回可移动/外置磁盘
+    :param prober: device_probe.DeviceProber，提供时并行探测，超时的设备以 probing 状态返回
+    :return: Drive 列表
+    """
+    system = platform.system().lower()
+    if system == 'linux':
+        return enumerate_linux(removable_only, prober=prober)
+    if system == 'darwin':
+        return enumerate_darwin(removable_only)
+    raise OSError(f"不支持的操作系统: {system}")
+
+
+def partition_number(path):
+    """:return: Linux分区节点的分区序号，如 /dev/sdb2 → 2，不是分区时返回None"""
+    name = os.path.basename(os.path.realpath(path))
+    number = _read_text(os.path.join('/sys/class/block', name, 'partition'))
+    return int(number) if number.isdigit() else None
+
+
+def parent_disk(path):
+    """分区路径 → 整盘路径，如 /dev/disk4s1 → /dev/disk4，/dev/sdb1 → /dev/sdb"""
+    match = re.match(r'^(/dev/r?disk\d+)(s\d+)?$', path)
+    if match:
+        return match.group(1).replace('/dev/rdisk', '/dev/disk')
+    name = os.path.basename(os.path.realpath(path))
+    class_dir = os.path.join('/sys/class/block', name)
+    if os.path.exists(os.path.join(class_dir, 'partition')):
+        return '/dev/' + os.path.basename(os.path.dirname(os.path.realpath(class_dir)))
+    return path
@@ -0,0 +1,193 @@
+import os
+import time
+import threading
+import logging
+
+from fs_events import FSEvent, FSEvents
+
+logger = logging.getLogger(__name__)
+
+# 同一路径的事件在安静这么久之后才作为一个事件发出（秒）
+DEFAULT_WINDOW = 0.5
+# 大小和修改时间保持不变这么久，视为文件已写完（秒）
+DEFAULT_STABLE_TIME = 3.0
+
+
+def merge_masks(previous, current):
+    """
+    合并同一路径上先后发生的两个事件
+    :return: 合并后的事件类型，None表示相互抵消（创建后又删除）
+    """
+    if previous is None:
+        return current
+    if previous == FSEvents.Create:
+        return None if current == FSEvents.Delete else FSEvents.Create
+    if previous == FSEvents.Delete:
+        # 删除后重新创建等同于内容被替换
+        return FSEvents.Modify if current != FSEvents.Delete else FSEvents.Delete
+    return FSEvents.Delete if current == FSEvents.Delete else FSEvents.Modify
+
+
+class _PathState:
+    __slots__ = ('mask', 'is_dir', 'last_event', 'emitted', 'closed', 'signature', 'stable_since', 'track')
+
+    def __init__(self, is_dir, track):
+        self.mask = None
+        self.is_dir = is_dir
+        self.last_event = 0.0
+        self.emitted = False
+        self.closed = False
+        self.signature = None
+        self.stable_since = 0.0
+        # 是否跟踪就绪状态
+        self.track = track
+
+
+class EventCoalescer:
+    """
+    位于 FSEventStream 和使用者之间：按路径合并时间窗口内的事件，
+    跟踪镜像文件的大小是否稳定，写完后只发出一次 FSEvents.Ready，按批次交给回调
+    """
+
+    def __init__(self, on_batch, window=DEFAULT_WINDOW, stable_time=DEFAULT_STABLE_TIME, ready_filter=None,
+                 close_events=False, clock=time.monotonic):
+        """
+        :param on_batch: on_batch(events)，events 为合并后的 FSEvent 列表；每个窗口最多调用一次，在工作线程中调用
+        :param window: 合并窗口（秒）
+        :param stable_time: 大小和修改时间不变多久视为写完（秒）
+        :param ready_filter: ready_filter(path) -> bool，只对这些文件跟踪就绪状态，如 .iso 文件
+        :param close_events: 事件源的 Modify 表示写入方关闭了文件（inotify 的 IN_CLOSE_WRITE），
+                             此时文件安静一个窗口即视为写完，不必等待 stable_time
+        """
+        self.on_batch = on_batch
+        self.window = window
+        self.stable_time = stable_time
+        self.ready_filter = ready_filter or (lambda path: False)
+        self.close_events = close_events
+        self.clock = clock
+        self._paths = {}
+        self._rescans = []
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def feed(self, event):
+        """接收原始事件，可直接作为 FSEventStream 的回调"""
+        now = self.clock()
+        with self._condition:
+            if event.mask == FSEvents.Rescan:
+                self._rescans.append(event)
+            else:
+                state = self._paths.get(event.name)
+                if state is None:
+                    state = _PathState(event.is_dir, not event.is_dir and self.ready_filter(event.name))
+                    self._paths[event.name] = state
+                if state.emitted:
+                    # 上一轮已经发出，重新开始合并
+                    state.mask, state.emitted = event.mask, False
+                else:
+                    state.mask = merge_masks(state.mask, event.mask)
+                state.last_event = now
+                if event.mask == FSEvents.Modify and self.close_events:
+                    state.closed = True
+                elif event.mask == FSEvents.Create:
+                    state.closed = False
+            self._condition.notify()
+
+    def _check_ready(self, path, state, now):
+        """
+        :return: 已就绪时返回True；文件已不存在时返回None
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        signature = (st.st_size, st.st_mtime_ns)
+        if signature != state.signature:
+            state.signature = signature
+            state.stable_since = now
+            # 关闭后又被改动，不能再认为已写完
+            state.closed = state.closed and now - state.last_event >= self.window
+            return False
+        if not st.st_size:
+            return False
+        if state.closed and now - state.last_event >= self.window:
+            return True
+        return now - state.stable_since >= self.stable_time
+
+    def flush(self, now=None):
+        """
+        取出到期的事件
+        :return: FSEvent 列表
+        """
+        now = self.clock() if now is None else now
+        batch = []
+        candidates = []
+        with self._condition:
+            batch.extend(self._rescans)
+            self._rescans = []
+            for path, state in list(self._paths.items()):
+                quiet = now - state.last_event >= self.window
+                if not quiet or state.emitted:
+                    if state.track and state.emitted:
+                        candidates.append((path, state))
+                    continue
+                state.emitted = True
+                if state.mask is None or state.mask == FSEvents.Delete:
+                    del self._paths[path]
+                    if state.mask is not None:
+                        batch.append(FSEvent(path, state.mask, state.is_dir))
+                    continue
+                # 跟踪中的镜像只报告创建，写入过程中的修改由最后的 Ready 代替
+                if not (state.track and state.mask == FSEvents.Modify):
+                    batch.append(FSEvent(path, state.mask, state.is_dir))
+                if state.track:
+                    candidates.append((path, state))
+                else:
+                    del self._paths[path]
+        for path, state in candidates:
+            ready = self._check_ready(path, state, now)
+            if ready is None or ready:
+                with self._condition:
+                    # 检查期间又有新事件时留到下一轮
+                    if self._paths.get(path) is state and state.emitted:
+                        del self._paths[path]
+                        if ready:
+                            batch.append(FSEvent(path, FSEvents.Ready))
+        return batch
+
+    def pending(self):
+        """仍在合并或等待写完的路径"""
+        with self._condition:
+            return sorted(self._paths)
+
+    def _worker(self):
+        tick = min(self.window, 0.25)
+        while True:
+            with self._condition:
+                if not self._running:
+                    break
+                self._condition.wait(tick)
+                if not self._running:
+                    break
+            batch = self.flush()
+            if batch:
+                try:
+                    self.on_batch(batch)
+                except Exception as e:
+                    logger.error(f"文件事件批量回调出错: {e}")
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self._thread = None
@@ -0,0 +1,316 @@
+import os
+import time
+import struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+DIR_ENTRY_SIZE = 32
+ATTR_READ_ONLY = 0x01
+ATTR_VOLUME_ID = 0x08
+ATTR_DIRECTORY = 0x10
+ATTR_LONG_NAME = 0x0F
+
+FAT12_MAX_CLUSTERS = 4085
+FAT16_MAX_CLUSTERS = 65525
+
+
+def is_fat_boot_sector(sector):
+    """粗略判断扇区是否为FAT引导扇区"""
+    if len(sector) < 512 or sector[510:512] != b'\x55\xaa' or sector[0] not in (0xEB, 0xE9):
+        return False
+    bytes_per_sector, sectors_per_cluster, reserved, fats = struct.unpack_from('<HBHB', sector, 11)
+    return (bytes_per_sector in (512, 1024, 2048, 4096) and sectors_per_cluster and
+            not sectors_per_cluster & (sectors_per_cluster - 1) and reserved and fats in (1, 2))
+
+
+def _dos_datetime(timestamp=None):
+    t = time.localtime(timestamp)
+    return (((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)),
+            (((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday))
+
+
+class FatEntry:
+    """目录中的一个文件或子目录"""
+    __slots__ = ('name', 'short_name', 'attr', 'cluster', 'size', 'offset')
+
+    def __init__(self, name, short_name, attr, cluster, size, offset):
+        self.name = name
+        self.short_name = short_name
+        self.attr = attr
+        self.cluster = cluster
+        self.size = size
+        # 短目录项在卷中的字节偏移
+        self.offset = offset
+
+    @property
+    def is_dir(self):
+        return bool(self.attr & ATTR_DIRECTORY)
+
+
+class FatVolume:
+    """
+    免挂载读写FAT12/16/32卷中已有的文件
+    替换文件内容时先写入新分配的簇，再一次性改写目录项，最后释放旧簇，
+    中途失败最多留下未引用的簇，不会出现半新半旧的文件
+    """
+
+    def __init__(self, path, offset=0, writable=False):
+        """
+        :param path: 设备或镜像文件
+        :param offset: 卷在文件中的起始字节
+        :param writable: 是否以读写方式打开
+        """
+        self.path = path
+        self.offset = offset
+        self.writable = writable
+        self._fd = os.open(path, (os.O_RDWR if writable else os.O_RDONLY) | getattr(os, 'O_BINARY', 0))
+        try:
+            self._load_bpb()
+        except Exception:
+            os.close(self._fd)
+            raise
+        self._fat_cache = {}
+        self._dirty = set()
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read(self, offset, size):
+        os.lseek(self._fd, self.offset + offset, os.SEEK_SET)
+        return os.read(self._fd, size)
+
+    def _write(self, offset, data):
+        os.lseek(self._fd, self.offset + offset, os.SEEK_SET)
+        os.write(self._fd, data)
+
+    def _load_bpb(self):
+        boot = self._read(0, 512)
+        if not is_fat_boot_sector(boot):
+            raise ValueError("不是FAT文件系统")
+        (self.bytes_per_sector, self.sectors_per_cluster, reserved, self.fat_count,
+         root_entries, total16, _, fat_size16) = struct.unpack_from('<HBHBHHBH', boot, 11)
+        total32, fat_size32 = struct.unpack_from('<II', boot, 32)
+        self.fat_sectors = fat_size16 or fat_size32
+        total = total16 or total32
+        root_sectors = -(-root_entries * DIR_ENTRY_SIZE // self.bytes_per_sector)
+        self.fat_offset = reserved * self.bytes_per_sector
+        self.root_offset = (reserved + self.fat_count * self.fat_sectors) * self.bytes_per_sector
+        self.root_size = root_entries * DIR_ENTRY_SIZE
+        self.data_offset = self.root_offset + root_sectors * self.bytes_per_sector
+        self.cluster_size = self.sectors_per_cluster * self.bytes_per_sector
+        self.cluster_count = (total * self.bytes_per_sector - self.data_offset) // self.cluster_size
+
+        if self.cluster_count < FAT12_MAX_CLUSTERS:
+            self.fat_type, self.eoc = 12, 0xFF8
+        elif self.cluster_count < FAT16_MAX_CLUSTERS:
+            self.fat_type, self.eoc = 16, 0xFFF8
+        else:
+            self.fat_type, self.eoc = 32, 0x0FFFFFF8
+            self.root_cluster = struct.unpack_from('<I', boot, 44)[0]
+            self.fsinfo_sector = struct.unpack_from('<H', boot, 48)[0]
+
+    # ---- FAT表 ----
+
+    def _fat_bytes(self, offset, size):
+        """从第一份FAT读取（带缓存，按扇区）"""
+        data = bytearray()
+        while size > 0:
+            sector = offset // self.bytes_per_sector
+            if sector not in self._fat_cache:
+                self._fat_cache[sector] = bytearray(
+                    self._read(self.fat_offset + sector * self.bytes_per_sector, self.bytes_per_sector))
+            start = offset % self.bytes_per_sector
+            chunk = self._fat_cache[sector][start:start + size]
+            data += chunk
+            offset += len(chunk)
+            size -= len(chunk)
+        return data
+
+    def _fat_store(self, offset, data):
+        for i, byte in enumerate(data):
+            sector, pos = divmod(offset + i, self.bytes_per_sector)
+            self._fat_bytes(sector * self.bytes_per_sector, 1)
+            self._fat_cache[sector][pos] = byte
+            self._dirty.add(sector)
+
+    def get_fat(self, cluster):
+        if self.fat_type == 32:
+            return struct.unpack('<I', self._fat_bytes(cluster * 4, 4))[0] & 0x0FFFFFFF
+        if self.fat_type == 16:
+            return struct.unpack('<H', self._fat_bytes(cluster * 2, 2))[0]
+        value = struct.unpack('<H', self._fat_bytes(cluster * 3 // 2, 2))[0]
+        return value >> 4 if cluster & 1 else value & 0xFFF
+
+    def set_fat(self, cluster, value):
+        if self.fat_type == 32:
+            old = struct.unpack('<I', self._fat_bytes(cluster * 4, 4))[0]
+            self._fat_store(cluster * 4, struct.pack('<I', (old & 0xF0000000) | (value & 0x0FFFFFFF)))
+        elif self.fat_type == 16:
+            self._fat_store(cluster * 2, struct.pack('<H', value & 0xFFFF))
+        else:
+            offset = cluster * 3 // 2
+            old = struct.unpack('<H', self._fat_bytes(offset, 2))[0]
+            if cluster & 1:
+                new = (old & 0x000F) | ((value & 0xFFF) << 4)
+            else:
+                new = (old & 0xF000) | (value & 0xFFF)
+            self._fat_store(offset, struct.pack('<H', new))
+
+    def _flush_fat(self):
+        """把修改过的FAT扇区写入每一份FAT"""
+        for sector in sorted(self._dirty):
+            for copy in range(self.fat_count):
+                self._write(self.fat_offset + (copy * self.fat_sectors + sector) * self.bytes_per_sector,
+                            bytes(self._fat_cache[sector]))
+        self._dirty.clear()
+        os.fsync(self._fd)
+
+    def chain(self, cluster):
+        clusters = []
+        while 2 <= cluster < self.eoc and len(clusters) <= self.cluster_count:
+            clusters.append(cluster)
+            cluster = self.get_fat(cluster)
+        return clusters
+
+    def _allocate(self, count):
+        clusters = []
+        for cluster in range(2, self.cluster_count + 2):
+            if self.get_fat(cluster) == 0:
+                clusters.append(cluster)
+                if len(clusters) == count:
+                    break
+        if len(clusters) < count:
+            raise IOError("FAT卷空间不足")
+        for current, following in zip(clusters, clusters[1:] + [None]):
+            self.set_fat(current, following if following else self.eoc | 0xF)
+        return clusters
+
+    def _cluster_offset(self, cluster):
+        return self.data_offset + (cluster - 2) * self.cluster_size
+
+    # ---- 目录 ----
+
+    def _dir_records(self, cluster):
+        """产出 (字节偏移, 32字节目录项)；cluster为None表示FAT12/16根目录"""
+        if cluster is None:
+            data = self._read(self.root_offset, self.root_size)
+            for pos in range(0, len(data), DIR_ENTRY_SIZE):
+                yield self.root_offset + pos, data[pos:pos + DIR_ENTRY_SIZE]
+            return
+        for current in self.chain(cluster):
+            base = self._cluster_offset(current)
+            data = self._read(base, self.cluster_size)
+            for pos in range(0, len(data), DIR_ENTRY_SIZE):
+                yield base + pos, data[pos:pos + DIR_ENTRY_SIZE]
+
+    def listdir(self, directory=None):
+        """
+        列出目录
+        :param directory: 目录 FatEntry，None表示根目录
+        :return: FatEntry 列表
+        """
+        if directory is None:
+            cluster = self.root_cluster if self.fat_type == 32 else None
+        else:
+            cluster = directory.cluster
+        entries = []
+        long_parts = []
+        for offset, record in self._dir_records(cluster):
+            first = record[0]
+            if first == 0:
+                break
+            if first == 0xE5:
+                long_parts = []
+                continue
+            attr = record[11]
+            if attr == ATTR_LONG_NAME:
+                chunk = record[1:11] + record[14:26] + record[28:32]
+                long_parts.insert(0, chunk)
+                continue
+            if attr & ATTR_VOLUME_ID:
+                long_parts = []
+                continue
+            base = record[0:8].decode('ascii', 'replace').rstrip()
+            ext = record[8:11].decode('ascii', 'replace').rstrip()
+            short_name = f"{base}.{ext}" if ext else base
+            name = short_name
+            if long_parts:
+                name = b''.join(long_parts).decode('utf-16-le', 'replace').split('\x00')[0]
+                long_parts = []
+            if short_name in ('.', '..'):
+                continue
+            high, _, _, low, size = struct.unpack_from('<HHHHI', record, 20)
+            cluster_no = (high << 16 | low) if self.fat_type == 32 else low
+            entries.append(FatEntry(name, short_name, attr, cluster_no, size, offset))
+        return entries
+
+    def lookup(self, path):
+        """按路径（不区分大小写）查找文件或目录"""
+        entry = None
+        for part in path.replace('\\', '/').strip('/').split('/'):
+            if not part:
+                continue
+            if entry is not None and not entry.is_dir:
+                return None
+            key = part.casefold()
+            entry = next((e for e in self.listdir(entry)
+                          if e.name.casefold() == key or e.short_name.casefold() == key), None)
+            if entry is None:
+                return None
+        return entry
+
+    def read_file(self, path):
+        """读取文件内容，不存在时返回None"""
+        entry = self.lookup(path)
+        if entry is None or entry.is_dir:
+            return None
+        data = bytearray()
+        for cluster in self.chain(entry.cluster):
+            data += self._read(self._cluster_offset(cluster), self.cluster_size)
+            if len(data) >= entry.size:
+                break
+        return bytes(data[:entry.size])
+
+    def replace_file(self, path, data):
+        """
+        整体替换已有文件的内容（写时复制）
+        :param path: 文件路径
+        :param data: 新内容
+        """
+        if not self.writable:
+            raise IOError("FAT卷以只读方式打开")
+        entry = self.lookup(path)
+        if entry is None or entry.is_dir:
+            raise FileNotFoundError(path)
+
+        old_chain = self.chain(entry.cluster)
+        new_chain = self._allocate(-(-len(data) // self.cluster_size)) if data else []
+        for i, cluster in enumerate(new_chain):
+            chunk = data[i * self.cluster_size:(i + 1) * self.cluster_size]
+            self._write(self._cluster_offset(cluster), chunk.ljust(self.cluster_size, b'\x00'))
+        self._flush_fat()
+
+        # 一次写入32字节目录项完成切换
+        record = bytearray(self._read(entry.offset, DIR_ENTRY_SIZE))
+        first = new_chain[0] if new_chain else 0
+        mtime, mdate = _dos_datetime()
+        struct.pack_into('<HHHHI', record, 20, first >> 16 if self.fat_type == 32 else 0,
+                         mtime, mdate, first & 0xFFFF, len(data))
+        self._write(entry.offset, bytes(record))
+        os.fsync(self._fd)
+
+        for cluster in old_chain:
+            self.set_fat(cluster, 0)
+        if self.fat_type == 32:
+            # 空闲簇计数已失效，标记为未知
+            self._write(self.fsinfo_sector * self.bytes_per_sector + 488, struct.pack('<I', 0xFFFFFFFF))
+        self._flush_fat()
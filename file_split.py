@@ -0,0 +1,256 @@
+import os
+import re
+import struct
+import subprocess
+import logging
+
+logger = logging.getLogger(__name__)
+
+# FAT32单个文件的上限
+FAT32_MAX_FILE_SIZE = 4 * 1024 * 1024 * 1024 - 1
+# 与 DISM /Split-Image 的默认 /FileSize:4000 一致
+DEFAULT_SWM_PART_SIZE = 4000 * 1024 * 1024
+
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+
+# WIM文件头
+WIM_MAGIC = b'MSWIM\x00\x00\x00'
+WIM_HEADER_SIZE = 208
+WIM_HDR_FLAG_SPANNED = 0x00000008
+WIM_LOOKUP_ENTRY_SIZE = 50
+
+# 资源头(reshdr)标志
+RESHDR_FLAG_METADATA = 0x02
+RESHDR_FLAG_SOLID = 0x10
+
+# 文件头中各资源头的偏移
+HDR_OFFSET_PART_NUMBER = 40
+HDR_OFFSET_TOTAL_PARTS = 42
+HDR_OFFSET_LOOKUP_TABLE = 48
+HDR_OFFSET_XML_DATA = 72
+HDR_OFFSET_BOOT_METADATA = 96
+HDR_OFFSET_INTEGRITY = 124
+
+
+# 有单文件大小限制的文件系统
+FILESYSTEM_FILE_LIMITS = {
+    'vfat': FAT32_MAX_FILE_SIZE,
+    'msdos': FAT32_MAX_FILE_SIZE,
+    'fat': FAT32_MAX_FILE_SIZE,
+    'fat32': FAT32_MAX_FILE_SIZE,
+}
+
+
+def detect_filesystem(path):
+    """
+    查找路径所在挂载点的文件系统类型
+    :return: 小写的文件系统名称，无法确定时返回None
+    """
+    path = os.path.realpath(path)
+    mounts = []
+    try:
+        if os.path.exists('/proc/mounts'):
+            with open('/proc/mounts', 'r') as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) >= 3:
+                        mount_point = fields[1].replace('\\040', ' ')
+                        mounts.append((mount_point, fields[2]))
+        else:
+            output = subprocess.check_output(['mount'], universal_newlines=True, timeout=5)
+            for line in output.splitlines():
+                match = re.match(r'.+? on (.+) \((\w+)', line)
+                if match:
+                    mounts.append((match.group(1), match.group(2)))
+    except Exception as e:
+        logger.warning(f"读取挂载信息失败: {e}")
+        return None
+
+    best = None
+    for mount_point, fstype in mounts:
+        prefix = mount_point.rstrip('/') + '/'
+        if path == mount_point or path.startswith(prefix) or mount_point == '/':
+            if best is None or len(mount_point) > len(best[0]):
+                best = (mount_point, fstype)
+    return best[1].lower() if best else None
+
+
+def max_file_size(path):
+    """返回目标路径所在文件系统的单文件上限，无限制时返回None"""
+    return FILESYSTEM_FILE_LIMITS.get(detect_filesystem(path) or '')
+
+
+def _unpack_reshdr(data, offset=0):
+    """解析24字节资源头 -> (存储大小, 标志, 偏移, 原始大小)"""
+    size_and_flags, res_offset, original_size = struct.unpack_from('<QQQ', data, offset)
+    return size_and_flags & 0x00ffffffffffffff, size_and_flags >> 56, res_offset, original_size
+
+
+def _pack_reshdr(size, flags, offset, original_size):
+    return struct.pack('<QQQ', size | (flags << 56), offset, original_size)
+
+
+def _copy_range(read_at, src_offset, size, dst):
+    """把源中的一段数据流式写到目标文件"""
+    while size > 0:
+        data = read_at(src_offset, min(COPY_BUFFER_SIZE, size))
+        if not data:
+            raise IOError("源文件提前结束")
+        dst.write(data)
+        src_offset += len(data)
+        size -= len(data)
+
+
+def split_stream(read_at, size, target_path, part_size=FAT32_MAX_FILE_SIZE, progress_callback=None):
+    """
+    把数据流按固定大小切分为 <name>.001、<name>.002 …
+    :param read_at: 读取函数 read_at(offset, size)
+    :param size: 源数据总大小
+    :param target_path: 目标文件路径（不含分片后缀）
+    :param part_size: 每个分片的最大字节数
+    :param progress_callback: 进度回调 callback(本次写入字节数)
+    :return: 分片文件路径列表
+    """
+    parts = []
+    offset = 0
+    index = 1
+    while offset < size or not parts:
+        path = f"{target_path}.{index:03d}"
+        length = min(part_size, size - offset)
+        with open(path, 'wb') as dst:
+            remaining = length
+            while remaining > 0:
+                data = read_at(offset, min(COPY_BUFFER_SIZE, remaining))
+                if not data:
+                    raise IOError("源文件提前结束")
+                dst.write(data)
+                offset += len(data)
+                remaining -= len(data)
+                if progress_callback:
+                    progress_callback(len(data))
+        parts.append(path)
+        index += 1
+    return parts
+
+
+def _swm_part_path(target_path, part_number):
+    """install.wim -> install.swm, install2.swm, install3.swm …"""
+    base = os.path.splitext(target_path)[0]
+    return f"{base}.swm" if part_number == 1 else f"{base}{part_number}.swm"
+
+
+def read_wim_layout(read_at):
+    """
+    读取WIM文件头、查找表和XML数据
+    :return: (文件头bytes, 查找表条目列表, XML数据bytes)
+    """
+    header = read_at(0, WIM_HEADER_SIZE)
+    if len(header) < WIM_HEADER_SIZE or header[:8] != WIM_MAGIC:
+        raise ValueError("不是有效的WIM文件")
+    if struct.unpack_from('<H', header, HDR_OFFSET_TOTAL_PARTS)[0] != 1:
+        raise ValueError("WIM已经是分卷文件")
+
+    size, flags, offset, _ = _unpack_reshdr(header, HDR_OFFSET_LOOKUP_TABLE)
+    table = read_at(offset, size)
+    entries = []
+    for pos in range(0, len(table) - WIM_LOOKUP_ENTRY_SIZE + 1, WIM_LOOKUP_ENTRY_SIZE):
+        res_size, res_flags, res_offset, original_size = _unpack_reshdr(table, pos)
+        _, refcount = struct.unpack_from('<HI', table, pos + 24)
+        if res_flags & RESHDR_FLAG_SOLID:
+            raise ValueError("不支持拆分固实压缩(solid)的WIM")
+        entries.append({
+            'size': res_size,
+            'flags': res_flags,
+            'offset': res_offset,
+            'original_size': original_size,
+            'refcount': refcount,
+            'hash': table[pos + 30:pos + 50]
+        })
+
+    xml_size, _, xml_offset, _ = _unpack_reshdr(header, HDR_OFFSET_XML_DATA)
+    xml_data = read_at(xml_offset, xml_size) if xml_size else b''
+    return header, entries, xml_data
+
+
+def plan_swm_parts(entries, xml_size, part_size=DEFAULT_SWM_PART_SIZE):
+    """
+    把资源分配到各分卷：元数据资源全部放在第一卷，其余资源按原偏移顺序依次装入
+    :return: 每个分卷的资源条目列表
+    """
+    metadata = [e for e in entries if e['flags'] & RESHDR_FLAG_METADATA]
+    blobs = sorted((e for e in entries if not e['flags'] & RESHDR_FLAG_METADATA),
+                   key=lambda e: e['offset'])
+
+    def overhead(count):
+        return WIM_HEADER_SIZE + count * WIM_LOOKUP_ENTRY_SIZE + xml_size
+
+    parts = [list(metadata)]
+    used = sum(e['size'] for e in metadata)
+    for entry in blobs:
+        current = parts[-1]
+        if current and used + entry['size'] + overhead(len(current) + 1) > part_size:
+            parts.append([])
+            used = 0
+        parts[-1].append(entry)
+        used += entry['size']
+    return parts
+
+
+def split_wim(read_at, target_path, part_size=DEFAULT_SWM_PART_SIZE, progress_callback=None):
+    """
+    流式把WIM拆分为可被Windows安装程序识别的 .swm 分卷
+    资源数据原样复制，每个分卷写入自己的查找表和XML数据
+    :param read_at: 读取函数 read_at(offset, size)
+    :param target_path: 目标WIM路径（如 .../sources/install.wim）
+    :param part_size: 单个分卷的最大字节数
+    :param progress_callback: 进度回调 callback(本次写入字节数)
+    :return: 分卷文件路径列表
+    """
+    header, entries, xml_data = read_wim_layout(read_at)
+    parts = plan_swm_parts(entries, len(xml_data), part_size)
+    total_parts = len(parts)
+
+    _, lookup_flags, _, _ = _unpack_reshdr(header, HDR_OFFSET_LOOKUP_TABLE)
+    _, xml_flags, _, _ = _unpack_reshdr(header, HDR_OFFSET_XML_DATA)
+    boot_size, _, boot_offset, _ = _unpack_reshdr(header, HDR_OFFSET_BOOT_METADATA)
+
+    paths = []
+    for part_number, part_entries in enumerate(parts, 1):
+        path = _swm_part_path(target_path, part_number)
+        part_header = bytearray(header)
+        boot_reshdr = bytes(24)
+
+        with open(path, 'wb') as dst:
+            dst.write(bytes(WIM_HEADER_SIZE))
+            table = bytearray()
+            for entry in part_entries:
+                new_offset = dst.tell()
+                _copy_range(read_at, entry['offset'], entry['size'], dst)
+                if progress_callback:
+                    progress_callback(entry['size'])
+                reshdr = _pack_reshdr(entry['size'], entry['flags'], new_offset, entry['original_size'])
+                if boot_size and entry['offset'] == boot_offset:
+                    boot_reshdr = reshdr
+                table += reshdr + struct.pack('<HI', part_number, entry['refcount']) + entry['hash']
+
+            table_offset = dst.tell()
+            dst.write(table)
+            xml_offset = dst.tell()
+            dst.write(xml_data)
+
+            part_header[HDR_OFFSET_LOOKUP_TABLE:HDR_OFFSET_LOOKUP_TABLE + 24] = \
+                _pack_reshdr(len(table), lookup_flags, table_offset, len(table))
+            part_header[HDR_OFFSET_XML_DATA:HDR_OFFSET_XML_DATA + 24] = \
+                _pack_reshdr(len(xml_data), xml_flags, xml_offset, len(xml_data))
+            part_header[HDR_OFFSET_BOOT_METADATA:HDR_OFFSET_BOOT_METADATA + 24] = boot_reshdr
+            part_header[HDR_OFFSET_INTEGRITY:HDR_OFFSET_INTEGRITY + 24] = bytes(24)
+            struct.pack_into('<HH', part_header, HDR_OFFSET_PART_NUMBER, part_number, total_parts)
+            flags = struct.unpack_from('<I', part_header, 16)[0]
+            struct.pack_into('<I', part_header, 16, flags | WIM_HDR_FLAG_SPANNED)
+
+            dst.seek(0)
+            dst.write(part_header)
+        paths.append(path)
+
+    logger.info(f"WIM已拆分为 {total_parts} 个分卷")
+    return paths
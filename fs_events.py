@@ -1,94 +1,486 @@
 import os
+import sys
+import errno
+import select
+import shutil
+import struct
 import threading
 import subprocess
-import shlex
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLL_INTERVAL = 2.0
+# 等待事件时每隔这么久检查一次是否已停止（秒），有事件时立即返回
+WAIT_TIMEOUT = 0.2
+
 
 class FSEvents:
     """事件类型常量"""
     Create = 'Created'
     Delete = 'Removed'
     Modify = 'Updated'
+    # 内核事件队列溢出等情况下丢失了事件，需要重新扫描该目录
+    Rescan = 'Rescan'
+    # 文件已写完（由 EventCoalescer 在大小稳定或写入方关闭文件后发出）
+    Ready = 'Ready'
+
+
+class FSEvent:
+    """文件系统事件"""
+    __slots__ = ('name', 'mask', 'is_dir')
+
+    def __init__(self, name, mask, is_dir=False):
+        """
+        :param name: 文件或目录的完整路径
+        :param mask: FSEvents 常量
+        """
+        self.name = name
+        self.mask = mask
+        self.is_dir = is_dir
+
+    def __repr__(self):
+        return f"FSEvent({self.name!r}, {self.mask!r}{', dir' if self.is_dir else ''})"
+
+    def __eq__(self, other):
+        return isinstance(other, FSEvent) and (self.name, self.mask, self.is_dir) == (other.name, other.mask,
+                                                                                    other.is_dir)
+
+    def __hash__(self):
+        return hash((self.name, self.mask, self.is_dir))
+
+
+class Backend:
+    """
+    事件后端：run() 在监控线程中阻塞运行，把事件交给 emit()，stop 事件被设置后返回
+    """
+    name = 'base'
+
+    def run(self, paths, emit, stop, recursive=True):
+        raise NotImplementedError
+
+    def interrupt(self):
+        """唤醒阻塞中的 run()"""
+        pass
+
+
+# ---- Linux inotify ----
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# 不监听 IN_MODIFY：大文件写入时会产生大量事件，写完关闭时的 IN_CLOSE_WRITE 就足够了
+WATCH_MASK = (IN_CREATE | IN_DELETE | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF
+              | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyBackend(Backend):
+    """
+    Linux inotify（ctypes 调用 libc），递归监控：新建或移入的子目录自动添加监控，
+    移出或删除的目录自动移除
+    """
+    name = 'inotify'
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "libc 不支持 inotify")
+        self._ctypes = ctypes
+        self._libc = libc
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = None
+        # wd -> 目录路径
+        self.watches = {}
+        self.roots = []
+        self._wake_read, self._wake_write = None, None
+        # 保护唤醒管道：run() 返回后 interrupt() 不能再写入已关闭（可能已被复用）的描述符
+        self._wake_lock = threading.Lock()
+
+    def _check(self, result):
+        if result < 0:
+            code = self._ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        return result
+
+    def add_watch(self, path):
+        """监控单个目录，已达到 max_user_watches 上限等错误时返回None"""
+        try:
+            wd = self._check(self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK))
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                logger.warning(f"inotify 监控数已达上限（fs.inotify.max_user_watches），{path} 未被监控")
+            elif e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                logger.debug(f"无法监控 {path}: {e}")
+            return None
+        self.watches[wd] = path
+        return wd
+
+    def add_tree(self, path, recursive=True):
+        """
+        监控目录及其子目录
+        :return: 目录下已有的文件和子目录路径（用于补发在添加监控之前产生的事件）
+        """
+        found = []
+        pending = [path]
+        while pending:
+            directory = pending.pop()
+            if self.add_watch(directory) is None or not recursive:
+                continue
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        found.append((entry.path, is_dir))
+                        if is_dir:
+                            pending.append(entry.path)
+            except OSError:
+                pass
+        return found
+
+    def remove_tree(self, path):
+        prefix = path.rstrip(os.sep) + os.sep
+        for wd, watched in list(self.watches.items()):
+            if watched == path or watched.startswith(prefix):
+                self._libc.inotify_rm_watch(self.fd, wd)
+                self.watches.pop(wd, None)
+
+    def rename_tree(self, old, new):
+        """目录在监控范围内改名后，更新其下所有监控的路径"""
+        prefix = old.rstrip(os.sep) + os.sep
+        for wd, watched in list(self.watches.items()):
+            if watched == old:
+                self.watches[wd] = new
+            elif watched.startswith(prefix):
+                self.watches[wd] = new + watched[len(old):]
+
+    def _parse(self, data):
+        """:return: [(wd, mask, cookie, name), ...]"""
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def _handle(self, raw_events, emit, recursive):
+        moved_from = {}
+        for wd, mask, cookie, name in raw_events:
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("inotify 事件队列溢出，需要重新扫描")
+                for root in set(self.roots):
+                    emit(FSEvent(root, FSEvents.Rescan, True))
+                continue
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                # 子目录的删除/移出事件已由父目录报告，这里只处理被监控的根目录本身
+                if directory in self.roots:
+                    emit(FSEvent(directory, FSEvents.Delete, True))
+                continue
+            path = os.path.join(directory, name) if name else directory
+            is_dir = bool(mask & IN_ISDIR)
+            if mask & IN_MOVED_FROM:
+                moved_from[cookie] = path
+                emit(FSEvent(path, FSEvents.Delete, is_dir))
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                old = moved_from.pop(cookie, None) if mask & IN_MOVED_TO else None
+                emit(FSEvent(path, FSEvents.Create, is_dir))
+                if is_dir and recursive:
+                    if old is not None:
+                        self.rename_tree(old, path)
+                        continue
+                    # 添加监控之前目录里可能已经有了文件（整个目录被移入或刚建好就写入）
+                    for child, child_is_dir in self.add_tree(path):
+                        emit(FSEvent(child, FSEvents.Create, child_is_dir))
+            elif mask & IN_DELETE:
+                emit(FSEvent(path, FSEvents.Delete, is_dir))
+            elif mask & IN_CLOSE_WRITE:
+                emit(FSEvent(path, FSEvents.Modify, False))
+        # 移出监控范围的目录
+        for path in moved_from.values():
+            self.remove_tree(path)
+
+    def run(self, paths, emit, stop, recursive=True):
+        self.fd = self._check(self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+        try:
+            with self._wake_lock:
+                self._wake_read, self._wake_write = os.pipe()
+        except OSError:
+            os.close(self.fd)
+            self.fd = None
+            raise
+        self.roots = [os.path.abspath(path) for path in paths if os.path.isdir(path)]
+        try:
+            for root in self.roots:
+                self.add_tree(root, recursive)
+            logger.info(f"inotify 已监控 {len(self.watches)} 个目录")
+            while not stop.is_set():
+                readable, _, _ = select.select([self.fd, self._wake_read], [], [], WAIT_TIMEOUT)
+                if self.fd not in readable:
+                    continue
+                try:
+                    data = os.read(self.fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                self._handle(self._parse(data), emit, recursive)
+                if self.roots and not any(path in self.roots for path in self.watches.values()):
+                    # 根目录被删除或所在的卷被卸载，监控已全部失效，交给调用方决定是否重新监控
+                    logger.info("inotify 监控的根目录都已失效，停止监控")
+                    break
+        finally:
+            with self._wake_lock:
+                os.close(self.fd)
+                os.close(self._wake_read)
+                os.close(self._wake_write)
+                self.fd = None
+                self._wake_read, self._wake_write = None, None
+            self.watches.clear()
+
+    def interrupt(self):
+        with self._wake_lock:
+            if self._wake_write is not None:
+                try:
+                    os.write(self._wake_write, b'\0')
+                except OSError:
+                    pass
+
+
+# ---- macOS fswatch ----
+
+class FSWatchBackend(Backend):
+    """
+    macOS：fswatch 命令行工具（底层为 FSEvents），每条记录以NUL结尾，
+    路径原样作为参数传递，不做 shell 转义
+    """
+    name = 'fswatch'
+
+    def __init__(self, executable=None):
+        self.executable = executable or shutil.which('fswatch')
+        if not self.executable:
+            raise OSError(errno.ENOENT, "未找到 fswatch")
+        self.process = None
+
+    @staticmethod
+    def parse_record(record):
+        """
+        解析 "路径 Created,IsFile" 形式的记录（标志在最后一个空格之后，路径可以含空格）
+        :return: FSEvent 或 None
+        """
+        path, _, flags = record.rpartition(' ')
+        if not path:
+            return None
+        flags = set(flags.split(','))
+        is_dir = 'IsDir' in flags
+        if 'Removed' in flags and not os.path.lexists(path):
+            mask = FSEvents.Delete
+        elif 'Renamed' in flags:
+            mask = FSEvents.Create if os.path.lexists(path) else FSEvents.Delete
+        elif 'Created' in flags:
+            mask = FSEvents.Create
+        elif flags & {'Updated', 'AttributeModified', 'Removed'}:
+            mask = FSEvents.Modify
+        elif 'Overflow' in flags:
+            mask = FSEvents.Rescan
+        else:
+            return None
+        return FSEvent(path, mask, is_dir)
+
+    def run(self, paths, emit, stop, recursive=True):
+        cmd = [self.executable, '-0', '-x', '--event-flag-separator=,']
+        if recursive:
+            cmd.append('-r')
+        cmd.append('--')
+        cmd.extend(path for path in paths if os.path.exists(path))
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        pending = b''
+        try:
+            while not stop.is_set():
+                # read1 有多少返回多少，不会等到读满或遇到换行
+                chunk = self.process.stdout.read1(64 * 1024)
+                if not chunk:
+                    break
+                *records, pending = (pending + chunk).split(b'\0')
+                for record in records:
+                    event = self.parse_record(os.fsdecode(record))
+                    if event:
+                        emit(event)
+        finally:
+            self.interrupt()
+
+    def interrupt(self):
+        process = self.process
+        if process and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+# ---- 轮询 ----
+
+def snapshot(paths, recursive=True):
+    """
+    :return: {路径: (是否目录, 大小, 修改时间ns)}
+    """
+    state = {}
+    pending = [os.path.abspath(path) for path in paths if os.path.isdir(path)]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        info = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    state[entry.path] = (is_dir, 0 if is_dir else info.st_size, info.st_mtime_ns)
+                    if is_dir and recursive:
+                        pending.append(entry.path)
+        except OSError:
+            pass
+    return state
+
+
+def diff_snapshots(old, new):
+    """:return: 两次快照之间的事件列表"""
+    events = []
+    for path in sorted(old.keys() - new.keys()):
+        events.append(FSEvent(path, FSEvents.Delete, old[path][0]))
+    for path in sorted(new):
+        previous = old.get(path)
+        if previous is None:
+            events.append(FSEvent(path, FSEvents.Create, new[path][0]))
+        elif not new[path][0] and previous[1:] != new[path][1:]:
+            events.append(FSEvent(path, FSEvents.Modify, False))
+    return events
+
+
+class PollingBackend(Backend):
+    """通用后备方案：定期扫描目录树并比较快照"""
+    name = 'polling'
+
+    def __init__(self, interval=DEFAULT_POLL_INTERVAL):
+        self.interval = interval
+
+    def run(self, paths, emit, stop, recursive=True):
+        state = snapshot(paths, recursive)
+        while not stop.wait(self.interval):
+            current = snapshot(paths, recursive)
+            for event in diff_snapshots(state, current):
+                emit(event)
+            state = current
+
+
+def default_backend(poll_interval=DEFAULT_POLL_INTERVAL):
+    """按平台选择事件后端：Linux inotify，macOS fswatch，不可用时退回轮询"""
+    try:
+        if sys.platform.startswith('linux'):
+            return InotifyBackend()
+        if sys.platform == 'darwin':
+            return FSWatchBackend()
+    except OSError as e:
+        logger.info(f"原生文件事件不可用，改用轮询: {e}")
+    return PollingBackend(poll_interval)
+
 
 class FSEventStream:
     """文件系统事件监控类"""
-    
-    def __init__(self, paths, callback, file_events=True):
+
+    def __init__(self, paths, callback, file_events=True, backend=None, recursive=True):
         """
         初始化FSEventStream
         :param paths: 要监控的路径列表
-        :param callback: 事件回调函数
+        :param callback: 事件回调函数 callback(FSEvent)，在监控线程中调用
         :param file_events: 是否监控文件级别事件（此参数保留用于兼容性）
+        :param backend: Backend，None时按平台自动选择
+        :param recursive: 是否监控子目录
         """
-        self.paths = paths
+        self.paths = list(paths)
         self.callback = callback
-        self.process = None
+        self.backend = backend or default_backend()
+        self.recursive = recursive
         self.thread = None
         self.running = False
-    
+        # 监控线程因异常结束时记录最后一个错误
+        self.error = None
+        self._stop = threading.Event()
+
     def start(self):
         """启动监控"""
         if self.running:
             return
-        
+
         self.running = True
+        self.error = None
+        self._stop.clear()
         self.thread = threading.Thread(target=self._monitor_thread)
         self.thread.daemon = True
         self.thread.start()
-    
+
     def stop(self):
         """停止监控"""
         self.running = False
-        if self.process:
-            try:
-                self.process.terminate()
-                self.process.wait(timeout=5)
-            except:
-                if self.process:
-                    self.process.kill()
-        
-        if self.thread:
+        self._stop.set()
+        # 监控线程已结束时后端已释放资源，不再唤醒
+        if self.thread and self.thread.is_alive():
+            self.backend.interrupt()
+
+        if self.thread and self.thread is not threading.current_thread():
             self.thread.join(timeout=5)
             self.thread = None
-    
+
+    def _emit(self, event):
+        if self.callback:
+            try:
+                self.callback(event)
+            except Exception as e:
+                logger.error(f"文件事件回调出错: {e}")
+
     def _monitor_thread(self):
         """监控线程"""
         try:
-            # 构建 fswatch 命令
-            cmd = ['fswatch', '-0']
-            for path in self.paths:
-                if os.path.exists(path):
-                    cmd.append(shlex.quote(path))
-            
-            # 启动 fswatch 进程
-            self.process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True
-            )
-            
-            # 读取输出
-            while self.running:
-                line = self.process.stdout.readline()
-                if not line:
-                    break
-                
-                # 处理事件
-                path = line.strip('\0\n')
-                if path.lower().endswith('.iso'):
-                    event = type('Event', (), {
-                        'name': path,
-                        'mask': FSEvents.Create
-                    })
-                    if self.callback:
-                        self.callback(event)
-        
+            self.backend.run(self.paths, self._emit, self._stop, self.recursive)
         except Exception as e:
-            print(f"监控错误: {str(e)}")
-        
+            logger.error(f"监控错误（{self.backend.name}）: {e}")
+            self.error = e
+            if not self._stop.is_set() and not isinstance(self.backend, PollingBackend):
+                # 原生后端启动失败时退回轮询
+                self.backend = PollingBackend()
+                try:
+                    self.backend.run(self.paths, self._emit, self._stop, self.recursive)
+                except Exception as e:
+                    logger.error(f"监控错误（polling）: {e}")
+                    self.error = e
         finally:
             self.running = False
-    
+
     def __del__(self):
         """析构函数，确保停止监控"""
         self.stop()
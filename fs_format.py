@@ -0,0 +1,379 @@
+import os
+import sys
+import stat
+import struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+SECTOR_SIZE = 512
+ZERO_CHUNK = 1024 * 1024
+
+# FAT32
+FAT32_RESERVED_SECTORS = 32
+FAT32_MIN_CLUSTERS = 65525
+FAT32_MAX_CLUSTERS = 0x0FFFFFF5
+FAT32_BACKUP_BOOT_SECTOR = 6
+FAT32_EOC = 0x0FFFFFFF
+
+# exFAT
+EXFAT_MAX_CLUSTERS = 0xFFFFFFF5
+EXFAT_EOC = 0xFFFFFFFF
+EXFAT_BOOT_REGION_SECTORS = 12
+
+# 数据区起点按1MB对齐，与 partition_table 的分区对齐一致
+DATA_ALIGNMENT = 1024 * 1024
+
+# Linux ioctl
+BLKDISCARD = 0x1277
+# fallocate 标志
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+
+# 非启动卷的引导代码：int 18h 交给BIOS尝试下一个启动设备
+NON_BOOTABLE_CODE = b'\xcd\x18\xeb\xfe'
+
+
+def fat32_cluster_size(volume_size):
+    """按Windows的默认规则选择FAT32簇大小"""
+    if volume_size <= 260 * 1024 ** 2:
+        return 512
+    if volume_size <= 8 * 1024 ** 3:
+        return 4096
+    if volume_size <= 16 * 1024 ** 3:
+        return 8192
+    if volume_size <= 32 * 1024 ** 3:
+        return 16384
+    return 32768
+
+
+def exfat_cluster_size(volume_size):
+    """按Windows的默认规则选择exFAT簇大小"""
+    if volume_size <= 256 * 1024 ** 2:
+        return 4096
+    if volume_size <= 32 * 1024 ** 3:
+        return 32768
+    return 131072
+
+
+def _fat32_label(label):
+    text = ''.join(c if c.isalnum() or c in ' _-' else '_' for c in (label or 'NO NAME').upper())
+    return text.encode('ascii', 'replace')[:11].ljust(11, b' ')
+
+
+def _round_up(value, multiple):
+    return (value + multiple - 1) // multiple * multiple
+
+
+def plan_fat32(volume_size, label='USBDISK', cluster_size=None, hidden_sectors=0, serial=None):
+    """
+    计算FAT32布局并生成需要写入的元数据
+    :param volume_size: 卷字节数
+    :param label: 卷标
+    :param cluster_size: 簇大小，None时自动选择
+    :param hidden_sectors: 卷在磁盘上的起始扇区（写入BPB）
+    :param serial: 卷序列号，None时随机生成
+    :return: (writes, zero_ranges, info)，偏移均相对于卷起点
+    """
+    total_sectors = min(volume_size // SECTOR_SIZE, 0xffffffff)
+    cluster_size = cluster_size or fat32_cluster_size(volume_size)
+    spc = cluster_size // SECTOR_SIZE
+    if spc < 1 or spc > 128 or spc & (spc - 1):
+        raise ValueError(f"无效的簇大小: {cluster_size}")
+
+    # 簇数超过FAT32上限时加大簇
+    while True:
+        fat_sectors = -(-(total_sectors - FAT32_RESERVED_SECTORS) // ((256 * spc + 2) // 2))
+        clusters = (total_sectors - FAT32_RESERVED_SECTORS - 2 * fat_sectors) // spc
+        if clusters < FAT32_MAX_CLUSTERS or spc == 128:
+            break
+        spc *= 2
+
+    # 加大保留区，使数据区按簇大小和1MB对齐
+    align = max(spc, min(DATA_ALIGNMENT // SECTOR_SIZE, total_sectors // 64) or 1)
+    reserved = _round_up(FAT32_RESERVED_SECTORS + 2 * fat_sectors, align) - 2 * fat_sectors
+    data_start = reserved + 2 * fat_sectors
+    clusters = (total_sectors - data_start) // spc
+    if clusters < FAT32_MIN_CLUSTERS:
+        raise ValueError("卷太小，无法格式化为FAT32")
+    if clusters >= FAT32_MAX_CLUSTERS:
+        raise ValueError("卷太大，无法格式化为FAT32")
+    if fat_sectors * SECTOR_SIZE // 4 < clusters + 2:
+        raise ValueError("FAT表空间不足")
+
+    serial = serial if serial is not None else struct.unpack('<I', os.urandom(4))[0]
+    volume_label = _fat32_label(label)
+
+    boot = bytearray(SECTOR_SIZE)
+    boot[0:3] = b'\xeb\x58\x90'
+    boot[3:11] = b'MSWIN4.1'
+    struct.pack_into('<HBHBHHBHHHII', boot, 11,
+                     SECTOR_SIZE, spc, reserved, 2, 0, 0, 0xF8, 0, 63, 255,
+                     hidden_sectors & 0xffffffff, total_sectors)
+    struct.pack_into('<IHHIHH', boot, 36, fat_sectors, 0, 0, 2, 1, FAT32_BACKUP_BOOT_SECTOR)
+    struct.pack_into('<BBBI', boot, 64, 0x80, 0, 0x29, serial)
+    boot[71:82] = volume_label
+    boot[82:90] = b'FAT32   '
+    boot[90:90 + len(NON_BOOTABLE_CODE)] = NON_BOOTABLE_CODE
+    boot[510:512] = b'\x55\xaa'
+
+    fsinfo = bytearray(SECTOR_SIZE)
+    struct.pack_into('<I', fsinfo, 0, 0x41615252)
+    struct.pack_into('<III', fsinfo, 484, 0x61417272, clusters - 1, 3)
+    struct.pack_into('<I', fsinfo, 508, 0xAA550000)
+
+    # 第三个引导扇区只含签名
+    boot2 = bytearray(SECTOR_SIZE)
+    boot2[510:512] = b'\x55\xaa'
+
+    fat_head = struct.pack('<III', 0x0FFFFFF8, 0x0FFFFFFF, FAT32_EOC)
+    root = bytearray(spc * SECTOR_SIZE)
+    root[0:11] = volume_label
+    root[11] = 0x08
+
+    boot_region = bytes(boot) + bytes(fsinfo) + bytes(boot2)
+    writes = [(0, boot_region),
+              (FAT32_BACKUP_BOOT_SECTOR * SECTOR_SIZE, boot_region)]
+    for i in range(2):
+        writes.append(((reserved + i * fat_sectors) * SECTOR_SIZE, fat_head))
+    writes.append((data_start * SECTOR_SIZE, bytes(root)))
+
+    # 保留区和两份FAT表先整体清零，旧文件系统的签名也随之清除
+    zero_ranges = [(0, data_start * SECTOR_SIZE)]
+
+    info = {
+        'filesystem': 'fat32',
+        'label': volume_label.decode('ascii').rstrip(),
+        'serial': f"{serial >> 16:04X}-{serial & 0xffff:04X}",
+        'cluster_size': spc * SECTOR_SIZE,
+        'clusters': clusters,
+        'fat_sectors': fat_sectors,
+        'data_offset': data_start * SECTOR_SIZE,
+        'metadata_end': (data_start + spc) * SECTOR_SIZE,
+        'free_bytes': (clusters - 1) * spc * SECTOR_SIZE
+    }
+    return writes, zero_ranges, info
+
+
+def _exfat_checksum(data, skip=()):
+    checksum = 0
+    for i, byte in enumerate(data):
+        if i in skip:
+            continue
+        checksum = (((checksum & 1) << 31) | (checksum >> 1)) + byte
+        checksum &= 0xffffffff
+    return checksum
+
+
+def exfat_upcase_table():
+    """
+    生成压缩格式的大写转换表：连续的恒等映射用 0xFFFF + 长度 表示
+    :return: (表数据, 校验和)
+    """
+    mapping = []
+    for code in range(0x10000):
+        upper = chr(code).upper()
+        mapping.append(ord(upper) if len(upper) == 1 and ord(upper) < 0x10000 else code)
+
+    entries = []
+    code = 0
+    while code < 0x10000:
+        run = code
+        while run < 0x10000 and mapping[run] == run:
+            run += 1
+        if run - code >= 3 or (run > code and run == 0x10000):
+            entries += [0xFFFF, run - code]
+            code = run
+        else:
+            entries.append(mapping[code])
+            code += 1
+
+    table = struct.pack(f'<{len(entries)}H', *entries)
+    return table, _exfat_checksum(table)
+
+
+def plan_exfat(volume_size, label='USBDISK', cluster_size=None, partition_offset=0, serial=None):
+    """
+    计算exFAT布局并生成需要写入的元数据
+    :param volume_size: 卷字节数
+    :param label: 卷标（最多11个字符）
+    :param cluster_size: 簇大小，None时自动选择
+    :param partition_offset: 卷在磁盘上的起始扇区（写入引导扇区）
+    :param serial: 卷序列号，None时随机生成
+    :return: (writes, zero_ranges, info)，偏移均相对于卷起点
+    """
+    total_sectors = volume_size // SECTOR_SIZE
+    cluster_size = cluster_size or exfat_cluster_size(volume_size)
+    spc = cluster_size // SECTOR_SIZE
+    if spc < 1 or spc & (spc - 1) or cluster_size > 32 * 1024 * 1024:
+        raise ValueError(f"无效的簇大小: {cluster_size}")
+
+    align = max(spc, min(DATA_ALIGNMENT // SECTOR_SIZE, total_sectors // 64) or 1)
+    fat_offset = max(_round_up(EXFAT_BOOT_REGION_SECTORS * 2, align), align)
+    clusters = (total_sectors - fat_offset) // spc
+    fat_length = _round_up((clusters + 2) * 4, SECTOR_SIZE) // SECTOR_SIZE
+    heap_offset = _round_up(fat_offset + fat_length, align)
+    clusters = min((total_sectors - heap_offset) // spc, EXFAT_MAX_CLUSTERS - 1)
+    if clusters < 16:
+        raise ValueError("卷太小，无法格式化为exFAT")
+
+    serial = serial if serial is not None else struct.unpack('<I', os.urandom(4))[0]
+    upcase, upcase_checksum = exfat_upcase_table()
+
+    # 簇2起依次放分配位图、大写表、根目录
+    bitmap_size = (clusters + 7) // 8
+    bitmap_clusters = -(-bitmap_size // cluster_size)
+    upcase_clusters = -(-len(upcase) // cluster_size)
+    bitmap_cluster = 2
+    upcase_cluster = bitmap_cluster + bitmap_clusters
+    root_cluster = upcase_cluster + upcase_clusters
+    used_clusters = bitmap_clusters + upcase_clusters + 1
+
+    boot = bytearray(SECTOR_SIZE)
+    boot[0:3] = b'\xeb\x76\x90'
+    boot[3:11] = b'EXFAT   '
+    struct.pack_into('<QQIIIIIIHHBBBBB', boot, 64,
+                     partition_offset, total_sectors, fat_offset, fat_length,
+                     heap_offset, clusters, root_cluster, serial,
+                     0x0100, 0, 9, spc.bit_length() - 1, 1, 0x80,
+                     used_clusters * 100 // clusters)
+    boot[120:120 + len(NON_BOOTABLE_CODE)] = NON_BOOTABLE_CODE
+    boot[510:512] = b'\x55\xaa'
+
+    extended = bytearray(SECTOR_SIZE)
+    struct.pack_into('<I', extended, 508, 0xAA550000)
+    region = bytes(boot) + bytes(extended) * 8 + bytes(SECTOR_SIZE * 2)
+    # 校验和不包含 VolumeFlags 和 PercentInUse
+    checksum = _exfat_checksum(region, skip=(106, 107, 112))
+    region += struct.pack('<I', checksum) * (SECTOR_SIZE // 4)
+
+    fat = [0xFFFFFFF8, 0xFFFFFFFF]
+    for first, count in ((bitmap_cluster, bitmap_clusters), (upcase_cluster, upcase_clusters), (root_cluster, 1)):
+        fat += list(range(first + 1, first + count)) + [EXFAT_EOC]
+
+    bitmap = bytearray(bitmap_size)
+    for i in range(used_clusters):
+        bitmap[i // 8] |= 1 << (i % 8)
+
+    root = bytearray(cluster_size)
+    name = (label or '')[:11]
+    if name:
+        root[0] = 0x83
+        root[1] = len(name)
+        encoded = name.encode('utf-16-le')
+        root[2:2 + len(encoded)] = encoded
+    else:
+        root[0] = 0x03
+    root[32] = 0x81
+    struct.pack_into('<IQ', root, 32 + 20, bitmap_cluster, bitmap_size)
+    root[64] = 0x82
+    struct.pack_into('<I', root, 64 + 4, upcase_checksum)
+    struct.pack_into('<IQ', root, 64 + 20, upcase_cluster, len(upcase))
+
+    def cluster_offset(cluster):
+        return (heap_offset + (cluster - 2) * spc) * SECTOR_SIZE
+
+    writes = [
+        (0, region),
+        (EXFAT_BOOT_REGION_SECTORS * SECTOR_SIZE, region),
+        (fat_offset * SECTOR_SIZE, struct.pack(f'<{len(fat)}I', *fat)),
+        (cluster_offset(bitmap_cluster), bytes(bitmap)),
+        (cluster_offset(upcase_cluster), upcase),
+        (cluster_offset(root_cluster), bytes(root)),
+    ]
+    zero_ranges = [(0, cluster_offset(root_cluster + 1))]
+
+    info = {
+        'filesystem': 'exfat',
+        'label': name,
+        'serial': f"{serial >> 16:04X}-{serial & 0xffff:04X}",
+        'cluster_size': cluster_size,
+        'clusters': clusters,
+        'fat_sectors': fat_length,
+        'data_offset': heap_offset * SECTOR_SIZE,
+        'metadata_end': cluster_offset(root_cluster + 1),
+        'free_bytes': (clusters - used_clusters) * cluster_size
+    }
+    return writes, zero_ranges, info
+
+
+def _write_zeros(fd, offset, length):
+    zeros = bytes(min(ZERO_CHUNK, length))
+    while length > 0:
+        n = min(len(zeros), length)
+        os.lseek(fd, offset, os.SEEK_SET)
+        os.write(fd, zeros[:n])
+        offset += n
+        length -= n
+
+
+def discard_range(fd, offset, length):
+    """
+    通知设备某段数据已不再使用：块设备用 BLKDISCARD，镜像文件打洞
+    :return: 是否成功
+    """
+    if length <= 0:
+        return True
+    try:
+        mode = os.fstat(fd).st_mode
+        if sys.platform.startswith('linux') and stat.S_ISBLK(mode):
+            import fcntl
+            fcntl.ioctl(fd, BLKDISCARD, struct.pack('QQ', offset, length))
+            return True
+        if sys.platform.startswith('linux') and stat.S_ISREG(mode):
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            libc.fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+            if libc.fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, offset, length) == 0:
+                return True
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+    except Exception as e:
+        logger.warning(f"TRIM/discard 失败: {e}")
+        return False
+    logger.info("当前平台不支持 discard，已跳过")
+    return False
+
+
+def format_volume(target, filesystem='fat32', offset=0, size=None, label='USBDISK',
+                  cluster_size=None, discard=False):
+    """
+    直接在设备或镜像文件上创建FAT32/exFAT文件系统，只写入元数据区域
+    :param target: 块设备、分区或镜像文件路径
+    :param filesystem: fat32/exfat
+    :param offset: 卷在target中的起始字节（用于在整盘上格式化某个分区）
+    :param size: 卷字节数，None表示到target末尾
+    :param label: 卷标
+    :param cluster_size: 簇大小，None时自动选择
+    :param discard: 是否对数据区执行TRIM/discard
+    :return: 文件系统信息字典
+    """
+    filesystem = filesystem.lower()
+    if filesystem not in ('fat32', 'exfat'):
+        raise ValueError(f"不支持的文件系统: {filesystem}")
+    if offset % SECTOR_SIZE:
+        raise ValueError("卷起点必须按扇区对齐")
+
+    fd = os.open(target, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+    try:
+        if size is None:
+            size = os.lseek(fd, 0, os.SEEK_END) - offset
+        if filesystem == 'fat32':
+            writes, zero_ranges, info = plan_fat32(size, label, cluster_size, offset // SECTOR_SIZE)
+        else:
+            writes, zero_ranges, info = plan_exfat(size, label, cluster_size, offset // SECTOR_SIZE)
+
+        for start, length in zero_ranges:
+            _write_zeros(fd, offset + start, length)
+        for start, data in writes:
+            os.lseek(fd, offset + start, os.SEEK_SET)
+            os.write(fd, data)
+        os.fsync(fd)
+
+        if discard:
+            info['discarded'] = discard_range(fd, offset + info['metadata_end'], size - info['metadata_end'])
+    finally:
+        os.close(fd)
+
+    logger.info(f"已将 {target} 格式化为 {filesystem}（簇大小 {info['cluster_size']}，{info['clusters']} 个簇）")
+    return info
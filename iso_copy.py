@@ -0,0 +1,276 @@
+import os
+import time
+import threading
+import posixpath
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from iso_reader import ISOReader, ISO_BLOCK_SIZE
+from file_split import split_stream, split_wim, DEFAULT_SWM_PART_SIZE
+
+logger = logging.getLogger(__name__)
+
+# 小于该大小的文件交给线程池并发复制
+SMALL_FILE_LIMIT = 1024 * 1024
+# 大文件流式复制时的缓冲区大小
+LARGE_BUFFER_SIZE = 8 * 1024 * 1024
+DEFAULT_WORKERS = 4
+
+# 超过目标文件系统上限的文件的处理方式
+POLICY_SPLIT = 'split'                    # WIM拆分为 .swm，其余文件切分为 .001/.002…
+POLICY_DATA_PARTITION = 'data_partition'  # 放到第二个(NTFS/exFAT)数据分区
+
+
+class CopyCancelled(Exception):
+    """复制被取消"""
+
+
+class CopyTask:
+    """一个待复制的文件"""
+    __slots__ = ('path', 'size', 'extents')
+
+    def __init__(self, path, size, extents):
+        self.path = path
+        self.size = size
+        self.extents = extents
+
+
+class _SourceReader:
+    """按偏移读取源镜像；有文件描述符时使用pread，多个线程互不干扰"""
+
+    def __init__(self, source):
+        self._lock = threading.Lock()
+        self._file = source
+        try:
+            self._fd = source.fileno() if hasattr(os, 'pread') else None
+        except (AttributeError, OSError, ValueError):
+            self._fd = None
+
+    def read_at(self, offset, size):
+        if self._fd is not None:
+            chunks = []
+            while size > 0:
+                data = os.pread(self._fd, size, offset)
+                if not data:
+                    break
+                chunks.append(data)
+                offset += len(data)
+                size -= len(data)
+            return b''.join(chunks)
+        with self._lock:
+            self._file.seek(offset)
+            return self._file.read(size)
+
+
+def plan_copy(reader, path='/'):
+    """
+    遍历ISO目录树，生成复制计划
+    :param reader: ISOReader
+    :param path: 起始目录
+    :return: (目录列表, 按源区段升序排列的 CopyTask 列表)
+    """
+    directories = []
+    tasks = []
+    for dir_path, entries in reader.walk(path):
+        rel_dir = posixpath.relpath(dir_path, path) if dir_path != path else ''
+        for entry in entries:
+            rel_path = posixpath.join(rel_dir, entry.name)
+            if entry.is_dir:
+                directories.append(rel_path)
+            else:
+                tasks.append(CopyTask(rel_path, entry.size, entry.extents))
+    tasks.sort(key=lambda task: task.extents[0][0])
+    return directories, tasks
+
+
+class ISOFileCopier:
+    """
+    免挂载地把ISO中的文件复制到目标目录（如已挂载的FAT/exFAT卷）
+    按源区段顺序调度，保证对ISO基本是顺序读取；
+    小文件交给有界线程池并发处理，大文件在调度线程中用大缓冲区流式复制
+    """
+
+    def __init__(self, source, target_dir, workers=DEFAULT_WORKERS,
+                 small_file_limit=SMALL_FILE_LIMIT, buffer_size=LARGE_BUFFER_SIZE,
+                 progress_callback=None, cancel_check=None,
+                 max_file_size=None, large_file_policy=POLICY_SPLIT, data_dir=None):
+        """
+        :param source: ISO路径或可读的二进制文件对象
+        :param target_dir: 目标目录
+        :param workers: 小文件线程数
+        :param small_file_limit: 小文件阈值（字节）
+        :param buffer_size: 大文件缓冲区大小（字节）
+        :param progress_callback: 进度回调 callback(已复制字节, 总字节)
+        :param cancel_check: 返回True时取消复制
+        :param max_file_size: 目标文件系统的单文件上限，None表示不限制
+        :param large_file_policy: 超限文件的处理方式 (split/data_partition)
+        :param data_dir: data_partition 方式下数据分区的挂载目录
+        """
+        if large_file_policy == POLICY_DATA_PARTITION and not data_dir:
+            raise ValueError("双分区模式需要指定数据分区目录")
+        self.source = source
+        self.target_dir = target_dir
+        self.workers = max(workers, 1)
+        self.small_file_limit = small_file_limit
+        self.buffer_size = max(buffer_size, ISO_BLOCK_SIZE)
+        self.progress_callback = progress_callback
+        self.cancel_check = cancel_check
+        self.max_file_size = max_file_size
+        self.large_file_policy = large_file_policy
+        self.data_dir = data_dir
+        self.copied = 0
+        self.total = 0
+        self._aborted = False
+        self._lock = threading.Lock()
+
+    def _target_path(self, rel_path, base_dir=None):
+        return os.path.join(base_dir or self.target_dir, *rel_path.split('/'))
+
+    def _check_cancel(self):
+        if self._aborted or (self.cancel_check and self.cancel_check()):
+            raise CopyCancelled("复制已取消")
+
+    def _advance(self, size):
+        with self._lock:
+            self.copied += size
+
+    def _report(self):
+        if self.progress_callback:
+            self.progress_callback(self.copied, self.total)
+
+    def _iter_task_data(self, reader, task):
+        """按缓冲区大小读取文件各区段"""
+        for extent, size in task.extents:
+            offset = extent * ISO_BLOCK_SIZE
+            remaining = size
+            while remaining > 0:
+                data = reader.read_at(offset, min(self.buffer_size, remaining))
+                if not data:
+                    raise IOError(f"读取 {task.path} 时源镜像提前结束")
+                yield data
+                offset += len(data)
+                remaining -= len(data)
+
+    def _extent_reader(self, reader, task):
+        """把文件内偏移映射到各区段的读取函数"""
+        def read_at(offset, size):
+            chunks = []
+            position = 0
+            for extent, extent_size in task.extents:
+                if size <= 0:
+                    break
+                if offset < position + extent_size:
+                    start = offset - position
+                    length = min(size, extent_size - start)
+                    data = reader.read_at(extent * ISO_BLOCK_SIZE + start, length)
+                    chunks.append(data)
+                    offset += len(data)
+                    size -= len(data)
+                    if len(data) < length:
+                        break
+                position += extent_size
+            return b''.join(chunks)
+        return read_at
+
+    def _copy_oversized(self, reader, task):
+        """处理超过目标文件系统上限的文件"""
+        if self.large_file_policy == POLICY_DATA_PARTITION:
+            target = self._target_path(task.path, self.data_dir)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            self._write_stream(reader, task, target)
+            return
+
+        counted = [0]
+
+        def on_progress(size):
+            self._check_cancel()
+            self._advance(size)
+            counted[0] += size
+
+        read_at = self._extent_reader(reader, task)
+        target = self._target_path(task.path)
+        if task.path.lower().endswith('.wim'):
+            parts = split_wim(read_at, target, min(DEFAULT_SWM_PART_SIZE, self.max_file_size), on_progress)
+            # 分卷只统计了资源数据，补齐头部、查找表等未计入的部分
+            self._advance(max(task.size - counted[0], 0))
+        else:
+            parts = split_stream(read_at, task.size, target, self.max_file_size, on_progress)
+        logger.info(f"{task.path} 超过目标文件系统上限，已拆分为 {len(parts)} 个文件")
+
+    def _write_stream(self, reader, task, target):
+        with open(target, 'wb') as dst:
+            for data in self._iter_task_data(reader, task):
+                self._check_cancel()
+                dst.write(data)
+                self._advance(len(data))
+
+    def copy_file(self, reader, task):
+        """复制单个文件，超过目标文件系统上限时按策略拆分或转移"""
+        if self.max_file_size and task.size > self.max_file_size:
+            self._copy_oversized(reader, task)
+            return
+        self._write_stream(reader, task, self._target_path(task.path))
+
+    def run(self, path='/'):
+        """
+        执行复制
+        :param path: ISO内要复制的目录
+        :return: 统计信息字典
+        """
+        start_time = time.time()
+        owns_file = isinstance(self.source, (str, bytes, os.PathLike))
+        source = open(self.source, 'rb') if owns_file else self.source
+        try:
+            iso = ISOReader(source)
+            directories, tasks = plan_copy(iso, path)
+            self.total = sum(task.size for task in tasks)
+            self.copied = 0
+            self._aborted = False
+            reader = _SourceReader(source)
+
+            os.makedirs(self.target_dir, exist_ok=True)
+            for rel_dir in directories:
+                os.makedirs(self._target_path(rel_dir), exist_ok=True)
+
+            # 限制同时在途的小文件数量，避免调度线程远远跑在前面
+            window = threading.BoundedSemaphore(self.workers * 4)
+            errors = []
+
+            def small_copy(task):
+                try:
+                    self.copy_file(reader, task)
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    window.release()
+
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                try:
+                    for task in tasks:
+                        self._check_cancel()
+                        if errors:
+                            break
+                        if task.size < self.small_file_limit:
+                            window.acquire()
+                            pool.submit(small_copy, task)
+                        else:
+                            self.copy_file(reader, task)
+                        self._report()
+                except BaseException:
+                    # 让在途的小文件尽快结束
+                    self._aborted = True
+                    raise
+
+            if errors:
+                raise errors[0]
+            self._report()
+
+            return {
+                'files': len(tasks),
+                'directories': len(directories),
+                'bytes': self.copied,
+                'elapsed': time.time() - start_time
+            }
+        finally:
+            if owns_file:
+                source.close()
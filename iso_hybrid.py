@@ -0,0 +1,322 @@
+import os
+import json
+import base64
+import struct
+import zlib
+import uuid
+import logging
+
+from iso_reader import ISOReader
+from partition_table import (
+    mbr_entry, gpt_entry, gpt_header,
+    GPT_ENTRY_COUNT, GPT_ENTRY_SIZE, GPT_ENTRIES_SECTORS, GPT_TYPE_BASIC_DATA, GPT_TYPE_EFI_SYSTEM
+)
+
+logger = logging.getLogger(__name__)
+
+SECTOR_SIZE = 512
+ISO_BLOCK_SIZE = 2048
+
+# isohybrid 使用的几何参数：64磁头 x 32扇区，一个柱面正好 1MB
+HYBRID_HEADS = 64
+HYBRID_SECTORS = 32
+CYLINDER_SIZE = HYBRID_HEADS * HYBRID_SECTORS * SECTOR_SIZE
+
+# isolinux.bin 偏移0x40处的混合启动签名
+ISOLINUX_HYBRID_MAGIC = 0x7078c0fb
+
+JOURNAL_SUFFIX = '.hybrid-journal'
+
+
+def _read_at(f, offset, size):
+    f.seek(offset)
+    return f.read(size)
+
+
+def _align_up(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+
+def _mbr_entry(boot_flag, part_type, start_lba, sector_count):
+    """构造使用 isohybrid 几何参数的MBR分区项"""
+    return mbr_entry(boot_flag, part_type, start_lba, sector_count, HYBRID_HEADS, HYBRID_SECTORS)
+
+
+def _find_el_torito(f):
+    """查找El Torito引导记录，返回引导目录所在的LBA"""
+    for lba in range(16, 64):
+        desc = _read_at(f, lba * ISO_BLOCK_SIZE, ISO_BLOCK_SIZE)
+        if len(desc) < ISO_BLOCK_SIZE or desc[1:6] != b'CD001':
+            break
+        if desc[0] == 0 and desc[7:30] == b'EL TORITO SPECIFICATION':
+            return struct.unpack_from('<I', desc, 0x47)[0]
+        if desc[0] == 255:
+            break
+    return None
+
+
+def _efi_image_sectors(f, lba):
+    """从EFI引导映像的FAT引导扇区推算其512字节扇区数"""
+    boot = _read_at(f, lba * ISO_BLOCK_SIZE, SECTOR_SIZE)
+    if len(boot) < SECTOR_SIZE or boot[510:512] != b'\x55\xaa':
+        return 0
+    bytes_per_sector = struct.unpack_from('<H', boot, 11)[0] or SECTOR_SIZE
+    total = struct.unpack_from('<H', boot, 19)[0] or struct.unpack_from('<I', boot, 32)[0]
+    return total * bytes_per_sector // SECTOR_SIZE
+
+
+def read_boot_catalog(f):
+    """
+    解析ISO的El Torito引导目录
+    :param f: 以二进制模式打开的ISO文件对象
+    :return: {'volume_blocks', 'bios_lba', 'efi_lba', 'efi_sectors'}
+    """
+    pvd = _read_at(f, 16 * ISO_BLOCK_SIZE, ISO_BLOCK_SIZE)
+    if len(pvd) < ISO_BLOCK_SIZE or pvd[0] != 1 or pvd[1:6] != b'CD001':
+        raise ValueError("文件不是有效的ISO9660镜像")
+
+    info = {
+        'volume_blocks': struct.unpack_from('<I', pvd, 80)[0],
+        'bios_lba': None,
+        'efi_lba': None,
+        'efi_sectors': 0
+    }
+
+    catalog_lba = _find_el_torito(f)
+    if catalog_lba is None:
+        return info
+
+    catalog = _read_at(f, catalog_lba * ISO_BLOCK_SIZE, ISO_BLOCK_SIZE)
+    if catalog[0] != 0x01 or catalog[0x1e:0x20] != b'\x55\xaa':
+        raise ValueError("El Torito引导目录校验失败")
+
+    def record(platform, entry):
+        load_rba = struct.unpack_from('<I', entry, 8)[0]
+        if platform == 0xEF:
+            if info['efi_lba'] is None:
+                count = struct.unpack_from('<H', entry, 6)[0]
+                info['efi_lba'] = load_rba
+                # 扇区数为0或1时通常表示"整个映像"，从FAT头部推算真实大小
+                info['efi_sectors'] = count if count > 1 else _efi_image_sectors(f, load_rba)
+        elif platform == 0 and info['bios_lba'] is None:
+            info['bios_lba'] = load_rba
+
+    # 默认项的平台由验证项决定
+    if catalog[32] == 0x88:
+        record(catalog[1], catalog[32:64])
+
+    offset = 64
+    while offset + 32 <= len(catalog):
+        header_id = catalog[offset]
+        if header_id not in (0x90, 0x91):
+            break
+        platform = catalog[offset + 1]
+        count = struct.unpack_from('<H', catalog, offset + 2)[0]
+        offset += 32
+        for _ in range(count):
+            if offset + 32 > len(catalog):
+                break
+            entry = catalog[offset:offset + 32]
+            if entry[0] == 0x88:
+                record(platform, entry)
+            offset += 32
+        if header_id == 0x91:
+            break
+
+    return info
+
+
+def _find_file_size_by_lba(f, target_lba, max_depth=3):
+    """在目录树浅层中查找起始于指定LBA的文件，返回其大小"""
+    reader = ISOReader(f)
+    for _, entries in reader.walk('/', max_depth=max_depth):
+        for entry in entries:
+            if not entry.is_dir and entry.extent == target_lba:
+                return entry.size
+    return None
+
+
+def _boot_info_table(f, lba):
+    """
+    计算isolinux.bin的boot-info表(偏移8-24)
+    :return: (当前表, 期望表)，无法确定文件大小时返回 (None, None)
+    """
+    size = _find_file_size_by_lba(f, lba)
+    if not size or size <= 64:
+        return None, None
+    image = bytearray(_read_at(f, lba * ISO_BLOCK_SIZE, size))
+    image.extend(bytes(-len(image) % 4))
+    checksum = sum(struct.unpack_from(f'<{(len(image) - 64) // 4}I', image, 64)) & 0xffffffff
+    expected = struct.pack('<IIII', 16, lba, size, checksum)
+    return bytes(image[8:24]), expected
+
+
+def plan_hybrid(iso_path, uefi=None, mbr_code_path=None):
+    """
+    计算混合化需要写入的区域，不修改文件
+    :param iso_path: ISO文件路径
+    :param uefi: 是否写入GPT/EFI分区；None表示根据引导目录自动判断
+    :param mbr_code_path: 432字节的MBR引导代码（如syslinux的isohdpfx.bin）
+    :return: (写入列表 [(offset, data)], 新文件大小, 信息字典)
+    """
+    with open(iso_path, 'rb') as f:
+        info = read_boot_catalog(f)
+        file_size = os.fstat(f.fileno()).st_size
+        # 以卷描述符记录的大小为准，重复转换时不受上次补齐的影响
+        iso_size = info['volume_blocks'] * ISO_BLOCK_SIZE or file_size
+
+        if uefi is None:
+            uefi = info['efi_lba'] is not None
+        if uefi and info['efi_lba'] is None:
+            raise ValueError("ISO不包含EFI引导映像，无法创建UEFI混合镜像")
+        if info['bios_lba'] is None and not uefi:
+            raise ValueError("ISO不包含BIOS引导映像")
+
+        writes = []
+        old_mbr = _read_at(f, 0, SECTOR_SIZE).ljust(SECTOR_SIZE, b'\x00')
+
+        # isolinux混合签名和boot-info表
+        if info['bios_lba'] is not None:
+            head = _read_at(f, info['bios_lba'] * ISO_BLOCK_SIZE, 0x44)
+            info['isolinux_hybrid'] = (len(head) == 0x44 and
+                                       struct.unpack_from('<I', head, 0x40)[0] == ISOLINUX_HYBRID_MAGIC)
+            if not info['isolinux_hybrid']:
+                logger.warning("引导映像缺少isolinux混合签名，BIOS方式可能无法从U盘启动")
+            current, expected = _boot_info_table(f, info['bios_lba'])
+            if expected and current != expected:
+                writes.append((info['bios_lba'] * ISO_BLOCK_SIZE + 8, expected))
+
+    # 新文件大小：补齐到柱面边界，UEFI模式需在末尾保留备份GPT
+    tail = (GPT_ENTRIES_SECTORS + 1) * SECTOR_SIZE if uefi else 0
+    new_size = max(_align_up(iso_size + tail, CYLINDER_SIZE), file_size)
+    total_sectors = new_size // SECTOR_SIZE
+
+    # MBR引导代码：优先保留镜像自带的系统区代码
+    boot_code = old_mbr[:432]
+    if not any(boot_code):
+        code_path = mbr_code_path or os.path.join(os.path.dirname(__file__), 'resources', 'isohdpfx.bin')
+        if os.path.exists(code_path):
+            with open(code_path, 'rb') as f:
+                boot_code = f.read(432).ljust(432, b'\x00')
+        else:
+            logger.warning("未找到MBR引导代码，仅写入分区表")
+
+    mbr = bytearray(boot_code)
+    mbr += struct.pack('<Q', info['bios_lba'] * 4 if info['bios_lba'] is not None else 0)
+    signature = old_mbr[440:444]
+    mbr += signature if any(signature) else os.urandom(4)
+    mbr += b'\x00\x00'
+    mbr += _mbr_entry(0x80, 0x17, 0, total_sectors)
+    if uefi:
+        mbr += _mbr_entry(0x00, 0xEF, info['efi_lba'] * 4, info['efi_sectors'])
+        # 保护性分区项覆盖主GPT结构
+        mbr += _mbr_entry(0x00, 0xEE, 1, 63)
+    else:
+        mbr += bytes(32)
+    mbr += bytes(16)
+    mbr += b'\x55\xaa'
+    writes.insert(0, (0, bytes(mbr)))
+
+    if uefi:
+        last_lba = total_sectors - 1
+        disk_guid = uuid.uuid4()
+        entries = bytearray(GPT_ENTRY_COUNT * GPT_ENTRY_SIZE)
+        iso_sectors = iso_size // SECTOR_SIZE
+        entries[0:GPT_ENTRY_SIZE] = gpt_entry(GPT_TYPE_BASIC_DATA, 64, iso_sectors - 1, 'ISOHybrid ISO')
+        efi_start = info['efi_lba'] * 4
+        entries[GPT_ENTRY_SIZE:2 * GPT_ENTRY_SIZE] = gpt_entry(
+            GPT_TYPE_EFI_SYSTEM, efi_start, efi_start + max(info['efi_sectors'], 1) - 1, 'ISOHybrid')
+        entries_crc = zlib.crc32(entries) & 0xffffffff
+        first_usable = 2 + GPT_ENTRIES_SECTORS
+        last_usable = last_lba - GPT_ENTRIES_SECTORS - 1
+
+        primary = gpt_header(1, last_lba, first_usable, last_usable, disk_guid, 2, entries_crc)
+        backup = gpt_header(last_lba, 1, first_usable, last_usable, disk_guid,
+                             last_lba - GPT_ENTRIES_SECTORS, entries_crc)
+        writes.insert(1, (SECTOR_SIZE, primary + bytes(entries)))
+        writes.append(((last_lba - GPT_ENTRIES_SECTORS) * SECTOR_SIZE, bytes(entries) + backup))
+
+    info.update({'uefi': uefi, 'original_size': file_size, 'new_size': new_size})
+    return writes, new_size, info
+
+
+def _load_journal(journal_path):
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_journal(journal_path, journal):
+    tmp_path = journal_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(journal, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, journal_path)
+
+
+def make_hybrid(iso_path, uefi=None, mbr_code_path=None, journal_path=None):
+    """
+    原地把ISO转换为混合镜像，只改写首部扇区、boot-info表和末尾备份GPT
+    :param iso_path: ISO文件路径
+    :param uefi: 是否写入GPT/EFI分区；None表示自动判断
+    :param mbr_code_path: MBR引导代码文件路径
+    :param journal_path: 回滚日志路径，默认为 <iso>.hybrid-journal
+    :return: 信息字典（包含回滚日志路径和写入字节数）
+    """
+    journal_path = journal_path or iso_path + JOURNAL_SUFFIX
+    writes, new_size, info = plan_hybrid(iso_path, uefi, mbr_code_path)
+
+    # 已有日志时保留其中记录的原始内容，只补充新增的区域
+    if os.path.exists(journal_path):
+        journal = _load_journal(journal_path)
+    else:
+        journal = {'iso': os.path.abspath(iso_path), 'original_size': info['original_size'], 'regions': []}
+    covered = {(r['offset'], r['length']) for r in journal['regions']}
+
+    with open(iso_path, 'r+b') as f:
+        for offset, data in writes:
+            if offset >= journal['original_size']:
+                continue
+            length = min(len(data), journal['original_size'] - offset)
+            if (offset, length) in covered:
+                continue
+            journal['regions'].append({
+                'offset': offset,
+                'length': length,
+                'data': base64.b64encode(_read_at(f, offset, length)).decode('ascii')
+            })
+        # 先持久化日志，再修改镜像
+        _write_journal(journal_path, journal)
+
+        if new_size > os.fstat(f.fileno()).st_size:
+            f.truncate(new_size)
+        for offset, data in writes:
+            f.seek(offset)
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+    info['journal'] = journal_path
+    info['bytes_written'] = sum(len(data) for _, data in writes)
+    return info
+
+
+def rollback_hybrid(iso_path, journal_path=None):
+    """
+    根据回滚日志恢复混合化之前的ISO
+    :param iso_path: ISO文件路径
+    :param journal_path: 回滚日志路径
+    """
+    journal_path = journal_path or iso_path + JOURNAL_SUFFIX
+    journal = _load_journal(journal_path)
+
+    with open(iso_path, 'r+b') as f:
+        # 倒序恢复：区域有重叠时，先记录的才是最初的内容，应最后写回
+        for region in reversed(journal['regions']):
+            f.seek(region['offset'])
+            f.write(base64.b64decode(region['data']))
+        f.truncate(journal['original_size'])
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.remove(journal_path)
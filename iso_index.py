@@ -0,0 +1,312 @@
+import os
+import json
+import time
+import threading
+import logging
+
+from fs_events import FSEvents
+from dir_crawler import DirCrawler
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 2
+# 默认每天对每个根目录做一次完整重扫
+DEFAULT_FULL_RESCAN_INTERVAL = 86400
+
+
+def is_iso(path):
+    return path.lower().endswith('.iso')
+
+
+class ISOEntry:
+    """索引中的一个镜像文件"""
+    __slots__ = ('path', 'size', 'mtime')
+
+    def __init__(self, path, size=0, mtime=0.0):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+
+    def __repr__(self):
+        return f"ISOEntry({self.path!r}, size={self.size})"
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data[name] for name in cls.__slots__ if name in data})
+
+
+class _IndexCache:
+    """
+    把索引作为 DirCrawler 的目录缓存：修改时间没变的目录沿用记录
+    完整重扫时只沿用本轮开始之后列出的记录，超时中断的完整重扫下次接着进行，不会从头开始
+    """
+
+    def __init__(self, index, full_roots):
+        """
+        :param full_roots: {正在完整重扫的根目录: 本轮开始时间}
+        """
+        self.index = index
+        self.full_roots = full_roots
+        # 本次访问到的目录
+        self.seen = set()
+
+    def _pass_start(self, path):
+        starts = [start for root, start in self.full_roots.items() if self.index._under(path, [root])]
+        return max(starts) if starts else 0
+
+    def lookup(self, path, st):
+        index = self.index
+        with index._lock:
+            self.seen.add(path)
+            record = index._load()['dirs'].get(path)
+            if record is None or record['mtime'] != st.st_mtime_ns:
+                return None
+            if record.get('scanned', 0) < self._pass_start(path):
+                return None
+            index._refresh_isos(path, record)
+            return record['subdirs'], dict(record['isos'])
+
+    def store(self, path, st, subdirs, files):
+        index = self.index
+        with index._lock:
+            dirs = index._load()['dirs']
+            record = dirs.get(path)
+            if record is not None:
+                # 消失的子目录连同其下的记录一起删除
+                for name in set(record['subdirs']) - set(subdirs):
+                    index._drop_tree(os.path.join(path, name))
+            dirs[path] = {'mtime': st.st_mtime_ns, 'subdirs': subdirs, 'isos': files, 'scanned': time.time()}
+            index._dirty = True
+
+    def discard(self, path):
+        with self.index._lock:
+            self.index._drop_tree(path)
+
+
+class ISOIndex:
+    """
+    持久化的ISO索引：记录每个目录的修改时间、子目录和其中的ISO文件
+    增量扫描时目录修改时间没变就沿用记录、不再列目录，只检查子目录和已知ISO的状态；
+    运行期间由文件监控的事件直接增删条目；索引保存为一个JSON文件，第一次使用时才加载
+    """
+
+    def __init__(self, path, full_rescan_interval=DEFAULT_FULL_RESCAN_INTERVAL):
+        """
+        :param path: 索引文件路径
+        :param full_rescan_interval: 根目录距上次完整扫描超过这么久（秒）时自动完整重扫，0表示只在请求时重扫
+        """
+        self.path = path
+        self.full_rescan_interval = full_rescan_interval
+        self._lock = threading.RLock()
+        self._data = None
+        self._dirty = False
+
+    # ---- 持久化 ----
+
+    def _load(self):
+        if self._data is None:
+            data = None
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                logger.warning(f"读取ISO索引失败，将重新扫描: {e}")
+            if not isinstance(data, dict) or data.get('version') != INDEX_VERSION:
+                data = {'version': INDEX_VERSION, 'roots': {}, 'dirs': {}}
+            self._data = data
+        return self._data
+
+    def save(self):
+        """有改动时写回索引文件"""
+        with self._lock:
+            if self._data is None or not self._dirty:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(self._data, f, ensure_ascii=False)
+            os.replace(self.path + '.tmp', self.path)
+            self._dirty = False
+
+    # ---- 查询 ----
+
+    def _under(self, path, roots):
+        return any(path == root or path.startswith(root.rstrip(os.sep) + os.sep) for root in roots)
+
+    def entries(self, roots=None):
+        """
+        :param roots: 只返回这些目录下的镜像，None表示全部
+        :return: 按路径排序的 ISOEntry 列表
+        """
+        with self._lock:
+            dirs = self._load()['dirs']
+            if roots is not None:
+                roots = [os.path.abspath(root) for root in roots]
+            result = []
+            for directory, record in dirs.items():
+                if roots is not None and not self._under(directory, roots):
+                    continue
+                for name, (size, mtime) in record['isos'].items():
+                    result.append(ISOEntry(os.path.join(directory, name), size, mtime))
+        return sorted(result, key=lambda entry: entry.path)
+
+    def isos(self, roots=None):
+        """:return: 镜像路径列表"""
+        return [entry.path for entry in self.entries(roots)]
+
+    def indexed_roots(self):
+        """:return: {根目录: 上次完成完整扫描的时间，还没有完成过时为None}"""
+        with self._lock:
+            return {root: state['full'] for root, state in self._load()['roots'].items()}
+
+    # ---- 扫描 ----
+
+    def _drop_tree(self, directory):
+        """删除目录及其所有子目录的记录"""
+        dirs = self._load()['dirs']
+        prefix = directory.rstrip(os.sep) + os.sep
+        for path in [path for path in dirs if path == directory or path.startswith(prefix)]:
+            del dirs[path]
+            self._dirty = True
+
+    def _refresh_isos(self, directory, record):
+        """目录没变时文件仍可能被改写，只需重新stat已知的少量镜像"""
+        for name, value in list(record['isos'].items()):
+            try:
+                st = os.stat(os.path.join(directory, name))
+            except OSError:
+                del record['isos'][name]
+                self._dirty = True
+                continue
+            if [st.st_size, st.st_mtime] != value:
+                record['isos'][name] = [st.st_size, st.st_mtime]
+                self._dirty = True
+
+    def scan_iter(self, roots, force=False, cancel_check=None, stats=None, **options):
+        """
+        增量扫描，边遍历边产出找到的镜像：修改时间没变的目录沿用记录，不再列出
+        :param roots: 根目录列表
+        :param force: 是否对所有根目录完整重扫：重新列出所有目录；已有未完成的完整重扫时接着进行
+        :param cancel_check: 返回True时尽快结束，已扫描的部分仍会保存
+        :param stats: 传入字典时填入统计信息 {'listed': 列出的目录数, 'skipped': 沿用记录的目录数,
+                      'full': 完成完整扫描的根目录, 'truncated': 超时或被取消、没有扫描完的根目录}
+        首次扫描和按 full_rescan_interval 定期的完整扫描沿用修改时间没变的记录，只在结束时清理没有访问到的记录
+        :param options: DirCrawler 的遍历选项，如 excludes、max_depth、time_budget
+        :return: 生成器，逐个产出 ISOEntry
+        """
+        roots = [os.path.abspath(root) for root in roots]
+        with self._lock:
+            known = self._load()['roots']
+            now = time.time()
+            full_roots = {}
+            for root in roots:
+                state = known.setdefault(root, {'full': None, 'pass': None})
+                due = force or state['full'] is None or (
+                    self.full_rescan_interval and now - state['full'] >= self.full_rescan_interval)
+                if state['pass'] is None and due:
+                    # 只有请求的完整重扫才重新列出所有目录，首次和定期扫描沿用没变的记录
+                    state['pass'] = now if force else 0
+                    self._dirty = True
+                if state['pass'] is not None:
+                    full_roots[root] = state['pass']
+        cache = _IndexCache(self, full_roots)
+        crawler = DirCrawler(roots, match=is_iso, cache=cache, cancel_check=cancel_check, **options)
+        try:
+            for path, size, mtime in crawler.crawl():
+                yield ISOEntry(path, size, mtime)
+        finally:
+            with self._lock:
+                completed = [root for root in full_roots if root not in crawler.truncated]
+                for root in completed:
+                    # 完整遍历过的根目录下，没有访问到的记录（已删除、新排除或超出深度）一并删除
+                    prefix = root.rstrip(os.sep) + os.sep
+                    for directory in list(self._data['dirs']):
+                        if (directory == root or directory.startswith(prefix)) and directory not in cache.seen:
+                            del self._data['dirs'][directory]
+                    known[root] = {'full': now, 'pass': None}
+                    self._dirty = True
+                self.save()
+            if stats is not None:
+                stats.update({'listed': crawler.stats['listed'], 'skipped': crawler.stats['cached'],
+                              'full': completed, 'truncated': sorted(crawler.truncated)})
+
+    def scan(self, roots, force=False, cancel_check=None, **options):
+        """
+        增量扫描，参数同 scan_iter
+        :return: 统计信息，同 scan_iter 的 stats
+        """
+        stats = {}
+        for _ in self.scan_iter(roots, force, cancel_check, stats, **options):
+            pass
+        return stats
+
+    def forget(self, root):
+        """删除某个根目录的全部记录"""
+        with self._lock:
+            root = os.path.abspath(root)
+            self._load()['roots'].pop(root, None)
+            self._drop_tree(root)
+            self._dirty = True
+            self.save()
+
+    # ---- 监控事件 ----
+
+    def _invalidate(self, directory):
+        """让下次增量扫描重新列出该目录"""
+        record = self._load()['dirs'].get(directory)
+        if record is not None and record['mtime'] is not None:
+            record['mtime'] = None
+            self._dirty = True
+
+    def apply_events(self, events):
+        """
+        把文件监控的事件（通常来自 EventCoalescer）应用到索引
+        新增或删除的目录只标记父目录待重新列出，由下次扫描补全其下的内容
+        :param events: FSEvent 列表
+        :return: 新加入索引的镜像路径列表
+        """
+        added = []
+        with self._lock:
+            dirs = self._load()['dirs']
+            for event in events:
+                path = os.path.abspath(event.name) if event.name else event.name
+                if event.mask == FSEvents.Rescan:
+                    # 事件丢失，受影响的目录都要重新列出
+                    for directory in list(dirs):
+                        if not path or directory == path or directory.startswith(path.rstrip(os.sep) + os.sep):
+                            self._invalidate(directory)
+                    continue
+                parent, name = os.path.split(path)
+                if event.is_dir:
+                    if event.mask == FSEvents.Delete:
+                        self._drop_tree(path)
+                    self._invalidate(parent)
+                    continue
+                if not is_iso(name):
+                    continue
+                record = dirs.get(parent)
+                if event.mask == FSEvents.Delete:
+                    if record is not None and record['isos'].pop(name, None) is not None:
+                        self._dirty = True
+                    continue
+                if event.mask not in (FSEvents.Ready, FSEvents.Create, FSEvents.Modify):
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if record is None:
+                    # 父目录还没扫描过，只有在索引的根目录之下才记录
+                    if not self._under(parent, list(self._load()['roots'])):
+                        continue
+                    record = dirs[parent] = {'mtime': None, 'subdirs': [], 'isos': {}}
+                if name not in record['isos']:
+                    added.append(path)
+                record['isos'][name] = [st.st_size, st.st_mtime]
+                self._dirty = True
+            self.save()
+        return added
@@ -0,0 +1,317 @@
+import os
+import io
+import json
+import time
+import zlib
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 分块候选边界按ISO逻辑块对齐：ISO9660中的文件都从块边界开始，
+# 版本间的插入/删除也以块为单位，按块判断边界即可抵抗内容平移
+BLOCK_SIZE = 2048
+
+MIN_CHUNK_SIZE = 256 * 1024
+AVG_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+
+READ_SIZE = 8 * 1024 * 1024
+
+LIBRARY_SCHEME = 'library://'
+
+
+def chunk_boundaries(stream, min_size=MIN_CHUNK_SIZE, avg_size=AVG_CHUNK_SIZE, max_size=MAX_CHUNK_SIZE):
+    """
+    基于内容的分块：对每个块计算指纹，指纹低位命中掩码处即为切分点
+    切分点只取决于块本身的内容，因此前面插入或删除数据不会改变后续边界
+    :param stream: 二进制输入流
+    :return: 依次产出分块数据 (bytes)
+    """
+    mask = (1 << max((avg_size // BLOCK_SIZE).bit_length() - 1, 0)) - 1
+    chunk = bytearray()
+    while True:
+        data = stream.read(READ_SIZE)
+        if not data:
+            break
+        view = memoryview(data)
+        start = 0
+        for pos in range(0, len(view), BLOCK_SIZE):
+            end = pos + BLOCK_SIZE
+            size = len(chunk) + end - start
+            if size < min_size:
+                continue
+            if size >= max_size or (zlib.crc32(view[pos:end]) & mask) == mask:
+                chunk += view[start:end]
+                yield bytes(chunk)
+                chunk = bytearray()
+                start = end
+        chunk += view[start:]
+    if chunk:
+        yield bytes(chunk)
+
+
+class ISOLibrary:
+    """
+    去重ISO库：内容寻址的分块仓库 + 每个镜像的配方(recipe)
+    配方以镜像内容的 SHA-256 为键，不同目录下的同名ISO互不覆盖；显示名称记录在配方中
+    可选本地缓存目录，读取时把用到的分块复制到缓存中；每个分块读取后都会校验 SHA-256
+    """
+
+    def __init__(self, root, cache_dir=None):
+        """
+        :param root: 库目录（可以位于NAS上）
+        :param cache_dir: 本地缓存目录（如工作站上的SSD）
+        """
+        self.root = root
+        self.cache_dir = cache_dir
+        self.chunks_dir = os.path.join(root, 'chunks')
+        self.recipes_dir = os.path.join(root, 'recipes')
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        os.makedirs(self.recipes_dir, exist_ok=True)
+
+    @staticmethod
+    def _chunk_relpath(digest):
+        return os.path.join(digest[:2], digest[2:])
+
+    def _recipe_path(self, image_id):
+        return os.path.join(self.recipes_dir, image_id + '.json')
+
+    def _recipes(self):
+        """:return: 生成器，逐个产出 (镜像ID, 配方)，跳过无法读取的配方"""
+        for image_id in self.list_images():
+            try:
+                with open(self._recipe_path(image_id), 'r', encoding='utf-8') as f:
+                    yield image_id, json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"读取配方 {image_id} 失败: {e}")
+
+    def resolve(self, key):
+        """
+        :param key: 镜像ID，或唯一的显示名称
+        :return: 镜像ID
+        """
+        if os.path.exists(self._recipe_path(key)):
+            return key
+        matches = [image_id for image_id, recipe in self._recipes() if recipe.get('name') == key]
+        if not matches:
+            raise FileNotFoundError(f"库中没有镜像: {key}")
+        if len(matches) > 1:
+            raise ValueError(f"库中有多个名为 {key} 的镜像，请使用镜像ID: {', '.join(matches)}")
+        return matches[0]
+
+    def _store_chunk(self, digest, data):
+        """写入分块，已存在时跳过；返回是否新增"""
+        path = os.path.join(self.chunks_dir, self._chunk_relpath(digest))
+        if os.path.exists(path):
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return True
+
+    def read_chunk(self, digest):
+        """
+        读取分块并校验 SHA-256，优先使用本地缓存；缓存损坏时删除并改从库中读取
+        :raises IOError: 库中的分块内容与摘要不符
+        """
+        relpath = self._chunk_relpath(digest)
+        if self.cache_dir:
+            cached = os.path.join(self.cache_dir, relpath)
+            if os.path.exists(cached):
+                with open(cached, 'rb') as f:
+                    data = f.read()
+                if hashlib.sha256(data).hexdigest() == digest:
+                    return data
+                logger.warning(f"本地缓存的分块 {digest} 已损坏，改从库中读取")
+                os.remove(cached)
+
+        with open(os.path.join(self.chunks_dir, relpath), 'rb') as f:
+            data = f.read()
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise IOError(f"库中的分块 {digest} 已损坏（SHA-256 不符）")
+
+        if self.cache_dir:
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            tmp_path = f"{cached}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, cached)
+        return data
+
+    def list_images(self):
+        """列出库中的所有镜像ID"""
+        return sorted(name[:-5] for name in os.listdir(self.recipes_dir) if name.endswith('.json'))
+
+    def get_recipe(self, key):
+        """
+        :param key: 镜像ID，或唯一的显示名称
+        """
+        with open(self._recipe_path(self.resolve(key)), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def find_source(self, iso_path):
+        """:return: 从该ISO文件导入的镜像ID列表"""
+        source = os.path.abspath(iso_path)
+        return [image_id for image_id, recipe in self._recipes() if recipe.get('source') == source]
+
+    def has_image(self, iso_path):
+        """判断ISO是否已入库且源文件未变化"""
+        try:
+            stat = os.stat(iso_path)
+        except OSError:
+            return False
+        source = os.path.abspath(iso_path)
+        return any(recipe.get('source') == source and recipe.get('size') == stat.st_size
+                   and recipe.get('mtime') == int(stat.st_mtime) for _, recipe in self._recipes())
+
+    def ingest(self, iso_path, name=None, progress_callback=None):
+        """
+        把ISO导入库中
+        :param iso_path: ISO文件路径
+        :param name: 库中显示的镜像名称，默认为文件名
+        :param progress_callback: 进度回调 callback(已处理字节, 总字节)
+        :return: 统计信息字典，其中 id 为镜像ID（内容的 SHA-256）
+        """
+        name = name or os.path.basename(iso_path)
+        stat = os.stat(iso_path)
+        sha256 = hashlib.sha256()
+        chunks = []
+        processed = 0
+        new_bytes = 0
+
+        with open(iso_path, 'rb') as f:
+            for data in chunk_boundaries(f):
+                sha256.update(data)
+                digest = hashlib.sha256(data).hexdigest()
+                if self._store_chunk(digest, data):
+                    new_bytes += len(data)
+                chunks.append([digest, len(data)])
+                processed += len(data)
+                if progress_callback:
+                    progress_callback(processed, stat.st_size)
+
+        image_id = sha256.hexdigest()
+        # 源文件改变后重新导入时，替换该文件以前的配方
+        replaced = [old_id for old_id in self.find_source(iso_path) if old_id != image_id]
+        recipe = {
+            'id': image_id,
+            'name': name,
+            'source': os.path.abspath(iso_path),
+            'size': processed,
+            'mtime': int(stat.st_mtime),
+            'sha256': image_id,
+            'ingested': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'chunks': chunks
+        }
+        tmp_path = self._recipe_path(image_id) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(recipe, f)
+        os.replace(tmp_path, self._recipe_path(image_id))
+        for old_id in replaced:
+            os.remove(self._recipe_path(old_id))
+
+        return {
+            'id': image_id,
+            'name': name,
+            'size': processed,
+            'chunks': len(chunks),
+            'new_bytes': new_bytes,
+            'dedup_bytes': processed - new_bytes
+        }
+
+    def open_image(self, key):
+        """以只读文件对象的形式打开库中的镜像，key 为镜像ID或唯一的显示名称"""
+        return LibraryImage(self, self.get_recipe(key))
+
+    def remove_image(self, key):
+        """删除镜像配方，分块由 collect_garbage 回收"""
+        os.remove(self._recipe_path(self.resolve(key)))
+
+    def collect_garbage(self):
+        """删除不再被任何配方引用的分块，返回释放的字节数"""
+        referenced = set()
+        for image_id in self.list_images():
+            referenced.update(digest for digest, _ in self.get_recipe(image_id)['chunks'])
+
+        freed = 0
+        for prefix in os.listdir(self.chunks_dir):
+            prefix_dir = os.path.join(self.chunks_dir, prefix)
+            for rest in os.listdir(prefix_dir):
+                if prefix + rest not in referenced:
+                    path = os.path.join(prefix_dir, rest)
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+        return freed
+
+    def stats(self):
+        """返回库的逻辑大小和实际占用"""
+        logical = sum(self.get_recipe(image_id)['size'] for image_id in self.list_images())
+        stored = 0
+        for prefix in os.listdir(self.chunks_dir):
+            prefix_dir = os.path.join(self.chunks_dir, prefix)
+            stored += sum(os.path.getsize(os.path.join(prefix_dir, rest)) for rest in os.listdir(prefix_dir))
+        return {'images': len(self.list_images()), 'logical_bytes': logical, 'stored_bytes': stored}
+
+
+class LibraryImage(io.RawIOBase):
+    """按配方从分块仓库流式读取镜像的只读文件对象"""
+
+    def __init__(self, library, recipe):
+        super().__init__()
+        self.library = library
+        self.recipe = recipe
+        self.size = recipe['size']
+        self._offsets = []
+        offset = 0
+        for _, length in recipe['chunks']:
+            self._offsets.append(offset)
+            offset += length
+        self._pos = 0
+        self._chunk_index = None
+        self._chunk_data = b''
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def _locate(self, pos):
+        # 二分查找包含pos的分块
+        lo, hi = 0, len(self._offsets) - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self._offsets[mid] <= pos:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        written = 0
+        while written < len(view) and self._pos < self.size:
+            index = self._locate(self._pos)
+            if index != self._chunk_index:
+                self._chunk_data = self.library.read_chunk(self.recipe['chunks'][index][0])
+                self._chunk_index = index
+            start = self._pos - self._offsets[index]
+            n = min(len(view) - written, len(self._chunk_data) - start)
+            view[written:written + n] = self._chunk_data[start:start + n]
+            written += n
+            self._pos += n
+        return written
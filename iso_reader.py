@@ -0,0 +1,368 @@
+import os
+import struct
+import bisect
+import posixpath
+from array import array
+from collections import OrderedDict, deque
+
+ISO_BLOCK_SIZE = 2048
+
+# 目录记录标志位
+FLAG_DIRECTORY = 0x02
+FLAG_MULTI_EXTENT = 0x80
+
+# 每次从目录区读取的块数，超大目录也只按这个粒度读入内存
+DIRECTORY_READ_BLOCKS = 32
+
+
+class ISOEntry:
+    """ISO目录中的一条记录"""
+    __slots__ = ('name', 'extent', 'size', 'is_dir', 'extents')
+
+    def __init__(self, name, extent, size, is_dir, extents=None):
+        self.name = name
+        self.extent = extent
+        self.size = size
+        self.is_dir = is_dir
+        # 多区段文件（单个区段最大4GB）的全部 (LBA, 长度)
+        self.extents = extents or ((extent, size),)
+
+    def __repr__(self):
+        kind = 'dir' if self.is_dir else 'file'
+        return f"ISOEntry({self.name!r}, {kind}, extent={self.extent}, size={self.size})"
+
+
+class DirectoryTable:
+    """
+    按列存储的目录表：名称列表 + array 列保存区段、大小和标志
+    每条记录只占十几个字节，只有在访问时才构造 ISOEntry
+    """
+    __slots__ = ('names', 'extents', 'sizes', 'flags', 'extra_extents', '_order', '_keys', '_fold')
+
+    def __init__(self, fold_case=False):
+        self.names = []
+        self.extents = array('L')
+        self.sizes = array('Q')
+        self.flags = array('B')
+        self.extra_extents = {}
+        self._order = None
+        self._keys = None
+        self._fold = fold_case
+
+    def append(self, entry):
+        index = len(self.names)
+        self.names.append(entry.name)
+        self.extents.append(entry.extent)
+        self.sizes.append(entry.size)
+        self.flags.append(FLAG_DIRECTORY if entry.is_dir else 0)
+        if len(entry.extents) > 1:
+            self.extra_extents[index] = entry.extents
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        return ISOEntry(self.names[index], self.extents[index], self.sizes[index],
+                        bool(self.flags[index] & FLAG_DIRECTORY), self.extra_extents.get(index))
+
+    def page(self, start=0, count=100):
+        """返回从start开始的count条记录"""
+        return [self[i] for i in range(max(start, 0), min(start + count, len(self)))]
+
+    def _sorted_index(self):
+        if self._order is None:
+            key = (lambda i: self.names[i].casefold()) if self._fold else (lambda i: self.names[i])
+            self._order = array('L', sorted(range(len(self.names)), key=key))
+            self._keys = [key(i) for i in self._order]
+        return self._order, self._keys
+
+    def find(self, name):
+        """按名称精确查找"""
+        order, keys = self._sorted_index()
+        key = name.casefold() if self._fold else name
+        pos = bisect.bisect_left(keys, key)
+        if pos < len(keys) and keys[pos] == key:
+            return self[order[pos]]
+        return None
+
+    def prefix(self, prefix, limit=None):
+        """按名称前缀查找，结果按名称排序"""
+        order, keys = self._sorted_index()
+        key = prefix.casefold() if self._fold else prefix
+        pos = bisect.bisect_left(keys, key)
+        results = []
+        while pos < len(keys) and keys[pos].startswith(key):
+            results.append(self[order[pos]])
+            if limit and len(results) >= limit:
+                break
+            pos += 1
+        return results
+
+
+class ISOReader:
+    """
+    只读ISO9660解析器，按需读取目录
+    优先使用Rock Ridge名称，其次Joliet，最后是ISO9660短名称
+    """
+
+    def __init__(self, source, max_cached_dirs=64):
+        """
+        :param source: ISO文件路径或以二进制模式打开的文件对象
+        :param max_cached_dirs: 缓存的目录表数量上限
+        """
+        if isinstance(source, (str, bytes, os.PathLike)):
+            self._file = open(source, 'rb')
+            self._owns_file = True
+        else:
+            self._file = source
+            self._owns_file = False
+        self.max_cached_dirs = max_cached_dirs
+        self._tables = OrderedDict()
+        self._load_volume_descriptors()
+
+    def close(self):
+        if self._owns_file and self._file:
+            self._file.close()
+        self._file = None
+        self._tables.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read(self, offset, size):
+        self._file.seek(offset)
+        return self._file.read(size)
+
+    def _load_volume_descriptors(self):
+        primary = None
+        joliet = None
+        for lba in range(16, 64):
+            desc = self._read(lba * ISO_BLOCK_SIZE, ISO_BLOCK_SIZE)
+            if len(desc) < ISO_BLOCK_SIZE or desc[1:6] != b'CD001':
+                break
+            if desc[0] == 1 and primary is None:
+                primary = desc
+            elif desc[0] == 2 and desc[88:91] in (b'%/@', b'%/C', b'%/E'):
+                joliet = desc
+            elif desc[0] == 255:
+                break
+
+        if primary is None:
+            raise ValueError("文件不是有效的ISO9660镜像")
+
+        self.volume_id = primary[40:72].decode('ascii', 'replace').strip()
+        self.volume_blocks = struct.unpack_from('<I', primary, 80)[0]
+
+        root, _ = self._parse_record(primary, 156, plain=True)
+        self.rock_ridge = self._detect_rock_ridge(root.extent)
+        if self.rock_ridge:
+            self.names_mode = 'rockridge'
+        elif joliet is not None:
+            self.names_mode = 'joliet'
+            root, _ = self._parse_record(joliet, 156, plain=True)
+        else:
+            self.names_mode = 'iso9660'
+        self.root = ISOEntry('/', root.extent, root.size, True)
+
+    def _detect_rock_ridge(self, root_extent):
+        """检查根目录'.'记录的系统使用区是否包含SUSP的SP项"""
+        block = self._read(root_extent * ISO_BLOCK_SIZE, ISO_BLOCK_SIZE)
+        if not block or block[0] == 0:
+            return False
+        name_len = block[32]
+        su_start = 33 + name_len + (1 - name_len % 2)
+        return block[su_start:su_start + 2] == b'SP' and block[su_start + 4:su_start + 6] == b'\xbe\xef'
+
+    def _rock_ridge_name(self, record, su_start, su_end):
+        """从系统使用区（含CE续接区）提取NM名称"""
+        name = b''
+        area = record[su_start:su_end]
+        visited = 0
+        while area and visited < 8:
+            visited += 1
+            pos = 0
+            continuation = None
+            while pos + 4 <= len(area):
+                sig, length = area[pos:pos + 2], area[pos + 2]
+                if length < 4:
+                    break
+                if sig == b'NM':
+                    flags = area[pos + 4]
+                    if flags & 0x06:
+                        return None
+                    name += area[pos + 5:pos + length]
+                elif sig == b'CE':
+                    block, offset, size = struct.unpack_from('<I', area, pos + 4)[0], \
+                        struct.unpack_from('<I', area, pos + 12)[0], struct.unpack_from('<I', area, pos + 20)[0]
+                    continuation = (block * ISO_BLOCK_SIZE + offset, size)
+                elif sig == b'ST':
+                    break
+                pos += length
+            area = self._read(*continuation) if continuation else b''
+        return name.decode('utf-8', 'replace') if name else None
+
+    def _parse_record(self, data, pos, plain=False):
+        length = data[pos]
+        extent = struct.unpack_from('<I', data, pos + 2)[0]
+        size = struct.unpack_from('<I', data, pos + 10)[0]
+        flags = data[pos + 25]
+        name_len = data[pos + 32]
+        raw_name = data[pos + 33:pos + 33 + name_len]
+
+        if plain or raw_name in (b'\x00', b'\x01'):
+            name = raw_name
+        elif self.names_mode == 'rockridge':
+            su_start = pos + 33 + name_len + (1 - name_len % 2)
+            name = self._rock_ridge_name(data, su_start, pos + length)
+            if name is None:
+                name = self._plain_name(raw_name, flags)
+        elif self.names_mode == 'joliet':
+            name = raw_name.decode('utf-16-be', 'replace').split(';')[0]
+        else:
+            name = self._plain_name(raw_name, flags)
+
+        return ISOEntry(name, extent, size, bool(flags & FLAG_DIRECTORY)), flags
+
+    @staticmethod
+    def _plain_name(raw_name, flags):
+        name = raw_name.decode('ascii', 'replace')
+        if not flags & FLAG_DIRECTORY:
+            name = name.split(';')[0]
+            if name.endswith('.'):
+                name = name[:-1]
+        return name
+
+    def iterdir(self, directory):
+        """
+        流式遍历目录记录，不缓存整张目录表
+        :param directory: 目录路径或目录 ISOEntry
+        """
+        if not isinstance(directory, ISOEntry):
+            directory = self.lookup(directory)
+            if directory is None or not directory.is_dir:
+                raise NotADirectoryError(directory)
+
+        pending = None
+        chunk_size = DIRECTORY_READ_BLOCKS * ISO_BLOCK_SIZE
+        for chunk_offset in range(0, directory.size, chunk_size):
+            data = self._read(directory.extent * ISO_BLOCK_SIZE + chunk_offset,
+                              min(chunk_size, directory.size - chunk_offset))
+            pos = 0
+            while pos < len(data):
+                if data[pos] == 0:
+                    # 目录记录不会跨越逻辑块，跳到下一个块
+                    pos = (pos // ISO_BLOCK_SIZE + 1) * ISO_BLOCK_SIZE
+                    continue
+                length = data[pos]
+                entry, flags = self._parse_record(data, pos)
+                pos += length
+
+                multi = bool(flags & FLAG_MULTI_EXTENT)
+                if entry.name in (b'\x00', b'\x01'):
+                    continue
+
+                # 合并多区段文件的各个区段
+                if pending is not None:
+                    pending.extents += ((entry.extent, entry.size),)
+                    pending.size += entry.size
+                    if not multi:
+                        yield pending
+                        pending = None
+                    continue
+                if multi:
+                    pending = entry
+                    continue
+                yield entry
+
+    def table(self, directory):
+        """
+        获取目录的列式表，按LRU缓存最近访问的目录
+        :param directory: 目录路径或目录 ISOEntry
+        """
+        if not isinstance(directory, ISOEntry):
+            directory = self.lookup(directory)
+            if directory is None or not directory.is_dir:
+                raise NotADirectoryError(directory)
+
+        table = self._tables.get(directory.extent)
+        if table is not None:
+            self._tables.move_to_end(directory.extent)
+            return table
+
+        table = DirectoryTable(fold_case=self.names_mode != 'rockridge')
+        for entry in self.iterdir(directory):
+            table.append(entry)
+        self._tables[directory.extent] = table
+        while len(self._tables) > self.max_cached_dirs:
+            self._tables.popitem(last=False)
+        return table
+
+    def listdir_page(self, path, start=0, count=100):
+        """
+        分页列出目录内容
+        :param path: 目录路径
+        :param start: 起始序号
+        :param count: 每页条数
+        :return: ISOEntry 列表
+        """
+        return self.table(path).page(start, count)
+
+    def prefix(self, path, prefix, limit=None):
+        """
+        在目录中按名称前缀查找
+        :param path: 目录路径
+        :param prefix: 名称前缀
+        :param limit: 最多返回条数
+        """
+        return self.table(path).prefix(prefix, limit)
+
+    def lookup(self, path):
+        """
+        按路径查找记录，只读取路径上经过的目录
+        :return: ISOEntry，不存在时返回None
+        """
+        entry = self.root
+        for part in posixpath.normpath('/' + path.lstrip('/')).split('/'):
+            if not part:
+                continue
+            if not entry.is_dir:
+                return None
+            entry = self.table(entry).find(part)
+            if entry is None:
+                return None
+        return entry
+
+    def walk(self, path='/', max_depth=None):
+        """
+        广度优先遍历目录树，逐个目录产出 (目录路径, 记录列表)
+        目录内容只在遍历到时读取，且不进入目录表缓存
+        """
+        top = self.lookup(path)
+        if top is None or not top.is_dir:
+            raise NotADirectoryError(path)
+        pending = deque([(posixpath.normpath('/' + path.lstrip('/')), top, 0)])
+        while pending:
+            dir_path, directory, depth = pending.popleft()
+            entries = list(self.iterdir(directory))
+            yield dir_path, entries
+            if max_depth is not None and depth >= max_depth:
+                continue
+            for entry in entries:
+                if entry.is_dir:
+                    pending.append((posixpath.join(dir_path, entry.name), entry, depth + 1))
+
+    def read_chunks(self, entry, chunk_size=1024 * 1024):
+        """按块读取文件内容"""
+        for extent, size in entry.extents:
+            offset = extent * ISO_BLOCK_SIZE
+            remaining = size
+            while remaining > 0:
+                data = self._read(offset, min(chunk_size, remaining))
+                if not data:
+                    return
+                yield data
+                offset += len(data)
+                remaining -= len(data)
@@ -0,0 +1,142 @@
+import os
+import stat
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# 各字段的有效期（秒）：容量几乎不变，剩余空间变化快
+DEFAULT_TTLS = {
+    'size': 300,
+    'block_info': 300,
+    'identity': 300,
+    'usage': 5,
+    'removable': 60,
+    'device_info': 60,
+    # 扩容盘检查要写设备，只在写入或插拔使缓存失效后重做；过期后同步重做，不在后台刷新
+    'capacity': 86400,
+}
+DEFAULT_TTL = 30
+# 过期超过这么久的值不再先返回旧值，而是同步重新获取
+DEFAULT_STALE_LIMIT = 600
+REFRESH_WORKERS = 2
+
+
+def device_key(path):
+    """
+    缓存键：块/字符设备用设备号，普通路径用所在文件系统，
+    因此 /dev/sdb 与其符号链接、同一文件系统中的不同目录共用缓存
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return ('path', os.path.abspath(path))
+    if stat.S_ISBLK(st.st_mode) or stat.S_ISCHR(st.st_mode):
+        return ('dev', st.st_rdev)
+    if stat.S_ISDIR(st.st_mode):
+        return ('fs', st.st_dev)
+    return ('file', st.st_dev, st.st_ino)
+
+
+class _Entry:
+    __slots__ = ('value', 'loaded')
+
+    def __init__(self, value, loaded):
+        self.value = value
+        self.loaded = loaded
+
+
+class MetadataCache:
+    """
+    设备元数据缓存：按字段设置有效期，过期后先返回旧值并在后台刷新（stale-while-revalidate）
+    """
+
+    def __init__(self, ttls=None, stale_limit=DEFAULT_STALE_LIMIT, workers=REFRESH_WORKERS):
+        """
+        :param ttls: {字段: 有效期秒数}，覆盖 DEFAULT_TTLS
+        :param stale_limit: 过期后仍可返回旧值的最长时间（秒）
+        :param workers: 后台刷新线程数
+        """
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.stale_limit = stale_limit
+        self._entries = {}
+        self._refreshing = set()
+        # 每次失效递增；失效前开始的加载结果不再写入缓存
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+    def _ttl(self, field):
+        return self.ttls.get(field, DEFAULT_TTL)
+
+    def get(self, path, field, loader, stale=True, cacheable=None):
+        """
+        读取缓存值
+        :param path: 设备或路径
+        :param field: 字段名，如 'size'、'usage'
+        :param loader: 无参函数，返回最新值
+        :param stale: 过期后是否先返回旧值并在后台刷新；False时同步重新获取，
+                      用于会写设备等不能在后台随时运行的加载函数
+        :param cacheable: cacheable(value) -> bool，返回False的值不写入缓存（如被取消的不完整结果）
+        """
+        key = (device_key(path), field)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            age = now - entry.loaded
+            ttl = self._ttl(field)
+            if age < ttl:
+                return entry.value
+            if stale and age < ttl + self.stale_limit:
+                self._refresh_async(key, loader)
+                return entry.value
+        return self._load(key, loader, cacheable)
+
+    def _load(self, key, loader, cacheable=None):
+        generation = self._generation
+        value = loader()
+        if cacheable is not None and not cacheable(value):
+            return value
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = _Entry(value, time.monotonic())
+        return value
+
+    def _refresh_async(self, key, loader):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._load(key, loader)
+            except Exception as e:
+                logger.warning(f"后台刷新设备信息失败 {key}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._pool.submit(refresh)
+
+    def invalidate(self, path=None, field=None):
+        """
+        使缓存失效
+        :param path: None表示所有设备
+        :param field: None表示所有字段
+        """
+        device = device_key(path) if path is not None else None
+        with self._lock:
+            self._generation += 1
+            for key in list(self._entries):
+                if (device is None or key[0] == device) and (field is None or key[1] == field):
+                    del self._entries[key]
+
+    def clear(self):
+        self.invalidate()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,275 @@
+import os
+import time
+import threading
+import logging
+
+import fs_events
+from fs_events import FSEvent, FSEvents, FSEventStream
+
+logger = logging.getLogger(__name__)
+
+# 每隔这么久检查一次各根目录和监控流的状态（秒）
+CHECK_INTERVAL = 5.0
+# 监控流失败后的重启等待：从 INITIAL_BACKOFF 起每次翻倍，最多 MAX_BACKOFF（秒）
+INITIAL_BACKOFF = 1.0
+MAX_BACKOFF = 300.0
+# 连续正常运行这么久后，重启等待恢复为初始值（秒）
+STABLE_RUN = 60.0
+
+STATE_STOPPED = 'stopped'
+STATE_RUNNING = 'running'
+# 根目录不存在（如卷已卸载），重新出现时自动恢复监控
+STATE_MISSING = 'missing'
+# 监控流异常结束，等待重启
+STATE_BACKOFF = 'backoff'
+
+
+class RootStats:
+    """一个监控根目录的状态和计数"""
+    __slots__ = ('path', 'state', 'backend', 'events', 'events_per_sec', 'queue_depth', 'last_event',
+                 'started', 'restarts', 'last_error')
+
+    def __init__(self, path):
+        self.path = path
+        self.state = STATE_STOPPED
+        # 当前使用的事件后端名称，如 inotify、fswatch、polling
+        self.backend = None
+        # 收到的事件总数和最近一个检查周期内的速率
+        self.events = 0
+        self.events_per_sec = 0.0
+        # 合并器中该目录下仍在等待的路径数
+        self.queue_depth = 0
+        # 最后一个事件的时间戳（time.time()），没有事件时为None
+        self.last_event = None
+        # 当前监控流的启动时间（单调时钟）
+        self.started = None
+        # 监控流被重新启动的次数
+        self.restarts = 0
+        self.last_error = None
+
+    def __repr__(self):
+        return f"RootStats({self.path!r}, {self.state}, events={self.events})"
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class _WatchedRoot:
+    __slots__ = ('stats', 'stream', 'identity', 'retry_at', 'backoff', 'counted', 'counted_at')
+
+    def __init__(self, path):
+        self.stats = RootStats(path)
+        self.stream = None
+        # 启动监控时根目录的 (st_dev, st_ino)，卷重新挂载后会变化
+        self.identity = None
+        self.retry_at = 0.0
+        self.backoff = INITIAL_BACKOFF
+        # 上次计算事件速率时的事件数和时间
+        self.counted = 0
+        self.counted_at = 0.0
+
+
+def root_identity(path):
+    """:return: (st_dev, st_ino)，目录不存在时返回None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino) if os.path.isdir(path) else None
+
+
+class MonitorManager:
+    """
+    管理所有根目录的监控流：每个根目录一个 FSEventStream，由后台线程定期检查
+    - 监控流异常结束（如 fswatch 进程退出）时按指数退避重启
+    - 根目录消失（卷被卸载）时停止该流，重新出现或被重新挂载时重新监控，并发出 Rescan 事件
+    - 记录每个根目录的事件数、事件速率、待处理数和最后事件时间
+    """
+
+    def __init__(self, paths, callback, backend_factory=None, pending=None, recursive=True,
+                 check_interval=CHECK_INTERVAL, clock=time.monotonic):
+        """
+        :param paths: 要监控的根目录列表
+        :param callback: callback(FSEvent)，在监控线程中调用
+        :param backend_factory: 每次启动监控流时调用，返回新的 Backend；None时按平台自动选择
+        :param pending: pending() -> 路径列表，用于统计每个根目录的待处理数，如 EventCoalescer.pending
+        """
+        self.callback = callback
+        self.backend_factory = backend_factory or fs_events.default_backend
+        self.pending = pending
+        self.recursive = recursive
+        self.check_interval = check_interval
+        self.clock = clock
+        self._roots = {}
+        for path in paths:
+            path = os.path.abspath(path)
+            self._roots.setdefault(path, _WatchedRoot(path))
+        self._lock = threading.RLock()
+        self._counter_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ---- 事件 ----
+
+    def _dispatcher(self, root):
+        def dispatch(event):
+            stats = root.stats
+            # 计数单独加锁：check() 持有 _lock 停止监控流时会等待监控线程结束
+            with self._counter_lock:
+                stats.events += 1
+                stats.last_event = time.time()
+            self.callback(event)
+        return dispatch
+
+    # ---- 监控流 ----
+
+    def _start_stream(self, root, identity, now):
+        stats = root.stats
+        try:
+            backend = self.backend_factory()
+            stream = FSEventStream([stats.path], self._dispatcher(root), backend=backend,
+                                   recursive=self.recursive)
+            stream.start()
+        except Exception as e:
+            self._failed(root, e, now)
+            return
+        restarted = stats.started is not None
+        # 重启或目录重新出现时，期间的变化没有事件
+        rearmed = restarted or stats.state == STATE_MISSING
+        root.stream = stream
+        root.identity = identity
+        stats.state = STATE_RUNNING
+        stats.backend = backend.name
+        stats.started = now
+        if restarted:
+            stats.restarts += 1
+        if rearmed:
+            logger.info(f"已重新监控 {stats.path}（{backend.name}）")
+            # 通知使用者重新扫描该目录
+            try:
+                self.callback(FSEvent(stats.path, FSEvents.Rescan, True))
+            except Exception as e:
+                logger.error(f"文件事件回调出错: {e}")
+
+    def _stop_stream(self, root):
+        if root.stream is not None:
+            root.stream.stop()
+            root.stream = None
+
+    def _failed(self, root, error, now):
+        stats = root.stats
+        self._stop_stream(root)
+        stats.state = STATE_BACKOFF
+        stats.last_error = str(error) if error else '监控意外结束'
+        root.retry_at = now + root.backoff
+        logger.warning(f"监控 {stats.path} 失败（{stats.last_error}），{root.backoff:.0f} 秒后重试")
+        root.backoff = min(root.backoff * 2, MAX_BACKOFF)
+
+    def _check_root(self, root, now):
+        stats = root.stats
+        identity = root_identity(stats.path)
+        if identity is None:
+            if stats.state != STATE_MISSING:
+                if stats.state == STATE_RUNNING:
+                    logger.info(f"监控的目录已不存在，等待其重新出现: {stats.path}")
+                self._stop_stream(root)
+                stats.state = STATE_MISSING
+                root.identity = None
+            return
+
+        if stats.state == STATE_RUNNING:
+            if root.stream is not None and not root.stream.running:
+                self._failed(root, root.stream.error, now)
+                return
+            if identity != root.identity:
+                # 卷被重新挂载，原来的监控已失效
+                logger.info(f"目录已被重新挂载，重新监控: {stats.path}")
+                self._stop_stream(root)
+                self._start_stream(root, identity, now)
+            elif now - stats.started >= STABLE_RUN:
+                root.backoff = INITIAL_BACKOFF
+            return
+
+        if stats.state == STATE_BACKOFF and now < root.retry_at:
+            return
+        self._start_stream(root, identity, now)
+
+    def _update_rates(self, now):
+        pending = []
+        if self.pending:
+            try:
+                pending = self.pending()
+            except Exception as e:
+                logger.debug(f"读取待处理事件数失败: {e}")
+        for root in self._roots.values():
+            stats = root.stats
+            prefix = stats.path.rstrip(os.sep) + os.sep
+            stats.queue_depth = sum(1 for path in pending if path == stats.path or path.startswith(prefix))
+            with self._counter_lock:
+                events = stats.events
+            elapsed = now - root.counted_at
+            if elapsed > 0:
+                stats.events_per_sec = (events - root.counted) / elapsed
+            root.counted, root.counted_at = events, now
+
+    def check(self, now=None):
+        """检查所有根目录一次，必要时启动、重启或停止监控流"""
+        now = self.clock() if now is None else now
+        with self._lock:
+            for root in self._roots.values():
+                try:
+                    self._check_root(root, now)
+                except Exception as e:
+                    logger.error(f"检查监控目录 {root.stats.path} 时出错: {e}")
+            self._update_rates(now)
+
+    # ---- 对外接口 ----
+
+    def status(self):
+        """:return: 每个根目录的 RootStats 字典列表"""
+        with self._lock, self._counter_lock:
+            return [root.stats.to_dict() for root in self._roots.values()]
+
+    def add_root(self, path):
+        """增加一个根目录，管理器运行中时立即开始监控"""
+        path = os.path.abspath(path)
+        with self._lock:
+            self._roots.setdefault(path, _WatchedRoot(path))
+        if self.running:
+            self.check()
+
+    def remove_root(self, path):
+        """停止并移除一个根目录"""
+        with self._lock:
+            root = self._roots.pop(os.path.abspath(path), None)
+            if root is not None:
+                self._stop_stream(root)
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def _supervise(self):
+        while not self._stop.wait(self.check_interval):
+            self.check()
+
+    def start(self):
+        """启动所有根目录的监控和后台检查线程"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self.check()
+        self._thread = threading.Thread(target=self._supervise, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止检查线程和所有监控流"""
+        self._stop.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self._thread = None
+        with self._lock:
+            for root in self._roots.values():
+                self._stop_stream(root)
+                root.stats.state = STATE_STOPPED
+                root.stats.started = None
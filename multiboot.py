@@ -0,0 +1,415 @@
+import os
+import re
+import sys
+import json
+import time
+import struct
+import posixpath
+import logging
+
+from iso_reader import ISOReader
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'multiboot.json'
+IMAGES_DIR = 'isos'
+GRUB_CFG_PATH = os.path.join('boot', 'grub', 'grub.cfg')
+
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+DEFAULT_BOOT_SIZE = '256M'
+# 数据分区在ISO总大小之外预留的空间，便于之后替换为更大的版本
+DEFAULT_HEADROOM = 0.1
+
+# Linux FIEMAP ioctl，用于检查文件是否连续存放
+FS_IOC_FIEMAP = 0xC020660B
+
+# 镜像中常见的启动配置位置，按优先级排列
+GRUB_CONFIGS = ('/boot/grub/grub.cfg', '/boot/grub/loopback.cfg', '/EFI/BOOT/grub.cfg', '/boot/grub2/grub.cfg')
+SYSLINUX_CONFIGS = ('/isolinux/isolinux.cfg', '/isolinux/txt.cfg', '/isolinux/live.cfg',
+                    '/syslinux/syslinux.cfg', '/boot/isolinux/isolinux.cfg', '/boot/syslinux/syslinux.cfg')
+LOOPBACK_CONFIG = '/boot/grub/loopback.cfg'
+EFI_LOADER = '/EFI/BOOT/BOOTX64.EFI'
+
+
+def plan_multiboot_partitions(iso_sizes, boot_size=DEFAULT_BOOT_SIZE, data_fs='exfat',
+                              persistence_size=None, headroom=DEFAULT_HEADROOM):
+    """
+    生成多系统启动U盘的分区描述，可直接传给 create_partition_table
+    分区1为FAT32引导分区（GRUB及菜单），分区2存放ISO，可选分区3为持久化数据分区
+    :param iso_sizes: 要放入的ISO大小列表（字节）
+    :param boot_size: 引导分区大小
+    :param data_fs: ISO分区的文件系统 (exfat/fat32)
+    :param persistence_size: 持久化分区大小，None表示不创建；此时ISO分区占满剩余空间
+    :param headroom: ISO分区在ISO总大小之外预留的比例
+    :return: 分区描述列表
+    """
+    partitions = [{'size': boot_size, 'type': 'efi', 'format': 'fat32', 'name': 'MULTIBOOT'}]
+    if persistence_size is None:
+        partitions.append({'size': None, 'format': data_fs, 'name': 'ISOS'})
+    else:
+        data_size = int(sum(iso_sizes) * (1 + headroom)) + 64 * 1024 * 1024
+        partitions.append({'size': data_size, 'format': data_fs, 'name': 'ISOS'})
+        partitions.append({'size': persistence_size, 'format': 'ext4', 'name': 'persistence'})
+    return partitions
+
+
+def _read_text(reader, path):
+    entry = reader.lookup(path)
+    if entry is None or entry.is_dir:
+        return None
+    return b''.join(reader.read_chunks(entry)).decode('utf-8', 'replace')
+
+
+def _parse_grub_entry(text):
+    """取第一个包含 linux 命令的菜单项 -> (内核, 参数, initrd列表)"""
+    kernel = None
+    for line in text.splitlines():
+        words = line.strip().split()
+        if not words:
+            continue
+        if words[0] in ('linux', 'linuxefi', 'linux16') and len(words) > 1 and kernel is None:
+            kernel, args = words[1], words[2:]
+        elif words[0] in ('initrd', 'initrdefi', 'initrd16') and kernel is not None:
+            return kernel, args, words[1:]
+    if kernel is not None:
+        return kernel, args, []
+    return None
+
+
+def _parse_syslinux_entry(reader, path, depth=0):
+    """取第一个带 kernel/linux 的 LABEL -> (内核, 参数, initrd列表)，跟随 include"""
+    text = _read_text(reader, path)
+    if text is None or depth > 3:
+        return None
+    base = posixpath.dirname(path)
+
+    def resolve(name):
+        return name if name.startswith('/') else posixpath.join(base, name)
+
+    kernel = None
+    for line in text.splitlines():
+        words = line.strip().split()
+        if not words:
+            continue
+        keyword = words[0].lower()
+        if keyword == 'include' and len(words) > 1 and kernel is None:
+            found = _parse_syslinux_entry(reader, resolve(words[1]), depth + 1)
+            if found:
+                return found
+        elif keyword in ('kernel', 'linux') and len(words) > 1 and kernel is None:
+            if words[1].endswith(('.c32', '.bin', '.0')):
+                continue
+            kernel = resolve(words[1])
+        elif keyword == 'append' and kernel is not None:
+            initrds = []
+            args = []
+            for word in words[1:]:
+                if word.startswith('initrd='):
+                    initrds += [resolve(name) for name in word[len('initrd='):].split(',')]
+                else:
+                    args.append(word)
+            return kernel, args, initrds
+    if kernel is not None:
+        return kernel, [], []
+    return None
+
+
+def detect_loopback_boot(reader):
+    """
+    根据镜像自带的启动配置，推断从GRUB loopback启动的方式
+    :param reader: ISOReader
+    :return: {'method': 'loopback_cfg'/'linux'/'chainload'/None, 'family', 'kernel', 'initrd', 'args'}
+    """
+    if reader.lookup(LOOPBACK_CONFIG) is not None:
+        return {'method': 'loopback_cfg', 'family': 'loopback.cfg', 'config': LOOPBACK_CONFIG}
+
+    if reader.lookup('/sources/install.wim') is not None or reader.lookup('/sources/install.esd') is not None:
+        # Windows安装镜像无法通过loopback启动
+        return {'method': None, 'family': 'windows'}
+
+    found = None
+    for path in GRUB_CONFIGS:
+        text = _read_text(reader, path)
+        if text:
+            found = _parse_grub_entry(text)
+            if found:
+                break
+    if not found:
+        for path in SYSLINUX_CONFIGS:
+            found = _parse_syslinux_entry(reader, path)
+            if found:
+                break
+
+    if found:
+        kernel, args, initrds = found
+        joined = ' '.join(args)
+        if 'boot=casper' in joined:
+            family, extra = 'casper', ['iso-scan/filename=$isofile']
+        elif 'boot=live' in joined:
+            family, extra = 'debian-live', ['findiso=$isofile']
+        elif 'archisobasedir' in joined:
+            family, extra = 'archiso', ['img_dev=/dev/disk/by-uuid/$isouuid', 'img_loop=$isofile']
+        elif 'root=live:' in joined:
+            family, extra = 'dracut', ['iso-scan/filename=$isofile']
+        else:
+            family, extra = 'generic', ['iso-scan/filename=$isofile', 'findiso=$isofile']
+        args = [arg for arg in args if not arg.startswith(('BOOT_IMAGE=', 'iso-scan/filename=', 'findiso='))]
+        # '---' 之后的参数只传给用户空间，定位ISO的参数要放在它前面
+        split = args.index('---') if '---' in args else len(args)
+        return {'method': 'linux', 'family': family, 'kernel': kernel, 'initrd': initrds,
+                'args': args[:split] + extra + args[split:]}
+
+    if reader.lookup(EFI_LOADER) is not None:
+        return {'method': 'chainload', 'family': 'efi', 'loader': EFI_LOADER}
+    return {'method': None, 'family': 'unknown'}
+
+
+def _grub_quote(text):
+    return "'" + text.replace("'", "'\\''") + "'"
+
+
+def _grub_arg(arg):
+    """含变量的内核参数加双引号，变量展开后即使含空格也仍是一个参数"""
+    return f'"{arg}"' if '$' in arg else arg
+
+
+def generate_grub_cfg(images, timeout=10, default=0, title=None):
+    """
+    生成多系统启动的GRUB菜单，每个ISO一个loopback菜单项
+    :param images: 清单中的镜像记录列表
+    :return: grub.cfg 文本
+    """
+    lines = [
+        '# 多系统启动菜单，由USB启动盘制作工具根据 /multiboot.json 生成',
+        f'set timeout={timeout}',
+        f'set default="{default}"',
+        'insmod part_gpt',
+        'insmod part_msdos',
+        'insmod fat',
+        'insmod exfat',
+        'insmod iso9660',
+        'insmod loopback',
+        f'search --no-floppy --set=isopart --file /{MANIFEST_NAME}',
+        'probe --set=isouuid --fs-uuid $isopart',
+        ''
+    ]
+    if title:
+        lines.insert(1, f'# {title}')
+
+    for image in images:
+        boot = image.get('boot') or {}
+        iso_file = '/' + image['file']
+        method = boot.get('method')
+        if not method:
+            lines += [f"# {image['name']}: 不支持loopback启动 ({boot.get('family', 'unknown')})", '']
+            continue
+
+        lines.append(f"menuentry {_grub_quote(image['name'])} {{")
+        lines.append(f"    set isofile={_grub_quote(iso_file)}")
+        lines.append('    loopback loop "($isopart)$isofile"')
+        if method == 'loopback_cfg':
+            lines += ['    set iso_path="$isofile"',
+                      '    export iso_path',
+                      '    set root=(loop)',
+                      f"    configfile {boot['config']}"]
+        elif method == 'linux':
+            lines.append(f"    linux (loop){boot['kernel']} {' '.join(_grub_arg(arg) for arg in boot['args'])}".rstrip())
+            if boot.get('initrd'):
+                lines.append('    initrd ' + ' '.join(f'(loop){path}' for path in boot['initrd']))
+        elif method == 'chainload':
+            lines.append(f"    chainloader (loop){boot['loader']}")
+        lines += ['}', '']
+    return '\n'.join(lines)
+
+
+def count_extents(path):
+    """
+    统计文件占用的物理区段数（Linux FIEMAP），1表示连续存放
+    :return: 区段数，无法获取时返回None
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        import fcntl
+        request = bytearray(struct.pack('=QQLLLL', 0, 0xFFFFFFFFFFFFFFFF, 0, 0, 0, 0))
+        with open(path, 'rb') as f:
+            fcntl.ioctl(f.fileno(), FS_IOC_FIEMAP, request)
+        return struct.unpack_from('=L', request, 20)[0]
+    except (OSError, ImportError):
+        return None
+
+
+class MultiBootVolume:
+    """
+    已挂载的多系统启动数据分区
+    ISO按完整大小预分配后再写入，文件系统会尽量给出连续的簇链；
+    添加或替换单个ISO时不会改动其他镜像
+    """
+
+    def __init__(self, data_dir, boot_dir=None):
+        """
+        :param data_dir: ISO数据分区的挂载目录
+        :param boot_dir: 引导分区的挂载目录，GRUB菜单写到这里；None时写到数据分区
+        """
+        self.data_dir = data_dir
+        self.boot_dir = boot_dir or data_dir
+        self.manifest_path = os.path.join(data_dir, MANIFEST_NAME)
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'version': 1, 'timeout': 10, 'default': 0, 'images': []}
+
+    def _save_manifest(self):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def images(self):
+        return list(self.manifest['images'])
+
+    def find(self, name):
+        for image in self.manifest['images']:
+            if image['name'] == name:
+                return image
+        return None
+
+    def _unique_file(self, name):
+        """
+        为镜像选择数据分区上的文件路径，不与其他镜像的文件重名
+        FAT/exFAT 不区分大小写，"a b" 和 "A_B" 这类名称也会映射到同一个文件，重名时加序号
+        :return: 相对数据分区的路径
+        """
+        # 空白也替换掉：initramfs 按空格切分内核参数，文件名中的空格会截断 iso-scan/filename= 等参数
+        stem = re.sub(r'[\\/:*?"<>|\s]', '_', name)
+        if stem.lower().endswith('.iso'):
+            stem = stem[:-4]
+        taken = {image['file'].casefold() for image in self.manifest['images'] if image['name'] != name}
+        rel_path = posixpath.join(IMAGES_DIR, stem + '.iso')
+        number = 2
+        while rel_path.casefold() in taken:
+            rel_path = posixpath.join(IMAGES_DIR, f"{stem}_{number}.iso")
+            number += 1
+        return rel_path
+
+    def _preallocate(self, path, size):
+        """预分配文件空间；已有文件足够大时原地覆盖，保留原来的簇"""
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                if hasattr(os, 'posix_fallocate'):
+                    try:
+                        os.posix_fallocate(fd, 0, size)
+                    except OSError as e:
+                        # 部分文件系统不支持fallocate，退化为直接扩展文件
+                        logger.debug(f"posix_fallocate 失败: {e}")
+                        os.ftruncate(fd, size)
+                else:
+                    os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+
+    def add_iso(self, source, size, name, progress_callback=None, cancel_check=None):
+        """
+        添加或替换一个ISO
+        :param source: 可读的二进制文件对象（ISO文件或 library:// 镜像）
+        :param size: 镜像字节数
+        :param name: 菜单中显示的名称，同名时替换
+        :param progress_callback: 进度回调 callback(已写入字节, 总字节)
+        :param cancel_check: 返回True时取消
+        :return: 镜像记录
+        """
+        existing = self.find(name)
+        rel_path = self._unique_file(name)
+        target = os.path.join(self.data_dir, *rel_path.split('/'))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        # 新镜像放不进原文件时删除重建，让文件系统重新分配连续空间
+        if os.path.exists(target) and os.path.getsize(target) < size:
+            os.remove(target)
+        self._preallocate(target, size)
+
+        written = 0
+        source.seek(0)
+        with open(target, 'r+b') as dst:
+            while written < size:
+                if cancel_check and cancel_check():
+                    raise InterruptedError("写入已取消")
+                data = source.read(min(COPY_BUFFER_SIZE, size - written))
+                if not data:
+                    raise IOError("源镜像提前结束")
+                dst.write(data)
+                written += len(data)
+                if progress_callback:
+                    progress_callback(written, size)
+            dst.truncate(size)
+            dst.flush()
+            os.fsync(dst.fileno())
+
+        source.seek(0)
+        reader = ISOReader(source)
+        image = {
+            'name': name,
+            'file': rel_path,
+            'size': size,
+            'volume_id': reader.volume_id,
+            'boot': detect_loopback_boot(reader),
+            'extents': count_extents(target),
+            'added': time.strftime('%Y-%m-%d %H:%M:%S')
+        }
+        if existing is not None:
+            self.manifest['images'][self.manifest['images'].index(existing)] = image
+            if existing['file'].casefold() != rel_path.casefold():
+                self._remove_file(existing['file'])
+        else:
+            self.manifest['images'].append(image)
+
+        self._save_manifest()
+        self.write_menu()
+        if image['extents'] and image['extents'] > 1:
+            logger.warning(f"{name} 在数据分区上不连续（{image['extents']} 个区段）")
+        return image
+
+    def _remove_file(self, rel_path):
+        try:
+            os.remove(os.path.join(self.data_dir, *rel_path.split('/')))
+        except FileNotFoundError:
+            pass
+
+    def remove_iso(self, name):
+        """删除一个ISO及其菜单项"""
+        image = self.find(name)
+        if image is None:
+            raise ValueError(f"镜像不存在: {name}")
+        self.manifest['images'].remove(image)
+        self._remove_file(image['file'])
+        self._save_manifest()
+        self.write_menu()
+
+    def set_menu_options(self, timeout=None, default=None):
+        if timeout is not None:
+            self.manifest['timeout'] = timeout
+        if default is not None:
+            self.manifest['default'] = default
+        self._save_manifest()
+        self.write_menu()
+
+    def write_menu(self):
+        """重新生成GRUB菜单"""
+        content = generate_grub_cfg(self.manifest['images'], self.manifest.get('timeout', 10),
+                                    self.manifest.get('default', 0))
+        path = os.path.join(self.boot_dir, GRUB_CFG_PATH)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return path
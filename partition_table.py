@@ -0,0 +1,294 @@
+import os
+import re
+import stat
+import struct
+import zlib
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+SECTOR_SIZE = 512
+# 分区起点按1MB对齐，兼顾闪存擦除块和4K扇区
+DEFAULT_ALIGNMENT = 1024 * 1024
+
+GPT_ENTRY_COUNT = 128
+GPT_ENTRY_SIZE = 128
+GPT_ENTRIES_SECTORS = GPT_ENTRY_COUNT * GPT_ENTRY_SIZE // SECTOR_SIZE
+
+GPT_TYPE_BASIC_DATA = uuid.UUID('ebd0a0a2-b9e5-4433-87c0-68b6b72699c7')
+GPT_TYPE_EFI_SYSTEM = uuid.UUID('c12a7328-f81f-11d2-ba4b-00a0c93ec93b')
+GPT_TYPE_LINUX_FS = uuid.UUID('0fc63daf-8483-4772-8e79-3d69d8477de4')
+
+# 分区用途/文件系统 -> (GPT类型, MBR类型)
+PARTITION_TYPES = {
+    'efi': (GPT_TYPE_EFI_SYSTEM, 0xEF),
+    'fat32': (GPT_TYPE_BASIC_DATA, 0x0C),
+    'ntfs': (GPT_TYPE_BASIC_DATA, 0x07),
+    'exfat': (GPT_TYPE_BASIC_DATA, 0x07),
+    'ext4': (GPT_TYPE_LINUX_FS, 0x83),
+}
+
+# 标准MBR的CHS几何参数
+DEFAULT_HEADS = 255
+DEFAULT_SECTORS = 63
+
+SIZE_UNITS = {'': 1, 'B': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(size, available):
+    """
+    解析分区大小
+    :param size: 字节数，或 '500M'、'1G'、'50%'，None/''/'*' 表示剩余全部空间
+    :param available: 剩余可用字节数
+    :return: 字节数
+    """
+    if size is None or (isinstance(size, str) and size.strip() in ('', '*', 'rest')):
+        return available
+    if isinstance(size, int):
+        return size
+    text = size.strip().upper()
+    if text.endswith('%'):
+        return int(available * float(text[:-1]) / 100)
+    match = re.fullmatch(r'([\d.]+)\s*([KMGT]?)I?B?', text)
+    if not match:
+        raise ValueError(f"无法解析分区大小: {size}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def lba_to_chs(lba, heads=DEFAULT_HEADS, sectors=DEFAULT_SECTORS):
+    """把LBA转换为MBR分区项中的CHS三字节，超出范围时取最大值"""
+    cylinder = lba // (heads * sectors)
+    head = (lba // sectors) % heads
+    sector = lba % sectors + 1
+    if cylinder >= 1024:
+        cylinder, head, sector = 1023, heads - 1, sectors
+    return bytes([head, (sector & 0x3f) | ((cylinder >> 2) & 0xc0), cylinder & 0xff])
+
+
+def mbr_entry(boot_flag, part_type, start_lba, sector_count, heads=DEFAULT_HEADS, sectors=DEFAULT_SECTORS):
+    """构造一个16字节的MBR分区项"""
+    if sector_count <= 0:
+        return bytes(16)
+    return (bytes([boot_flag]) + lba_to_chs(start_lba, heads, sectors) + bytes([part_type]) +
+            lba_to_chs(start_lba + sector_count - 1, heads, sectors) +
+            struct.pack('<II', start_lba, min(sector_count, 0xffffffff)))
+
+
+def gpt_entry(type_guid, start_lba, end_lba, name, unique_guid=None, attributes=0):
+    """构造一个128字节的GPT分区项"""
+    return (type_guid.bytes_le + (unique_guid or uuid.uuid4()).bytes_le +
+            struct.pack('<QQQ', start_lba, end_lba, attributes) +
+            name.encode('utf-16-le')[:72].ljust(72, b'\x00'))
+
+
+def gpt_header(current_lba, backup_lba, first_usable, last_usable, disk_guid, entries_lba, entries_crc):
+    """构造一个扇区大小的GPT头，含CRC32"""
+    header = bytearray(struct.pack(
+        '<8sIIIIQQQQ16sQIII',
+        b'EFI PART', 0x00010000, 92, 0, 0,
+        current_lba, backup_lba, first_usable, last_usable,
+        disk_guid.bytes_le, entries_lba, GPT_ENTRY_COUNT, GPT_ENTRY_SIZE, entries_crc
+    ))
+    struct.pack_into('<I', header, 16, zlib.crc32(header) & 0xffffffff)
+    return bytes(header).ljust(SECTOR_SIZE, b'\x00')
+
+
+def target_size(target):
+    """获取镜像文件或块设备的字节数"""
+    st = os.stat(target)
+    if stat.S_ISREG(st.st_mode):
+        return st.st_size
+    fd = os.open(target, os.O_RDONLY)
+    try:
+        return os.lseek(fd, 0, os.SEEK_END)
+    finally:
+        os.close(fd)
+
+
+def compute_layout(disk_size, table_type='gpt', partitions=None, alignment=DEFAULT_ALIGNMENT):
+    """
+    根据分区描述计算对齐后的分区布局
+    :param disk_size: 磁盘字节数
+    :param table_type: gpt/mbr
+    :param partitions: [{'size': '1G', 'type': 'efi', 'format': 'fat32', 'name': ...}, ...]
+    :param alignment: 分区起点对齐字节数
+    :return: 分区布局列表，每项包含 index/start_lba/end_lba/sectors/size 等
+    """
+    table_type = table_type.lower()
+    if table_type not in ('gpt', 'mbr'):
+        raise ValueError(f"不支持的分区表类型: {table_type}")
+    partitions = partitions or []
+    if table_type == 'mbr' and len(partitions) > 4:
+        raise ValueError("MBR分区表最多支持4个主分区")
+
+    total_sectors = disk_size // SECTOR_SIZE
+    align = max(alignment // SECTOR_SIZE, 1)
+    if table_type == 'gpt':
+        last_usable = total_sectors - GPT_ENTRIES_SECTORS - 2
+    else:
+        last_usable = min(total_sectors - 1, 0xffffffff)
+
+    layout = []
+    next_lba = align
+    for index, part in enumerate(partitions, 1):
+        start = (next_lba + align - 1) // align * align
+        available = (last_usable + 1 - start) * SECTOR_SIZE
+        if available <= 0:
+            raise ValueError(f"分区 {index} 超出磁盘容量")
+        size = parse_size(part.get('size'), available)
+        sectors = min(size // SECTOR_SIZE, last_usable + 1 - start)
+        # 非最后一个分区的末尾对齐到下一个对齐边界之前
+        if index < len(partitions) and sectors >= align:
+            sectors = sectors // align * align
+        if sectors <= 0:
+            raise ValueError(f"分区 {index} 大小无效")
+
+        fs = (part.get('format') or 'fat32').lower()
+        kind = 'efi' if part.get('type') == 'efi' else fs
+        gpt_type, mbr_type = PARTITION_TYPES.get(kind, PARTITION_TYPES['fat32'])
+        layout.append({
+            'index': index,
+            'start_lba': start,
+            'end_lba': start + sectors - 1,
+            'sectors': sectors,
+            'offset': start * SECTOR_SIZE,
+            'size': sectors * SECTOR_SIZE,
+            'type': part.get('type', 'data'),
+            'format': fs,
+            'name': part.get('name') or ('EFI System' if kind == 'efi' else f'Partition{index}'),
+            'gpt_type': str(gpt_type),
+            'mbr_type': mbr_type
+        })
+        next_lba = start + sectors
+    return layout
+
+
+def build_tables(disk_size, table_type, layout, disk_guid=None):
+    """
+    生成分区表的全部写入内容
+    :return: [(offset, data), ...]，GPT时包含首部和末尾两处
+    """
+    total_sectors = disk_size // SECTOR_SIZE
+    mbr = bytearray(SECTOR_SIZE)
+    struct.pack_into('<I', mbr, 440, struct.unpack('<I', os.urandom(4))[0])
+    mbr[510:512] = b'\x55\xaa'
+
+    if table_type == 'mbr':
+        for i, part in enumerate(layout):
+            boot_flag = 0x80 if part['type'] == 'efi' or i == 0 else 0x00
+            mbr[446 + i * 16:462 + i * 16] = mbr_entry(boot_flag, part['mbr_type'], part['start_lba'], part['sectors'])
+        # 清除可能残留的备份GPT，避免被误识别
+        return [(0, bytes(mbr) + bytes(GPT_ENTRIES_SECTORS * SECTOR_SIZE + SECTOR_SIZE)),
+                ((total_sectors - GPT_ENTRIES_SECTORS - 1) * SECTOR_SIZE,
+                 bytes((GPT_ENTRIES_SECTORS + 1) * SECTOR_SIZE))]
+
+    # 保护性MBR
+    mbr[446:462] = mbr_entry(0x00, 0xEE, 1, min(total_sectors - 1, 0xffffffff))
+
+    last_lba = total_sectors - 1
+    entries = bytearray(GPT_ENTRY_COUNT * GPT_ENTRY_SIZE)
+    for i, part in enumerate(layout):
+        entries[i * GPT_ENTRY_SIZE:(i + 1) * GPT_ENTRY_SIZE] = gpt_entry(
+            uuid.UUID(part['gpt_type']), part['start_lba'], part['end_lba'], part['name'])
+    entries_crc = zlib.crc32(entries) & 0xffffffff
+    disk_guid = disk_guid or uuid.uuid4()
+    first_usable = 2 + GPT_ENTRIES_SECTORS
+    last_usable = last_lba - GPT_ENTRIES_SECTORS - 1
+
+    primary = gpt_header(1, last_lba, first_usable, last_usable, disk_guid, 2, entries_crc)
+    backup = gpt_header(last_lba, 1, first_usable, last_usable, disk_guid,
+                        last_lba - GPT_ENTRIES_SECTORS, entries_crc)
+    return [(0, bytes(mbr) + primary + bytes(entries)),
+            ((last_lba - GPT_ENTRIES_SECTORS) * SECTOR_SIZE, bytes(entries) + backup)]
+
+
+def write_partition_table(target, table_type='gpt', partitions=None, dry_run=False,
+                          alignment=DEFAULT_ALIGNMENT):
+    """
+    直接在设备或镜像文件上写入分区表
+    :param target: 块设备或镜像文件路径
+    :param table_type: gpt/mbr
+    :param partitions: 分区描述列表
+    :param dry_run: 只计算布局，不写入
+    :param alignment: 分区起点对齐字节数
+    :return: 分区布局列表
+    """
+    disk_size = target_size(target)
+    table_type = table_type.lower()
+    layout = compute_layout(disk_size, table_type, partitions, alignment)
+    if dry_run:
+        return layout
+
+    writes = build_tables(disk_size, table_type, layout)
+    fd = os.open(target, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+    try:
+        for offset, data in writes:
+            os.lseek(fd, offset, os.SEEK_SET)
+            os.write(fd, data)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return layout
+
+
+def read_partition_table(target):
+    """
+    读取设备或镜像文件上的分区表
+    :return: {'type': 'gpt'/'mbr'/None, 'partitions': [{'index', 'start_lba', 'sectors', ...}]}
+    """
+    with open(target, 'rb') as f:
+        head = f.read(SECTOR_SIZE * (2 + GPT_ENTRIES_SECTORS))
+    if len(head) < SECTOR_SIZE or head[510:512] != b'\x55\xaa':
+        return {'type': None, 'partitions': []}
+
+    mbr_parts = []
+    for i in range(4):
+        entry = head[446 + i * 16:462 + i * 16]
+        part_type = entry[4]
+        start, count = struct.unpack_from('<II', entry, 8)
+        if part_type and count:
+            mbr_parts.append({'index': i + 1, 'start_lba': start, 'sectors': count,
+                              'end_lba': start + count - 1, 'mbr_type': part_type,
+                              'bootable': entry[0] == 0x80})
+
+    header = head[SECTOR_SIZE:SECTOR_SIZE + 92]
+    if (any(p['mbr_type'] == 0xEE for p in mbr_parts) and header[:8] == b'EFI PART'):
+        check = bytearray(header)
+        crc = struct.unpack_from('<I', check, 16)[0]
+        struct.pack_into('<I', check, 16, 0)
+        if zlib.crc32(check) & 0xffffffff != crc:
+            raise ValueError("GPT头CRC校验失败")
+        entries_lba, count, entry_size = struct.unpack_from('<QII', header, 72)
+        with open(target, 'rb') as f:
+            f.seek(entries_lba * SECTOR_SIZE)
+            entries = f.read(count * entry_size)
+        parts = []
+        for i in range(count):
+            entry = entries[i * entry_size:(i + 1) * entry_size]
+            if not any(entry[:16]):
+                continue
+            start, end = struct.unpack_from('<QQ', entry, 32)
+            parts.append({
+                'index': i + 1,
+                'start_lba': start,
+                'end_lba': end,
+                'sectors': end - start + 1,
+                'gpt_type': str(uuid.UUID(bytes_le=bytes(entry[:16]))),
+                'name': entry[56:128].decode('utf-16-le', 'replace').rstrip('\x00')
+            })
+        return {'type': 'gpt', 'partitions': parts, 'mbr_partitions': mbr_parts}
+
+    return {'type': 'mbr', 'partitions': mbr_parts}
+
+
+def partition_device_path(device, index):
+    """
+    根据磁盘设备路径推算分区设备路径
+    /dev/disk4 -> /dev/disk4s1, /dev/sdb -> /dev/sdb1, /dev/nvme0n1 -> /dev/nvme0n1p1
+    """
+    if re.match(r'^/dev/r?disk\d+$', device):
+        return f"{device}s{index}"
+    if device[-1:].isdigit():
+        return f"{device}p{index}"
+    return f"{device}{index}"
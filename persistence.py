@@ -0,0 +1,231 @@
+import os
+import shutil
+import struct
+import zlib
+import tempfile
+import subprocess
+import logging
+
+import fs_format
+from partition_table import (mbr_entry, gpt_entry, target_size, parse_size,
+                             SECTOR_SIZE, DEFAULT_ALIGNMENT, PARTITION_TYPES)
+from iso_hybrid import HYBRID_HEADS, HYBRID_SECTORS
+
+logger = logging.getLogger(__name__)
+
+# 各发行版识别持久化分区所用的卷标
+LABEL_CASPER = 'casper-rw'
+LABEL_DEBIAN_LIVE = 'persistence'
+# Debian live 需要分区根目录中的 persistence.conf
+DEBIAN_PERSISTENCE_CONF = '/ union\n'
+
+# 启用持久化分区的内核参数：Ubuntu（casper）为 persistent，Debian live 为 persistence
+KERNEL_ARG_CASPER = 'persistent'
+KERNEL_ARG_DEBIAN_LIVE = 'persistence'
+
+MBR_TABLE_OFFSET = 446
+MBR_TYPE_PROTECTIVE = 0xEE
+
+
+def persistence_label(family):
+    """根据 multiboot.detect_loopback_boot 识别的发行版系列选择卷标"""
+    return LABEL_DEBIAN_LIVE if family == 'debian-live' else LABEL_CASPER
+
+
+def persistence_kernel_arg(label):
+    """根据持久化分区的卷标选择需要加到内核参数中的开关"""
+    return KERNEL_ARG_DEBIAN_LIVE if label == LABEL_DEBIAN_LIVE else KERNEL_ARG_CASPER
+
+
+def _read_gpt(f):
+    """读取主GPT头和分区项，不存在或CRC不符时返回None"""
+    f.seek(SECTOR_SIZE)
+    header = bytearray(f.read(SECTOR_SIZE))
+    if header[:8] != b'EFI PART':
+        return None
+    header_size = struct.unpack_from('<I', header, 12)[0]
+    check = bytearray(header[:header_size])
+    struct.pack_into('<I', check, 16, 0)
+    if zlib.crc32(check) & 0xffffffff != struct.unpack_from('<I', header, 16)[0]:
+        return None
+    entries_lba, count, entry_size = struct.unpack_from('<QII', header, 72)
+    f.seek(entries_lba * SECTOR_SIZE)
+    entries = bytearray(f.read(count * entry_size))
+    return header, entries, entries_lba, count, entry_size
+
+
+def _finish_gpt_header(header, current_lba, backup_lba, entries_lba, last_usable, entries_crc):
+    header = bytearray(header)
+    header_size = struct.unpack_from('<I', header, 12)[0]
+    struct.pack_into('<QQ', header, 24, current_lba, backup_lba)
+    struct.pack_into('<Q', header, 48, last_usable)
+    struct.pack_into('<Q', header, 72, entries_lba)
+    struct.pack_into('<I', header, 88, entries_crc)
+    struct.pack_into('<I', header, 16, 0)
+    struct.pack_into('<I', header, 16, zlib.crc32(header[:header_size]) & 0xffffffff)
+    return bytes(header)
+
+
+def plan_persistence(device, image_size, size=None, filesystem='ext4', alignment=DEFAULT_ALIGNMENT):
+    """
+    计算在镜像之后追加持久化分区需要修改的分区表
+    :param device: 已写入混合镜像的设备或镜像文件
+    :param image_size: 镜像字节数
+    :param size: 分区大小，None表示剩余全部空间
+    :param filesystem: ext4/fat32
+    :param alignment: 分区起点对齐字节数
+    :return: (writes, 分区信息字典)
+    """
+    disk_size = target_size(device)
+    total_sectors = disk_size // SECTOR_SIZE
+    gpt_type, mbr_type = PARTITION_TYPES[filesystem]
+
+    with open(device, 'rb') as f:
+        mbr = bytearray(f.read(SECTOR_SIZE))
+        if mbr[510:512] != b'\x55\xaa':
+            raise ValueError("设备上没有MBR，不是混合镜像")
+        gpt = _read_gpt(f)
+
+    # 新分区从镜像和现有分区之后的第一个对齐位置开始
+    used_end = -(-image_size // SECTOR_SIZE)
+    mbr_parts = []
+    for i in range(4):
+        entry = mbr[MBR_TABLE_OFFSET + i * 16:MBR_TABLE_OFFSET + (i + 1) * 16]
+        start, count = struct.unpack_from('<II', entry, 8)
+        mbr_parts.append((entry[4], start, count))
+        if entry[4] and entry[4] != MBR_TYPE_PROTECTIVE:
+            used_end = max(used_end, start + count)
+    if gpt:
+        _, entries, _, count, entry_size = gpt
+        for i in range(count):
+            entry = entries[i * entry_size:(i + 1) * entry_size]
+            if any(entry[:16]):
+                used_end = max(used_end, struct.unpack_from('<Q', entry, 40)[0] + 1)
+
+    align = max(alignment // SECTOR_SIZE, 1)
+    start = -(-used_end // align) * align
+    # GPT时末尾留给备份GPT
+    reserved_tail = 0
+    if gpt:
+        reserved_tail = -(-gpt[3] * gpt[4] // SECTOR_SIZE) + 1
+    last_usable = total_sectors - 1 - reserved_tail
+    available = (last_usable + 1 - start) * SECTOR_SIZE
+    if available <= 0:
+        raise ValueError("镜像之后没有可用空间")
+    sectors = min(parse_size(size, available), available) // SECTOR_SIZE
+    if sectors * SECTOR_SIZE < 64 * 1024 * 1024:
+        raise ValueError("镜像之后的可用空间不足以创建持久化分区")
+
+    writes = []
+    protective_only = all(t in (0, MBR_TYPE_PROTECTIVE) for t, _, _ in mbr_parts)
+    tables = []
+
+    if protective_only:
+        # 纯保护性MBR：只扩展0xEE分区项以覆盖整个设备
+        for i, (part_type, part_start, _) in enumerate(mbr_parts):
+            if part_type == MBR_TYPE_PROTECTIVE:
+                mbr[MBR_TABLE_OFFSET + i * 16:MBR_TABLE_OFFSET + (i + 1) * 16] = mbr_entry(
+                    0x00, MBR_TYPE_PROTECTIVE, part_start, min(total_sectors - part_start, 0xffffffff),
+                    HYBRID_HEADS, HYBRID_SECTORS)
+    else:
+        free = [i for i, (part_type, _, _) in enumerate(mbr_parts) if part_type == 0]
+        if not free:
+            raise ValueError("MBR分区表已满，无法添加持久化分区")
+        if start + sectors > 0xffffffff:
+            sectors = 0xffffffff - start
+        i = free[0]
+        mbr[MBR_TABLE_OFFSET + i * 16:MBR_TABLE_OFFSET + (i + 1) * 16] = mbr_entry(
+            0x00, mbr_type, start, sectors, HYBRID_HEADS, HYBRID_SECTORS)
+        tables.append('mbr')
+    writes.append((0, bytes(mbr)))
+
+    if gpt:
+        header, entries, entries_lba, count, entry_size = gpt
+        index = next((i for i in range(count) if not any(entries[i * entry_size:i * entry_size + 16])), None)
+        if index is None:
+            raise ValueError("GPT分区项已满，无法添加持久化分区")
+        entries[index * entry_size:index * entry_size + 128] = gpt_entry(
+            gpt_type, start, start + sectors - 1, 'persistence')
+        entries_crc = zlib.crc32(entries) & 0xffffffff
+        last_lba = total_sectors - 1
+        backup_entries_lba = last_lba - (reserved_tail - 1)
+        # 原备份GPT位于镜像末尾，属于镜像内容，保持不动；新的备份写到设备末尾
+        primary = _finish_gpt_header(header, 1, last_lba, entries_lba, last_usable, entries_crc)
+        backup = _finish_gpt_header(header, last_lba, 1, backup_entries_lba, last_usable, entries_crc)
+        writes.append((SECTOR_SIZE, primary))
+        writes.append((entries_lba * SECTOR_SIZE, bytes(entries)))
+        writes.append((backup_entries_lba * SECTOR_SIZE, bytes(entries) + backup))
+        tables.append('gpt')
+
+    if not tables:
+        raise ValueError("无法识别设备上的分区表")
+
+    return writes, {
+        'start_lba': start,
+        'sectors': sectors,
+        'offset': start * SECTOR_SIZE,
+        'size': sectors * SECTOR_SIZE,
+        'filesystem': filesystem,
+        'tables': tables
+    }
+
+
+def format_ext4(device, offset, size, label, files=None):
+    """
+    用 mke2fs 在设备的指定偏移处创建ext4：inode表和日志延迟初始化，只写入元数据
+    :param files: 写入文件系统根目录的文件 {名称: 内容}
+    """
+    mke2fs = shutil.which('mke2fs') or shutil.which('mkfs.ext4')
+    if not mke2fs:
+        raise ValueError("未找到 mke2fs，请安装 e2fsprogs 或改用FAT32持久化分区")
+    with tempfile.TemporaryDirectory() as root:
+        for name, content in (files or {}).items():
+            with open(os.path.join(root, name), 'w') as f:
+                f.write(content)
+        command = [mke2fs, '-q', '-F', '-t', 'ext4', '-L', label,
+                   '-E', f'offset={offset},lazy_itable_init=1,lazy_journal_init=1,nodiscard']
+        if files:
+            command += ['-d', root]
+        # 指定文件系统大小（KB），避免越过分区末尾
+        subprocess.run(command + [device, f'{size // 1024}k'], check=True,
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def add_persistence_partition(device, image_size, size=None, filesystem='ext4', label=LABEL_CASPER,
+                              dry_run=False):
+    """
+    在已写入的混合镜像之后追加持久化分区，不重写镜像
+    先在空闲区域创建文件系统，最后才修改分区表，中途失败时U盘仍保持原样可启动
+    :param device: 设备或镜像文件路径
+    :param image_size: 已写入镜像的字节数
+    :param size: 分区大小，None表示剩余全部空间
+    :param filesystem: ext4/fat32
+    :param label: 卷标，Ubuntu为 casper-rw，Debian live为 persistence
+    :param dry_run: 只计算分区位置
+    :return: 分区信息字典
+    """
+    filesystem = filesystem.lower()
+    if filesystem not in ('ext4', 'fat32'):
+        raise ValueError(f"不支持的持久化分区文件系统: {filesystem}")
+    writes, part = plan_persistence(device, image_size, size, filesystem)
+    part['label'] = label
+    if dry_run:
+        return part
+
+    if filesystem == 'fat32':
+        fs_format.format_volume(device, 'fat32', offset=part['offset'], size=part['size'], label=label)
+    else:
+        files = {'persistence.conf': DEBIAN_PERSISTENCE_CONF} if label == LABEL_DEBIAN_LIVE else None
+        format_ext4(device, part['offset'], part['size'], label, files)
+
+    fd = os.open(device, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+    try:
+        for offset, data in writes:
+            os.lseek(fd, offset, os.SEEK_SET)
+            os.write(fd, data)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    logger.info(f"已在 {device} 上追加持久化分区: {part}")
+    return part
@@ -0,0 +1,488 @@
+import os
+import re
+import sys
+import json
+import mmap
+import stat
+import time
+import errno
+import struct
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+import logging
+
+import block_device
+
+logger = logging.getLogger(__name__)
+
+KiB = 1024
+MiB = 1024 * KiB
+
+# 测试区域：顺序测试在其中连续读写，随机测试在其中随机选取4K偏移
+DEFAULT_AREA_SIZE = 64 * MiB
+# 每项测试的时间上限（秒），达到上限即停止，不必走完整个区域
+DEFAULT_DURATION = 3.0
+PERCENTILES = (50, 90, 99, 99.9)
+# macOS 的 F_NOCACHE
+F_NOCACHE = 48
+# 测试区域放在设备中部并按1MB对齐，避开分区表和文件系统元数据
+AREA_ALIGNMENT = MiB
+JOURNAL_MAGIC = b'ZTBENCH1'
+
+SEQUENTIAL = 'seq'
+RANDOM = 'rand'
+READ = 'read'
+WRITE = 'write'
+
+
+class BenchTest:
+    """一项测试：访问模式、读/写、块大小、队列深度"""
+    __slots__ = ('pattern', 'operation', 'block_size', 'queue_depth')
+
+    def __init__(self, pattern, operation, block_size, queue_depth=1):
+        """
+        :param pattern: SEQUENTIAL 或 RANDOM
+        :param operation: READ 或 WRITE
+        :param queue_depth: 同时进行的I/O数（用线程模拟）
+        """
+        self.pattern = pattern
+        self.operation = operation
+        self.block_size = block_size
+        self.queue_depth = queue_depth
+
+    def __repr__(self):
+        return f"BenchTest({self.label!r})"
+
+    @property
+    def label(self):
+        return f"{self.pattern}-{self.operation} {format_size(self.block_size)} QD{self.queue_depth}"
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+DEFAULT_TESTS = (
+    BenchTest(SEQUENTIAL, READ, MiB),
+    BenchTest(SEQUENTIAL, WRITE, MiB),
+    BenchTest(RANDOM, READ, 4 * KiB),
+    BenchTest(RANDOM, READ, 4 * KiB, 32),
+    BenchTest(RANDOM, WRITE, 4 * KiB),
+    BenchTest(RANDOM, WRITE, 4 * KiB, 32),
+)
+
+
+def percentile(values, pct):
+    """最近秩百分位数，values 须已排序"""
+    if not values:
+        return 0.0
+    rank = max(1, -(-len(values) * pct // 100))
+    return values[min(len(values), int(rank)) - 1]
+
+
+class BenchResult:
+    """一项测试的结果，延迟单位为秒"""
+    __slots__ = ('test', 'ops', 'bytes', 'elapsed', 'latencies')
+
+    def __init__(self, test, ops=0, bytes=0, elapsed=0.0, latencies=()):
+        self.test = test
+        self.ops = ops
+        self.bytes = bytes
+        self.elapsed = elapsed
+        self.latencies = sorted(latencies)
+
+    @property
+    def throughput(self):
+        """字节/秒"""
+        return self.bytes / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def iops(self):
+        return self.ops / self.elapsed if self.elapsed > 0 else 0.0
+
+    def percentiles(self):
+        """{'p50': 秒, ..., 'max': 秒}"""
+        result = {f'p{pct:g}': percentile(self.latencies, pct) for pct in PERCENTILES}
+        result['max'] = self.latencies[-1] if self.latencies else 0.0
+        return result
+
+    def to_dict(self):
+        return dict(self.test.to_dict(), label=self.test.label, ops=self.ops, bytes=self.bytes,
+                    elapsed=self.elapsed, throughput=self.throughput, iops=self.iops,
+                    latency=self.percentiles())
+
+
+def format_size(size):
+    for unit in ('B', 'K', 'M', 'G'):
+        if size < 1024 or unit == 'G':
+            break
+        size /= 1024
+    return f"{int(size)}{unit}" if size == int(size) else f"{size:.1f}{unit}"
+
+
+def parse_size(text):
+    """
+    解析 4K、1M、512 这样的大小
+    :return: 字节数
+    """
+    match = re.fullmatch(r'\s*(\d+)\s*([KMG]?)i?B?\s*', str(text), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"无效的大小: {text}")
+    return int(match.group(1)) * {'': 1, 'K': KiB, 'M': MiB, 'G': 1024 * MiB}[match.group(2).upper()]
+
+
+def aligned_buffer(size):
+    """匿名 mmap 按页对齐，满足 O_DIRECT 的缓冲区对齐要求"""
+    return mmap.mmap(-1, size)
+
+
+def open_direct(path, writable, direct):
+    """
+    打开设备或文件，尽量绕过页缓存
+    :return: (fd, 是否为直接I/O)
+    """
+    flags = os.O_RDWR if writable else os.O_RDONLY
+    if direct and hasattr(os, 'O_DIRECT'):
+        try:
+            return os.open(path, flags | os.O_DIRECT), True
+        except OSError as e:
+            # tmpfs 等文件系统不支持 O_DIRECT
+            if e.errno != errno.EINVAL:
+                raise
+            logger.info(f"{path} 不支持直接I/O，改用普通I/O加fsync")
+    fd = os.open(path, flags)
+    if direct and sys.platform == 'darwin':
+        import fcntl
+        try:
+            fcntl.fcntl(fd, F_NOCACHE, 1)
+            return fd, True
+        except OSError:
+            pass
+    return fd, False
+
+
+def pread_into(fd, buf, offset):
+    """读入已对齐的缓冲区；没有 preadv 的平台退回 pread 再复制"""
+    if hasattr(os, 'preadv'):
+        return os.preadv(fd, [buf], offset)
+    data = os.pread(fd, len(buf), offset)
+    buf[:len(data)] = data
+    return len(data)
+
+
+class StorageBenchmark:
+    """
+    设备/镜像文件读写性能测试
+    默认不破坏数据：写测试前先读出测试区域，全部测试结束后写回并校验
+    """
+
+    def __init__(self, path, area_size=DEFAULT_AREA_SIZE, offset=None, duration=DEFAULT_DURATION,
+                 destructive=False, direct=True, journal=None, cancel_check=None, seed=None):
+        """
+        :param path: 设备或镜像文件
+        :param area_size: 测试区域大小（字节）
+        :param offset: 测试区域起始偏移，None时放在设备中部
+        :param duration: 每项测试的时间上限（秒）
+        :param destructive: True时不保存/恢复测试区域（空白设备或临时文件）
+        :param direct: 是否使用直接I/O
+        :param journal: 保存测试区域原始数据的文件，中途断电后可用 restore_journal 恢复
+        :param cancel_check: 返回True时尽快结束当前测试
+        """
+        self.path = path
+        self.duration = duration
+        self.destructive = destructive
+        self.direct = direct
+        self.journal = journal
+        self.cancel_check = cancel_check or (lambda: False)
+        self._random = random.Random(seed)
+
+        info = block_device.probe(path)
+        self.alignment = max(info.alignment, 4 * KiB)
+        if info.size < self.alignment:
+            raise ValueError(f"{path} 容量太小，无法测试")
+        area_size = min(area_size, info.size) // self.alignment * self.alignment
+        if offset is None:
+            offset = (info.size - area_size) // 2 // AREA_ALIGNMENT * AREA_ALIGNMENT
+        if offset % self.alignment or offset + area_size > info.size:
+            raise ValueError(f"测试区域 {offset}+{area_size} 超出设备范围或未对齐")
+        self.size = info.size
+        self.offset = offset
+        self.area_size = area_size
+        self.direct_io = None
+        self._saved = None
+
+    # ---- 保存/恢复 ----
+
+    def _save_area(self, fd):
+        buf = aligned_buffer(self.area_size)
+        if pread_into(fd, buf, self.offset) != self.area_size:
+            raise IOError(f"读取测试区域失败: {self.path}")
+        self._saved = buf
+        if self.journal:
+            write_journal(self.journal, self.path, self.offset, buf)
+
+    def _restore_area(self, fd):
+        if self._saved is None:
+            return
+        written = os.pwrite(fd, self._saved, self.offset)
+        os.fsync(fd)
+        check = aligned_buffer(self.area_size)
+        pread_into(fd, check, self.offset)
+        if written != self.area_size or check[:] != self._saved[:]:
+            raise IOError(f"恢复测试区域失败，原始数据保存在 {self.journal or '内存'}")
+        self._saved.close()
+        self._saved = None
+        if self.journal and os.path.exists(self.journal):
+            os.remove(self.journal)
+
+    # ---- 测试 ----
+
+    def _offsets(self, test):
+        """按测试模式生成无限的偏移序列"""
+        count = self.area_size // test.block_size
+        if test.pattern == SEQUENTIAL:
+            index = 0
+            while True:
+                yield self.offset + index * test.block_size
+                index = (index + 1) % count
+        else:
+            while True:
+                yield self.offset + self._random.randrange(count) * test.block_size
+
+    def _run_test(self, fd, test):
+        if test.block_size % self.alignment:
+            raise ValueError(f"块大小 {test.block_size} 不是 {self.alignment} 的整数倍")
+        if test.block_size > self.area_size:
+            raise ValueError(f"块大小 {test.block_size} 超过测试区域")
+        offsets = self._offsets(test)
+        lock = threading.Lock()
+        # 顺序测试最多走完一遍测试区域
+        limit = self.area_size // test.block_size if test.pattern == SEQUENTIAL else None
+        issued = [0]
+        latencies = []
+        errors = []
+        pattern = os.urandom(test.block_size)
+        deadline = time.monotonic() + self.duration
+
+        def worker():
+            buf = aligned_buffer(test.block_size)
+            if test.operation == WRITE:
+                # 随机数据，避免主控压缩或去重让结果虚高
+                buf.write(pattern)
+            local = []
+            try:
+                while not errors and time.monotonic() < deadline and not self.cancel_check():
+                    with lock:
+                        if limit is not None and issued[0] >= limit:
+                            break
+                        issued[0] += 1
+                        offset = next(offsets)
+                    start = time.perf_counter()
+                    if test.operation == WRITE:
+                        done = os.pwrite(fd, buf, offset)
+                    else:
+                        done = pread_into(fd, buf, offset)
+                    local.append(time.perf_counter() - start)
+                    if done != test.block_size:
+                        raise IOError(f"{test.label}: 偏移 {offset} 只完成 {done} 字节")
+            except (OSError, IOError) as e:
+                errors.append(e)
+            finally:
+                buf.close()
+                with lock:
+                    latencies.extend(local)
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(test.queue_depth)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 没有直接I/O时写入只进了页缓存，计时要包含落盘
+        if test.operation == WRITE and not self.direct_io:
+            os.fsync(fd)
+        elapsed = time.perf_counter() - started
+        if errors:
+            raise errors[0]
+        return BenchResult(test, len(latencies), len(latencies) * test.block_size, elapsed, latencies)
+
+    def run(self, tests=DEFAULT_TESTS, progress=None):
+        """
+        依次执行测试
+        :param progress: progress(index, total, test) 回调
+        :return: 结构化结果字典
+        """
+        writes = any(test.operation == WRITE for test in tests)
+        fd, self.direct_io = open_direct(self.path, writes, self.direct)
+        results = []
+        try:
+            if writes and not self.destructive:
+                self._save_area(fd)
+            try:
+                for index, test in enumerate(tests):
+                    if self.cancel_check():
+                        break
+                    if progress:
+                        progress(index, len(tests), test)
+                    results.append(self._run_test(fd, test))
+                    logger.debug(f"{test.label}: {format_size(results[-1].throughput)}/s")
+            finally:
+                self._restore_area(fd)
+        finally:
+            os.close(fd)
+        return {
+            'path': self.path,
+            'size': self.size,
+            'area_offset': self.offset,
+            'area_size': self.area_size,
+            'direct_io': self.direct_io,
+            'destructive': self.destructive,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'results': [result.to_dict() for result in results]
+        }
+
+
+# ---- 恢复日志 ----
+
+def write_journal(journal, path, offset, data):
+    """日志格式：魔数、设备路径、偏移、长度、blake2b摘要，然后是原始数据"""
+    encoded = os.path.abspath(path).encode('utf-8')
+    with open(journal + '.tmp', 'wb') as f:
+        f.write(JOURNAL_MAGIC)
+        f.write(struct.pack('<HQQ', len(encoded), offset, len(data)))
+        f.write(encoded)
+        f.write(hashlib.blake2b(data, digest_size=16).digest())
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(journal + '.tmp', journal)
+
+
+def restore_journal(journal, path=None):
+    """
+    把中断的测试留下的原始数据写回设备
+    :param path: 目标设备，None时使用日志中记录的路径
+    :return: 写回的字节数
+    """
+    with open(journal, 'rb') as f:
+        if f.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+            raise ValueError(f"{journal} 不是测试恢复日志")
+        name_length, offset, length = struct.unpack('<HQQ', f.read(struct.calcsize('<HQQ')))
+        recorded = f.read(name_length).decode('utf-8')
+        digest = f.read(16)
+        data = f.read(length)
+    if len(data) != length or hashlib.blake2b(data, digest_size=16).digest() != digest:
+        raise ValueError(f"恢复日志 {journal} 已损坏")
+    fd = os.open(path or recorded, os.O_WRONLY)
+    try:
+        os.pwrite(fd, data, offset)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.remove(journal)
+    return length
+
+
+# ---- 便捷函数 ----
+
+def benchmark_directory(directory, size=16 * MiB, tests=DEFAULT_TESTS, **options):
+    """
+    在已挂载的文件系统中用临时文件测试，不触碰已有数据
+    :return: 结构化结果字典
+    """
+    fd, path = tempfile.mkstemp(prefix='.zhitrend_bench_', dir=directory)
+    try:
+        chunk = os.urandom(MiB)
+        for _ in range(max(1, size // MiB)):
+            os.write(fd, chunk)
+        os.fsync(fd)
+        os.close(fd)
+        fd = None
+        profile = StorageBenchmark(path, area_size=size, offset=0, destructive=True, **options).run(tests)
+        profile['path'] = directory
+        return profile
+    finally:
+        if fd is not None:
+            os.close(fd)
+        os.remove(path)
+
+
+def summarize(profile):
+    """
+    :return: {'seq-write': 最高字节/秒, 'rand-read': ...}，每种模式取各块大小/队列深度中最好的结果
+    """
+    summary = {}
+    for result in profile['results']:
+        key = f"{result['pattern']}-{result['operation']}"
+        summary[key] = max(summary.get(key, 0), result['throughput'])
+    return summary
+
+
+def format_profile(profile):
+    """格式化为文本表格"""
+    lines = [f"{profile['path']}  测试区域 {format_size(profile['area_offset'])}+{format_size(profile['area_size'])}"
+             f"  {'直接I/O' if profile['direct_io'] else '页缓存+fsync'}"]
+    lines.append(f"{'测试':<22}{'吞吐量':>12}{'IOPS':>10}{'p50':>10}{'p99':>10}{'p99.9':>10}{'max':>10}")
+    for result in profile['results']:
+        latency = result['latency']
+        lines.append(f"{result['label']:<22}{format_size(result['throughput']) + '/s':>12}{result['iops']:>10.0f}"
+                     + ''.join(f"{latency[key] * 1000:>8.2f}ms" for key in ('p50', 'p99', 'p99.9', 'max')))
+    return '\n'.join(lines)
+
+
+def _parse_tests(args):
+    tests = []
+    for name in args.tests.split(','):
+        pattern, operation = name.strip().split('-')
+        if pattern not in (SEQUENTIAL, RANDOM) or operation not in (READ, WRITE):
+            raise ValueError(f"未知测试: {name}")
+        sizes = args.block_size or ([MiB] if pattern == SEQUENTIAL else [4 * KiB])
+        depths = args.queue_depth or ([1] if pattern == SEQUENTIAL else [1, 32])
+        for block_size in sizes:
+            for depth in depths:
+                tests.append(BenchTest(pattern, operation, block_size, depth))
+    return tests
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='U盘/镜像文件读写性能测试')
+    parser.add_argument('path', help='镜像文件、目录或设备')
+    parser.add_argument('--tests', default='seq-read,seq-write,rand-read,rand-write',
+                        help='逗号分隔：seq-read,seq-write,rand-read,rand-write')
+    parser.add_argument('--block-size', type=parse_size, action='append', help='块大小，可重复，如 4K、1M')
+    parser.add_argument('--queue-depth', type=int, action='append', help='队列深度，可重复')
+    parser.add_argument('--area', type=parse_size, default=DEFAULT_AREA_SIZE, help='测试区域大小')
+    parser.add_argument('--offset', type=parse_size, help='测试区域起始偏移')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help='每项测试的秒数上限')
+    parser.add_argument('--destructive', action='store_true', help='不保存/恢复测试区域')
+    parser.add_argument('--buffered', action='store_true', help='不使用直接I/O')
+    parser.add_argument('--journal', help='保存测试区域原始数据的恢复日志')
+    parser.add_argument('--restore', metavar='JOURNAL', help='从恢复日志写回原始数据后退出')
+    parser.add_argument('--allow-device', action='store_true', help='允许测试块设备')
+    parser.add_argument('--json', action='store_true', help='输出JSON')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.restore:
+            print(f"已恢复 {restore_journal(args.restore, args.path)} 字节")
+            return 0
+        tests = _parse_tests(args)
+        options = dict(duration=args.duration, direct=not args.buffered)
+        if os.path.isdir(args.path):
+            profile = benchmark_directory(args.path, args.area, tests, **options)
+        else:
+            if stat.S_ISBLK(os.stat(args.path).st_mode) and not args.allow_device:
+                parser.error('测试块设备需要 --allow-device')
+            profile = StorageBenchmark(args.path, area_size=args.area, offset=args.offset,
+                                       destructive=args.destructive, journal=args.journal, **options).run(tests)
+    except (OSError, IOError, ValueError) as e:
+        print(f"测试失败: {e}", file=sys.stderr)
+        return 1
+    print(json.dumps(profile, ensure_ascii=False, indent=2) if args.json else format_profile(profile))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""测试用的FAT卷写入工具：FatVolume 只能替换已有文件，这里补上创建短文件名文件和目录"""
+import struct
+
+from fat_volume import FatVolume, DIR_ENTRY_SIZE, ATTR_DIRECTORY
+
+ATTR_ARCHIVE = 0x20
+
+
+def _short_name(name):
+    base, _, ext = name.upper().partition('.')
+    if not base or len(base) > 8 or len(ext) > 3:
+        raise ValueError(f"不是8.3短文件名: {name}")
+    return base.ljust(8).encode('ascii') + ext.ljust(3).encode('ascii')
+
+
+def _dir_entry(raw_name, attr, cluster, size):
+    record = bytearray(DIR_ENTRY_SIZE)
+    record[0:11] = raw_name
+    record[11] = attr
+    struct.pack_into('<HHHHI', record, 20, cluster >> 16, 0, 0, cluster & 0xFFFF, size)
+    return bytes(record)
+
+
+def _free_slot(volume, directory):
+    if directory is None:
+        cluster = volume.root_cluster if volume.fat_type == 32 else None
+    else:
+        cluster = directory.cluster
+    for offset, record in volume._dir_records(cluster):
+        if record[0] in (0x00, 0xE5):
+            return offset
+    raise IOError("目录已满")
+
+
+def _parent(volume, path):
+    parent_path, _, name = path.strip('/').rpartition('/')
+    parent = volume.lookup(parent_path) if parent_path else None
+    if parent_path and (parent is None or not parent.is_dir):
+        raise FileNotFoundError(parent_path)
+    return parent, name
+
+
+def _link(volume, path, attr, clusters, size):
+    parent, name = _parent(volume, path)
+    first = clusters[0] if clusters else 0
+    volume._write(_free_slot(volume, parent), _dir_entry(_short_name(name), attr, first, size))
+    return parent, first
+
+
+def add_dir(image, path, offset=0):
+    """在卷中创建目录（父目录须已存在）"""
+    with FatVolume(image, offset, writable=True) as volume:
+        clusters = volume._allocate(1)
+        volume._write(volume._cluster_offset(clusters[0]), bytes(volume.cluster_size))
+        volume._flush_fat()
+        parent, first = _link(volume, path, ATTR_DIRECTORY, clusters, 0)
+        parent_cluster = parent.cluster if parent is not None else 0
+        volume._write(volume._cluster_offset(first),
+                      _dir_entry(b'.          ', ATTR_DIRECTORY, first, 0) +
+                      _dir_entry(b'..         ', ATTR_DIRECTORY, parent_cluster, 0))
+
+
+def add_file(image, path, data, offset=0):
+    """在卷中创建文件，缺少的父目录会一并创建"""
+    parts = path.strip('/').split('/')
+    for depth in range(1, len(parts)):
+        with FatVolume(image, offset) as volume:
+            exists = volume.lookup('/'.join(parts[:depth])) is not None
+        if not exists:
+            add_dir(image, '/'.join(parts[:depth]), offset)
+    with FatVolume(image, offset, writable=True) as volume:
+        clusters = volume._allocate(-(-len(data) // volume.cluster_size)) if data else []
+        for i, cluster in enumerate(clusters):
+            chunk = data[i * volume.cluster_size:(i + 1) * volume.cluster_size]
+            volume._write(volume._cluster_offset(cluster), chunk.ljust(volume.cluster_size, b'\x00'))
+        volume._flush_fat()
+        _link(volume, path, ATTR_ARCHIVE, clusters, len(data))
@@ -0,0 +1,367 @@
+"""测试用的最小ISO9660镜像生成器：支持Joliet、Rock Ridge名称、多区段文件和El Torito引导目录"""
+import re
+import struct
+
+BLOCK = 2048
+
+FLAG_DIRECTORY = 0x02
+FLAG_MULTI_EXTENT = 0x80
+
+
+def both16(value):
+    return struct.pack('<H', value) + struct.pack('>H', value)
+
+
+def both32(value):
+    return struct.pack('<I', value) + struct.pack('>I', value)
+
+
+def _blocks(size):
+    return -(-size // BLOCK)
+
+
+class _Node:
+    def __init__(self, name, data=None, parent=None):
+        self.name = name
+        self.data = data
+        self.parent = parent
+        self.children = {} if data is None else None
+        self.lba = 0
+        self.extents = []
+
+    @property
+    def is_dir(self):
+        return self.children is not None
+
+
+def _short_names(names, is_dir):
+    """为一个目录中的记录生成互不相同的ISO9660短名称"""
+    result = {}
+    used = set()
+    for index, name in enumerate(sorted(names)):
+        stem, _, ext = name.rpartition('.') if '.' in name and not is_dir[name] else (name, '', '')
+        stem = re.sub(r'[^A-Z0-9_]', '_', stem.upper())[:8] or '_'
+        ext = re.sub(r'[^A-Z0-9_]', '_', ext.upper())[:3]
+        short = f"{stem}.{ext}" if ext else stem
+        if short in used:
+            short = f"{stem[:4]}{index:04d}" + (f".{ext}" if ext else '')
+        used.add(short)
+        result[name] = short if is_dir[name] else short + (';1' if ext else '.;1')
+    return result
+
+
+def _record(name, lba, size, flags, system_use=b''):
+    name_pad = b'' if len(name) % 2 else b'\x00'
+    length = 33 + len(name) + len(name_pad) + len(system_use)
+    length += length % 2
+    record = bytearray(length)
+    record[0] = length
+    record[2:10] = both32(lba)
+    record[10:18] = both32(size)
+    record[18:25] = bytes((126, 1, 1, 0, 0, 0, 0))
+    record[25] = flags
+    record[28:32] = both16(1)
+    record[32] = len(name)
+    record[33:33 + len(name)] = name
+    start = 33 + len(name) + len(name_pad)
+    record[start:start + len(system_use)] = system_use
+    return bytes(record)
+
+
+def _nm(name):
+    encoded = name.encode('utf-8')
+    return b'NM' + bytes((5 + len(encoded), 1, 0)) + encoded
+
+
+SP_ENTRY = b'SP\x07\x01\xbe\xef\x00'
+_ER_ID = b'RRIP_1991A'
+_ER_DESCRIPTION = b'ROCK RIDGE INTERCHANGE PROTOCOL'
+_ER_SOURCE = b'TEST'
+ER_ENTRY = (b'ER' + bytes((8 + len(_ER_ID) + len(_ER_DESCRIPTION) + len(_ER_SOURCE), 1,
+                           len(_ER_ID), len(_ER_DESCRIPTION), len(_ER_SOURCE), 1))
+            + _ER_ID + _ER_DESCRIPTION + _ER_SOURCE)
+
+
+class ISOBuilder:
+    """
+    在内存中组织目录树，按以下布局写出镜像：
+    系统区 | 主卷描述符 | 引导记录 | Joliet卷描述符 | 终止符 | 引导目录 | 目录区 | 文件数据
+    """
+
+    def __init__(self, volume_id='TEST', joliet=False, rock_ridge=False, max_extent=None):
+        """
+        :param max_extent: 单个区段的最大字节数（须为2048的整数倍），超过时拆成多区段文件
+        """
+        self.volume_id = volume_id
+        self.joliet = joliet
+        self.rock_ridge = rock_ridge
+        self.max_extent = max_extent
+        self.root = _Node('')
+        self.bios_boot = None
+        self.efi_boot = None
+        self.efi_sectors = 0
+
+    def _node(self, path, create=True):
+        node = self.root
+        for part in [p for p in path.split('/') if p]:
+            if part not in node.children:
+                if not create:
+                    return None
+                node.children[part] = _Node(part, parent=node)
+            node = node.children[part]
+        return node
+
+    def add_dir(self, path):
+        self._node(path)
+
+    def add_file(self, path, data):
+        parent, _, name = path.strip('/').rpartition('/')
+        directory = self._node(parent)
+        directory.children[name] = _Node(name, bytes(data), directory)
+
+    def set_boot(self, bios=None, efi=None, efi_sectors=0):
+        """
+        :param bios: BIOS引导映像在镜像中的路径
+        :param efi: EFI引导映像在镜像中的路径
+        :param efi_sectors: 引导目录中记录的EFI映像扇区数，0表示由映像自己的FAT头决定
+        """
+        self.bios_boot = bios
+        self.efi_boot = efi
+        self.efi_sectors = efi_sectors
+
+    def _dirs(self):
+        pending = [self.root]
+        while pending:
+            node = pending.pop(0)
+            yield node
+            pending.extend(child for _, child in sorted(node.children.items()) if child.is_dir)
+
+    def _files(self):
+        for directory in self._dirs():
+            for _, child in sorted(directory.children.items()):
+                if not child.is_dir:
+                    yield child
+
+    def _records(self, directory, joliet, locations):
+        """目录中的全部记录（'.'、'..' 及子项），locations 为 {节点id: (LBA, 大小)}"""
+        parent = directory.parent or directory
+        rock_ridge = self.rock_ridge and not joliet
+        records = []
+        dot_su = SP_ENTRY + ER_ENTRY if rock_ridge and directory is self.root else b''
+        records.append(_record(b'\x00', *locations[id(directory)], FLAG_DIRECTORY, dot_su))
+        records.append(_record(b'\x01', *locations[id(parent)], FLAG_DIRECTORY))
+
+        names = sorted(directory.children)
+        shorts = _short_names(names, {n: directory.children[n].is_dir for n in names})
+        if joliet:
+            keyed = sorted(names, key=lambda n: n.encode('utf-16-be'))
+        else:
+            keyed = sorted(names, key=lambda n: shorts[n])
+        for name in keyed:
+            child = directory.children[name]
+            if joliet:
+                raw = (name + ('' if child.is_dir else ';1')).encode('utf-16-be')
+            else:
+                raw = shorts[name].encode('ascii')
+            su = _nm(name) if rock_ridge else b''
+            if child.is_dir:
+                records.append(_record(raw, *locations[id(child)], FLAG_DIRECTORY, su))
+            elif not child.extents:
+                records.append(_record(raw, child.lba, 0, 0, su))
+            else:
+                for index, (lba, size) in enumerate(child.extents):
+                    flags = FLAG_MULTI_EXTENT if index < len(child.extents) - 1 else 0
+                    records.append(_record(raw, lba, size, flags, su))
+        return records
+
+    @staticmethod
+    def _pack(records):
+        """把记录排入逻辑块，记录不跨越块边界"""
+        data = bytearray()
+        for record in records:
+            if len(data) % BLOCK + len(record) > BLOCK:
+                data += bytes(-len(data) % BLOCK)
+            data += record
+        data += bytes(-len(data) % BLOCK)
+        return bytes(data)
+
+    def _layout_tree(self, joliet, next_lba, locations):
+        """先按目录大小分配LBA（大小与LBA无关，两遍即可稳定）"""
+        directories = list(self._dirs())
+        sizes = {id(d): BLOCK for d in directories}
+        for _ in range(2):
+            lba = next_lba
+            for directory in directories:
+                locations[id(directory)] = (lba, sizes[id(directory)])
+                lba += _blocks(sizes[id(directory)])
+            for directory in directories:
+                sizes[id(directory)] = len(self._pack(self._records(directory, joliet, locations)))
+        lba = next_lba
+        for directory in directories:
+            locations[id(directory)] = (lba, sizes[id(directory)])
+            lba += _blocks(sizes[id(directory)])
+        return directories, lba
+
+    def _dir_name(self, directory, joliet):
+        parent = directory.parent
+        if parent is None:
+            return b'\x00'
+        if joliet:
+            return directory.name.encode('utf-16-be')
+        names = sorted(parent.children)
+        return _short_names(names, {n: parent.children[n].is_dir for n in names})[directory.name].encode('ascii')
+
+    def _path_table(self, directories, joliet, locations, big_endian=False):
+        """路径表：按广度优先顺序编号，每项记录目录区段和父目录编号"""
+        numbers = {id(d): i for i, d in enumerate(directories, 1)}
+        order = '>' if big_endian else '<'
+        table = bytearray()
+        for directory in directories:
+            name = self._dir_name(directory, joliet)
+            parent = numbers[id(directory.parent or directory)]
+            table += bytes((len(name), 0)) + struct.pack(order + 'IH', locations[id(directory)][0], parent)
+            table += name + bytes(len(name) % 2)
+        return bytes(table)
+
+    def _descriptor(self, kind, root_record, total_blocks, joliet=False, path_table=(0, 0, 0)):
+        desc = bytearray(BLOCK)
+        desc[0] = kind
+        desc[1:6] = b'CD001'
+        desc[6] = 1
+        if joliet:
+            desc[40:72] = self.volume_id.encode('utf-16-be')[:32].ljust(32, b'\x00')
+            desc[88:91] = b'%/E'
+        else:
+            desc[8:40] = b' ' * 32
+            desc[40:72] = self.volume_id.encode('ascii')[:32].ljust(32, b' ')
+        desc[80:88] = both32(total_blocks)
+        desc[120:124] = both16(1)
+        desc[124:128] = both16(1)
+        desc[128:132] = both16(BLOCK)
+        table_size, l_table, m_table = path_table
+        desc[132:140] = both32(table_size)
+        struct.pack_into('<I', desc, 140, l_table)
+        struct.pack_into('>I', desc, 148, m_table)
+        desc[156:156 + 34] = root_record
+        desc[881] = 1
+        return bytes(desc)
+
+    def _boot_catalog(self):
+        bios = self._node(self.bios_boot, False) if self.bios_boot else None
+        efi = self._node(self.efi_boot, False) if self.efi_boot else None
+        catalog = bytearray(BLOCK)
+        catalog[0] = 0x01
+        catalog[1] = 0 if bios else 0xEF
+        catalog[0x1e:0x20] = b'\x55\xaa'
+        checksum = -sum(struct.unpack_from('<16H', catalog, 0)) & 0xffff
+        struct.pack_into('<H', catalog, 0x1c, checksum)
+
+        def entry(node, sectors):
+            item = bytearray(32)
+            item[0] = 0x88
+            struct.pack_into('<HI', item, 6, sectors, node.lba)
+            return bytes(item)
+
+        default = bios or efi
+        catalog[32:64] = entry(default, 4 if bios else self.efi_sectors)
+        if bios and efi:
+            catalog[64:68] = bytes((0x91, 0xEF)) + struct.pack('<H', 1)
+            catalog[96:128] = entry(efi, self.efi_sectors)
+        return bytes(catalog)
+
+    def build(self, path):
+        """写出镜像，返回总块数"""
+        boot = bool(self.bios_boot or self.efi_boot)
+        descriptors = 2 + boot + self.joliet
+        next_lba = 16 + descriptors
+        catalog_lba = None
+        if boot:
+            catalog_lba = next_lba
+            next_lba += 1
+
+        # 先确定每个文件的区段划分，目录记录数取决于区段数
+        for node in self._files():
+            size = len(node.data)
+            step = self.max_extent or max(size, 1)
+            node.extents = [(0, min(step, size - pos)) for pos in range(0, size, step)]
+
+        # 路径表的大小只取决于目录名称，先为每棵树预留L型和M型两张表
+        trees = []
+        for joliet in (False, True)[:1 + self.joliet]:
+            directories = list(self._dirs())
+            locations = {id(d): (0, 0) for d in directories}
+            table_blocks = _blocks(len(self._path_table(directories, joliet, locations)))
+            tables = (next_lba, next_lba + table_blocks)
+            next_lba += 2 * table_blocks
+            trees.append((joliet, locations, tables))
+        layouts = []
+        for joliet, locations, tables in trees:
+            directories, next_lba = self._layout_tree(joliet, next_lba, locations)
+            layouts.append((joliet, directories, locations, tables))
+
+        for node in self._files():
+            node.lba = next_lba
+            extents = []
+            for _, size in node.extents:
+                extents.append((next_lba, size))
+                next_lba += _blocks(size)
+            node.extents = extents
+        total_blocks = next_lba
+
+        with open(path, 'wb') as f:
+            f.truncate(total_blocks * BLOCK)
+
+            def put(lba, data):
+                f.seek(lba * BLOCK)
+                f.write(data)
+
+            descriptors = {}
+            for joliet, directories, locations, tables in layouts:
+                table = self._path_table(directories, joliet, locations)
+                put(tables[0], table)
+                put(tables[1], self._path_table(directories, joliet, locations, big_endian=True))
+                root = _record(b'\x00', *locations[id(self.root)], FLAG_DIRECTORY)
+                descriptors[joliet] = (root, (len(table),) + tables)
+                for directory in directories:
+                    put(locations[id(directory)][0], self._pack(self._records(directory, joliet, locations)))
+
+            lba = 16
+            root, table = descriptors[False]
+            put(lba, self._descriptor(1, root, total_blocks, path_table=table))
+            lba += 1
+            if boot:
+                record = bytearray(BLOCK)
+                record[1:7] = b'CD001\x01'
+                record[7:30] = b'EL TORITO SPECIFICATION'
+                struct.pack_into('<I', record, 0x47, catalog_lba)
+                put(lba, bytes(record))
+                lba += 1
+            if self.joliet:
+                root, table = descriptors[True]
+                put(lba, self._descriptor(2, root, total_blocks, joliet=True, path_table=table))
+                lba += 1
+            put(lba, b'\xffCD001\x01'.ljust(BLOCK, b'\x00'))
+            for node in self._files():
+                if node.data:
+                    put(node.lba, node.data)
+            if boot:
+                put(catalog_lba, self._boot_catalog())
+        return total_blocks
+
+    def file_lba(self, path):
+        return self._node(path, False).lba
+
+
+def build_iso(path, files, **options):
+    """
+    :param files: {镜像内路径: 内容}，内容为None表示空目录
+    :return: ISOBuilder
+    """
+    builder = ISOBuilder(**options)
+    for name, data in files.items():
+        if data is None:
+            builder.add_dir(name)
+        else:
+            builder.add_file(name, data)
+    builder.build(path)
+    return builder
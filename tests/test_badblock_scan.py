@@ -0,0 +1,226 @@
+import errno
+import json
+import os
+import shutil
+
+import pytest
+
+import badblock_scan
+from badblock_scan import (BadRanges, BadBlockScanner, ScanResult, MODE_READ, MODE_NONDESTRUCTIVE,
+                           MODE_DESTRUCTIVE, GRADE_GOOD, GRADE_FAIR, GRADE_POOR)
+
+MiB = 1024 * 1024
+BLOCK = 4096
+SECTOR = 512
+SIZE = 4 * MiB
+
+
+class FaultyScanner(BadBlockScanner):
+    """
+    模拟有坏块的设备：读取覆盖 bad 中任一4K块时报 EIO，
+    读取 flipped 中的块时返回的数据有一位翻转；fail_restore 为写回原数据时失败的偏移
+    """
+
+    def __init__(self, path, bad=(), flipped=(), fail_restore=None, **options):
+        self.bad = set(bad)
+        self.flipped = set(flipped)
+        self.fail_restore = fail_restore
+        self.reads = []
+        self._written = set()
+        options.setdefault('chunk_size', MiB)
+        super().__init__(path, direct=False, **options)
+
+    def _pread(self, fd, buf, offset):
+        length = len(buf)
+        self.reads.append(offset)
+        if any(offset <= block < offset + length for block in self.bad):
+            raise OSError(errno.EIO, '输入/输出错误')
+        count = super()._pread(fd, buf, offset)
+        for block in self.flipped:
+            if offset <= block < offset + length:
+                buf[block - offset] ^= 0x01
+        return count
+
+    def _pwrite(self, fd, data, offset):
+        if offset == self.fail_restore:
+            if offset in self._written:
+                raise OSError(errno.EIO, '输入/输出错误')
+            self._written.add(offset)
+        return super()._pwrite(fd, data, offset)
+
+
+def _device(tmp_path, name='usb.img', size=SIZE):
+    path = str(tmp_path / name)
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+    return path
+
+
+def _snapshot(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _lba(offset):
+    return offset // SECTOR
+
+
+def _cancel_after(chunks):
+    calls = []
+    return (lambda done, total, bad: calls.append(done)), (lambda: len(calls) >= chunks)
+
+
+def test_bad_ranges_merge():
+    ranges = BadRanges()
+    ranges.add(100, 8)
+    ranges.add(20)
+    ranges.add(108, 4)
+    ranges.add(21)
+    ranges.add(50, 10)
+    assert ranges.to_list() == [[20, 2], [50, 10], [100, 12]]
+    # 跨越多个区间的重叠区域合并成一个
+    ranges.add(55, 50)
+    assert ranges.to_list() == [[20, 2], [50, 62]]
+    ranges.add(0, 20)
+    assert ranges.to_list() == [[0, 22], [50, 62]]
+    assert len(ranges) == 84
+    assert 21 in ranges and 22 not in ranges and 111 in ranges and 112 not in ranges
+    assert BadRanges([(5, 1), (3, 2), (9, 1)]).to_list() == [[3, 3], [9, 1]]
+
+
+def test_read_scan_locates_bad_sectors(tmp_path):
+    path = _device(tmp_path)
+    # 2MiB-4K 和 2MiB 两块跨越块边界，应合并为一个区间
+    bad = [MiB + 2 * BLOCK, 2 * MiB - BLOCK, 2 * MiB, 3 * MiB]
+    result = FaultyScanner(path, bad).scan()
+    assert result.complete and result.scanned == SIZE
+    assert result.bad.to_list() == [[_lba(MiB + 2 * BLOCK), 8], [_lba(2 * MiB - BLOCK), 16], [_lba(3 * MiB), 8]]
+    # read_errors 按出错的块计数，前两个坏块在同一块中
+    assert result.read_errors == 3 and result.grade == GRADE_POOR
+
+    result = FaultyScanner(path).scan()
+    assert result.complete and result.bad_sectors == 0 and result.grade == GRADE_GOOD
+
+
+def test_cancel_and_resume(tmp_path):
+    path = _device(tmp_path)
+    state = str(tmp_path / 'state' / 'scan.json')
+    progress, cancel = _cancel_after(2)
+    first = FaultyScanner(path, [BLOCK, 3 * MiB], state_path=state, progress=progress, cancel_check=cancel).scan()
+    assert not first.complete and first.scanned == 2 * MiB
+    assert first.bad.to_list() == [[_lba(BLOCK), 8]]
+    with open(state, encoding='utf-8') as f:
+        assert json.load(f)['position'] == 2 * MiB
+
+    scanner = FaultyScanner(path, [BLOCK, 3 * MiB], state_path=state)
+    result = scanner.scan()
+    # 从断点继续，不再读前半部分
+    assert min(scanner.reads) == 2 * MiB
+    assert result.complete and result.scanned == SIZE
+    assert result.bad.to_list() == [[_lba(BLOCK), 8], [_lba(3 * MiB), 8]]
+    assert not os.path.exists(state)
+
+
+def test_resume_matches_state(tmp_path):
+    path = _device(tmp_path)
+    state = str(tmp_path / 'scan.json')
+
+    def interrupted(**options):
+        progress, cancel = _cancel_after(2)
+        FaultyScanner(path, state_path=state, progress=progress, cancel_check=cancel, **options).scan()
+        assert os.path.exists(state)
+
+    # 重新插拔后设备路径变了：按身份找到断点
+    moved = str(tmp_path / 'moved.img')
+    shutil.copyfile(path, moved)
+    interrupted(identity='usb:AAAA')
+    scanner = FaultyScanner(moved, state_path=state, identity='usb:AAAA')
+    assert scanner.scan().complete and min(scanner.reads) == 2 * MiB
+
+    # 同一路径上换了另一个U盘、扫描参数变了或不要求续扫：从头开始
+    for options, resume in (({'identity': 'usb:BBBB'}, True), ({'chunk_size': 2 * MiB}, True),
+                            ({'mode': MODE_NONDESTRUCTIVE}, True), ({}, False)):
+        interrupted(identity='usb:AAAA')
+        scanner = FaultyScanner(path, state_path=state, **dict({'identity': 'usb:AAAA'}, **options))
+        assert scanner.scan(resume).complete and min(scanner.reads) == 0
+
+    interrupted()
+    scanner = FaultyScanner(moved, state_path=state)
+    assert scanner.scan().complete and min(scanner.reads) == 0
+
+
+def test_nondestructive_preserves_data(tmp_path):
+    path = _device(tmp_path)
+    before = _snapshot(path)
+    state = str(tmp_path / 'scan.json')
+    result = FaultyScanner(path, [2 * MiB + BLOCK], mode=MODE_NONDESTRUCTIVE, state_path=state).scan()
+    assert result.complete and result.bad.to_list() == [[_lba(2 * MiB + BLOCK), 8]]
+    assert _snapshot(path) == before
+    assert not os.path.exists(state) and not os.path.exists(state + '.journal')
+
+
+def test_nondestructive_detects_corruption(tmp_path):
+    path = _device(tmp_path)
+    result = FaultyScanner(path, flipped=[3 * MiB + 5 * BLOCK + 17], mode=MODE_NONDESTRUCTIVE).scan()
+    assert result.corruption_errors == 1 and result.read_errors == 0
+    assert result.bad.to_list() == [[_lba(3 * MiB + 5 * BLOCK), 8]]
+
+
+def test_nondestructive_journal_recovery(tmp_path):
+    path = _device(tmp_path)
+    before = _snapshot(path)
+    state = str(tmp_path / 'scan.json')
+    # 写入测试数据后写回原数据失败：设备上留着测试数据，原数据在恢复日志中
+    with pytest.raises(IOError):
+        FaultyScanner(path, fail_restore=MiB, mode=MODE_NONDESTRUCTIVE, state_path=state).scan()
+    assert _snapshot(path) != before
+    assert os.path.exists(state + '.journal')
+
+    result = FaultyScanner(path, mode=MODE_NONDESTRUCTIVE, state_path=state).scan()
+    assert result.complete
+    assert _snapshot(path) == before
+    assert not os.path.exists(state + '.journal')
+
+
+def test_destructive(tmp_path):
+    path = _device(tmp_path)
+    state = str(tmp_path / 'scan.json')
+    progress, cancel = _cancel_after(3)
+    first = FaultyScanner(path, [MiB], mode=MODE_DESTRUCTIVE, state_path=state, progress=progress,
+                          cancel_check=cancel).scan()
+    assert not first.complete
+
+    result = FaultyScanner(path, [MiB], mode=MODE_DESTRUCTIVE, state_path=state).scan()
+    assert result.complete and result.bad.to_list() == [[_lba(MiB), 8]]
+    # 每种图案读回时都会遇到同一个坏块
+    assert result.read_errors == len(badblock_scan.DESTRUCTIVE_PATTERNS)
+    assert _snapshot(path) == bytes([badblock_scan.DESTRUCTIVE_PATTERNS[-1]]) * SIZE
+
+
+def test_sample(tmp_path):
+    path = _device(tmp_path)
+    result = FaultyScanner(path, [0]).sample(count=4, sample_size=64 * 1024)
+    # 首尾两处总会被抽到
+    assert result.read_errors >= 1 and result.bad.to_list()[0] == [0, 8]
+    assert not result.complete
+
+    before = _snapshot(path)
+    result = badblock_scan.sample(path, count=8, sample_size=64 * 1024, direct=False)
+    assert result.bad_sectors == 0 and 64 * 1024 * 2 <= result.scanned <= 64 * 1024 * 10
+    assert _snapshot(path) == before
+
+    with pytest.raises(ValueError):
+        BadBlockScanner(path, mode='quick')
+
+
+def test_scan_result_round_trip():
+    sectors = 1024 * 1024 * 1024 // SECTOR
+    result = ScanResult('/dev/sdx', MODE_READ, sectors * SECTOR, SECTOR, BadRanges([(10, 100)]), read_errors=2,
+                        scanned=1000, complete=True)
+    assert result.grade == GRADE_FAIR
+    data = json.loads(json.dumps(result.to_dict()))
+    assert data['bad_sectors'] == 100 and data['grade'] == GRADE_FAIR
+    restored = ScanResult.from_dict(data)
+    assert restored.to_dict() == result.to_dict()
+    restored.bad.add(0, sectors // 1000)
+    assert restored.grade == GRADE_POOR
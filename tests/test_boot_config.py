@@ -0,0 +1,266 @@
+import os
+
+import pytest
+
+import fs_format
+import partition_table
+from boot_config import GrubConfig, SyslinuxConfig, BootConfigTransaction, open_volumes
+from fat_image import add_file
+from fat_volume import FatVolume
+from iso_image import build_iso
+
+MiB = 1024 * 1024
+
+GRUB_CFG = """# 由镜像自带
+set default=0
+set timeout=5
+if [ x$feature_timeout_style = xy ]; then
+  set timeout_style=menu
+  set timeout=10 # 有菜单时
+fi
+
+menuentry "Try Ubuntu" {
+\tlinux /casper/vmlinuz boot=casper quiet splash ---
+\tinitrd /casper/initrd
+}
+menuentry 'Safe graphics' --class ubuntu {
+\tlinux\t/casper/vmlinuz boot=casper nomodeset quiet splash ---
+}
+submenu 'Advanced' {
+  menuentry 'Inner' {
+    linux /casper/vmlinuz boot=casper
+  }
+}
+"""
+
+SYSLINUX_CFG = """# isolinux
+DEFAULT vesamenu.c32
+TIMEOUT 50
+UI vesamenu.c32
+
+LABEL live
+  MENU LABEL ^Start Live
+  MENU DEFAULT
+  KERNEL /casper/vmlinuz
+  APPEND initrd=/casper/initrd boot=casper quiet splash ---
+label safe
+  menu label Safe ^graphics
+  kernel /casper/vmlinuz
+  append initrd=/casper/initrd nomodeset ---
+"""
+
+
+def _changed_lines(config):
+    old = config.original.split('\n')
+    return [(i, old[i], line) for i, line in enumerate(config.lines) if i < len(old) and old[i] != line]
+
+
+def test_grub_round_trip():
+    config = GrubConfig.parse(GRUB_CFG)
+    assert str(config) == GRUB_CFG and not config.modified
+    assert [(e['title'], e['kind']) for e in config.entries()] == \
+        [('Try Ubuntu', 'menuentry'), ('Safe graphics', 'menuentry'), ('Advanced', 'submenu')]
+    assert config.get('timeout') == '10'
+
+
+def test_grub_timeout_and_default():
+    config = GrubConfig.parse(GRUB_CFG)
+    config.set_timeout(3)
+    # if 分支中的赋值也要改，行尾注释保留
+    assert _changed_lines(config) == [(2, 'set timeout=5', 'set timeout=3'),
+                                      (5, '  set timeout=10 # 有菜单时', '  set timeout=3 # 有菜单时')]
+    config.set_default(2)
+    assert config.lines[1] == 'set default=2'
+    config.set_default('Safe graphics')
+    assert config.lines[1] == 'set default="Safe graphics"'
+    with pytest.raises(ValueError):
+        config.set_default('Missing')
+    with pytest.raises(ValueError):
+        config.set_default(3)
+
+    config = GrubConfig.parse('# 注释\n\nmenuentry x {\n}\n')
+    config.set_timeout(1)
+    assert str(config) == '# 注释\nset timeout=1\n\nmenuentry x {\n}\n'
+
+
+def test_grub_kernel_args():
+    config = GrubConfig.parse(GRUB_CFG)
+    config.update_kernel_args(add=['persistent', 'quiet', 'boot=live'], remove=['splash'])
+    # 新参数放在 '---' 之前，行首和命令后的分隔符原样保留
+    assert [line for _, _, line in _changed_lines(config)] == [
+        '\tlinux /casper/vmlinuz persistent quiet boot=live ---',
+        '\tlinux\t/casper/vmlinuz nomodeset persistent quiet boot=live ---',
+        '    linux /casper/vmlinuz persistent quiet boot=live',
+    ]
+
+    config = GrubConfig.parse(GRUB_CFG)
+    config.update_kernel_args(add=['toram'], entry='Safe graphics')
+    assert [i for i, _, _ in _changed_lines(config)] == [13]
+    config.update_kernel_args(remove=['boot', '---'], entry=0)
+    assert config.lines[9] == '\tlinux /casper/vmlinuz quiet splash'
+    with pytest.raises(ValueError):
+        config.update_kernel_args(add=['x'], entry='Missing')
+
+
+def test_syslinux_round_trip():
+    config = SyslinuxConfig.parse(SYSLINUX_CFG)
+    assert str(config) == SYSLINUX_CFG and not config.modified
+    assert [(e['label'], e['title']) for e in config.entries()] == [('live', 'Start Live'), ('safe', 'Safe graphics')]
+    config.set_timeout(3)
+    assert _changed_lines(config) == [(2, 'TIMEOUT 50', 'TIMEOUT 30')]
+
+
+def test_syslinux_menu_default():
+    config = SyslinuxConfig.parse(SYSLINUX_CFG)
+    config.set_default('safe graphics')
+    # DEFAULT 指向菜单模块时保持不变，只移动 MENU DEFAULT
+    assert config.get('default') == 'vesamenu.c32'
+    assert [i for i, line in enumerate(config.lines) if 'MENU DEFAULT' in line] == [10]
+    assert config.lines[9:11] == ['label safe', '  MENU DEFAULT']
+    assert config.resolve_entry('live')['line'] == 5
+
+    config = SyslinuxConfig.parse('DEFAULT live\nLABEL live\n  KERNEL a\nLABEL safe\n  KERNEL b\n')
+    config.set_default(1)
+    assert str(config) == 'DEFAULT safe\nLABEL live\n  KERNEL a\nLABEL safe\n  KERNEL b\n'
+    with pytest.raises(ValueError):
+        config.set_default('missing')
+
+
+def test_syslinux_kernel_args():
+    config = SyslinuxConfig.parse(SYSLINUX_CFG)
+    config.update_kernel_args(add=['persistent'], remove=['quiet', 'nomodeset'])
+    assert [line for _, _, line in _changed_lines(config)] == [
+        '  APPEND initrd=/casper/initrd boot=casper splash persistent ---',
+        '  append initrd=/casper/initrd persistent ---',
+    ]
+    config = SyslinuxConfig.parse(SYSLINUX_CFG)
+    config.update_kernel_args(add=['toram'], entry='live')
+    assert [i for i, _, _ in _changed_lines(config)] == [9]
+
+
+def _write_tree(root, files):
+    for path, data in files.items():
+        full = os.path.join(root, *path.split('/'))
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        with open(full, 'wb') as f:
+            f.write(data)
+
+
+def _read_tree(root, path):
+    with open(os.path.join(root, *path.split('/')), 'rb') as f:
+        return f.read()
+
+
+def _fat_image(tmp_path, files, size=64 * MiB):
+    image = str(tmp_path / 'fat.img')
+    with open(image, 'wb') as f:
+        f.truncate(size)
+    fs_format.format_volume(image, 'fat32')
+    for path, data in files.items():
+        add_file(image, path, data)
+    return image
+
+
+def _gpt_image(tmp_path, files, iso_files=None):
+    """GPT分区的U盘镜像，第一个分区是FAT；iso_files 不为空时前1MiB中再放一个ISO9660文件系统"""
+    image = str(tmp_path / 'usb.img')
+    if iso_files:
+        build_iso(image, iso_files)
+    with open(image, 'r+b' if iso_files else 'wb') as f:
+        f.truncate(96 * MiB)
+    layout = partition_table.write_partition_table(image, 'gpt', [{'size': '48M'}])
+    offset = layout[0]['offset']
+    fs_format.format_volume(image, 'fat32', offset=offset, size=layout[0]['size'])
+    for path, data in files.items():
+        add_file(image, path, data, offset)
+    return image, offset
+
+
+def _snapshot(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_transaction_directory(tmp_path):
+    root = str(tmp_path / 'mnt')
+    _write_tree(root, {'boot/grub/grub.cfg': GRUB_CFG.encode(), 'isolinux/isolinux.cfg': SYSLINUX_CFG.encode()})
+    with BootConfigTransaction(root) as transaction:
+        assert len(transaction.grub_configs()) == 1 and len(transaction.syslinux_configs()) == 1
+        transaction.apply({'timeout': 2, 'default_entry': 'Safe graphics', 'kernel_args_add': ['persistent']})
+    grub = _read_tree(root, 'boot/grub/grub.cfg').decode()
+    assert 'set timeout=2' in grub and 'set default="Safe graphics"' in grub
+    assert 'boot=casper quiet splash persistent ---' in grub
+    syslinux = _read_tree(root, 'isolinux/isolinux.cfg').decode()
+    assert 'TIMEOUT 20' in syslinux and syslinux.count('persistent') == 2
+    assert sorted(os.listdir(os.path.join(root, 'boot', 'grub'))) == ['grub.cfg']
+
+    # 没有修改时不写入任何文件
+    transaction = BootConfigTransaction(root)
+    transaction.load()
+    transaction.set_timeout(2)
+    assert transaction.commit() == []
+    transaction.close()
+
+
+def test_transaction_whole_disk_fat(tmp_path):
+    image = _fat_image(tmp_path, {'EFI/BOOT/grub.cfg': GRUB_CFG.encode(), 'syslinux.cfg': SYSLINUX_CFG.encode(),
+                                  'casper/vmlinuz': b'kernel' * 5000})
+    with BootConfigTransaction(image) as transaction:
+        transaction.update_kernel_args(add=['toram'])
+    with FatVolume(image) as volume:
+        assert volume.read_file('EFI/BOOT/grub.cfg').decode().count(' toram ---') == 2
+        assert volume.read_file('syslinux.cfg').decode().count(' toram ---') == 2
+        assert volume.read_file('casper/vmlinuz') == b'kernel' * 5000
+
+
+def test_transaction_partitioned_fat(tmp_path):
+    image, offset = _gpt_image(tmp_path, {'boot/grub/grub.cfg': GRUB_CFG.encode()})
+    volumes = open_volumes(image, writable=False)
+    assert [volume.name for volume in volumes] == [f'{image}@{offset}']
+    for volume in volumes:
+        volume.close()
+
+    with BootConfigTransaction(image) as transaction:
+        transaction.set_default(1)
+    with FatVolume(image, offset) as volume:
+        assert volume.read_file('boot/grub/grub.cfg').decode().split('\n')[1] == 'set default=1'
+
+
+def test_transaction_mounted_partition(tmp_path):
+    image, _ = _gpt_image(tmp_path, {'boot/grub/grub.cfg': GRUB_CFG.encode()})
+    root = str(tmp_path / 'mnt')
+    _write_tree(root, {'boot/grub/grub.cfg': GRUB_CFG.encode()})
+    before = _snapshot(image)
+    # 已挂载的分区只能通过挂载目录修改，不能在文件系统底下直接改写FAT
+    with BootConfigTransaction(image, mountpoints={1: root}) as transaction:
+        transaction.set_timeout(9)
+    assert 'set timeout=9' in _read_tree(root, 'boot/grub/grub.cfg').decode()
+    assert _snapshot(image) == before
+
+
+def test_transaction_readonly_iso(tmp_path):
+    iso_files = {'boot/grub/grub.cfg': GRUB_CFG.encode()}
+    image, offset = _gpt_image(tmp_path, {'EFI/BOOT/grub.cfg': GRUB_CFG.encode()}, iso_files)
+    volumes = open_volumes(image)
+    assert [volume.readonly for volume in volumes] == [False, True]
+    for volume in volumes:
+        volume.close()
+
+    before = _snapshot(image)
+    transaction = BootConfigTransaction(image)
+    transaction.load()
+    transaction.set_timeout(1)
+    # ISO中的配置也被修改了：整个事务都不写入
+    with pytest.raises(IOError):
+        transaction.commit()
+    transaction.close()
+    assert _snapshot(image) == before
+
+    with BootConfigTransaction(image) as transaction:
+        transaction.update_kernel_args(add=['persistent'], writable_only=True)
+    with FatVolume(image, offset) as volume:
+        assert 'quiet splash persistent ---' in volume.read_file('EFI/BOOT/grub.cfg').decode()
+    volumes = open_volumes(image, writable=False)
+    assert volumes[1].read_file('boot/grub/grub.cfg') == GRUB_CFG.encode()
+    for volume in volumes:
+        volume.close()
@@ -0,0 +1,160 @@
+import os
+
+import pytest
+
+import capacity_check
+from capacity_check import CapacityChecker, CapacityReport, make_block, read_tag, probe_offsets
+
+MiB = 1024 * 1024
+BLOCK = 4096
+
+
+class FakeDeviceChecker(CapacityChecker):
+    """
+    模拟扩容盘：标称容量是文件大小，真实存储只有前 real_size 字节
+    wrap=True 时超出部分的地址回绕到开头，否则写入被丢弃、读回全零
+    """
+
+    def __init__(self, path, real_size, wrap=True, **options):
+        self.real_size = real_size
+        self.wrap = wrap
+        super().__init__(path, direct=False, **options)
+
+    def _map(self, offset):
+        if offset < self.real_size:
+            return offset
+        return offset % self.real_size if self.wrap else None
+
+    def _pwrite(self, fd, data, offset):
+        with memoryview(data) as view:
+            for position in range(0, len(view), BLOCK):
+                target = self._map(offset + position)
+                if target is not None:
+                    os.pwrite(fd, view[position:position + BLOCK], target)
+            return len(view)
+
+    def _pread(self, fd, buf, offset):
+        with memoryview(buf) as view:
+            for position in range(0, len(view), BLOCK):
+                length = min(BLOCK, len(view) - position)
+                target = self._map(offset + position)
+                view[position:position + length] = os.pread(fd, length, target) if target is not None \
+                    else bytes(length)
+            return len(view)
+
+
+def _device(tmp_path, size, real_size=None):
+    """标称 size 字节的"U盘"，真实存储部分填入随机数据"""
+    path = str(tmp_path / 'usb.img')
+    with open(path, 'wb') as f:
+        f.truncate(size)
+        f.write(os.urandom(real_size or size))
+    return path
+
+
+def _snapshot(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_genuine_device(tmp_path):
+    path = _device(tmp_path, 32 * MiB)
+    before = _snapshot(path)
+    report = capacity_check.check_capacity(path, direct=False, seed=1)
+    assert not report.is_fake and report.complete
+    assert report.usable_size == report.reported_size == 32 * MiB
+    assert report.bad_blocks == report.aliased_blocks == 0 and report.probes > 20
+    # 稀疏检查不破坏数据
+    assert _snapshot(path) == before
+
+    report = capacity_check.check_capacity(path, full=True, direct=False)
+    assert not report.is_fake and report.probes == 32 * MiB // BLOCK
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_sparse_wraparound(tmp_path, seed):
+    path = _device(tmp_path, 64 * MiB, 16 * MiB)
+    before = _snapshot(path)
+    report = FakeDeviceChecker(path, 16 * MiB, seed=seed).check_sparse()
+    assert report.is_fake and report.complete
+    assert report.usable_size == 16 * MiB
+    assert report.aliased_blocks > 0
+    # 地址回绕时先保存的是被覆盖前的数据，按相反顺序写回才能完全还原
+    assert _snapshot(path) == before
+
+
+def test_sparse_dropped_writes(tmp_path):
+    path = _device(tmp_path, 64 * MiB, 20 * MiB)
+    before = _snapshot(path)
+    report = FakeDeviceChecker(path, 20 * MiB, wrap=False, seed=1).check_sparse()
+    assert report.is_fake and report.aliased_blocks == 0
+    # 二分查找把边界精确到 BOUNDARY_GRANULARITY 之内
+    assert 20 * MiB <= report.usable_size < 20 * MiB + capacity_check.BOUNDARY_GRANULARITY
+    assert report.usable_size % BLOCK == 0
+    assert _snapshot(path) == before
+
+
+def test_sparse_without_preserve(tmp_path):
+    path = _device(tmp_path, 32 * MiB)
+    before = _snapshot(path)
+    report = CapacityChecker(path, direct=False, seed=1).check_sparse(preserve=False)
+    assert not report.is_fake
+    assert _snapshot(path) != before
+
+
+def test_sparse_cancel(tmp_path):
+    path = _device(tmp_path, 64 * MiB, 16 * MiB)
+    before = _snapshot(path)
+    calls = []
+    checker = FakeDeviceChecker(path, 16 * MiB, seed=1, progress=lambda done, total, phase: calls.append(done),
+                                cancel_check=lambda: len(calls) >= 5)
+    report = checker.check_sparse()
+    assert not report.complete and report.probes == 5
+    assert _snapshot(path) == before
+
+
+def test_full_arbitrary_wraparound(tmp_path):
+    # 不在2的幂处回绕的扩容盘只有全盘检查能准确测出容量
+    path = _device(tmp_path, 64 * MiB, 24 * MiB)
+    report = FakeDeviceChecker(path, 24 * MiB).check_full()
+    assert report.is_fake and report.complete
+    assert report.usable_size == 24 * MiB
+    assert report.bad_blocks == report.aliased_blocks == 40 * MiB // BLOCK
+
+
+def test_full_dropped_writes(tmp_path):
+    path = _device(tmp_path, 32 * MiB, 12 * MiB)
+    report = FakeDeviceChecker(path, 12 * MiB, wrap=False).check_full()
+    assert report.usable_size == 12 * MiB
+    assert report.bad_blocks == 20 * MiB // BLOCK and report.aliased_blocks == 0
+
+
+def test_probe_offsets():
+    offsets = probe_offsets(64 * MiB, BLOCK, random_probes=0)
+    boundaries = [MiB << i for i in range(6)]
+    assert offsets == sorted({0, 64 * MiB - BLOCK} | set(boundaries) | {b - BLOCK for b in boundaries})
+    offsets = probe_offsets(64 * MiB, BLOCK)
+    assert offsets == sorted(set(offsets)) and all(o % BLOCK == 0 and o <= 64 * MiB - BLOCK for o in offsets)
+    assert probe_offsets(BLOCK, BLOCK) == [0]
+
+
+def test_block_tags():
+    nonce = os.urandom(16)
+    pattern = os.urandom(BLOCK)
+    block = make_block(nonce, 12345 * BLOCK, pattern)
+    assert read_tag(block, nonce, pattern) == (capacity_check.STATUS_OK, 12345 * BLOCK)
+    assert read_tag(bytes(BLOCK), nonce, pattern)[0] == capacity_check.STATUS_LOST
+    assert read_tag(block, os.urandom(16), pattern)[0] == capacity_check.STATUS_LOST
+    block[-1] ^= 0xff
+    assert read_tag(block, nonce, pattern)[0] == capacity_check.STATUS_LOST
+
+
+def test_report_round_trip(tmp_path):
+    report = CapacityReport('/dev/sdx', 64 * MiB, 16 * MiB, 'full', 100, 3, 2, 1.5, False)
+    data = report.to_dict()
+    assert data['is_fake'] and data['usable_size'] == 16 * MiB
+    restored = CapacityReport.from_dict(data)
+    assert restored.to_dict() == data
+
+    with pytest.raises(ValueError):
+        CapacityChecker(_device(tmp_path, 100), direct=False)
@@ -0,0 +1,170 @@
+import io
+import os
+import shutil
+
+import pytest
+
+import delta_flash
+from delta_flash import DeltaFlasher, FlashManifestStore, BlockHasher, MODE_DEVICE, MODE_MANIFEST
+
+BLOCK = 4096
+IMAGE_SIZE = 64 * BLOCK + 100
+
+
+def _device(tmp_path, name='device.img', size=128 * BLOCK):
+    path = tmp_path / name
+    with open(path, 'wb') as f:
+        f.truncate(size)
+    return str(path)
+
+
+def _read(path, size=IMAGE_SIZE):
+    with open(path, 'rb') as f:
+        return f.read(size)
+
+
+def _flash(device, image, store=None, identity=None, **options):
+    flasher = DeltaFlasher(device, store, block_size=BLOCK, identity=identity, workers=3)
+    return flasher.flash(io.BytesIO(image), len(image), 'test.iso', **options)
+
+
+@pytest.fixture
+def image():
+    return bytearray(os.urandom(IMAGE_SIZE))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FlashManifestStore(str(tmp_path / 'manifests'))
+
+
+def test_first_flash_reads_device(tmp_path, image, store):
+    device = _device(tmp_path)
+    stats = _flash(device, image, store)
+    assert stats['mode'] == MODE_DEVICE and stats['changed_bytes'] == IMAGE_SIZE
+    assert _read(device) == image
+    manifest = store.load(device, BLOCK)
+    assert manifest['image_size'] == IMAGE_SIZE and len(manifest['digests']) == 65
+
+
+def test_second_flash_writes_only_changes(tmp_path, image, store):
+    device = _device(tmp_path)
+    _flash(device, image, store)
+    image[5 * BLOCK + 7] ^= 0xff
+    image[6 * BLOCK] ^= 0xff
+    image[40 * BLOCK:42 * BLOCK] = os.urandom(2 * BLOCK)
+    image[-1] ^= 0xff
+    stats = _flash(device, image, store)
+    assert stats['mode'] == MODE_MANIFEST
+    # 相邻的变化块合并为一个区域
+    assert stats['regions'] == 3
+    assert stats['changed_bytes'] == 4 * BLOCK + 100
+    assert _read(device) == image
+
+
+def test_unchanged_image_writes_nothing(tmp_path, image, store):
+    device = _device(tmp_path)
+    _flash(device, image, store)
+    stats = _flash(device, image, store)
+    assert stats['regions'] == 0 and stats['changed_bytes'] == 0
+
+
+def test_stale_manifest_falls_back_to_device(tmp_path, image, store):
+    device = _device(tmp_path)
+    _flash(device, image, store)
+    # 设备在上次写入后被改动（比如被重新格式化），清单不能再用
+    with open(device, 'r+b') as f:
+        f.write(bytes(512))
+    image[20 * BLOCK] ^= 0xff
+    stats = _flash(device, image, store)
+    assert stats['mode'] == MODE_DEVICE
+    assert stats['changed_bytes'] == 2 * BLOCK
+    assert _read(device) == image
+
+
+def test_manifest_mode_requires_manifest(tmp_path, image, store):
+    device = _device(tmp_path)
+    with pytest.raises(ValueError):
+        _flash(device, image, store, mode=MODE_MANIFEST)
+    assert _read(device) == bytes(IMAGE_SIZE)
+
+
+def test_manifest_keyed_by_identity(tmp_path, image, store):
+    device = _device(tmp_path)
+    _flash(device, image, store, identity='usb:0781:5567:AAAA')
+    assert store.load(device, BLOCK, 'usb:0781:5567:AAAA') is not None
+    # 同一设备节点上换了另一个U盘：不能使用前一个U盘的清单
+    assert store.load(device, BLOCK, 'usb:0781:5567:BBBB') is None
+    assert store.load(device, BLOCK) is None
+
+    # 同一个U盘重新插拔后换了设备节点：仍按身份找到清单
+    moved = str(tmp_path / 'moved.img')
+    shutil.copyfile(device, moved)
+    image[3] ^= 0xff
+    stats = _flash(moved, image, store, identity='usb:0781:5567:AAAA')
+    assert stats['mode'] == MODE_MANIFEST and stats['regions'] == 1
+    assert _read(moved) == image
+
+
+def test_different_stick_same_node(tmp_path, image, store):
+    device = _device(tmp_path)
+    _flash(device, image, store, identity='stick-a')
+    # 换上内容不同的另一个U盘，清单属于前一个U盘，必须读取设备比较
+    with open(device, 'r+b') as f:
+        f.write(os.urandom(IMAGE_SIZE))
+    stats = _flash(device, image, store, identity='stick-b')
+    assert stats['mode'] == MODE_DEVICE
+    assert _read(device) == image
+
+
+def test_cancelled_flash_drops_manifest(tmp_path, image, store, monkeypatch):
+    device = _device(tmp_path)
+    _flash(device, image, store)
+    image[:] = os.urandom(IMAGE_SIZE)
+    # 每块单独写入，写完几块后取消
+    monkeypatch.setattr(delta_flash, 'MAX_RUN_BYTES', BLOCK)
+    written = []
+    state = {'writing': False}
+
+    def status(message):
+        state['writing'] = message.startswith('需要写入')
+
+    def progress(done, total):
+        if state['writing']:
+            written.append(done)
+
+    flasher = DeltaFlasher(device, store, block_size=BLOCK, status_callback=status, progress_callback=progress,
+                           cancel_check=lambda: len(written) >= 3)
+    with pytest.raises(InterruptedError):
+        flasher.flash(io.BytesIO(image), IMAGE_SIZE)
+    assert _read(device, BLOCK) == image[:BLOCK]
+    # 设备已部分改写，旧清单不能留下
+    assert store.load(device, BLOCK) is None
+    assert _flash(device, image, store)['mode'] == MODE_DEVICE
+    assert _read(device) == image
+
+
+def test_device_too_small(tmp_path, image, store):
+    device = _device(tmp_path, size=IMAGE_SIZE - 1)
+    with pytest.raises(ValueError):
+        _flash(device, image, store)
+
+
+def test_block_hasher_chunking():
+    data = os.urandom(10 * BLOCK + 5)
+    hasher = BlockHasher(BLOCK)
+    for start in range(0, len(data), 3000):
+        hasher.update(data[start:start + 3000])
+    expected = [delta_flash.block_digest(data[pos:pos + BLOCK]) for pos in range(0, len(data), BLOCK)]
+    assert hasher.finish() == expected and hasher.size == len(data)
+
+
+def test_changed_runs(monkeypatch):
+    new = [b'a', b'b', b'c', b'd', b'e', b'f']
+    old = [b'a', b'x', b'x', b'd', b'x']
+    assert delta_flash.changed_runs(new, old, BLOCK, 6 * BLOCK - 10) == \
+        [(BLOCK, 2 * BLOCK), (4 * BLOCK, 2 * BLOCK - 10)]
+    # 单个区域不超过 MAX_RUN_BYTES
+    monkeypatch.setattr(delta_flash, 'MAX_RUN_BYTES', 2 * BLOCK)
+    assert delta_flash.changed_runs(new[:5], [], BLOCK, 5 * BLOCK) == \
+        [(0, 2 * BLOCK), (2 * BLOCK, 2 * BLOCK), (4 * BLOCK, BLOCK)]
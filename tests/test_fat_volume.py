@@ -0,0 +1,116 @@
+import shutil
+import struct
+import subprocess
+
+import pytest
+
+import fs_format
+import partition_table
+from fat_image import add_file
+from fat_volume import FatVolume, is_fat_boot_sector
+
+MiB = 1024 * 1024
+
+
+def _image(tmp_path, size=64 * MiB):
+    path = tmp_path / 'disk.img'
+    with open(path, 'wb') as f:
+        f.truncate(size)
+    return str(path)
+
+
+def _free_clusters(volume):
+    return sum(1 for cluster in range(2, volume.cluster_count + 2) if volume.get_fat(cluster) == 0)
+
+
+@pytest.fixture
+def volume_image(tmp_path):
+    image = _image(tmp_path)
+    fs_format.format_volume(image, 'fat32', label='BOOT')
+    add_file(image, 'boot/grub/grub.cfg', b'set timeout=5\n')
+    add_file(image, 'syslinux.cfg', b'DEFAULT linux\n' * 1000)
+    add_file(image, 'empty.txt', b'')
+    return image
+
+
+def test_read_files(volume_image):
+    with FatVolume(volume_image) as volume:
+        assert sorted(e.name for e in volume.listdir()) == ['BOOT', 'EMPTY.TXT', 'SYSLINUX.CFG']
+        assert volume.read_file('boot/grub/grub.cfg') == b'set timeout=5\n'
+        # 不区分大小写
+        assert volume.read_file('/BOOT/Grub/GRUB.CFG') == b'set timeout=5\n'
+        assert volume.read_file('syslinux.cfg') == b'DEFAULT linux\n' * 1000
+        assert volume.read_file('empty.txt') == b''
+        assert volume.read_file('missing.cfg') is None
+        assert volume.read_file('boot') is None
+        assert volume.lookup('syslinux.cfg/x') is None
+
+
+@pytest.mark.parametrize('data', [b'short', b'x' * 100000, b''])
+def test_replace_file(volume_image, data):
+    with FatVolume(volume_image) as volume:
+        free_before = _free_clusters(volume)
+        old_clusters = len(volume.chain(volume.lookup('syslinux.cfg').cluster))
+    with FatVolume(volume_image, writable=True) as volume:
+        volume.replace_file('syslinux.cfg', data)
+    with FatVolume(volume_image) as volume:
+        assert volume.read_file('syslinux.cfg') == data
+        # 旧簇全部释放，新簇数与内容大小一致
+        new_clusters = -(-len(data) // volume.cluster_size)
+        assert _free_clusters(volume) == free_before + old_clusters - new_clusters
+        # 其他文件不受影响
+        assert volume.read_file('boot/grub/grub.cfg') == b'set timeout=5\n'
+        fat_size = volume.fat_sectors * volume.bytes_per_sector
+        assert volume._read(volume.fat_offset, fat_size) == volume._read(volume.fat_offset + fat_size, fat_size)
+        # FSInfo中的空闲簇计数标记为未知
+        fsinfo = volume._read(volume.fsinfo_sector * volume.bytes_per_sector, 512)
+        assert struct.unpack_from('<I', fsinfo, 488)[0] == 0xFFFFFFFF
+
+
+def test_replace_file_errors(volume_image):
+    with FatVolume(volume_image) as volume:
+        with pytest.raises(IOError):
+            volume.replace_file('syslinux.cfg', b'x')
+    with FatVolume(volume_image, writable=True) as volume:
+        with pytest.raises(FileNotFoundError):
+            volume.replace_file('missing.cfg', b'x')
+        with pytest.raises(FileNotFoundError):
+            volume.replace_file('boot', b'x')
+
+
+def test_replace_file_out_of_space(volume_image):
+    with FatVolume(volume_image, writable=True) as volume:
+        too_big = bytes((volume.cluster_count + 1) * volume.cluster_size)
+        free_before = _free_clusters(volume)
+        with pytest.raises(IOError):
+            volume.replace_file('syslinux.cfg', too_big)
+    # 写时复制：分配失败时原文件和FAT都保持不变
+    with FatVolume(volume_image) as volume:
+        assert volume.read_file('syslinux.cfg') == b'DEFAULT linux\n' * 1000
+        assert _free_clusters(volume) == free_before
+
+
+def test_volume_in_partition(tmp_path):
+    image = _image(tmp_path, 96 * MiB)
+    layout = partition_table.write_partition_table(image, 'gpt', [{'size': '48M', 'format': 'fat32'}, {}])
+    offset = layout[0]['offset']
+    fs_format.format_volume(image, 'fat32', offset=offset, size=layout[0]['size'])
+    add_file(image, 'EFI/BOOT/grub.cfg', b'menuentry x {\n}\n', offset)
+    with open(image, 'rb') as f:
+        assert not is_fat_boot_sector(f.read(512))
+        f.seek(offset)
+        assert is_fat_boot_sector(f.read(512))
+    with FatVolume(image, offset, writable=True) as volume:
+        volume.replace_file('efi/boot/grub.cfg', b'set default=0\n')
+    with FatVolume(image, offset) as volume:
+        assert volume.read_file('EFI/BOOT/GRUB.CFG') == b'set default=0\n'
+    assert partition_table.read_partition_table(image)['type'] == 'gpt'
+
+
+@pytest.mark.skipif(not shutil.which('fsck.fat'), reason='需要 fsck.fat')
+def test_fsck_after_replace(volume_image):
+    with FatVolume(volume_image, writable=True) as volume:
+        volume.replace_file('syslinux.cfg', b'y' * 70000)
+        volume.replace_file('boot/grub/grub.cfg', b'')
+    result = subprocess.run(['fsck.fat', '-n', volume_image], capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout + result.stderr
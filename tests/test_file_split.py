@@ -0,0 +1,181 @@
+import hashlib
+import os
+import struct
+
+import pytest
+
+import file_split
+from file_split import (WIM_MAGIC, WIM_HEADER_SIZE, WIM_HDR_FLAG_SPANNED, WIM_LOOKUP_ENTRY_SIZE,
+                        RESHDR_FLAG_METADATA, RESHDR_FLAG_SOLID, HDR_OFFSET_PART_NUMBER, HDR_OFFSET_LOOKUP_TABLE,
+                        HDR_OFFSET_XML_DATA, HDR_OFFSET_BOOT_METADATA, HDR_OFFSET_INTEGRITY)
+
+# 资源头中大小字段占低56位
+SIZE_MASK = 0x00ffffffffffffff
+XML = '<WIM><IMAGE INDEX="1"><NAME>Test</NAME></IMAGE></WIM>'.encode('utf-16-le')
+
+
+def _reshdr(size, flags, offset, original_size=None):
+    return struct.pack('<QQQ', size | (flags << 56), offset, size if original_size is None else original_size)
+
+
+def _reader(data):
+    return lambda offset, size: data[offset:offset + size]
+
+
+def _build_wim(path, blob_sizes, metadata_size=3000, extra_flags=0):
+    """
+    单卷WIM：一个元数据资源和若干数据资源，查找表中的摘要是资源内容的SHA-1
+    :return: {摘要: 资源内容}
+    """
+    resources = [(RESHDR_FLAG_METADATA, os.urandom(metadata_size))]
+    resources += [(extra_flags, os.urandom(size)) for size in blob_sizes]
+    body = bytearray(WIM_HEADER_SIZE)
+    table = bytearray()
+    contents = {}
+    boot = None
+    for flags, data in resources:
+        offset = len(body)
+        body += data
+        digest = hashlib.sha1(data).digest()
+        contents[digest] = data
+        reshdr = _reshdr(len(data), flags, offset)
+        table += reshdr + struct.pack('<HI', 1, 1) + digest
+        if flags & RESHDR_FLAG_METADATA:
+            boot = reshdr
+    table_offset = len(body)
+    body += table
+    xml_offset = len(body)
+    body += XML
+
+    body[0:8] = WIM_MAGIC
+    struct.pack_into('<III', body, 8, WIM_HEADER_SIZE, 0x10d00, 0x2)
+    struct.pack_into('<HHI', body, HDR_OFFSET_PART_NUMBER, 1, 1, 1)
+    body[HDR_OFFSET_LOOKUP_TABLE:HDR_OFFSET_LOOKUP_TABLE + 24] = _reshdr(len(table), 0, table_offset)
+    body[HDR_OFFSET_XML_DATA:HDR_OFFSET_XML_DATA + 24] = _reshdr(len(XML), 0, xml_offset)
+    body[HDR_OFFSET_BOOT_METADATA:HDR_OFFSET_BOOT_METADATA + 24] = boot
+    struct.pack_into('<I', body, 120, 1)
+    body[HDR_OFFSET_INTEGRITY:HDR_OFFSET_INTEGRITY + 24] = _reshdr(100, 0, 12345)
+    with open(path, 'wb') as f:
+        f.write(body)
+    return contents
+
+
+def _parse_part(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    size_flags, offset, _ = struct.unpack_from('<QQQ', data, HDR_OFFSET_LOOKUP_TABLE)
+    table = data[offset:offset + (size_flags & SIZE_MASK)]
+    entries = []
+    for pos in range(0, len(table), WIM_LOOKUP_ENTRY_SIZE):
+        size_flags, res_offset, _ = struct.unpack_from('<QQQ', table, pos)
+        part_number, refcount = struct.unpack_from('<HI', table, pos + 24)
+        size = size_flags & SIZE_MASK
+        entries.append({'flags': size_flags >> 56, 'part': part_number, 'refcount': refcount,
+                        'hash': table[pos + 30:pos + 50], 'data': data[res_offset:res_offset + size]})
+    return data, entries
+
+
+def test_split_wim(tmp_path):
+    source = str(tmp_path / 'install.wim')
+    contents = _build_wim(source, [5000, 12000, 800, 9000, 16000, 3000, 7000])
+    with open(source, 'rb') as f:
+        wim = f.read()
+    part_size = 20000
+    written = []
+    paths = file_split.split_wim(_reader(wim), source, part_size, written.append)
+    assert [os.path.basename(p) for p in paths] == \
+        ['install.swm'] + [f'install{i}.swm' for i in range(2, len(paths) + 1)]
+    assert len(paths) > 2
+
+    seen = {}
+    for number, path in enumerate(paths, 1):
+        assert os.path.getsize(path) <= part_size
+        data, entries = _parse_part(path)
+        assert data[:8] == WIM_MAGIC
+        assert struct.unpack_from('<HH', data, HDR_OFFSET_PART_NUMBER) == (number, len(paths))
+        assert struct.unpack_from('<I', data, 16)[0] & WIM_HDR_FLAG_SPANNED
+        assert data[HDR_OFFSET_INTEGRITY:HDR_OFFSET_INTEGRITY + 24] == bytes(24)
+        size_flags, xml_offset, _ = struct.unpack_from('<QQQ', data, HDR_OFFSET_XML_DATA)
+        assert data[xml_offset:xml_offset + (size_flags & SIZE_MASK)] == XML
+        boot_size, boot_offset, _ = struct.unpack_from('<QQQ', data, HDR_OFFSET_BOOT_METADATA)
+        for entry in entries:
+            # 分卷中的资源原样复制，摘要仍然对得上
+            assert entry['part'] == number
+            assert hashlib.sha1(entry['data']).digest() == entry['hash']
+            assert entry['hash'] not in seen
+            seen[entry['hash']] = number
+            if entry['flags'] & RESHDR_FLAG_METADATA:
+                # 元数据资源和启动元数据都在第一卷
+                assert number == 1
+                assert data[boot_offset:boot_offset + (boot_size & SIZE_MASK)] == entry['data']
+        if number > 1:
+            assert boot_size == 0
+    assert set(seen) == set(contents)
+    assert sum(written) == sum(len(data) for data in contents.values())
+
+
+def test_split_wim_single_part(tmp_path):
+    source = str(tmp_path / 'boot.wim')
+    _build_wim(source, [1000, 2000])
+    with open(source, 'rb') as f:
+        wim = f.read()
+    paths = file_split.split_wim(_reader(wim), source)
+    assert [os.path.basename(p) for p in paths] == ['boot.swm']
+    data, entries = _parse_part(paths[0])
+    assert struct.unpack_from('<HH', data, HDR_OFFSET_PART_NUMBER) == (1, 1)
+    assert len(entries) == 3
+
+
+def test_plan_swm_parts_keeps_offset_order():
+    entries = [{'size': 10, 'flags': 0, 'offset': offset} for offset in (900, 100, 500, 300)]
+    entries.append({'size': 50, 'flags': RESHDR_FLAG_METADATA, 'offset': 2000})
+    parts = file_split.plan_swm_parts(entries, 0, WIM_HEADER_SIZE + 70 + 3 * WIM_LOOKUP_ENTRY_SIZE)
+    assert parts[0][0]['flags'] & RESHDR_FLAG_METADATA
+    offsets = [e['offset'] for part in parts for e in part if not e['flags']]
+    assert offsets == [100, 300, 500, 900]
+
+
+def test_read_wim_layout_rejects(tmp_path):
+    with pytest.raises(ValueError):
+        file_split.read_wim_layout(_reader(bytes(WIM_HEADER_SIZE)))
+
+    path = str(tmp_path / 'install.wim')
+    _build_wim(path, [1000])
+    with open(path, 'rb') as f:
+        spanned = bytearray(f.read())
+    struct.pack_into('<HH', spanned, HDR_OFFSET_PART_NUMBER, 1, 2)
+    with pytest.raises(ValueError):
+        file_split.read_wim_layout(_reader(bytes(spanned)))
+
+    _build_wim(path, [1000], extra_flags=RESHDR_FLAG_SOLID)
+    with open(path, 'rb') as f:
+        with pytest.raises(ValueError):
+            file_split.read_wim_layout(_reader(f.read()))
+
+
+@pytest.mark.parametrize('size, part_size, count', [(10000, 4096, 3), (8192, 4096, 2), (0, 4096, 1), (5, 4096, 1)])
+def test_split_stream(tmp_path, size, part_size, count):
+    data = os.urandom(size)
+    written = []
+    target = str(tmp_path / 'filesystem.squashfs')
+    parts = file_split.split_stream(_reader(data), size, target, part_size, written.append)
+    assert parts == [f'{target}.{i:03d}' for i in range(1, count + 1)]
+    chunks = []
+    for path in parts:
+        with open(path, 'rb') as f:
+            chunks.append(f.read())
+    assert all(len(chunk) <= part_size for chunk in chunks)
+    assert b''.join(chunks) == data
+    assert sum(written) == size
+
+
+def test_split_stream_short_source(tmp_path):
+    with pytest.raises(IOError):
+        file_split.split_stream(_reader(bytes(100)), 1000, str(tmp_path / 'x'), 4096)
+
+
+def test_max_file_size(monkeypatch, tmp_path):
+    monkeypatch.setattr(file_split, 'detect_filesystem', lambda path: 'vfat')
+    assert file_split.max_file_size(str(tmp_path)) == file_split.FAT32_MAX_FILE_SIZE
+    monkeypatch.setattr(file_split, 'detect_filesystem', lambda path: 'exfat')
+    assert file_split.max_file_size(str(tmp_path)) is None
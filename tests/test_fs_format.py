@@ -0,0 +1,116 @@
+import shutil
+import struct
+import subprocess
+
+import pytest
+
+import fs_format
+import partition_table
+from fat_volume import FatVolume
+from fs_format import SECTOR_SIZE
+
+MiB = 1024 * 1024
+
+
+def _image(tmp_path, size):
+    path = tmp_path / 'disk.img'
+    with open(path, 'wb') as f:
+        f.truncate(size)
+    return str(path)
+
+
+def _read(path, offset, size):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def _exfat_checksum(region):
+    """按exFAT规范独立计算引导区校验和（跳过 VolumeFlags 和 PercentInUse）"""
+    checksum = 0
+    for i, byte in enumerate(region):
+        if i in (106, 107, 112):
+            continue
+        checksum = ((checksum >> 1) | ((checksum & 1) << 31)) + byte & 0xffffffff
+    return checksum
+
+
+def test_fat32_whole_image(tmp_path):
+    image = _image(tmp_path, 64 * MiB)
+    info = fs_format.format_volume(image, 'fat32', label='Test Disk')
+    assert info['label'] == 'TEST DISK'
+    with FatVolume(image) as volume:
+        assert volume.fat_type == 32
+        assert volume.cluster_count == info['clusters']
+        assert volume.cluster_size == info['cluster_size']
+        assert volume.data_offset == info['data_offset']
+        assert volume.listdir() == []
+        # 根目录簇链只有一个簇
+        assert volume.chain(volume.root_cluster) == [volume.root_cluster]
+    # 备份引导扇区与主引导扇区相同
+    assert _read(image, 0, 3 * SECTOR_SIZE) == _read(image, 6 * SECTOR_SIZE, 3 * SECTOR_SIZE)
+
+
+def test_fat32_in_partition(tmp_path):
+    image = _image(tmp_path, 96 * MiB)
+    layout = partition_table.write_partition_table(image, 'gpt', [{'size': '48M', 'format': 'fat32'}, {}])
+    part = layout[0]
+    fs_format.format_volume(image, 'fat32', offset=part['offset'], size=part['size'])
+    # 格式化不能越出分区破坏分区表
+    table = partition_table.read_partition_table(image)
+    assert [(p['start_lba'], p['end_lba']) for p in table['partitions']] == \
+        [(p['start_lba'], p['end_lba']) for p in layout]
+    boot = _read(image, part['offset'], SECTOR_SIZE)
+    hidden, total = struct.unpack_from('<II', boot, 28)
+    assert hidden == part['start_lba'] and total == part['sectors']
+    with FatVolume(image, offset=part['offset']) as volume:
+        assert volume.fat_type == 32 and volume.listdir() == []
+
+
+def test_fat32_only_writes_metadata(tmp_path):
+    image = _image(tmp_path, 64 * MiB)
+    marker = b'KEEP' * 128
+    with open(image, 'r+b') as f:
+        f.seek(48 * MiB)
+        f.write(marker)
+    info = fs_format.format_volume(image, 'fat32')
+    assert info['metadata_end'] < 48 * MiB
+    assert _read(image, 48 * MiB, len(marker)) == marker
+
+
+def test_exfat_boot_region(tmp_path):
+    image = _image(tmp_path, 64 * MiB)
+    info = fs_format.format_volume(image, 'exfat', label='Daten')
+    region = _read(image, 0, 12 * SECTOR_SIZE)
+    assert region[3:11] == b'EXFAT   ' and region[510:512] == b'\x55\xaa'
+    assert _read(image, 12 * SECTOR_SIZE, 12 * SECTOR_SIZE) == region
+    checksum = _exfat_checksum(region[:11 * SECTOR_SIZE])
+    assert region[11 * SECTOR_SIZE:] == struct.pack('<I', checksum) * (SECTOR_SIZE // 4)
+
+    fat_offset, fat_length, heap_offset, clusters, root_cluster = struct.unpack_from('<IIIII', region, 80)
+    assert clusters == info['clusters'] and heap_offset * SECTOR_SIZE == info['data_offset']
+    assert fat_offset + fat_length <= heap_offset
+    root = _read(image, (heap_offset + (root_cluster - 2) * (info['cluster_size'] // SECTOR_SIZE)) * SECTOR_SIZE, 96)
+    # 卷标、分配位图、大写表三个目录项
+    assert root[0] == 0x83 and root[2:2 + root[1] * 2].decode('utf-16-le') == 'Daten'
+    assert root[32] == 0x81 and root[64] == 0x82
+
+
+def test_invalid_arguments(tmp_path):
+    image = _image(tmp_path, 64 * MiB)
+    with pytest.raises(ValueError):
+        fs_format.format_volume(image, 'ntfs')
+    with pytest.raises(ValueError):
+        fs_format.format_volume(image, 'fat32', offset=100)
+    with pytest.raises(ValueError):
+        fs_format.format_volume(_image(tmp_path, 8 * MiB), 'fat32')
+
+
+@pytest.mark.parametrize('filesystem, fsck', [('fat32', 'fsck.fat'), ('exfat', 'fsck.exfat')])
+def test_fsck_accepts_volume(tmp_path, filesystem, fsck):
+    if not shutil.which(fsck):
+        pytest.skip(f'需要 {fsck}')
+    image = _image(tmp_path, 64 * MiB)
+    fs_format.format_volume(image, filesystem, label='FSCK')
+    result = subprocess.run([fsck, '-n', image], capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout + result.stderr
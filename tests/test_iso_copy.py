@@ -0,0 +1,150 @@
+import io
+import os
+
+import pytest
+
+import iso_copy
+from iso_copy import ISOFileCopier, CopyCancelled, POLICY_DATA_PARTITION
+from iso_image import build_iso
+from iso_reader import ISOReader
+
+
+def _data(size, seed):
+    return bytes((i * 31 + seed) & 0xff for i in range(size))
+
+
+FILES = {
+    'README.txt': b'hello',
+    'empty.cfg': b'',
+    'boot/grub/grub.cfg': b'set timeout=5\n',
+    'boot/vmlinuz': _data(300 * 1024, 1),
+    'casper/filesystem.squashfs': _data(1024 * 1024 + 123, 2),
+    'casper/initrd': _data(50 * 1024, 3),
+    'pool/main/a/pkg_1.0.deb': _data(7000, 4),
+    'pool/main/b': None,
+}
+
+
+def _tree(root):
+    """目标目录中的 {相对路径: 内容}，目录的内容为None"""
+    result = {}
+    for dir_path, dirs, files in os.walk(root):
+        rel = os.path.relpath(dir_path, root).replace(os.sep, '/')
+        prefix = '' if rel == '.' else rel + '/'
+        for name in dirs:
+            result[prefix + name] = None
+        for name in files:
+            with open(os.path.join(dir_path, name), 'rb') as f:
+                result[prefix + name] = f.read()
+    return result
+
+
+def _expected(files):
+    result = {}
+    for path, data in files.items():
+        parts = path.split('/')
+        for i in range(1, len(parts)):
+            result['/'.join(parts[:i])] = None
+        result[path] = data
+    return result
+
+
+@pytest.fixture
+def iso(tmp_path):
+    path = str(tmp_path / 'source.iso')
+    # 大文件拆成多个区段，测试跨区段复制
+    build_iso(path, FILES, rock_ridge=True, max_extent=256 * 1024)
+    return path
+
+
+@pytest.mark.parametrize('small_file_limit, buffer_size', [(64 * 1024, 100 * 1024), (1, 4096), (10 ** 9, 8192)])
+def test_copy_tree(iso, tmp_path, small_file_limit, buffer_size):
+    target = str(tmp_path / 'target')
+    progress = []
+    copier = ISOFileCopier(iso, target, workers=3, small_file_limit=small_file_limit, buffer_size=buffer_size,
+                           progress_callback=lambda done, total: progress.append((done, total)))
+    stats = copier.run()
+    assert _tree(target) == _expected(FILES)
+    total = sum(len(d) for d in FILES.values() if d is not None)
+    assert stats['files'] == 7 and stats['bytes'] == total
+    assert progress[-1] == (total, total)
+
+
+def test_plan_copy_order(iso):
+    with ISOReader(iso) as reader:
+        directories, tasks = iso_copy.plan_copy(reader)
+        assert sorted(directories) == ['boot', 'boot/grub', 'casper', 'pool', 'pool/main', 'pool/main/a',
+                                       'pool/main/b']
+        # 按源区段升序，读取ISO基本是顺序的
+        starts = [task.extents[0][0] for task in tasks]
+        assert starts == sorted(starts)
+        squashfs = next(task for task in tasks if task.path == 'casper/filesystem.squashfs')
+        assert len(squashfs.extents) == 5
+
+        directories, tasks = iso_copy.plan_copy(reader, '/boot')
+        assert directories == ['grub']
+        assert sorted(task.path for task in tasks) == ['grub/grub.cfg', 'vmlinuz']
+
+
+def test_copy_subdirectory(iso, tmp_path):
+    target = str(tmp_path / 'target')
+    ISOFileCopier(iso, target).run('/casper')
+    assert _tree(target) == {'filesystem.squashfs': FILES['casper/filesystem.squashfs'],
+                             'initrd': FILES['casper/initrd']}
+
+
+def test_file_object_without_fileno(iso, tmp_path):
+    with open(iso, 'rb') as f:
+        source = io.BytesIO(f.read())
+    target = str(tmp_path / 'target')
+    ISOFileCopier(source, target, small_file_limit=512 * 1024).run()
+    assert _tree(target) == _expected(FILES)
+    assert not source.closed
+
+
+def test_split_oversized_files(iso, tmp_path):
+    target = str(tmp_path / 'target')
+    limit = 400 * 1024
+    stats = ISOFileCopier(iso, target, max_file_size=limit).run()
+    tree = _tree(target)
+    data = FILES['casper/filesystem.squashfs']
+    parts = sorted(name for name in tree if name.startswith('casper/filesystem.squashfs.'))
+    assert parts == [f'casper/filesystem.squashfs.{i:03d}' for i in (1, 2, 3)]
+    assert all(len(tree[name]) <= limit for name in parts)
+    assert b''.join(tree[name] for name in parts) == data
+    assert 'casper/filesystem.squashfs' not in tree
+    # 未超限的文件照常复制
+    assert tree['boot/vmlinuz'] == FILES['boot/vmlinuz']
+    assert stats['bytes'] == sum(len(d) for d in FILES.values() if d is not None)
+
+
+def test_data_partition_policy(iso, tmp_path):
+    target = str(tmp_path / 'target')
+    data_dir = str(tmp_path / 'data')
+    ISOFileCopier(iso, target, max_file_size=512 * 1024, large_file_policy=POLICY_DATA_PARTITION,
+                  data_dir=data_dir).run()
+    assert _tree(data_dir) == {'casper': None, 'casper/filesystem.squashfs': FILES['casper/filesystem.squashfs']}
+    assert 'casper/filesystem.squashfs' not in _tree(target)
+    with pytest.raises(ValueError):
+        ISOFileCopier(iso, target, large_file_policy=POLICY_DATA_PARTITION)
+
+
+def test_cancel(iso, tmp_path):
+    calls = []
+
+    def cancel_check():
+        calls.append(1)
+        return len(calls) > 3
+
+    with pytest.raises(CopyCancelled):
+        ISOFileCopier(iso, str(tmp_path / 'target'), cancel_check=cancel_check, buffer_size=4096).run()
+
+
+@pytest.mark.parametrize('small_file_limit', [1, 10 ** 9])
+def test_truncated_source_fails(iso, tmp_path, small_file_limit):
+    # 镜像被截断时必须报错，不能留下不完整的文件却报告成功
+    size = os.path.getsize(iso)
+    with open(iso, 'r+b') as f:
+        f.truncate(size - 4096)
+    with pytest.raises(IOError):
+        ISOFileCopier(iso, str(tmp_path / 'target'), small_file_limit=small_file_limit).run()
@@ -0,0 +1,196 @@
+import os
+import struct
+import zlib
+
+import pytest
+
+import iso_hybrid
+import partition_table
+from iso_hybrid import CYLINDER_SIZE, ISOLINUX_HYBRID_MAGIC, SECTOR_SIZE
+from iso_image import ISOBuilder
+from iso_reader import ISOReader
+from partition_table import GPT_TYPE_EFI_SYSTEM
+
+EFI_IMAGE_SECTORS = 96
+
+
+def _isolinux():
+    image = bytearray(bytes((i * 7) & 0xff for i in range(6000)))
+    image[8:24] = bytes(16)
+    struct.pack_into('<I', image, 0x40, ISOLINUX_HYBRID_MAGIC)
+    return bytes(image)
+
+
+def _efi_image():
+    """只有FAT引导扇区头部的EFI映像，扇区总数写在BPB中"""
+    image = bytearray(EFI_IMAGE_SECTORS * SECTOR_SIZE)
+    image[0:3] = b'\xeb\x3c\x90'
+    struct.pack_into('<HBHBHH', image, 11, 512, 4, 1, 2, 512, EFI_IMAGE_SECTORS)
+    image[510:512] = b'\x55\xaa'
+    return bytes(image)
+
+
+def _build(tmp_path, bios=True, efi=True, efi_sectors=0):
+    path = str(tmp_path / 'hybrid.iso')
+    builder = ISOBuilder(rock_ridge=True)
+    builder.add_file('isolinux/isolinux.bin', _isolinux())
+    builder.add_file('efi/boot.img', _efi_image())
+    builder.add_file('README.txt', b'readme')
+    builder.set_boot('isolinux/isolinux.bin' if bios else None, 'efi/boot.img' if efi else None, efi_sectors)
+    builder.build(path)
+    return path, builder
+
+
+def _read(path, offset, size):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def _crc_ok(header):
+    header = bytearray(header[:92])
+    crc = struct.unpack_from('<I', header, 16)[0]
+    struct.pack_into('<I', header, 16, 0)
+    return zlib.crc32(header) & 0xffffffff == crc
+
+
+@pytest.mark.parametrize('efi_sectors, expected', [(0, EFI_IMAGE_SECTORS), (1, EFI_IMAGE_SECTORS), (40, 40)])
+def test_read_boot_catalog(tmp_path, efi_sectors, expected):
+    path, builder = _build(tmp_path, efi_sectors=efi_sectors)
+    with open(path, 'rb') as f:
+        info = iso_hybrid.read_boot_catalog(f)
+    assert info['bios_lba'] == builder.file_lba('isolinux/isolinux.bin')
+    assert info['efi_lba'] == builder.file_lba('efi/boot.img')
+    # 扇区数为0或1时从FAT头推算
+    assert info['efi_sectors'] == expected
+    assert info['volume_blocks'] * 2048 == os.path.getsize(path)
+
+
+def test_bios_hybrid(tmp_path):
+    path, builder = _build(tmp_path, efi=False)
+    original_size = os.path.getsize(path)
+    code = bytes(range(256)) + bytes(176)
+    code_path = tmp_path / 'mbr.bin'
+    code_path.write_bytes(code)
+
+    info = iso_hybrid.make_hybrid(path, mbr_code_path=str(code_path))
+    assert not info['uefi'] and info['isolinux_hybrid']
+    size = os.path.getsize(path)
+    assert size % CYLINDER_SIZE == 0 and size >= original_size
+
+    mbr = _read(path, 0, SECTOR_SIZE)
+    assert mbr[:432] == code and mbr[510:512] == b'\x55\xaa'
+    lba = builder.file_lba('isolinux/isolinux.bin')
+    assert struct.unpack_from('<Q', mbr, 432)[0] == lba * 4
+    table = partition_table.read_partition_table(path)
+    assert table['type'] == 'mbr'
+    assert [(p['start_lba'], p['sectors'], p['mbr_type'], p['bootable']) for p in table['partitions']] == \
+        [(0, size // SECTOR_SIZE, 0x17, True)]
+
+    # boot-info表：主卷描述符LBA、文件LBA、文件大小、偏移64起的32位校验和
+    isolinux = _isolinux()
+    checksum = sum(struct.unpack_from(f'<{(len(isolinux) - 64) // 4}I', isolinux, 64)) & 0xffffffff
+    assert _read(path, lba * 2048 + 8, 16) == struct.pack('<IIII', 16, lba, len(isolinux), checksum)
+
+    # 混合化后ISO9660内容不变
+    with ISOReader(path) as reader:
+        assert b''.join(reader.read_chunks(reader.lookup('README.txt'))) == b'readme'
+
+
+def test_uefi_hybrid(tmp_path):
+    path, builder = _build(tmp_path)
+    info = iso_hybrid.make_hybrid(path)
+    assert info['uefi']
+    size = os.path.getsize(path)
+    total_sectors = size // SECTOR_SIZE
+
+    primary = _read(path, SECTOR_SIZE, SECTOR_SIZE)
+    backup = _read(path, size - SECTOR_SIZE, SECTOR_SIZE)
+    assert primary[:8] == b'EFI PART' and _crc_ok(primary)
+    assert backup[:8] == b'EFI PART' and _crc_ok(backup)
+    assert struct.unpack_from('<QQ', backup, 24) == (total_sectors - 1, 1)
+
+    table = partition_table.read_partition_table(path)
+    assert table['type'] == 'gpt'
+    efi_start = builder.file_lba('efi/boot.img') * 4
+    efi = [p for p in table['partitions'] if p['gpt_type'] == str(GPT_TYPE_EFI_SYSTEM)]
+    assert [(p['start_lba'], p['sectors']) for p in efi] == [(efi_start, EFI_IMAGE_SECTORS)]
+    assert {p['mbr_type'] for p in table['mbr_partitions']} == {0x17, 0xEF, 0xEE}
+
+
+@pytest.mark.parametrize('uefi', [False, True])
+def test_rollback_restores_original(tmp_path, uefi):
+    path, _ = _build(tmp_path)
+    with open(path, 'rb') as f:
+        original = f.read()
+    info = iso_hybrid.make_hybrid(path, uefi=uefi)
+    assert os.path.exists(info['journal'])
+    assert _read(path, 0, len(original)) != original
+
+    iso_hybrid.rollback_hybrid(path)
+    with open(path, 'rb') as f:
+        assert f.read() == original
+    assert not os.path.exists(info['journal'])
+
+
+def test_rollback_after_repeated_conversion(tmp_path):
+    path, _ = _build(tmp_path)
+    with open(path, 'rb') as f:
+        original = f.read()
+    # 重复转换复用同一个日志，回滚后仍应得到最初的ISO
+    iso_hybrid.make_hybrid(path, uefi=False)
+    iso_hybrid.make_hybrid(path, uefi=True)
+    iso_hybrid.make_hybrid(path, uefi=True)
+    iso_hybrid.rollback_hybrid(path)
+    with open(path, 'rb') as f:
+        assert f.read() == original
+
+
+def test_rollback_overlapping_regions(tmp_path, monkeypatch):
+    path, _ = _build(tmp_path)
+    with open(path, 'rb') as f:
+        original = f.read()
+    iso_hybrid.make_hybrid(path, uefi=True)
+
+    # 第二次转换把MBR和主GPT合并为一个区域写入，与上次记录的区域重叠但不相同
+    plan = iso_hybrid.plan_hybrid
+
+    def merged_plan(*args, **kwargs):
+        writes, new_size, info = plan(*args, **kwargs)
+        (_, mbr), (_, gpt) = writes[:2]
+        return [(0, mbr + gpt)] + writes[2:], new_size, info
+
+    monkeypatch.setattr(iso_hybrid, 'plan_hybrid', merged_plan)
+    iso_hybrid.make_hybrid(path, uefi=True)
+    iso_hybrid.rollback_hybrid(path)
+    with open(path, 'rb') as f:
+        assert f.read() == original
+
+
+def test_plan_does_not_modify(tmp_path):
+    path, _ = _build(tmp_path)
+    with open(path, 'rb') as f:
+        original = f.read()
+    writes, new_size, info = iso_hybrid.plan_hybrid(path)
+    assert writes and new_size % CYLINDER_SIZE == 0
+    assert all(offset + len(data) <= new_size for offset, data in writes)
+    with open(path, 'rb') as f:
+        assert f.read() == original
+
+
+def test_missing_boot_images(tmp_path):
+    path, _ = _build(tmp_path, efi=False)
+    with pytest.raises(ValueError):
+        iso_hybrid.plan_hybrid(path, uefi=True)
+
+    plain = str(tmp_path / 'plain.iso')
+    builder = ISOBuilder()
+    builder.add_file('a.txt', b'a')
+    builder.build(plain)
+    with pytest.raises(ValueError):
+        iso_hybrid.plan_hybrid(plain)
+
+    zero = tmp_path / 'zero.img'
+    zero.write_bytes(bytes(64 * 1024))
+    with pytest.raises(ValueError):
+        iso_hybrid.plan_hybrid(str(zero))
@@ -0,0 +1,160 @@
+import pytest
+
+import iso_reader
+from iso_reader import ISOReader
+from iso_image import build_iso, ISOBuilder
+
+FILES = {
+    'README.txt': b'hello',
+    'Mixed Case Name.iso': b'iso' * 1000,
+    'boot/isolinux/isolinux.cfg': b'DEFAULT linux\n',
+    'empty': b'',
+    'docs/a/b': None,
+}
+
+
+@pytest.mark.parametrize('options, mode, name', [
+    ({}, 'iso9660', 'MIXED_CA.ISO'),
+    ({'joliet': True}, 'joliet', 'Mixed Case Name.iso'),
+    ({'rock_ridge': True}, 'rockridge', 'Mixed Case Name.iso'),
+    # 两者都有时优先使用Rock Ridge名称
+    ({'joliet': True, 'rock_ridge': True}, 'rockridge', 'Mixed Case Name.iso'),
+])
+def test_name_modes(tmp_path, options, mode, name):
+    path = str(tmp_path / 'test.iso')
+    build_iso(path, FILES, **options)
+    with ISOReader(path) as reader:
+        assert reader.names_mode == mode
+        assert reader.rock_ridge == (mode == 'rockridge')
+        assert name in [e.name for e in reader.listdir_page('/')]
+        entry = reader.lookup(name)
+        assert not entry.is_dir and entry.size == 3000
+        assert b''.join(reader.read_chunks(entry, chunk_size=1000)) == FILES['Mixed Case Name.iso']
+        assert reader.lookup('boot/isolinux/isolinux.cfg') is not None
+        assert reader.lookup('docs/a/b').is_dir and reader.listdir_page('docs/a/b') == []
+        assert reader.lookup('empty').size == 0
+
+
+def test_case_folding(tmp_path):
+    path = str(tmp_path / 'test.iso')
+    build_iso(path, FILES, joliet=True)
+    with ISOReader(path) as reader:
+        # Joliet/ISO9660 名称不区分大小写
+        assert reader.lookup('/BOOT/IsoLinux/ISOLINUX.CFG').name == 'isolinux.cfg'
+    build_iso(path, FILES, rock_ridge=True)
+    with ISOReader(path) as reader:
+        # Rock Ridge 是POSIX名称，区分大小写
+        assert reader.lookup('/BOOT/isolinux/isolinux.cfg') is None
+        assert reader.lookup('/boot/isolinux/isolinux.cfg') is not None
+
+
+def test_lookup_missing(tmp_path):
+    path = str(tmp_path / 'test.iso')
+    build_iso(path, FILES, rock_ridge=True)
+    with ISOReader(path) as reader:
+        assert reader.lookup('missing') is None
+        # 路径中间是文件
+        assert reader.lookup('README.txt/x') is None
+        assert reader.lookup('/').is_dir
+        with pytest.raises(NotADirectoryError):
+            reader.listdir_page('README.txt')
+
+
+@pytest.mark.parametrize('options', [{'rock_ridge': True}, {'joliet': True}, {}])
+def test_multi_extent_file(tmp_path, options):
+    data = bytes(range(256)) * 100
+    path = str(tmp_path / 'test.iso')
+    build_iso(path, {'big.bin': data, 'small.txt': b'x'}, max_extent=8192, **options)
+    with ISOReader(path) as reader:
+        entries = reader.listdir_page('/')
+        # 多个区段的目录记录合并为一条
+        assert len(entries) == 2
+        big = reader.lookup('big.bin')
+        assert big.size == len(data)
+        assert len(big.extents) == 4 and sum(size for _, size in big.extents) == len(data)
+        assert b''.join(reader.read_chunks(big, chunk_size=3000)) == data
+        assert b''.join(reader.read_chunks(reader.lookup('small.txt'))) == b'x'
+
+
+def test_multi_extent_across_read_chunks(tmp_path, monkeypatch):
+    # 每次只读一个块，让多区段文件的记录跨越两次读取
+    monkeypatch.setattr(iso_reader, 'DIRECTORY_READ_BLOCKS', 1)
+    files = {f'file{i:03d}.txt': b'%d' % i for i in range(60)}
+    files['file030.zzz'] = bytes(200 * 1024)
+    path = str(tmp_path / 'test.iso')
+    build_iso(path, files, rock_ridge=True, max_extent=2048)
+    with ISOReader(path) as reader:
+        assert reader.lookup('/').size > 2048 * 3
+        entries = list(reader.iterdir('/'))
+        assert sorted(e.name for e in entries) == sorted(files)
+        big = reader.lookup('file030.zzz')
+        assert big.size == 200 * 1024 and len(big.extents) == 100
+        assert b''.join(reader.read_chunks(big)) == files['file030.zzz']
+
+
+def test_paged_listing(tmp_path):
+    files = {f'item{i:04d}.dat': b'%d' % i for i in range(500)}
+    path = str(tmp_path / 'test.iso')
+    build_iso(path, files, rock_ridge=True)
+    with ISOReader(path) as reader:
+        # 500条记录占用多个目录块
+        assert reader.lookup('/').size > 2048 * 10
+        pages = []
+        start = 0
+        while True:
+            page = reader.listdir_page('/', start, 64)
+            if not page:
+                break
+            assert len(page) <= 64
+            pages.extend(e.name for e in page)
+            start += len(page)
+        assert sorted(pages) == sorted(files)
+        assert reader.listdir_page('/', 490, 100)[-1].name == pages[-1]
+        assert reader.listdir_page('/', 1000) == []
+        assert [e.name for e in reader.prefix('/', 'item012')] == [f'item012{i}.dat' for i in range(10)]
+        assert len(reader.prefix('/', 'item', limit=5)) == 5
+        assert reader.prefix('/', 'none') == []
+
+
+def test_table_cache_is_bounded(tmp_path):
+    files = {f'd{i}/f.txt': b'x' for i in range(10)}
+    path = str(tmp_path / 'test.iso')
+    build_iso(path, files, rock_ridge=True)
+    with ISOReader(path, max_cached_dirs=3) as reader:
+        for i in range(10):
+            assert reader.lookup(f'd{i}/f.txt') is not None
+        assert len(reader._tables) <= 3
+
+
+def test_walk(tmp_path):
+    path = str(tmp_path / 'test.iso')
+    build_iso(path, FILES, joliet=True)
+    with ISOReader(path) as reader:
+        tree = {dir_path: sorted(e.name for e in entries) for dir_path, entries in reader.walk('/')}
+        assert tree['/'] == ['Mixed Case Name.iso', 'README.txt', 'boot', 'docs', 'empty']
+        assert tree['/boot/isolinux'] == ['isolinux.cfg']
+        assert tree['/docs/a/b'] == []
+        shallow = [dir_path for dir_path, _ in reader.walk('/', max_depth=1)]
+        assert sorted(shallow) == ['/', '/boot', '/docs']
+        with pytest.raises(NotADirectoryError):
+            list(reader.walk('README.txt'))
+
+
+def test_file_object_source(tmp_path):
+    path = str(tmp_path / 'test.iso')
+    builder = ISOBuilder(volume_id='MYDISC', rock_ridge=True)
+    builder.add_file('a.txt', b'abc')
+    total_blocks = builder.build(path)
+    with open(path, 'rb') as f:
+        reader = ISOReader(f)
+        assert reader.volume_id == 'MYDISC' and reader.volume_blocks == total_blocks
+        reader.close()
+        # 调用方传入的文件对象不由读取器关闭
+        assert not f.closed
+
+
+def test_not_an_iso(tmp_path):
+    path = tmp_path / 'zero.img'
+    path.write_bytes(bytes(64 * 1024))
+    with pytest.raises(ValueError):
+        ISOReader(str(path))
@@ -0,0 +1,113 @@
+import json
+import shutil
+import struct
+import subprocess
+import zlib
+
+import pytest
+
+import partition_table
+from partition_table import SECTOR_SIZE, GPT_ENTRIES_SECTORS
+
+MiB = 1024 * 1024
+
+
+@pytest.fixture
+def image(tmp_path):
+    """64MB 的稀疏镜像文件"""
+    path = tmp_path / 'disk.img'
+    with open(path, 'wb') as f:
+        f.truncate(64 * MiB)
+    return str(path)
+
+
+def _header_crc_ok(sector):
+    header = bytearray(sector[:92])
+    crc = struct.unpack_from('<I', header, 16)[0]
+    struct.pack_into('<I', header, 16, 0)
+    return zlib.crc32(header) & 0xffffffff == crc
+
+
+def test_gpt_round_trip(image):
+    layout = partition_table.write_partition_table(image, 'gpt', [
+        {'size': '16M', 'type': 'efi', 'format': 'fat32'},
+        {'size': None, 'format': 'exfat', 'name': 'DATA'},
+    ])
+    table = partition_table.read_partition_table(image)
+    assert table['type'] == 'gpt'
+    # 保护性MBR只有一个 0xEE 分区
+    assert [p['mbr_type'] for p in table['mbr_partitions']] == [0xEE]
+    assert [(p['start_lba'], p['end_lba'], p['gpt_type'], p['name']) for p in table['partitions']] == \
+        [(p['start_lba'], p['end_lba'], p['gpt_type'], p['name']) for p in layout]
+    assert layout[0]['gpt_type'] == str(partition_table.GPT_TYPE_EFI_SYSTEM)
+    assert layout[1]['name'] == 'DATA'
+
+
+def test_gpt_layout_is_aligned_and_fits(image):
+    layout = partition_table.write_partition_table(image, 'gpt', [{'size': '10M'}, {'size': '50%'}, {}])
+    total_sectors = 64 * MiB // SECTOR_SIZE
+    align = partition_table.DEFAULT_ALIGNMENT // SECTOR_SIZE
+    for part in layout:
+        assert part['start_lba'] % align == 0
+    for before, after in zip(layout, layout[1:]):
+        assert before['end_lba'] < after['start_lba']
+    assert layout[-1]['end_lba'] <= total_sectors - GPT_ENTRIES_SECTORS - 2
+
+
+def test_gpt_backup_header(image):
+    partition_table.write_partition_table(image, 'gpt', [{'size': '8M'}])
+    with open(image, 'rb') as f:
+        primary = f.read(2 * SECTOR_SIZE)[SECTOR_SIZE:]
+        f.seek(-SECTOR_SIZE, 2)
+        backup = f.read(SECTOR_SIZE)
+        f.seek(-(GPT_ENTRIES_SECTORS + 1) * SECTOR_SIZE, 2)
+        backup_entries = f.read(GPT_ENTRIES_SECTORS * SECTOR_SIZE)
+    assert backup[:8] == b'EFI PART' and _header_crc_ok(backup)
+    current, other = struct.unpack_from('<QQ', backup, 24)
+    assert current == 64 * MiB // SECTOR_SIZE - 1 and other == 1
+    assert struct.unpack_from('<I', backup, 88)[0] == zlib.crc32(backup_entries) & 0xffffffff
+    assert struct.unpack_from('<I', primary, 88)[0] == struct.unpack_from('<I', backup, 88)[0]
+
+
+def test_mbr_round_trip(image):
+    layout = partition_table.write_partition_table(image, 'mbr', [
+        {'size': '20M', 'format': 'fat32'},
+        {'size': '*', 'format': 'ext4'},
+    ])
+    table = partition_table.read_partition_table(image)
+    assert table['type'] == 'mbr'
+    assert [(p['start_lba'], p['sectors'], p['mbr_type']) for p in table['partitions']] == \
+        [(p['start_lba'], p['sectors'], p['mbr_type']) for p in layout]
+    assert [p['bootable'] for p in table['partitions']] == [True, False]
+
+
+def test_mbr_replaces_gpt(image):
+    partition_table.write_partition_table(image, 'gpt', [{'size': '8M'}])
+    partition_table.write_partition_table(image, 'mbr', [{'size': '8M'}])
+    assert partition_table.read_partition_table(image)['type'] == 'mbr'
+    with open(image, 'rb') as f:
+        f.seek(-SECTOR_SIZE, 2)
+        assert f.read(8) != b'EFI PART'
+
+
+def test_dry_run_does_not_write(image):
+    layout = partition_table.write_partition_table(image, 'gpt', [{'size': '8M'}], dry_run=True)
+    assert layout and partition_table.read_partition_table(image)['type'] is None
+
+
+def test_invalid_layouts(image):
+    with pytest.raises(ValueError):
+        partition_table.write_partition_table(image, 'mbr', [{'size': '1M'}] * 5)
+    with pytest.raises(ValueError):
+        # 前两个分区已占满磁盘
+        partition_table.write_partition_table(image, 'gpt', [{}, {}, {'size': '1M'}])
+    with pytest.raises(ValueError):
+        partition_table.write_partition_table(image, 'apm', [])
+
+
+@pytest.mark.skipif(not shutil.which('sfdisk'), reason='需要 sfdisk')
+def test_sfdisk_reads_gpt(image):
+    layout = partition_table.write_partition_table(image, 'gpt', [{'size': '16M', 'type': 'efi'}, {}])
+    output = subprocess.run(['sfdisk', '--json', image], capture_output=True, text=True, check=True).stdout
+    parts = json.loads(output)['partitiontable']['partitions']
+    assert [(p['start'], p['size']) for p in parts] == [(p['start_lba'], p['sectors']) for p in layout]
@@ -0,0 +1,191 @@
+import shutil
+import struct
+import zlib
+
+import pytest
+
+import iso_hybrid
+import partition_table
+import persistence
+from fat_volume import FatVolume
+from iso_image import ISOBuilder
+from iso_reader import ISOReader
+from partition_table import SECTOR_SIZE, GPT_TYPE_LINUX_FS
+
+MiB = 1024 * 1024
+DEVICE_SIZE = 256 * MiB
+
+
+def _hybrid_image(tmp_path, uefi):
+    """带isolinux和EFI引导映像的混合ISO"""
+    isolinux = bytearray(4096)
+    struct.pack_into('<I', isolinux, 0x40, iso_hybrid.ISOLINUX_HYBRID_MAGIC)
+    efi = bytearray(64 * SECTOR_SIZE)
+    efi[0:3] = b'\xeb\x3c\x90'
+    struct.pack_into('<HBHBHH', efi, 11, 512, 4, 1, 2, 512, 64)
+    efi[510:512] = b'\x55\xaa'
+
+    path = str(tmp_path / 'live.iso')
+    builder = ISOBuilder(rock_ridge=True)
+    builder.add_file('isolinux/isolinux.bin', isolinux)
+    builder.add_file('efi/boot.img', efi)
+    builder.add_file('casper/vmlinuz', b'kernel' * 1000)
+    builder.set_boot('isolinux/isolinux.bin', 'efi/boot.img')
+    builder.build(path)
+    iso_hybrid.make_hybrid(path, uefi=uefi)
+    return path
+
+
+def _device(tmp_path, image):
+    """把镜像写到更大的"U盘"开头"""
+    device = str(tmp_path / 'usb.img')
+    with open(device, 'wb') as f:
+        f.truncate(DEVICE_SIZE)
+    with open(image, 'rb') as src, open(device, 'r+b') as dst:
+        shutil.copyfileobj(src, dst)
+    return device
+
+
+def _image_size(path):
+    with open(path, 'rb') as f:
+        return f.seek(0, 2)
+
+
+def _read(path, offset, size):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def _crc_ok(header):
+    header = bytearray(header[:92])
+    crc = struct.unpack_from('<I', header, 16)[0]
+    struct.pack_into('<I', header, 16, 0)
+    return zlib.crc32(header) & 0xffffffff == crc
+
+
+def test_mbr_hybrid(tmp_path):
+    image = _hybrid_image(tmp_path, uefi=False)
+    image_size = _image_size(image)
+    device = _device(tmp_path, image)
+
+    part = persistence.add_persistence_partition(device, image_size, filesystem='fat32')
+    assert part['tables'] == ['mbr']
+    assert part['start_lba'] * SECTOR_SIZE >= image_size
+    assert part['offset'] % MiB == 0
+    assert part['offset'] + part['size'] == DEVICE_SIZE
+
+    table = partition_table.read_partition_table(device)
+    assert table['type'] == 'mbr'
+    assert [(p['start_lba'], p['sectors'], p['mbr_type']) for p in table['partitions']][1:] == \
+        [(part['start_lba'], part['sectors'], 0x0C)]
+    # 原有的ISO分区和ISO9660内容不受影响
+    assert table['partitions'][0]['mbr_type'] == 0x17
+    assert _read(device, 0, 440) == _read(image, 0, 440)
+    with ISOReader(device) as reader:
+        assert b''.join(reader.read_chunks(reader.lookup('casper/vmlinuz'))) == b'kernel' * 1000
+    with FatVolume(device, offset=part['offset']) as volume:
+        assert volume.fat_type == 32 and volume.listdir() == []
+    assert _read(device, part['offset'] + 71, 11) == b'CASPER-RW  '
+
+
+def test_uefi_hybrid(tmp_path):
+    image = _hybrid_image(tmp_path, uefi=True)
+    image_size = _image_size(image)
+    device = _device(tmp_path, image)
+    old_backup = _read(device, image_size - SECTOR_SIZE, SECTOR_SIZE)
+
+    writes, part = persistence.plan_persistence(device, image_size, size='100M')
+    assert part['tables'] == ['mbr', 'gpt'] and part['size'] == 100 * MiB
+    with open(device, 'r+b') as f:
+        for offset, data in writes:
+            f.seek(offset)
+            f.write(data)
+
+    total_sectors = DEVICE_SIZE // SECTOR_SIZE
+    primary = _read(device, SECTOR_SIZE, SECTOR_SIZE)
+    backup = _read(device, DEVICE_SIZE - SECTOR_SIZE, SECTOR_SIZE)
+    assert _crc_ok(primary) and _crc_ok(backup)
+    # 主GPT的备份位置指向设备末尾，镜像末尾原来的备份GPT原样保留
+    assert struct.unpack_from('<QQ', primary, 24) == (1, total_sectors - 1)
+    assert struct.unpack_from('<QQ', backup, 24) == (total_sectors - 1, 1)
+    assert _read(device, image_size - SECTOR_SIZE, SECTOR_SIZE) == old_backup
+
+    table = partition_table.read_partition_table(device)
+    assert table['type'] == 'gpt'
+    new = [p for p in table['partitions'] if p['name'] == 'persistence']
+    assert [(p['start_lba'], p['sectors'], p['gpt_type']) for p in new] == \
+        [(part['start_lba'], part['sectors'], str(GPT_TYPE_LINUX_FS))]
+    mbr_new = [p for p in table['mbr_partitions'] if p['mbr_type'] == 0x83]
+    assert [(p['start_lba'], p['sectors']) for p in mbr_new] == [(part['start_lba'], part['sectors'])]
+    assert struct.unpack_from('<I', primary, 88) == struct.unpack_from('<I', backup, 88)
+
+
+def test_protective_mbr_only(tmp_path):
+    # 纯GPT镜像（只有保护性MBR）
+    image = str(tmp_path / 'gpt.img')
+    with open(image, 'wb') as f:
+        f.truncate(32 * MiB)
+    partition_table.write_partition_table(image, 'gpt', [{'size': '16M', 'type': 'efi'}])
+    device = _device(tmp_path, image)
+
+    writes, part = persistence.plan_persistence(device, 32 * MiB, filesystem='fat32')
+    assert part['tables'] == ['gpt']
+    mbr = dict(writes)[0]
+    # 只把0xEE分区项扩展到整个设备
+    assert mbr[446 + 4] == 0xEE
+    assert struct.unpack_from('<II', mbr, 446 + 8) == (1, DEVICE_SIZE // SECTOR_SIZE - 1)
+
+
+def test_dry_run_and_errors(tmp_path):
+    image = _hybrid_image(tmp_path, uefi=False)
+    image_size = _image_size(image)
+    device = _device(tmp_path, image)
+    with open(device, 'rb') as f:
+        before = f.read(4 * MiB)
+    part = persistence.add_persistence_partition(device, image_size, filesystem='fat32', dry_run=True)
+    assert part['label'] == persistence.LABEL_CASPER
+    with open(device, 'rb') as f:
+        assert f.read(4 * MiB) == before
+
+    with pytest.raises(ValueError):
+        persistence.add_persistence_partition(device, image_size, filesystem='ntfs')
+    # 镜像之后的空间不足64MB
+    with pytest.raises(ValueError):
+        persistence.plan_persistence(device, DEVICE_SIZE - 32 * MiB)
+    with pytest.raises(ValueError):
+        persistence.plan_persistence(image, image_size)
+
+    blank = str(tmp_path / 'blank.img')
+    with open(blank, 'wb') as f:
+        f.truncate(DEVICE_SIZE)
+    with pytest.raises(ValueError):
+        persistence.plan_persistence(blank, MiB)
+
+
+def test_full_mbr(tmp_path):
+    device = str(tmp_path / 'usb.img')
+    with open(device, 'wb') as f:
+        f.truncate(DEVICE_SIZE)
+    partition_table.write_partition_table(device, 'mbr', [{'size': '1M'}] * 4)
+    with pytest.raises(ValueError):
+        persistence.plan_persistence(device, 8 * MiB)
+
+
+@pytest.mark.skipif(not (shutil.which('mke2fs') or shutil.which('mkfs.ext4')), reason='需要 mke2fs')
+def test_ext4_debian_live(tmp_path):
+    image = _hybrid_image(tmp_path, uefi=False)
+    device = _device(tmp_path, image)
+    part = persistence.add_persistence_partition(device, _image_size(image), size='80M',
+                                                 label=persistence.LABEL_DEBIAN_LIVE)
+    # ext4超级块位于分区起点1024字节处，魔数 0xEF53
+    superblock = _read(device, part['offset'] + 1024, 1024)
+    assert struct.unpack_from('<H', superblock, 56)[0] == 0xEF53
+    assert superblock[120:131] == b'persistence'
+
+
+def test_kernel_args():
+    assert persistence.persistence_label('debian-live') == persistence.LABEL_DEBIAN_LIVE
+    assert persistence.persistence_label('casper') == persistence.LABEL_CASPER
+    assert persistence.persistence_kernel_arg(persistence.LABEL_DEBIAN_LIVE) == 'persistence'
+    assert persistence.persistence_kernel_arg(persistence.LABEL_CASPER) == 'persistent'
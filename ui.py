@@ -155,8 +155,9 @@ class AdvancedOptionsDialog(QDialog):
         buffer_layout = QHBoxLayout()
         buffer_layout.addWidget(QLabel(t('advanced.buffer_size')))
         self.buffer_size = QSpinBox()
-        self.buffer_size.setRange(1, 32768)  # 1KB to 32MB
-        self.buffer_size.setValue(current_options.get('buffer_size', 4096))
+        self.buffer_size.setRange(0, 32768)  # 1KB to 32MB，0 表示自动
+        self.buffer_size.setSpecialValueText("自动")
+        self.buffer_size.setValue(current_options.get('buffer_size') or 0)
         self.buffer_size.setSuffix(" KB")
         buffer_layout.addWidget(self.buffer_size)
         advanced_layout.addLayout(buffer_layout)
@@ -195,7 +196,7 @@ class AdvancedOptionsDialog(QDialog):
             'write_method': 'iso9660' if self.iso9660_radio.isChecked() else 'dd',
             'verify_after_write': self.verify_after_write.isChecked(),
             'skip_verify': self.skip_verify.isChecked(),
-            'buffer_size': self.buffer_size.value(),
+            'buffer_size': self.buffer_size.value() or None,
             'compression': self.compression.isChecked(),
             'force_uefi': self.force_uefi.isChecked(),
             'preserve_data': self.preserve_data.isChecked()
@@ -550,7 +551,7 @@ class ISOListDialog(QDialog):
         
         # 刷新按钮
         refresh_button = QPushButton("刷新列表")
-        refresh_button.clicked.connect(self.refresh_list)
+        refresh_button.clicked.connect(lambda: self.refresh_list(force=True))
         layout.addWidget(refresh_button)
         
         # 确定取消按钮
@@ -619,11 +620,14 @@ class ISOListDialog(QDialog):
             size /= 1024
         return f"{size:.1f} PB"
     
-    def refresh_list(self):
-        """刷新ISO列表"""
+    def refresh_list(self, force=False):
+        """
+        刷新ISO列表
+        :param force: 是否完整重扫，否则只重新列出有变化的目录
+        """
         if self.usb_maker:
             self.iso_list.clear()
-            iso_files = self.usb_maker.scan_for_isos()
+            iso_files = self.usb_maker.scan_for_isos(force=force)
             for iso in iso_files:
                 self.add_iso_item(iso)
     
@@ -1111,12 +1115,18 @@ class USBMakerApp(QMainWindow):
         self.usb_maker.progress_signal.connect(self.update_progress)
         self.usb_maker.speed_signal.connect(lambda speed: self.speed_display.update_speed(speed))
         self.usb_maker.remaining_time_signal.connect(lambda time: self.time_label.setText(f"预计剩余时间: {time}"))
+        # 插拔U盘时自动更新设备列表
+        self.usb_maker.drives_changed_signal.connect(self.populate_device_combo)
+        # 下载目录中的ISO写完后加入最近文件列表
+        self.usb_maker.iso_ready_signal.connect(self.add_found_isos)
         
         # 创建菜单栏
         self.create_menu_bar()
         
         # 刷新设备列表
         self.refresh_usb_drives()
+        self.usb_maker.start_device_monitor()
+        self.usb_maker.monitor_iso_directories()
         
         # 更新按钮状态
         self.update_button_states()
@@ -1136,15 +1146,21 @@ class USBMakerApp(QMainWindow):
         QApplication.processEvents()
         
         try:
-            drives = self.usb_maker.get_usb_drives()
-            self.device_combo.clear()
-            
-            if drives:
-                self.device_combo.addItems(drives)
-            else:
-                self.device_combo.addItem('未检测到USB设备')
+            self.populate_device_combo(self.usb_maker.get_usb_drives())
         finally:
             loading.close()
+    
+    def populate_device_combo(self, drives):
+        """用设备列表填充下拉框，保留原来的选择"""
+        current = self.device_combo.currentText()
+        self.device_combo.clear()
+        
+        if drives:
+            self.device_combo.addItems(drives)
+            if current in drives:
+                self.device_combo.setCurrentText(current)
+        else:
+            self.device_combo.addItem('未检测到USB设备')
         
         self.update_button_states()
     
@@ -1211,15 +1227,15 @@ class USBMakerApp(QMainWindow):
             
             # 在新线程中执行写入
             def write_thread():
-                success = self.usb_maker.write_iso_to_usb(
+                success, message = self.usb_maker.write_iso_to_usb(
                     self.iso_path.text(),
-                    self.device_combo.currentText()
+                    self.usb_maker.resolve_device(self.device_combo.currentText())
                 )
                 
                 if success:
                     self.status_label.setText('写入完成！')
                 else:
-                    self.status_label.setText('写入失败！')
+                    self.status_label.setText(f'写入失败: {message}')
                 
                 self.start_btn.setEnabled(True)
                 self.cancel_btn.setEnabled(True)
@@ -1242,6 +1258,13 @@ class USBMakerApp(QMainWindow):
             self.start_btn.setEnabled(True)
             self.cancel_btn.setEnabled(True)
     
+    def closeEvent(self, event):
+        """关闭窗口时停止设备和ISO目录监控，释放浏览中的ISO"""
+        self.usb_maker.stop_device_monitor()
+        self.usb_maker.stop_iso_monitor()
+        self.usb_maker.close_iso_contents()
+        super().closeEvent(event)
+    
     def update_button_states(self):
         """更新按钮状态"""
         has_iso = bool(self.iso_path.text())
@@ -1496,6 +1519,15 @@ class USBMakerApp(QMainWindow):
                 item.setToolTip(file_path)
                 self.recent_list.addItem(item)
     
+    def add_found_isos(self, paths):
+        """把一批新发现的ISO文件加入最近文件列表，只刷新一次列表"""
+        for path in paths:
+            self.recent_files.add_file(path)
+        self.update_recent_files_list()
+        names = ', '.join(os.path.basename(path) for path in paths[:3])
+        more = f" 等 {len(paths)} 个" if len(paths) > 3 else ""
+        self.status_label.setText(f"发现新的ISO文件: {names}{more}")
+    
     def select_recent_file(self, item):
         """选择最近使用的文件"""
         file_path = item.toolTip()
@@ -11,7 +11,34 @@ import hashlib
 import zlib
 import tempfile
 import shutil
-from fs_events import FSEventStream, FSEvents
+import io
+import stat
+import fs_events
+from fs_events import FSEvents
+from event_coalescer import EventCoalescer
+from monitor_manager import MonitorManager
+from iso_index import ISOIndex, DEFAULT_FULL_RESCAN_INTERVAL
+import dir_crawler
+import iso_hybrid
+from iso_reader import ISOReader
+from iso_library import ISOLibrary, LIBRARY_SCHEME
+from iso_copy import ISOFileCopier, CopyCancelled, LARGE_BUFFER_SIZE
+import file_split
+import partition_table
+import fs_format
+import multiboot
+import persistence
+import drive_enum
+import block_device
+from device_registry import DeviceRegistry, DeviceEvents
+from device_probe import DeviceProber
+import device_profile
+import storage_bench
+import capacity_check
+import badblock_scan
+from metadata_cache import MetadataCache
+from boot_config import BootConfigTransaction
+from delta_flash import DeltaFlasher, FlashManifestStore, BlockHasher
 
 # 国际化支持
 import json
@@ -73,7 +100,12 @@ class USBMaker(QObject):
     repair_status_signal = pyqtSignal(str)  # 修复状态信号
     partition_status_signal = pyqtSignal(str)  # 分区状态信号
     partition_progress_signal = pyqtSignal(int)  # 分区进度信号
-    iso_found_signal = pyqtSignal(str)  # ISO发现信号
+    iso_found_signal = pyqtSignal(str)  # ISO发现信号（文件写完后）
+    iso_ready_signal = pyqtSignal(list)  # 同一批写完的ISO文件路径列表
+    write_status_signal = pyqtSignal(str)  # 写入状态信号
+    write_progress_signal = pyqtSignal(int)  # 写入进度信号
+    device_event_signal = pyqtSignal(str, object)  # 设备热插拔信号 (DeviceEvents事件, Drive)
+    drives_changed_signal = pyqtSignal(list)  # 设备列表变化信号，传递显示名称列表
 
     def __init__(self, logger=None):
         super().__init__()
@@ -84,6 +116,19 @@ class USBMaker(QObject):
         self.bytes_written = 0
         self.is_writing = False
         self.should_cancel = False
+        # 最近一次枚举结果：显示名称 → Drive
+        self.drives = {}
+        self.device_registry = None
+        # ISO目录监控（MonitorManager）及其事件合并
+        self.iso_monitor = None
+        self.iso_coalescer = None
+        # 并行探测设备详情，卡住的设备先显示为“正在探测”
+        self.device_prober = DeviceProber(on_update=self._handle_probe_update)
+        # 设备容量、剩余空间等信息的缓存，插拔或写入后失效
+        self.metadata_cache = MetadataCache()
+        # 浏览中的ISO：路径 → (ISOReader, (大小, 修改时间))，翻页时复用，关闭浏览窗口时释放
+        self._iso_readers = {}
+        self._iso_readers_lock = threading.Lock()
         
         # 初始化国际化
         self.init_internationalization()
@@ -102,13 +147,17 @@ class USBMaker(QObject):
 
         # 高级选项默认值
         self.advanced_options = {
-            'write_method': 'dd',  # 'dd' or 'iso9660'
+            'write_method': 'dd',  # 'dd', 'iso9660' 或 'delta'（只写入变化的块）
             'verify_after_write': True,
-            'buffer_size': 4096,  # 4KB
+            'buffer_size': None,  # KB；None 表示自动：优先使用设备档案中实测最快的块大小
             'compression': False,
             'skip_verify': False,
             'force_uefi': False,
-            'preserve_data': False
+            'preserve_data': False,
+            'large_file_policy': 'split',  # 'split' 或 'data_partition'
+            'data_partition_dir': None,  # 双分区模式下NTFS/exFAT数据分区的挂载目录
+            'discard': False,  # 格式化后对数据区执行TRIM/discard
+            'capacity_check': 'sparse'  # 写入前检查扩容盘：'sparse'（稀疏探测，几秒）或 'off'
         }
     
     def init_internationalization(self):
@@ -323,41 +372,24 @@ class USBMaker(QObject):
                 except Exception as e:
                     self.logger.warning(f"检查驱动器 {drive} 时出错: {e}")
         
-        elif system == 'darwin':
-            import subprocess
-            
-            # macOS使用diskutil list
+        elif system in ('darwin', 'linux'):
             try:
-                output = subprocess.check_output(['diskutil', 'list'], universal_newlines=True)
-                for line in output.split('\n'):
-                    if '/dev/disk' in line and 'external' in line.lower():
-                        parts = line.split()
-                        if len(parts) >= 2:
-                            device = parts[1]
-                            drives.append({
-                                'path': f'/dev/disk{device}',
-                                'label': f'Disk {device}',
-                                'size': self.get_drive_size(f'/dev/disk{device}')
-                            })
-            except Exception as e:
-                self.logger.warning(f"列出USB驱动器时出错: {e}")
-        
-        elif system == 'linux':
-            import pyudev
-            
-            context = pyudev.Context()
-            for device in context.list_devices(subsystem='block', DEVTYPE='disk'):
-                if device.get('ID_BUS') == 'usb':
+                for drive in drive_enum.enumerate_drives(prober=self.device_prober):
                     drives.append({
-                        'path': device.device_node,
-                        'label': device.get('ID_VENDOR', 'Unknown'),
-                        'size': self.get_drive_size(device.device_node)
+                        'path': drive.path,
+                        'label': drive.label,
+                        'size': drive.size
                     })
+            except Exception as e:
+                self.logger.warning(f"列出USB驱动器时出错: {e}")
         
         return drives
 
     def get_drive_size(self, drive_path):
-        """获取驱动器大小"""
+        """获取驱动器大小（带缓存）"""
+        return self.metadata_cache.get(drive_path, 'size', lambda: self._load_drive_size(drive_path))
+
+    def _load_drive_size(self, drive_path):
         system = platform.system().lower()
         
         if system == 'windows':
@@ -385,8 +417,9 @@ class USBMaker(QObject):
                 return 0
         
         elif system == 'linux':
-            import os
             try:
+                if stat.S_ISBLK(os.stat(drive_path).st_mode):
+                    return block_device.probe_linux(drive_path).size
                 st = os.statvfs(drive_path)
                 return st.f_blocks * st.f_frsize
             except Exception as e:
@@ -434,72 +467,71 @@ class USBMaker(QObject):
             self.logger.error(f"获取磁盘大小失败: {e}")
             return '未知大小'
 
+    def enumerate_drives(self, removable_only=True):
+        """
+        一次批量查询所有磁盘（macOS一次diskutil调用，Linux只读sysfs和/proc/mounts）
+        设备注册表运行时直接读取其内存中的列表
+        :return: Drive 列表
+        """
+        if removable_only and self.device_registry and self.device_registry.running:
+            drives = self.device_registry.drives()
+        else:
+            drives = drive_enum.enumerate_drives(removable_only, prober=self.device_prober)
+        self.drives = {drive.display_name: drive for drive in drives}
+        return drives
+
+    def start_device_monitor(self, source=None):
+        """
+        启动设备注册表，U盘插拔时发出 device_event_signal 和 drives_changed_signal
+        :param source: device_registry.EventSource，None时按平台自动选择
+        """
+        if self.device_registry and self.device_registry.running:
+            return True, "设备监控已在运行"
+        try:
+            self.device_registry = DeviceRegistry(source, prober=self.device_prober)
+            self.device_registry.subscribe(self._handle_device_event)
+            self.device_registry.start()
+            return True, f"设备监控已启动（{self.device_registry.source.name}）"
+        except Exception as e:
+            self.device_registry = None
+            self.logger.error(f"启动设备监控失败: {e}")
+            return False, f"启动设备监控失败: {str(e)}"
+
+    def stop_device_monitor(self):
+        if self.device_registry:
+            self.device_registry.stop()
+            self.device_registry = None
+
+    def _handle_probe_update(self, drive):
+        """慢速设备探测完成（工作线程）：重新生成设备列表"""
+        if self.device_registry and self.device_registry.running:
+            self.device_registry.notify()
+            return
+        try:
+            drives = self.enumerate_drives()
+            self.drives_changed_signal.emit([item.display_name for item in drives])
+        except Exception as e:
+            self.logger.warning(f"更新设备列表失败: {e}")
+
+    def _handle_device_event(self, event, drive):
+        """注册表回调（后台线程），转换为Qt信号"""
+        self.logger.info(f"设备事件 {event}: {drive.path}")
+        if event == DeviceEvents.Remove:
+            # 设备节点已消失，无法再按设备号定位缓存项
+            self.invalidate_device_metadata()
+        else:
+            for path in (drive.path,) + drive.partitions + drive.mountpoints:
+                self.metadata_cache.invalidate(path)
+        self.device_event_signal.emit(event, drive)
+        drives = self.device_registry.drives() if self.device_registry else []
+        self.drives = {item.display_name: item for item in drives}
+        self.drives_changed_signal.emit([item.display_name for item in drives])
+
     def get_usb_drives(self):
         """获取可用的U盘列表"""
         try:
-            # 使用diskutil list获取所有磁盘信息
-            result = subprocess.check_output(['diskutil', 'list'], universal_newlines=True)
-            
-            # 存储U盘信息的列表
-            usb_drives = []
-            
-            # 逐行分析
-            for line in result.split('\n'):
-                # 查找磁盘
-                if '/dev/disk' in line:
-                    # 提取磁盘号
-                    disk_match = re.search(r'/dev/disk(\d+)', line)
-                    if disk_match:
-                        disk_number = disk_match.group(1)
-                        disk_path = f'/dev/disk{disk_number}'
-                        
-                        # 检查是否为可移动设备
-                        if not self.is_removable_device(disk_path):
-                            continue
-                        
-                        # 获取磁盘详细信息
-                        try:
-                            # 获取磁盘大小
-                            disk_size = self.get_disk_size(disk_path)
-                            
-                            # 尝试获取卷名
-                            volume_name = 'Unnamed'
-                            try:
-                                # 使用mount命令获取挂载的卷名
-                                mount_output = subprocess.check_output(['mount'], universal_newlines=True)
-                                volume_match = re.search(rf'{disk_path}s\d+\s+on\s+(.+)\s+\(', mount_output)
-                                if volume_match:
-                                    volume_name = os.path.basename(volume_match.group(1).strip())
-                            except:
-                                pass
-                            
-                            # 获取详细信息
-                            detailed_info = subprocess.check_output(['diskutil', 'info', disk_path], universal_newlines=True)
-                            
-                            # 检查文件系统
-                            fs_match = re.search(r'File System Personality:\s*(.+)', detailed_info)
-                            fs_type = fs_match.group(1).strip() if fs_match else 'Unknown'
-                            
-                            # 如果文件系统是Unknown，尝试从分区信息获取
-                            if fs_type == 'Unknown':
-                                partitions_output = subprocess.check_output(['diskutil', 'list', disk_path], universal_newlines=True)
-                                fs_matches = re.findall(r'\d+:\s+(\w+)\s+', partitions_output)
-                                for match in fs_matches:
-                                    if match.lower() in ['microsoft', 'fat', 'exfat', 'apfs', 'hfs']:
-                                        fs_type = match
-                                        break
-                            
-                            # 组合显示信息
-                            display_name = f"{volume_name} ({disk_path}) - {disk_size} [{fs_type}]"
-                            usb_drives.append((disk_path, display_name))
-                        
-                        except subprocess.CalledProcessError:
-                            # 如果获取详细信息失败，使用磁盘路径
-                            usb_drives.append((disk_path, f"{disk_path} - 未知大小 [未知文件系统]"))
-            
-            # 返回可用的U盘列表
-            return [name for _, name in usb_drives] if usb_drives else ['未找到U盘']
-        
+            drives = self.enumerate_drives()
+            return [drive.display_name for drive in drives] if drives else ['未找到U盘']
         except Exception as e:
             error_msg = f"获取U盘列表失败: {str(e)}"
             self.logger.error(error_msg)
@@ -509,16 +541,111 @@ class USBMaker(QObject):
     def is_removable_device(self, disk_path):
         """判断是否为可移动设备"""
         try:
-            # 使用 diskutil info 获取详细信息
-            detailed_info = subprocess.check_output(['diskutil', 'info', disk_path], universal_newlines=True)
-            
-            # 检查是否为外部设备或可移动设备
-            removable_keywords = ['external', 'removable', 'usb', 'flash', 'thumb']
-            return any(keyword in detailed_info.lower() for keyword in removable_keywords)
+            return self.metadata_cache.get(disk_path, 'removable',
+                                           lambda: self.find_drive(disk_path) is not None)
         except Exception as e:
             self.logger.warning(f"无法确定设备类型: {e}")
             return False
 
+    def get_block_device_info(self, device):
+        """获取设备容量、逻辑/物理扇区大小、最佳I/O大小及discard等特性（带缓存）"""
+        return self.metadata_cache.get(device, 'block_info', lambda: block_device.probe(device))
+
+    def get_io_size(self, device, requested=None):
+        """
+        按设备扇区和最佳I/O大小对齐的写入块大小
+        :param requested: 期望的块大小（字节），None时优先使用设备档案中实测最快的块大小，其次由设备决定
+        """
+        if requested is None:
+            profile = self.get_device_profile(device)
+            requested = profile.get('best_block_size') if profile else None
+        try:
+            return block_device.aligned_io_size(self.get_block_device_info(device), requested)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"获取 {device} 的I/O参数失败: {e}")
+            return requested or block_device.DEFAULT_IO_SIZE
+
+    def get_requested_buffer_size(self):
+        """
+        高级选项中手动设置的缓冲区大小
+        :return: 字节数，未设置（自动）时返回None
+        """
+        size = self.advanced_options.get('buffer_size')
+        return size * 1024 if size else None
+
+    def resolve_device(self, device):
+        """
+        把设备下拉框中的显示名称转换为设备路径，已经是路径时原样返回
+        :param device: 显示名称，如 "Unnamed (/dev/disk4) - 16.01 GB [FAT32]"，或设备路径
+        """
+        if device in self.drives:
+            return self.drives[device].path
+        match = re.search(r'\((/dev/[^)\s]+)\)', device)
+        return match.group(1) if match else device
+
+    def get_device_profiles(self):
+        """获取设备档案存储"""
+        if getattr(self, '_device_profiles', None) is None:
+            self._device_profiles = device_profile.DeviceProfileStore(
+                self.config.get('device_profiles_path') or self.get_default_config()['device_profiles_path'])
+        return self._device_profiles
+
+    def get_device_identity(self, device):
+        """获取设备身份（厂商、型号、序列号、容量、USB端口，带缓存）"""
+        return self.metadata_cache.get(device, 'identity', lambda: device_profile.identify(device))
+
+    def get_device_profile(self, device):
+        """
+        读取设备档案
+        :return: 档案字典，无法识别设备或没有记录时返回None
+        """
+        try:
+            return self.get_device_profiles().get(self.get_device_identity(device))
+        except Exception as e:
+            self.logger.debug(f"读取 {device} 的设备档案失败: {e}")
+            return None
+
+    def update_device_profile(self, device, action, *args):
+        """
+        更新设备档案，失败只记录日志，不影响写入流程
+        :param action: DeviceProfileStore 的方法名，如 record_failure
+        """
+        try:
+            getattr(self.get_device_profiles(), action)(self.get_device_identity(device), *args)
+        except Exception as e:
+            self.logger.warning(f"更新 {device} 的设备档案失败: {e}")
+
+    def find_drive(self, path):
+        """
+        查找设备或其分区所属的U盘
+        :return: Drive，不是可移动设备时返回None
+        """
+        disk = drive_enum.parent_disk(path)
+        if self.device_registry and self.device_registry.running:
+            return self.device_registry.get(disk)
+        return next((drive for drive in drive_enum.enumerate_drives(prober=self.device_prober)
+                     if drive.path == disk), None)
+
+    def invalidate_device_metadata(self, device=None):
+        """
+        设备内容或分区变化后清除缓存的容量、空间等信息
+        :param device: 设备路径，None表示全部
+        """
+        if device is None:
+            self.metadata_cache.invalidate()
+            return
+        drive = None
+        try:
+            drive = self.find_drive(device)
+        except Exception:
+            pass
+        paths = {device, drive_enum.parent_disk(device)}
+        if drive:
+            paths.update(drive.partitions)
+            paths.update(drive.mountpoints)
+        for path in paths:
+            self.metadata_cache.invalidate(path)
+
     def validate_iso(self, iso_path):
         """校验ISO文件完整性"""
         try:
@@ -549,12 +676,20 @@ class USBMaker(QObject):
             self.logger.warning(f"在线哈希校验失败: {e}")
             return True  # 默认信任本地校验
 
-    def check_disk_safety(self, disk_path):
+    def check_disk_safety(self, disk_path, required_size=None):
+        """
+        :param required_size: 将要写入的字节数，用于判断扩容盘的真实容量是否够用
+        """
         try:
             # 检查是否为可移动设备
             if not self.is_removable_device(disk_path):
                 raise ValueError(f"警告：{disk_path} 不是可移动设备！")
             
+            # 检查是否为扩容盘
+            success, message = self.check_capacity_gate(disk_path, required_size)
+            if not success:
+                raise ValueError(message)
+            
             # 检查剩余空间
             total_space = self.get_drive_size(disk_path)
             free_space = self.get_free_space(disk_path)
@@ -567,48 +702,135 @@ class USBMaker(QObject):
             self.emit_error(f"Disk safety check failed: {str(e)}")
             return False
 
+    def get_capacity_report(self, device_path):
+        """
+        扩容盘稀疏检查结果（带缓存，写入或插拔后重新检查）
+        检查会写设备，过期后在调用线程中同步重做，不在后台刷新；被取消的不完整结果不缓存
+        :return: CapacityReport
+        """
+        return self.metadata_cache.get(device_path, 'capacity', lambda: self._load_capacity_report(device_path),
+                                       stale=False, cacheable=lambda report: report.complete)
+
+    def _load_capacity_report(self, device_path, full=False):
+        if full:
+            self.forget_flash_manifest(device_path)
+        report = capacity_check.check_capacity(device_path, full=full, cancel_check=lambda: self.should_cancel)
+        if report.complete:
+            self.update_device_profile(device_path, 'record_capacity', report.to_dict())
+        if report.is_fake:
+            self.logger.warning(f"{device_path} 疑似扩容盘：标称 {drive_enum.format_size(report.reported_size)}，"
+                                f"实际可用 {drive_enum.format_size(report.usable_size)}")
+        return report
+
+    def verify_capacity(self, device_path, full=False):
+        """
+        检查U盘真实容量
+        :param full: True时全盘写入再读回（清除所有数据），否则稀疏探测并恢复原有数据
+        :return: (bool, str) 容量是否真实和说明
+        """
+        try:
+            self.status_signal.emit("正在检查U盘真实容量...")
+            if full:
+                report = self._load_capacity_report(device_path, full=True)
+                self.invalidate_device_metadata(device_path)
+            else:
+                report = self.get_capacity_report(device_path)
+        except (OSError, IOError, ValueError) as e:
+            return False, f"容量检查失败: {e}"
+        if not report.complete:
+            return False, "容量检查已取消"
+        if report.is_fake:
+            return False, (f"疑似扩容盘：标称 {drive_enum.format_size(report.reported_size)}，"
+                           f"实际可用 {drive_enum.format_size(report.usable_size)}")
+        return True, f"容量正常: {drive_enum.format_size(report.reported_size)}"
+
+    def check_capacity_gate(self, device_path, required_size=None):
+        """
+        写入前的扩容盘检查：真实容量放不下要写入的数据时拒绝
+        :param required_size: 将要写入的字节数，None表示任何扩容盘都拒绝
+        :return: (bool, str)
+        """
+        if self.advanced_options.get('capacity_check', 'sparse') == 'off':
+            return True, "已跳过容量检查"
+        try:
+            if not stat.S_ISBLK(os.stat(device_path).st_mode):
+                return True, "不是块设备，跳过容量检查"
+            report = self.get_capacity_report(device_path)
+        except (OSError, IOError, ValueError) as e:
+            # 无法检查时不阻止写入，写入后的校验仍会发现问题
+            self.logger.warning(f"容量检查失败，跳过: {e}")
+            return True, f"容量检查失败: {e}"
+        if not report.complete:
+            return True, "容量检查未完成"
+        if report.is_fake and (required_size is None or required_size > report.usable_size):
+            return False, (f"{device_path} 是扩容盘：标称 {drive_enum.format_size(report.reported_size)}，"
+                           f"实际只能可靠写入 {drive_enum.format_size(report.usable_size)}")
+        return True, "容量检查通过"
+
     def get_free_space(self, disk_path):
         """获取磁盘剩余空间"""
-        system = platform.system().lower()
-        
-        if system == 'windows':
-            import win32api
-            free_bytes = win32api.GetDiskFreeSpaceEx(disk_path)[0]
-            return free_bytes
-        
-        elif system == 'darwin':
-            import subprocess
-            try:
-                output = subprocess.check_output(['df', '-k', disk_path], universal_newlines=True)
-                lines = output.strip().split('\n')
-                if len(lines) >= 2:
-                    parts = lines[1].split()
-                    free_kb = int(parts[3])
-                    return free_kb * 1024
-            except:
-                return 0
-        
-        elif system == 'linux':
-            import os
-            st = os.statvfs(disk_path)
-            return st.f_bavail * st.f_frsize
+        return self.get_space_usage(disk_path)[2]
+
+    def get_space_usage(self, path):
+        """
+        获取文件系统空间（带缓存，过期后先返回旧值再后台刷新）
+        :param path: 目录、挂载点或设备路径
+        :return: (总字节, 已用字节, 可用字节)
+        """
+        return self.metadata_cache.get(path, 'usage', lambda: self._load_space_usage(path))
 
-    def format_usb(self, disk_path, filesystem_type='FAT32'):
-        """格式化U盘"""
+    def _load_space_usage(self, path):
+        target = path
+        try:
+            if stat.S_ISBLK(os.stat(path).st_mode):
+                # 设备节点本身没有剩余空间，取它已挂载的分区
+                drive = self.find_drive(path)
+                if not drive or not drive.mountpoints:
+                    return 0, 0, 0
+                target = drive.mountpoints[0]
+            usage = shutil.disk_usage(target)
+            return usage.total, usage.used, usage.free
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"获取 {path} 空间信息失败: {e}")
+            return 0, 0, 0
+
+    def format_usb(self, disk_path, filesystem_type='FAT32', label='USBDISK', discard=None):
+        """
+        格式化U盘
+        FAT32/exFAT 在进程内完成：写入MBR和文件系统元数据，不清零整个设备
+        :param disk_path: 磁盘设备或镜像文件路径
+        :param filesystem_type: 文件系统类型
+        :param label: 卷标
+        :param discard: 是否对数据区执行TRIM/discard，None时使用高级选项
+        """
         system = platform.system().lower()
+        fs = filesystem_type.lower()
+        if discard is None:
+            discard = self.advanced_options.get('discard', False)
         
+        self.forget_flash_manifest(disk_path)
         try:
-            if system == 'windows':
+            if fs in ('fat32', 'exfat') and self.is_raw_target(disk_path):
+                # 直接写入元数据前必须卸载，否则内核仍按旧文件系统读写
+                self.unmount_device(disk_path)
+                
+                layout = partition_table.write_partition_table(disk_path, 'mbr', [{'format': fs}])
+                fs_format.format_volume(disk_path, fs, offset=layout[0]['offset'], size=layout[0]['size'],
+                                        label=label, discard=discard)
+                if not os.path.isfile(disk_path):
+                    self.reread_partitions(disk_path)
+            
+            elif system == 'windows':
                 # Windows格式化
                 subprocess.run(['format', disk_path, '/fs:' + filesystem_type, '/q'], check=True)
             
             elif system == 'darwin':
                 # macOS格式化
-                subprocess.run(['diskutil', 'eraseDisk', filesystem_type, 'USBDISK', disk_path], check=True)
+                subprocess.run(['diskutil', 'eraseDisk', filesystem_type, label, disk_path], check=True)
             
             elif system == 'linux':
                 # Linux格式化
-                subprocess.run(['mkfs.' + filesystem_type.lower(), disk_path], check=True)
+                subprocess.run(self.LINUX_MKFS.get(fs, ['mkfs.' + fs]) + [disk_path], check=True)
             
             self.emit_success(f"成功格式化 {disk_path} 为 {filesystem_type}")
             return True
@@ -616,8 +838,28 @@ class USBMaker(QObject):
         except Exception as e:
             self.emit_error(f"格式化失败: {e}")
             return False
+        finally:
+            self.invalidate_device_metadata(disk_path)
+
+    # Linux下各文件系统对应的mkfs命令
+    LINUX_MKFS = {
+        'fat32': ['mkfs.vfat', '-F', '32'],
+        'exfat': ['mkfs.exfat'],
+        'ntfs': ['mkfs.ntfs', '-Q'],
+        'ext4': ['mkfs.ext4', '-F']
+    }
+
+    @staticmethod
+    def is_raw_target(path):
+        """判断路径是否为可直接读写的块设备或镜像文件"""
+        try:
+            mode = os.stat(path).st_mode
+        except OSError:
+            return False
+        return stat.S_ISBLK(mode) or stat.S_ISREG(mode) or (sys.platform == 'darwin' and stat.S_ISCHR(mode))
 
     def create_bootable_usb(self, iso_path, usb_device_display):
+        usb_device_display = self.resolve_device(usb_device_display)
         try:
             # 获取ISO文件大小
             self.total_bytes = os.path.getsize(iso_path)
@@ -629,7 +871,7 @@ class USBMaker(QObject):
                 raise ValueError("ISO文件校验失败")
             
             # 安全检查
-            if not self.check_disk_safety(usb_device_display):
+            if not self.check_disk_safety(usb_device_display, self.total_bytes):
                 raise ValueError("磁盘安全检查未通过")
             
             # 格式化磁盘
@@ -732,6 +974,20 @@ class USBMaker(QObject):
                 time_text = self.format_time(estimated_time)
                 self.remaining_time_signal.emit(time_text)
     
+    def calculate_progress_info(self, written, total):
+        """
+        计算并发送写入速度和剩余时间
+        :param written: 已写入的字节数
+        :param total: 总字节数
+        """
+        if self.start_time is None:
+            self.start_time = time.time()
+        elapsed_time = time.time() - self.start_time
+        if elapsed_time > 0 and written > 0:
+            speed = written / elapsed_time
+            self.speed_signal.emit(self.format_speed(speed))
+            self.remaining_time_signal.emit(self.format_time(max(total - written, 0) / speed))
+    
     def format_speed(self, speed_bytes_per_sec):
         """
         格式化速度显示
@@ -849,20 +1105,72 @@ class USBMaker(QObject):
             
             # 检查写入速度
             write_speed = self.test_write_speed(usb_device)
-            health_info.append(f"写入速度: {write_speed}/s")
-            
-            # 检查是否有坏块
-            bad_blocks = self.check_bad_blocks(usb_device)
-            health_info.append(f"坏块检查: {'发现 ' + str(bad_blocks) + ' 个坏块' if bad_blocks > 0 else '未发现坏块'}")
-            
-            # 综合评估
-            health_status = "良好" if bad_blocks == 0 and write_speed > 1024*1024 else "可能存在问题"
+            health_info.append(f"写入速度: {drive_enum.format_size(write_speed)}/s")
+            
+            # 坏块：优先使用设备档案中保存的完整扫描结果，否则只做抽样检查；完整扫描由 scan_bad_blocks 单独执行
+            profile = self.get_device_profile(usb_device)
+            grades = [badblock_scan.GRADE_GOOD]
+            stored = (profile or {}).get('bad_blocks')
+            if stored and stored.get('complete'):
+                scan = badblock_scan.ScanResult.from_dict(stored)
+                bad_blocks = scan.bad_sectors
+                health_info.append(f"坏块检查（{stored.get('time', '')} 的完整扫描）: "
+                                   + (f"发现 {bad_blocks} 个坏扇区（{len(scan.bad.ranges)} 个区间）"
+                                      if bad_blocks else "未发现坏块"))
+                grades.append(scan.grade)
+            else:
+                success, scan = self.sample_bad_blocks(usb_device)
+                if success:
+                    bad_blocks = scan.bad_sectors
+                    # 上次未完成的完整扫描中已发现的坏块同样计入
+                    if stored:
+                        partial = badblock_scan.ScanResult.from_dict(stored)
+                        bad_blocks = max(bad_blocks, partial.bad_sectors)
+                        grades.append(partial.grade)
+                    health_info.append(f"坏块抽样检查（读取 {drive_enum.format_size(scan.scanned)}）: "
+                                       + (f"发现 {bad_blocks} 个坏扇区" if bad_blocks else "未发现坏块")
+                                       + "，完整结果请运行坏块扫描")
+                    grades.append(scan.grade)
+                else:
+                    bad_blocks = -1
+                    health_info.append(f"坏块检查: {scan}")
+                    grades.append(badblock_scan.GRADE_FAIR)
+            
+            # 写入过慢的U盘通常已接近寿命末期
+            if write_speed < 1024 * 1024:
+                grades.append(badblock_scan.GRADE_FAIR)
+            
+            # 扩容盘写入超出真实容量的数据会损坏
+            if profile and profile.get('capacity', {}).get('is_fake'):
+                grades.append(badblock_scan.GRADE_POOR)
+            
+            # 综合评估：取各项中最差的一级
+            order = (badblock_scan.GRADE_GOOD, badblock_scan.GRADE_FAIR, badblock_scan.GRADE_POOR)
+            health_status = max(grades, key=order.index)
             health_info.append(f"健康状态: {health_status}")
             
+            # 设备档案：插在哪个接口、叫什么设备名都对应同一份记录
+            if profile:
+                health_info.append(f"历史写入次数: {profile.get('flash_count', 0)}")
+                if profile.get('write_throughput'):
+                    health_info.append(f"平均写入速度: {drive_enum.format_size(profile['write_throughput'])}/s")
+                failures = profile.get('failures', [])
+                if failures:
+                    last = failures[-1]
+                    health_info.append(f"失败记录: {len(failures)} 次，最近一次 {last['time']} {last['message']}")
+                capacity = profile.get('capacity')
+                if capacity:
+                    health_info.append(f"容量检查: 标称 {drive_enum.format_size(capacity['reported_size'])}，"
+                                       f"实际可用 {drive_enum.format_size(capacity['usable_size'])}"
+                                       f"{'（扩容盘）' if capacity['is_fake'] else ''}")
+                if profile.get('last_image'):
+                    health_info.append(f"上次写入镜像: {os.path.basename(profile['last_image']['image'])}")
+            self.update_device_profile(usb_device, 'record_health', health_status, bad_blocks, write_speed)
+            
             result_info = "\n".join(health_info)
             self.health_check_signal.emit(f"U盘健康检查完成: {health_status}")
             
-            return health_status == "良好", result_info
+            return health_status == badblock_scan.GRADE_GOOD, result_info
             
         except Exception as e:
             error_msg = f"U盘健康检查失败: {str(e)}"
@@ -872,61 +1180,131 @@ class USBMaker(QObject):
     def get_device_info(self, device_path):
         """获取设备信息"""
         try:
-            if sys.platform == 'darwin':  # macOS
-                result = subprocess.check_output(['diskutil', 'info', device_path], 
-                                     capture_output=True, text=True)
-                return result.stdout
-            else:
-                return "设备信息获取不支持当前系统"
+            return self.metadata_cache.get(device_path, 'device_info',
+                                           lambda: self._load_device_info(device_path))
         except Exception as e:
             return f"无法获取设备信息: {str(e)}"
+
+    def _load_device_info(self, device_path):
+        if sys.platform == 'darwin':  # macOS
+            result = subprocess.run(['diskutil', 'info', device_path],
+                                    capture_output=True, text=True, check=True)
+            return result.stdout
+        drive = self.find_drive(device_path)
+        if drive:
+            return f"{drive.vendor} {drive.model} ({drive.path}, {drive.bus or '未知总线'})".strip()
+        return "设备信息获取不支持当前系统"
     
     def get_space_info(self, device_path):
         """获取空间信息"""
-        try:
-            if sys.platform == 'darwin':  # macOS
-                result = subprocess.check_output(['df', '-k', device_path], 
-                                     capture_output=True, text=True)
-                lines = result.stdout.strip().split('\n')
-                if len(lines) >= 2:
-                    parts = lines[1].split()
-                    total = int(parts[1]) * 1024  # 转换为字节
-                    free = int(parts[3]) * 1024
-                    return total, free
-            return 0, 0
-        except Exception:
-            return 0, 0
+        total, _, free = self.get_space_usage(device_path)
+        return total, free
     
-    def test_write_speed(self, device_path):
-        """测试写入速度"""
+    def benchmark_device(self, device_path, tests=storage_bench.DEFAULT_TESTS,
+                         duration=storage_bench.DEFAULT_DURATION, area_size=storage_bench.DEFAULT_AREA_SIZE):
+        """
+        读写性能测试，不破坏数据：已挂载的U盘在其文件系统中用临时文件测试，
+        未挂载的设备先保存测试区域，测试后写回
+        :return: (bool, dict或str) 成功时返回 storage_bench 的结构化结果
+        """
         try:
-            # 创建一个临时文件进行写入测试
-            test_size = 1024 * 1024 * 10  # 10MB
-            test_data = b'0' * 1024
-            
-            start_time = time.time()
-            written = 0
-            
-            with open(device_path, 'wb') as f:
-                while written < test_size:
-                    f.write(test_data)
-                    written += len(test_data)
-            
-            end_time = time.time()
-            speed = test_size / (end_time - start_time)
-            return speed
-        except Exception:
+            drive = self.find_drive(device_path)
+            options = dict(duration=duration, cancel_check=lambda: self.should_cancel)
+            if drive and drive.mountpoints:
+                profile = storage_bench.benchmark_directory(drive.mountpoints[0], min(area_size, 16 * 1024 * 1024),
+                                                            tests, **options)
+            else:
+                journal = os.path.join(tempfile.gettempdir(), f'zhitrend_bench_{os.path.basename(device_path)}.journal')
+                profile = storage_bench.StorageBenchmark(device_path, area_size=area_size, journal=journal,
+                                                         **options).run(tests)
+        except (OSError, IOError, ValueError) as e:
+            self.logger.error(f"性能测试失败: {e}")
+            return False, f"性能测试失败: {e}"
+        block_sizes = {result['block_size']: result['throughput'] for result in profile['results']
+                       if result['pattern'] == storage_bench.SEQUENTIAL and result['operation'] == storage_bench.WRITE}
+        self.update_device_profile(device_path, 'record_benchmark', storage_bench.summarize(profile), block_sizes)
+        return True, profile
+
+    def test_write_speed(self, device_path):
+        """
+        测试顺序写入速度（直接I/O，测试区域写后恢复），同时比较几种块大小供写入时选择
+        :return: 字节/秒，失败时返回0
+        """
+        tests = [storage_bench.BenchTest(storage_bench.SEQUENTIAL, storage_bench.WRITE, size)
+                 for size in (512 * 1024, 1024 * 1024, 4 * 1024 * 1024)]
+        success, profile = self.benchmark_device(device_path, tests, duration=1.0, area_size=32 * 1024 * 1024)
+        if not success:
             return 0
+        return max((result['throughput'] for result in profile['results']), default=0)
     
-    def check_bad_blocks(self, device_path):
-        """检查坏块"""
+    def get_device_key(self, device_path):
+        """:return: 设备身份键（DeviceIdentity.key），用于匹配扫描断点和写入清单；无法识别时返回None（按路径匹配）"""
         try:
-            if sys.platform == 'darwin':  # macOS
-                # macOS没有直接的坏块检查工具，返回0表示假定没有坏块
-                return 0
-            return 0
+            return self.get_device_identity(device_path).key
         except Exception:
-            return 0
+            return None
+
+    def get_scan_state_path(self, device_path, mode):
+        """按设备身份保存扫描断点，重新插拔换了设备名也能续扫"""
+        directory = self.config.get('scan_state_path') or self.get_default_config()['scan_state_path']
+        key = self.get_device_key(device_path) or os.path.abspath(device_path)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(directory, f'{digest}-{mode}.json')
+
+    def scan_bad_blocks(self, device_path, mode=badblock_scan.MODE_READ, resume=True):
+        """
+        扫描坏块
+        :param mode: 'read' 只读；'nondestructive' 逐块写入测试数据后写回原数据；'destructive' 图案写满全盘（清除数据）
+        :param resume: 上次扫描中断时从断点继续
+        :return: (bool, ScanResult或str)
+        """
+        try:
+            if mode != badblock_scan.MODE_READ:
+                drive = self.find_drive(device_path)
+                if drive and drive.mountpoints:
+                    return False, f"{device_path} 已挂载，请先卸载再进行写入扫描"
+                # 非破坏模式同样逐块改写，中断时设备内容可能与清单不一致
+                self.forget_flash_manifest(device_path)
+            self.health_check_signal.emit("正在扫描坏块...")
+
+            def progress(done, total, bad):
+                self.progress_signal.emit(int(done * 100 / total) if total else 100)
+
+            result = badblock_scan.scan(device_path, mode, resume,
+                                        state_path=self.get_scan_state_path(device_path, mode),
+                                        identity=self.get_device_key(device_path),
+                                        cancel_check=lambda: self.should_cancel, progress=progress)
+        except (OSError, IOError, ValueError) as e:
+            self.logger.error(f"坏块扫描失败: {e}")
+            return False, f"坏块扫描失败: {e}"
+        finally:
+            if mode != badblock_scan.MODE_READ:
+                self.invalidate_device_metadata(device_path)
+        self.update_device_profile(device_path, 'record_bad_blocks', result.to_dict())
+        return True, result
+
+    def sample_bad_blocks(self, device_path):
+        """
+        抽样只读检查坏块（耗时与容量无关），结果不写入设备档案
+        :return: (bool, ScanResult或str)
+        """
+        try:
+            def progress(done, total, bad):
+                self.progress_signal.emit(int(done * 100 / total) if total else 100)
+
+            return True, badblock_scan.sample(device_path, cancel_check=lambda: self.should_cancel,
+                                              progress=progress)
+        except (OSError, IOError, ValueError) as e:
+            self.logger.error(f"坏块抽样检查失败: {e}")
+            return False, f"坏块抽样检查失败: {e}"
+
+    def check_bad_blocks(self, device_path, mode=badblock_scan.MODE_READ):
+        """
+        检查坏块
+        :return: 坏扇区数，扫描失败时返回-1
+        """
+        success, result = self.scan_bad_blocks(device_path, mode)
+        return result.bad_sectors if success else -1
 
     def load_config(self):
         """加载配置文件"""
@@ -947,7 +1325,21 @@ class USBMaker(QObject):
             "update_url": "https://api.github.com/repos/yourusername/zhitrend_iso/releases/latest",
             "check_update_interval": 86400,
             "theme": "auto",
-            "last_update_check": 0
+            "last_update_check": 0,
+            "library_path": os.path.join(os.path.expanduser('~'), '.zhitrend_iso', 'library'),
+            "library_cache_path": None,
+            "flash_manifest_path": os.path.join(os.path.expanduser('~'), '.zhitrend_iso', 'flash_manifests'),
+            "device_profiles_path": os.path.join(os.path.expanduser('~'), '.zhitrend_iso', 'device_profiles.json'),
+            "scan_state_path": os.path.join(os.path.expanduser('~'), '.zhitrend_iso', 'scans'),
+            "iso_index_path": os.path.join(os.path.expanduser('~'), '.zhitrend_iso', 'iso_index.json'),
+            "iso_full_rescan_interval": DEFAULT_FULL_RESCAN_INTERVAL,
+            # ISO扫描：跳过的目录通配符、最大深度（null不限）、是否不跨文件系统、每个根目录的时间预算（秒）
+            "iso_scan_excludes": list(dir_crawler.DEFAULT_EXCLUDES),
+            "iso_scan_max_depth": None,
+            "iso_scan_same_filesystem": False,
+            "iso_scan_skip_network": True,
+            "iso_scan_time_budget": 30,
+            "iso_scan_workers": dir_crawler.DEFAULT_WORKERS
         }
     
     def save_config(self):
@@ -1146,53 +1538,92 @@ class USBMaker(QObject):
     
     def get_used_space(self, path):
         """获取目录的总大小和已用空间"""
-        try:
-            if sys.platform == 'darwin':  # macOS
-                result = subprocess.check_output(['df', '-k', path], 
-                                     capture_output=True, text=True)
-                lines = result.stdout.strip().split('\n')
-                if len(lines) >= 2:
-                    parts = lines[1].split()
-                    total = int(parts[1]) * 1024  # 转换为字节
-                    used = int(parts[2]) * 1024
-                    return total, used
-            return 0, 0
-        except Exception:
-            return 0, 0
+        total, used, _ = self.get_space_usage(path)
+        return total, used
     
     def get_backup_free_space(self, path):
         """获取备份位置的可用空间"""
-        try:
-            if sys.platform == 'darwin':  # macOS
-                result = subprocess.check_output(['df', '-k', path], 
-                                     capture_output=True, text=True)
-                lines = result.stdout.strip().split('\n')
-                if len(lines) >= 2:
-                    parts = lines[1].split()
-                    free = int(parts[3]) * 1024  # 转换为字节
-                    return free
-            return 0
-        except Exception:
-            return 0
+        return self.get_space_usage(path)[2]
 
     def set_advanced_options(self, options):
         """设置高级选项"""
         self.advanced_options.update(options)
     
+    def get_iso_library(self):
+        """获取去重ISO库（按配置中的库目录和本地缓存目录创建）"""
+        if getattr(self, '_iso_library', None) is None:
+            defaults = self.get_default_config()
+            self._iso_library = ISOLibrary(
+                self.config.get('library_path') or defaults['library_path'],
+                cache_dir=self.config.get('library_cache_path')
+            )
+        return self._iso_library
+    
+    def ingest_iso_library(self, directories=None):
+        """
+        扫描目录并把发现的ISO导入去重库
+        :param directories: 要扫描的目录列表，None表示默认目录
+        :return: (bool, str) 是否成功和消息
+        """
+        try:
+            library = self.get_iso_library()
+            iso_files = [path for path in self.scan_for_isos(directories)
+                         if not library.has_image(path)]
+            
+            total_new = 0
+            total_dedup = 0
+            for i, iso_path in enumerate(iso_files, 1):
+                self.status_signal.emit(f"正在导入 {os.path.basename(iso_path)} ({i}/{len(iso_files)})...")
+                result = library.ingest(
+                    iso_path,
+                    progress_callback=lambda done, total: self.progress_signal.emit(int(done / total * 100) if total else 100)
+                )
+                total_new += result['new_bytes']
+                total_dedup += result['dedup_bytes']
+            
+            return True, f"导入 {len(iso_files)} 个ISO，新增 {total_new} 字节，去重 {total_dedup} 字节"
+        except Exception as e:
+            error_msg = f"导入ISO库失败: {str(e)}"
+            self.logger.error(error_msg)
+            return False, error_msg
+    
+    def open_image_source(self, iso_path):
+        """
+        打开写入源
+        :param iso_path: ISO文件路径，或 library://<镜像ID或唯一名称> 表示库中的镜像
+        :return: 可读的二进制文件对象
+        """
+        if iso_path.startswith(LIBRARY_SCHEME):
+            image = self.get_iso_library().open_image(iso_path[len(LIBRARY_SCHEME):])
+            return io.BufferedReader(image, 4 * 1024 * 1024)
+        return open(iso_path, 'rb')
+    
+    def get_image_size(self, iso_path):
+        """获取写入源大小，支持 library://<名称>"""
+        if iso_path.startswith(LIBRARY_SCHEME):
+            return self.get_iso_library().get_recipe(iso_path[len(LIBRARY_SCHEME):])['size']
+        return os.path.getsize(iso_path)
+    
     def write_iso_dd(self, iso_path, usb_device):
         """使用DD模式写入ISO"""
         try:
-            iso_size = os.path.getsize(iso_path)
+            self.start_time = time.time()
+            iso_size = self.get_image_size(iso_path)
             written = 0
-            
-            with open(iso_path, 'rb') as iso_file, open(usb_device, 'wb') as usb:
-                # 设置缓冲区大小
-                buffer_size = self.advanced_options['buffer_size'] * 1024  # KB
+            # 同时记录块摘要，下次可以增量写入
+            hasher = BlockHasher()
+            # 写入成功后才记录新清单，失败或取消时不保留旧清单
+            self.forget_flash_manifest(usb_device)
+            
+            with self.open_image_source(iso_path) as iso_file, open(usb_device, 'wb') as usb:
+                # 设置缓冲区大小（按设备扇区/最佳I/O大小对齐）；未手动设置时使用设备档案中最快的块大小
+                buffer_size = self.get_io_size(usb_device, self.get_requested_buffer_size())
                 
                 while True:
                     chunk = iso_file.read(buffer_size)
                     if not chunk:
                         break
+                    hasher.update(chunk)
                     
                     if self.advanced_options['compression']:
                         chunk = zlib.compress(chunk)
@@ -1206,69 +1637,133 @@ class USBMaker(QObject):
                     # 计算写入速度和剩余时间
                     self.calculate_progress_info(written, iso_size)
             
+            self.record_flash_manifest(usb_device, iso_path, hasher)
+            if not self.advanced_options['compression']:
+                elapsed = time.time() - self.start_time
+                if elapsed > 0:
+                    self.update_device_profile(usb_device, 'record_throughput', written / elapsed, buffer_size)
+                self.update_device_profile(usb_device, 'record_flash', iso_path,
+                                           device_profile.image_digest(hasher.finish()), hasher.size)
             return True, "DD模式写入完成"
         except Exception as e:
             return False, f"DD模式写入失败: {str(e)}"
     
+    def get_flash_manifest_store(self):
+        """获取保存设备写入清单的存储"""
+        if getattr(self, '_flash_manifests', None) is None:
+            self._flash_manifests = FlashManifestStore(
+                self.config.get('flash_manifest_path') or self.get_default_config()['flash_manifest_path'])
+        return self._flash_manifests
+    
+    def forget_flash_manifest(self, device):
+        """
+        在改写设备内容之前删除其写入清单，否则下次增量写入会按过时的清单跳过实际已变化的块
+        :param device: 设备或镜像文件路径
+        """
+        try:
+            self.get_flash_manifest_store().forget(device, self.get_device_key(device))
+        except Exception as e:
+            self.logger.warning(f"删除 {device} 的写入清单失败: {e}")
+    
+    def record_flash_manifest(self, usb_device, iso_path, hasher):
+        """记录本次写入的块摘要；压缩写入时设备内容与镜像不同，不记录"""
+        try:
+            store = self.get_flash_manifest_store()
+            identity = self.get_device_key(usb_device)
+            if self.advanced_options['compression']:
+                store.forget(usb_device, identity)
+                return
+            store.save(usb_device, iso_path, hasher.size, hasher.finish(), identity=identity)
+        except Exception as e:
+            self.logger.warning(f"记录写入清单失败: {e}")
+    
+    def write_iso_delta(self, iso_path, usb_device, mode='auto'):
+        """
+        增量写入ISO：只写入与设备现有内容不同的块，并只校验这些区域
+        :param iso_path: ISO文件路径（支持 library://<名称>）
+        :param usb_device: 目标设备或镜像文件路径
+        :param mode: auto（优先使用上次写入的清单）/manifest/device（读取设备比较）
+        :return: (bool, str) 是否成功和消息
+        """
+        try:
+            self.start_time = time.time()
+            
+            def on_progress(done, total):
+                if total > 0:
+                    self.progress_signal.emit(int(done / total * 100))
+                    self.calculate_progress_info(done, total)
+            
+            flasher = DeltaFlasher(
+                usb_device,
+                manifest_store=self.get_flash_manifest_store(),
+                progress_callback=on_progress,
+                status_callback=self.status_signal.emit,
+                cancel_check=lambda: self.should_cancel,
+                identity=self.get_device_key(usb_device)
+            )
+            with self.open_image_source(iso_path) as source:
+                stats = flasher.flash(source, self.get_image_size(iso_path), iso_path, mode=mode,
+                                      verify=not self.advanced_options['skip_verify'])
+            
+            manifest = self.get_flash_manifest_store().load(usb_device, identity=flasher.identity)
+            if manifest:
+                self.update_device_profile(usb_device, 'record_flash', iso_path,
+                                           device_profile.image_digest(manifest['digests']), stats['image_bytes'])
+            percent = stats['changed_bytes'] * 100 / stats['image_bytes'] if stats['image_bytes'] else 0
+            return True, f"增量写入完成：{stats['regions']} 个区域，{percent:.1f}% 的数据发生变化"
+        except InterruptedError:
+            return False, "写入已取消"
+        except Exception as e:
+            return False, f"增量写入失败: {str(e)}"
+    
     def write_iso_9660(self, iso_path, usb_device):
-        """使用ISO9660模式写入ISO"""
+        """
+        使用ISO9660模式写入ISO：直接按区段表读取镜像中的文件，无需挂载
+        :param iso_path: ISO文件路径（支持 library://<名称>）
+        :param usb_device: 目标目录（已挂载的FAT/exFAT卷）
+        """
         try:
-            # 挂载ISO文件
-            with tempfile.TemporaryDirectory() as mount_point:
-                if sys.platform == 'darwin':
-                    subprocess.run(['hdiutil', 'attach', iso_path,
-                                 '-mountpoint', mount_point], check=True)
-                    
-                    try:
-                        # 计算总大小
-                        total_size = sum(os.path.getsize(os.path.join(root, f))
-                                       for root, _, files in os.walk(mount_point)
-                                       for f in files)
-                        copied = 0
-                        
-                        # 复制文件
-                        for root, dirs, files in os.walk(mount_point):
-                            for d in dirs:
-                                src_dir = os.path.join(root, d)
-                                dst_dir = os.path.join(usb_device, 
-                                                     os.path.relpath(src_dir, mount_point))
-                                os.makedirs(dst_dir, exist_ok=True)
-                            
-                            for f in files:
-                                src_file = os.path.join(root, f)
-                                dst_file = os.path.join(usb_device,
-                                                      os.path.relpath(src_file, mount_point))
-                                
-                                with open(src_file, 'rb') as sf, open(dst_file, 'wb') as df:
-                                    while True:
-                                        chunk = sf.read(self.advanced_options['buffer_size'] * 1024)
-                                        if not chunk:
-                                            break
-                                        
-                                        if self.advanced_options['compression']:
-                                            chunk = zlib.compress(chunk)
-                                        
-                                        df.write(chunk)
-                                        copied += len(chunk)
-                                        
-                                        progress = int((copied / total_size) * 100)
-                                        self.progress_signal.emit(progress)
-                                        
-                                        # 计算写入速度和剩余时间
-                                        self.calculate_progress_info(copied, total_size)
-                    
-                    finally:
-                        # 卸载ISO
-                        if sys.platform == 'darwin':
-                            subprocess.run(['hdiutil', 'detach', mount_point], check=True)
+            self.start_time = time.time()
             
+            # FAT32等文件系统有单文件大小上限，超限文件按策略拆分或放到数据分区
+            max_file_size = file_split.max_file_size(usb_device)
+            
+            def on_progress(copied, total):
+                if total > 0:
+                    self.progress_signal.emit(int((copied / total) * 100))
+                    # 计算写入速度和剩余时间
+                    self.calculate_progress_info(copied, total)
+            
+            with self.open_image_source(iso_path) as source:
+                copier = ISOFileCopier(
+                    source,
+                    usb_device,
+                    buffer_size=max(self.get_requested_buffer_size() or 0, LARGE_BUFFER_SIZE),
+                    progress_callback=on_progress,
+                    cancel_check=lambda: self.should_cancel,
+                    max_file_size=max_file_size,
+                    large_file_policy=self.advanced_options.get('large_file_policy', 'split'),
+                    data_dir=self.advanced_options.get('data_partition_dir')
+                )
+                stats = copier.run()
+            
+            self.logger.info(f"ISO9660模式复制 {stats['files']} 个文件，用时 {stats['elapsed']:.1f} 秒")
             return True, "ISO9660模式写入完成"
+        except CopyCancelled:
+            return False, "写入已取消"
         except Exception as e:
             return False, f"ISO9660模式写入失败: {str(e)}"
     
     def write_iso_to_usb(self, iso_path, usb_device):
         """写入ISO到U盘"""
+        usb_device = self.resolve_device(usb_device)
         try:
+            # 扩容盘的真实容量放不下镜像时，写入后的数据会被回绕覆盖
+            success, message = self.check_capacity_gate(usb_device, self.get_image_size(iso_path))
+            if not success:
+                self.update_device_profile(usb_device, 'record_failure', 'capacity', message)
+                return False, message
+            
             # 检查UEFI支持
             if self.advanced_options['force_uefi']:
                 if not self.check_uefi_support(iso_path):
@@ -1277,22 +1772,33 @@ class USBMaker(QObject):
             # 选择写入方式
             if self.advanced_options['write_method'] == 'dd':
                 success, message = self.write_iso_dd(iso_path, usb_device)
+            elif self.advanced_options['write_method'] == 'delta':
+                # 增量写入已经校验过写入的区域
+                success, message = self.write_iso_delta(iso_path, usb_device)
+                if not success:
+                    self.update_device_profile(usb_device, 'record_failure', 'write', message)
+                return success, message
             else:
                 success, message = self.write_iso_9660(iso_path, usb_device)
             
             if not success:
+                self.update_device_profile(usb_device, 'record_failure', 'write', message)
                 return False, message
             
             # 写入后验证
             if self.advanced_options['verify_after_write'] and not self.advanced_options['skip_verify']:
                 self.status_signal.emit("正在验证写入...")
                 if not self.verify_written_data(iso_path, usb_device):
+                    self.update_device_profile(usb_device, 'record_failure', 'verify', "写入验证失败")
                     return False, "写入验证失败"
             
             return True, "写入完成"
             
         except Exception as e:
+            self.update_device_profile(usb_device, 'record_failure', 'write', str(e))
             return False, f"写入失败: {str(e)}"
+        finally:
+            self.invalidate_device_metadata(usb_device)
     
     def check_uefi_support(self, iso_path):
         """检查ISO是否支持UEFI启动"""
@@ -1317,12 +1823,12 @@ class USBMaker(QObject):
     def verify_written_data(self, iso_path, usb_device):
         """验证写入的数据"""
         try:
-            iso_size = os.path.getsize(iso_path)
+            iso_size = self.get_image_size(iso_path)
             verified = 0
             
-            with open(iso_path, 'rb') as iso_file, open(usb_device, 'rb') as usb:
+            with self.open_image_source(iso_path) as iso_file, open(usb_device, 'rb') as usb:
                 while True:
-                    iso_chunk = iso_file.read(self.advanced_options['buffer_size'] * 1024)
+                    iso_chunk = iso_file.read(self.get_requested_buffer_size() or block_device.DEFAULT_IO_SIZE)
                     if not iso_chunk:
                         break
                     
@@ -1340,8 +1846,8 @@ class USBMaker(QObject):
 
     def detect_boot_config(self, usb_device):
         """
-        检测U盘的启动配置
-        :param usb_device: U盘设备路径
+        检测U盘的启动配置：直接读取设备/镜像中的FAT和ISO9660卷，也支持已挂载的目录
+        :param usb_device: U盘设备路径、镜像文件或挂载目录
         :return: 启动配置信息
         """
         try:
@@ -1353,62 +1859,31 @@ class USBMaker(QObject):
                 'hybrid': False
             }
             
-            with tempfile.TemporaryDirectory() as mount_point:
-                if sys.platform == 'darwin':
-                    subprocess.run(['hdiutil', 'attach', usb_device,
-                                 '-mountpoint', mount_point], check=True)
-                    
-                    try:
-                        # 检查UEFI启动
-                        if os.path.exists(os.path.join(mount_point, 'EFI')):
-                            config['uefi'] = True
-                            config['type'] = 'uefi'
-                            
-                            # 检查EFI启动项
-                            efi_boot = os.path.join(mount_point, 'EFI', 'BOOT')
-                            if os.path.exists(efi_boot):
-                                config['entries'].extend(
-                                    f.name for f in os.scandir(efi_boot)
-                                    if f.name.lower().endswith('.efi')
-                                )
-                        
-                        # 检查Legacy启动
-                        grub_cfg = os.path.join(mount_point, 'boot', 'grub', 'grub.cfg')
-                        if os.path.exists(grub_cfg):
-                            config['bootloader'] = 'grub2'
-                            config['type'] = 'legacy'
-                            
-                            # 解析GRUB配置
-                            with open(grub_cfg, 'r') as f:
-                                content = f.read()
-                                # 提取菜单项
-                                for line in content.split('\n'):
-                                    if 'menuentry' in line:
-                                        entry = line.split("'")[1]
-                                        config['entries'].append(entry)
-                        
-                        # 检查Syslinux
-                        syslinux_cfg = os.path.join(mount_point, 'syslinux.cfg')
-                        if os.path.exists(syslinux_cfg):
-                            config['bootloader'] = 'syslinux'
-                            config['type'] = 'legacy'
-                            
-                            # 解析Syslinux配置
-                            with open(syslinux_cfg, 'r') as f:
-                                content = f.read()
-                                # 提取标签
-                                for line in content.split('\n'):
-                                    if line.startswith('LABEL'):
-                                        entry = line.split()[1]
-                                        config['entries'].append(entry)
-                        
-                        # 检查是否是混合启动
-                        if config['uefi'] and config['bootloader']:
-                            config['hybrid'] = True
-                            config['type'] = 'hybrid'
-                    
-                    finally:
-                        subprocess.run(['hdiutil', 'detach', mount_point], check=True)
+            transaction = BootConfigTransaction(usb_device, writable=False)
+            try:
+                transaction.load()
+                
+                # 检查UEFI启动
+                for volume in transaction.volumes:
+                    efi_boot = volume.listdir('EFI/BOOT')
+                    if efi_boot is not None:
+                        config['uefi'] = True
+                        config['type'] = 'uefi'
+                        config['entries'].extend(name for name in efi_boot if name.lower().endswith('.efi'))
+                
+                # 检查Legacy启动
+                for _, _, boot_cfg in transaction.configs:
+                    if config['bootloader'] is None:
+                        config['bootloader'] = 'grub2' if boot_cfg.kind == 'grub' else 'syslinux'
+                        config['type'] = 'legacy'
+                    config['entries'].extend(entry['title'] for entry in boot_cfg.entries())
+            finally:
+                transaction.close()
+            
+            # 检查是否是混合启动
+            if config['uefi'] and config['bootloader']:
+                config['hybrid'] = True
+                config['type'] = 'hybrid'
             
             self.boot_config_signal.emit(config)
             return config
@@ -1419,69 +1894,29 @@ class USBMaker(QObject):
     
     def update_boot_config(self, usb_device, config_updates):
         """
-        更新启动配置
-        :param usb_device: U盘设备路径
+        更新启动配置：解析全部GRUB/syslinux配置，在内存中应用所有修改，
+        每个变化的文件只原子地写入一次
+        :param usb_device: U盘设备路径、镜像文件或挂载目录
         :param config_updates: 要更新的配置
+            {'grub_timeout': 秒, 'default_entry': 序号或标题,
+             'kernel_args_add': [...], 'kernel_args_remove': [...]}
         :return: (bool, str) 更新结果和消息
         """
         try:
-            with tempfile.TemporaryDirectory() as mount_point:
-                if sys.platform == 'darwin':
-                    subprocess.run(['hdiutil', 'attach', usb_device,
-                                 '-mountpoint', mount_point], check=True)
-                    
-                    try:
-                        # 更新GRUB配置
-                        if 'grub_timeout' in config_updates:
-                            grub_cfg = os.path.join(mount_point, 'boot/grub/grub.cfg')
-                            if os.path.exists(grub_cfg):
-                                with open(grub_cfg, 'r') as f:
-                                    content = f.read()
-                                
-                                # 更新超时时间
-                                content = re.sub(
-                                    r'set timeout=\d+',
-                                    f'set timeout={config_updates["grub_timeout"]}',
-                                    content
-                                )
-                                
-                                with open(grub_cfg, 'w') as f:
-                                    f.write(content)
-                        
-                        # 更新默认启动项
-                        if 'default_entry' in config_updates:
-                            if os.path.exists(os.path.join(mount_point, 'boot/grub/grub.cfg')):
-                                # 更新GRUB默认启动项
-                                with open(os.path.join(mount_point, 'boot/grub/grub.cfg'), 'r') as f:
-                                    content = f.read()
-                                
-                                content = re.sub(
-                                    r'set default="\w+"',
-                                    f'set default="{config_updates["default_entry"]}"',
-                                    content
-                                )
-                                
-                                with open(os.path.join(mount_point, 'boot/grub/grub.cfg'), 'w') as f:
-                                    f.write(content)
-                            
-                            elif os.path.exists(os.path.join(mount_point, 'syslinux.cfg')):
-                                # 更新Syslinux默认启动项
-                                with open(os.path.join(mount_point, 'syslinux.cfg'), 'r') as f:
-                                    content = f.read()
-                                
-                                content = re.sub(
-                                    r'DEFAULT \w+',
-                                    f'DEFAULT {config_updates["default_entry"]}',
-                                    content
-                                )
-                                
-                                with open(os.path.join(mount_point, 'syslinux.cfg'), 'w') as f:
-                                    f.write(content)
-                    
-                    finally:
-                        subprocess.run(['hdiutil', 'detach', mount_point], check=True)
-            
-            return True, "启动配置更新成功"
+            mountpoints = None
+            if not os.path.isdir(usb_device):
+                self.forget_flash_manifest(usb_device)
+                # 已挂载的分区通过挂载目录修改
+                mountpoints = self.partition_mountpoints(usb_device)
+            with BootConfigTransaction(usb_device, mountpoints=mountpoints) as transaction:
+                if not transaction.configs:
+                    return False, "未找到启动配置文件"
+                transaction.apply(config_updates)
+                changed = [path for _, path, cfg in transaction.configs if cfg.modified]
+            
+            if not changed:
+                return True, "启动配置无需修改"
+            return True, f"启动配置更新成功: {', '.join(changed)}"
             
         except Exception as e:
             return False, f"更新启动配置失败: {str(e)}"
@@ -1558,50 +1993,39 @@ class USBMaker(QObject):
             self.repair_status_signal.emit(error_msg)
             return False, error_msg
 
-    def create_partition_table(self, device, table_type='gpt', partitions=None):
+    def create_partition_table(self, device, table_type='gpt', partitions=None, dry_run=False):
         """
-        创建分区表
-        :param device: 设备路径
+        创建分区表：计算对齐布局后一次性写入保护性MBR、主/备GPT，可直接作用于镜像文件
+        :param device: 设备路径或镜像文件路径
         :param table_type: 分区表类型 (gpt/mbr)
         :param partitions: 分区列表 [{'size': '1G', 'type': 'efi', 'format': 'fat32'}, ...]
-        :return: (bool, str) 是否成功和消息
+        :param dry_run: 只计算并返回布局，不写入
+        :return: (bool, str) 是否成功和消息；dry_run时为 (bool, 布局列表)
         """
         try:
+            if dry_run:
+                return True, partition_table.write_partition_table(device, table_type, partitions, dry_run=True)
+            
             self.partition_status_signal.emit("正在创建分区表...")
+            is_image = os.path.isfile(device)
+            self.forget_flash_manifest(device)
             
-            # 卸载设备
-            subprocess.run(['diskutil', 'unmountDisk', device], check=True)
+            # 卸载设备；无法卸载时不写入
+            self.unmount_device(device)
             
-            # 创建分区表
-            if table_type == 'gpt':
-                subprocess.run(['diskutil', 'eraseDisk', 'GPT', 'UNTITLED', device], check=True)
-            else:
-                subprocess.run(['diskutil', 'eraseDisk', 'MBR', 'UNTITLED', device], check=True)
+            layout = partition_table.write_partition_table(device, table_type, partitions)
+            if not is_image:
+                # 内核没有读到新分区表时，不能在旧分区之上继续格式化
+                self.reread_partitions(device)
             
-            if not partitions:
+            if not layout:
                 return True, "分区表创建成功"
             
-            # 创建分区
-            for i, part in enumerate(partitions, 1):
-                self.partition_status_signal.emit(f"正在创建分区 {i}/{len(partitions)}...")
-                self.partition_progress_signal.emit(int(i/len(partitions)*100))
-                
-                # 转换分区类型
-                format_map = {
-                    'fat32': 'FAT32',
-                    'ntfs': 'NTFS',
-                    'exfat': 'ExFAT',
-                    'ext4': 'EXT4'
-                }
-                
-                # 创建分区
-                subprocess.run([
-                    'diskutil', 'addPartition',
-                    device,
-                    format_map.get(part['format'], 'FAT32'),
-                    f'Partition{i}',
-                    part['size']
-                ], check=True)
+            # 格式化分区
+            for i, part in enumerate(layout, 1):
+                self.partition_status_signal.emit(f"正在格式化分区 {i}/{len(layout)}...")
+                self.partition_progress_signal.emit(int(i/len(layout)*100))
+                self.format_partition(device, part)
             
             return True, "分区创建成功"
             
@@ -1609,6 +2033,188 @@ class USBMaker(QObject):
             error_msg = f"创建分区失败: {str(e)}"
             self.partition_status_signal.emit(error_msg)
             return False, error_msg
+        finally:
+            if not dry_run:
+                self.invalidate_device_metadata(device)
+    
+    def mounted_volumes(self, device):
+        """
+        设备当前的挂载点：整盘时包括其所有分区，分区时只含该分区
+        :param device: 整盘、分区或镜像文件路径
+        :return: 挂载点列表，镜像文件返回空列表
+        """
+        if os.path.isfile(device):
+            return []
+        if sys.platform.startswith('linux'):
+            # 直接读挂载表，不可移动的磁盘也能查到
+            target = os.path.realpath(device)
+            whole_disk = drive_enum.parent_disk(target) == target
+            return [mountpoint for node, entries in drive_enum.read_mounts().items()
+                    if node == target or (whole_disk and drive_enum.parent_disk(node) == target)
+                    for mountpoint, _ in entries]
+        drive = self.find_drive(device)
+        return list(drive.mountpoints) if drive else []
+
+    def partition_mountpoints(self, device):
+        """
+        设备上已挂载的文件系统
+        :return: {分区序号: 挂载点}，0 表示设备本身（无分区表的整盘或分区节点）
+        :raises OSError: 已挂载但无法确定各分区的挂载点（非Linux）
+        """
+        if os.path.isfile(device) or os.path.isdir(device):
+            return {}
+        if not sys.platform.startswith('linux'):
+            mounted = self.mounted_volumes(device)
+            if mounted:
+                raise OSError(f"{device} 已挂载在 {', '.join(mounted)}，请先卸载或直接指定挂载目录")
+            return {}
+        target = os.path.realpath(device)
+        result = {}
+        for node, entries in drive_enum.read_mounts().items():
+            if node == target:
+                result[0] = entries[0][0]
+            elif drive_enum.parent_disk(node) == target:
+                index = drive_enum.partition_number(node)
+                if index is None:
+                    raise OSError(f"无法确定 {node} 的分区序号，请先卸载")
+                result[index] = entries[0][0]
+        return result
+
+    def unmount_device(self, device):
+        """
+        直接写入整盘或分区之前卸载其上的文件系统，镜像文件直接返回
+        :raises OSError: 无法卸载或当前系统不支持卸载时
+        """
+        if os.path.isfile(device):
+            return
+        if sys.platform == 'darwin':
+            command = 'unmountDisk' if drive_enum.parent_disk(device) == device else 'unmount'
+            subprocess.run(['diskutil', command, device], check=True)
+            return
+        mountpoints = self.mounted_volumes(device)
+        if not mountpoints:
+            return
+        if not sys.platform.startswith('linux'):
+            raise OSError(f"{device} 已挂载在 {', '.join(mountpoints)}，请先卸载")
+        # 先卸载嵌套更深的挂载点
+        for mountpoint in sorted(mountpoints, key=len, reverse=True):
+            self.logger.info(f"正在卸载 {mountpoint}")
+            result = subprocess.run(['umount', mountpoint], capture_output=True, text=True)
+            if result.returncode != 0:
+                raise OSError(f"无法卸载 {mountpoint}: {result.stderr.strip() or result.returncode}")
+        remaining = self.mounted_volumes(device)
+        if remaining:
+            raise OSError(f"{device} 仍挂载在 {', '.join(remaining)}")
+
+    def reread_partitions(self, device):
+        """
+        通知系统重新读取分区表
+        :raises OSError: 内核拒绝重新读取（通常是分区仍在使用，EBUSY）
+        """
+        if sys.platform.startswith('linux'):
+            import fcntl
+            BLKRRPART = 0x125F
+            fd = os.open(device, os.O_RDONLY)
+            try:
+                fcntl.ioctl(fd, BLKRRPART)
+            except OSError as e:
+                raise OSError(e.errno, f"重新读取 {device} 的分区表失败，分区可能仍在使用: {e.strerror}")
+            finally:
+                os.close(fd)
+    
+    def format_partition(self, device, part):
+        """
+        格式化布局中的一个分区
+        FAT32/exFAT 按偏移直接写入整盘，镜像文件同样适用；其他文件系统交给系统工具
+        :param device: 磁盘设备或镜像文件路径
+        :param part: compute_layout 返回的分区项
+        """
+        fs = part['format']
+        label = 'EFI' if part['type'] == 'efi' else f"PART{part['index']}"
+        self.forget_flash_manifest(device)
+        
+        if fs in ('fat32', 'exfat'):
+            fs_format.format_volume(device, fs, offset=part['offset'], size=part['size'], label=label,
+                                    discard=self.advanced_options.get('discard', False))
+            return
+        
+        if os.path.isfile(device):
+            self.logger.info(f"镜像文件 {device} 的分区 {part['index']} 跳过格式化")
+            return
+        
+        part_device = partition_table.partition_device_path(device, part['index'])
+        
+        if sys.platform == 'darwin':
+            format_map = {
+                'ntfs': 'NTFS',
+                'ext4': 'EXT4'
+            }
+            subprocess.run(['diskutil', 'eraseVolume', format_map.get(fs, fs.upper()), label, part_device], check=True)
+        elif sys.platform.startswith('linux'):
+            label_flag = ['-L', label] if fs in ('ntfs', 'ext4') else []
+            subprocess.run(self.LINUX_MKFS.get(fs, ['mkfs.' + fs]) + label_flag + [part_device], check=True)
+        else:
+            raise OSError(f"不支持在当前系统上格式化分区: {sys.platform}")
+    
+    def create_multiboot_layout(self, device, iso_paths, persistence_size=None, data_fs='exfat', dry_run=False):
+        """
+        创建多系统启动U盘的分区：FAT32引导分区 + ISO数据分区 + 可选持久化分区
+        :param device: 设备路径或镜像文件路径
+        :param iso_paths: 计划放入的ISO列表，用于估算数据分区大小
+        :param persistence_size: 持久化分区大小，None表示不创建
+        :param data_fs: ISO分区的文件系统 (exfat/fat32)
+        :param dry_run: 只返回计算出的布局
+        :return: (bool, str) 是否成功和消息；dry_run时为 (bool, 布局列表)
+        """
+        try:
+            partitions = multiboot.plan_multiboot_partitions(
+                [self.get_image_size(path) for path in iso_paths],
+                data_fs=data_fs, persistence_size=persistence_size)
+        except Exception as e:
+            return False, f"规划多系统启动布局失败: {str(e)}"
+        return self.create_partition_table(device, 'gpt', partitions, dry_run=dry_run)
+    
+    def add_multiboot_iso(self, data_dir, iso_path, boot_dir=None, name=None):
+        """
+        向多系统启动U盘添加或替换一个ISO，并重新生成GRUB菜单
+        :param data_dir: ISO数据分区的挂载目录
+        :param iso_path: ISO文件路径（支持 library://<名称>）
+        :param boot_dir: 引导分区的挂载目录
+        :param name: 菜单名称，默认为ISO文件名
+        :return: (bool, str) 是否成功和消息
+        """
+        try:
+            self.start_time = time.time()
+            if not name and iso_path.startswith(LIBRARY_SCHEME):
+                name = self.get_iso_library().get_recipe(iso_path[len(LIBRARY_SCHEME):])['name']
+            name = name or os.path.basename(iso_path)
+            volume = multiboot.MultiBootVolume(data_dir, boot_dir)
+            self.status_signal.emit(f"正在写入 {name}...")
+            
+            def on_progress(written, total):
+                self.progress_signal.emit(int(written / total * 100))
+                self.calculate_progress_info(written, total)
+            
+            with self.open_image_source(iso_path) as source:
+                image = volume.add_iso(source, self.get_image_size(iso_path), name,
+                                       progress_callback=on_progress,
+                                       cancel_check=lambda: self.should_cancel)
+            
+            if not image['boot'].get('method'):
+                return True, f"{name} 已添加，但无法通过loopback启动（{image['boot']['family']}）"
+            return True, f"{name} 已添加到多系统启动菜单"
+        except InterruptedError:
+            return False, "写入已取消"
+        except Exception as e:
+            return False, f"添加ISO失败: {str(e)}"
+    
+    def remove_multiboot_iso(self, data_dir, name, boot_dir=None):
+        """从多系统启动U盘删除一个ISO"""
+        try:
+            multiboot.MultiBootVolume(data_dir, boot_dir).remove_iso(name)
+            return True, f"{name} 已删除"
+        except Exception as e:
+            return False, f"删除ISO失败: {str(e)}"
     
     def write_hybrid_iso(self, iso_path, device, options=None):
         """
@@ -1625,23 +2231,26 @@ class USBMaker(QObject):
             # 检查ISO是否是混合镜像
             self.write_status_signal.emit("正在检查ISO类型...")
             
-            # 使用file命令检查ISO类型
-            result = subprocess.check_output(['file', iso_path], universal_newlines=True)
-            is_hybrid = 'boot sector' in result.stdout.lower()
+            # 混合镜像的第一个扇区带有MBR签名
+            with self.open_image_source(iso_path) as src:
+                is_hybrid = src.read(512)[510:512] == b'\x55\xaa'
             
             if not is_hybrid and not options.get('force_hybrid', False):
                 return False, "不是混合ISO镜像，请使用普通ISO写入模式"
             
             # 卸载设备
-            subprocess.run(['diskutil', 'unmountDisk', device], check=True)
+            is_image = os.path.isfile(device)
+            self.forget_flash_manifest(device)
+            if sys.platform == 'darwin' and not is_image:
+                subprocess.run(['diskutil', 'unmountDisk', device], check=True)
             
             # 计算总大小
-            total_size = os.path.getsize(iso_path)
+            total_size = self.get_image_size(iso_path)
             
-            # 创建写入进程
-            with open(iso_path, 'rb') as src, open(device, 'wb') as dst:
-                # 设置缓冲区大小
-                buffer_size = options.get('buffer_size', 1024*1024)  # 默认1MB
+            # 创建写入进程；镜像文件不截断，保留后面的空间给持久化分区
+            with self.open_image_source(iso_path) as src, open(device, 'r+b' if is_image else 'wb') as dst:
+                # 设置缓冲区大小，默认由设备的最佳I/O大小决定
+                buffer_size = self.get_io_size(device, options.get('buffer_size'))
                 
                 written = 0
                 while True:
@@ -1657,17 +2266,17 @@ class USBMaker(QObject):
                     self.write_progress_signal.emit(progress)
                     self.write_status_signal.emit(f"正在写入: {progress}%")
             
-            # 同步数据
-            self.write_status_signal.emit("正在同步数据...")
-            dst.flush()
-            os.sync()
+                # 同步数据
+                self.write_status_signal.emit("正在同步数据...")
+                dst.flush()
+                os.fsync(dst.fileno())
             
             # 验证写入
             if options.get('verify', True):
                 self.write_status_signal.emit("正在验证写入...")
                 
                 # 重新打开设备进行验证
-                with open(iso_path, 'rb') as src, open(device, 'rb') as dst:
+                with self.open_image_source(iso_path) as src, open(device, 'rb') as dst:
                     while True:
                         src_data = src.read(buffer_size)
                         if not src_data:
@@ -1677,43 +2286,137 @@ class USBMaker(QObject):
                         if src_data != dst_data:
                             return False, "验证失败：数据不匹配"
             
+            # 在镜像之后追加持久化分区
+            if options.get('persistence'):
+                success, message = self.add_persistence(
+                    device, iso_path,
+                    size=None if options['persistence'] is True else options['persistence'],
+                    filesystem=options.get('persistence_fs', 'ext4'))
+                if not success:
+                    return False, message
+                return True, f"混合ISO写入成功；{message}"
+            
             return True, "混合ISO写入成功"
             
         except Exception as e:
             error_msg = f"写入失败: {str(e)}"
             self.write_status_signal.emit(error_msg)
             return False, error_msg
+        finally:
+            self.invalidate_device_metadata(device)
     
-    def convert_to_hybrid(self, iso_path):
+    def add_persistence(self, device, iso_path, size=None, filesystem='ext4', label=None):
         """
-        将普通ISO转换为混合ISO
+        在已写入的混合镜像之后追加持久化分区（casper-rw / persistence），不重写镜像
+        :param device: 已写入镜像的设备或镜像文件
+        :param iso_path: 写入的ISO路径（支持 library://<名称>），用于确定镜像大小和发行版
+        :param size: 分区大小，None表示剩余全部空间
+        :param filesystem: ext4/fat32
+        :param label: 卷标，None时根据发行版自动选择
+        :return: (bool, str) 是否成功和消息
+        """
+        try:
+            self.write_status_signal.emit("正在创建持久化分区...")
+            self.forget_flash_manifest(device)
+            if label is None:
+                with self.open_image_source(iso_path) as source:
+                    family = multiboot.detect_loopback_boot(ISOReader(source)).get('family')
+                label = persistence.persistence_label(family)
+            
+            part = persistence.add_persistence_partition(
+                device, self.get_image_size(iso_path), size, filesystem, label)
+            if not os.path.isfile(device):
+                self.reread_partitions(device)
+            
+            message = f"持久化分区已创建: {label}，{part['size'] / 1024 ** 3:.1f} GB"
+            # 发行版只在内核参数带有持久化开关时才使用该分区
+            arg = persistence.persistence_kernel_arg(label)
+            try:
+                changed = self.add_boot_kernel_arg(device, arg)
+            except Exception as e:
+                self.logger.warning(f"修改启动配置失败: {e}")
+                changed = []
+            if changed:
+                message += f"，已在 {', '.join(changed)} 中加入启动参数 {arg}"
+            else:
+                message += f"；未找到可写的启动配置，启动时请在内核参数中加上 {arg}"
+            self.write_status_signal.emit(message)
+            return True, message
+        except Exception as e:
+            error_msg = f"创建持久化分区失败: {str(e)}"
+            self.write_status_signal.emit(error_msg)
+            return False, error_msg
+        finally:
+            self.invalidate_device_metadata(device)
+    
+    def add_boot_kernel_arg(self, device, arg):
+        """
+        在设备上可写卷（如FAT格式的EFI分区）的启动配置中加入内核参数，ISO9660中的配置是只读的，不修改
+        :return: 修改过的配置文件路径列表，没有可写的配置时为空
+        """
+        with BootConfigTransaction(device, mountpoints=self.partition_mountpoints(device)) as transaction:
+            transaction.update_kernel_args([arg], writable_only=True)
+            return [path for _, path, config in transaction.configs if config.modified]
+
+    def convert_to_hybrid(self, iso_path, uefi=None):
+        """
+        将普通ISO原地转换为混合ISO
+        只改写首部的MBR/GPT、isolinux的boot-info表和末尾的备份GPT，
+        被覆盖的原始内容记录在回滚日志中
         :param iso_path: ISO文件路径
+        :param uefi: 是否同时写入GPT和EFI分区，None表示自动判断
         :return: (bool, str) 是否成功和消息
         """
         try:
             self.write_status_signal.emit("正在转换为混合ISO...")
             
-            # 创建临时目录
-            with tempfile.TemporaryDirectory() as temp_dir:
-                # 复制ISO到临时目录
-                temp_iso = os.path.join(temp_dir, 'temp.iso')
-                shutil.copy2(iso_path, temp_iso)
-                
-                # 使用isohybrid转换
-                subprocess.run(['isohybrid', temp_iso], check=True)
-                
-                # 替换原文件
-                shutil.move(temp_iso, iso_path)
+            info = iso_hybrid.make_hybrid(iso_path, uefi=uefi)
+            self.logger.info(f"混合ISO转换完成，写入 {info['bytes_written']} 字节，回滚日志: {info['journal']}")
             
             return True, "转换成功"
             
         except Exception as e:
             return False, f"转换失败: {str(e)}"
+    
+    def rollback_hybrid(self, iso_path):
+        """
+        撤销混合ISO转换，恢复原始ISO
+        :param iso_path: ISO文件路径
+        :return: (bool, str) 是否成功和消息
+        """
+        try:
+            iso_hybrid.rollback_hybrid(iso_path)
+            return True, "已恢复原始ISO"
+        except Exception as e:
+            return False, f"恢复失败: {str(e)}"
 
-    def scan_for_isos(self, directories=None):
+    def get_iso_index(self):
+        """获取ISO索引，第一次使用时才加载索引文件"""
+        if getattr(self, '_iso_index', None) is None:
+            defaults = self.get_default_config()
+            interval = self.config.get('iso_full_rescan_interval')
+            self._iso_index = ISOIndex(
+                self.config.get('iso_index_path') or defaults['iso_index_path'],
+                full_rescan_interval=defaults['iso_full_rescan_interval'] if interval is None else interval
+            )
+        return self._iso_index
+    
+    def get_iso_scan_options(self):
+        """从配置读取目录遍历选项（DirCrawler 参数）"""
+        defaults = self.get_default_config()
+        options = {}
+        for key in ('excludes', 'max_depth', 'same_filesystem', 'skip_network', 'time_budget', 'workers'):
+            name = 'iso_scan_' + key
+            options[key] = self.config[name] if name in self.config else defaults[name]
+        return options
+    
+    def scan_for_isos(self, directories=None, force=False, cancel_check=None):
         """
-        扫描指定目录查找ISO文件
+        扫描指定目录查找ISO文件，找到一个就发出一次 iso_found_signal
+        使用持久化索引：修改时间没变的目录不再列出，超过 iso_full_rescan_interval 或 force 时完整重扫
         :param directories: 要扫描的目录列表，如果为None则扫描默认目录
+        :param force: 是否忽略索引完整重扫
+        :param cancel_check: 返回True时停止扫描，返回已找到的部分
         :return: ISO文件列表
         """
         if not directories:
@@ -1727,20 +2430,22 @@ class USBMaker(QObject):
             ]
         
         iso_files = []
+        stats = {}
+        try:
+            # 各根目录并行遍历，结果边找边发出
+            for entry in self.get_iso_index().scan_iter(directories, force=force, cancel_check=cancel_check,
+                                                        stats=stats, **self.get_iso_scan_options()):
+                # 发出信号通知找到新的ISO
+                self.iso_found_signal.emit(entry.path)
+                iso_files.append(entry.path)
+        except Exception as e:
+            self.logger.error(f"扫描目录 {', '.join(directories)} 时出错: {str(e)}")
         
-        for directory in directories:
-            try:
-                for root, _, files in os.walk(directory):
-                    for file in files:
-                        if file.lower().endswith('.iso'):
-                            full_path = os.path.join(root, file)
-                            # 发出信号通知找到新的ISO
-                            self.iso_found_signal.emit(full_path)
-                            iso_files.append(full_path)
-            except Exception as e:
-                self.logger.error(f"扫描目录 {directory} 时出错: {str(e)}")
-        
-        return iso_files
+        if stats:
+            self.logger.debug(f"扫描ISO: 列出 {stats['listed']} 个目录，沿用索引 {stats['skipped']} 个")
+            for root in stats['truncated']:
+                self.logger.warning(f"扫描目录 {root} 超时或被取消，结果可能不完整")
+        return sorted(iso_files)
     
     def analyze_iso(self, iso_path):
         """
@@ -1790,6 +2495,52 @@ class USBMaker(QObject):
         
         return info
     
+    def list_iso_contents(self, iso_path, path='/', start=0, count=100):
+        """
+        分页列出ISO中某个目录的内容，无需挂载，只读取经过的目录
+        :param iso_path: ISO文件路径
+        :param path: ISO内的目录路径
+        :param start: 起始序号
+        :param count: 每页条数
+        :return: [{'name', 'size', 'is_dir'}, ...]
+        同一个ISO在 close_iso_contents 之前复用同一个 ISOReader，已读过的目录表不会重复读取
+        """
+        try:
+            with self._iso_readers_lock:
+                reader = self._get_iso_reader(iso_path)
+                return [
+                    {'name': entry.name, 'size': entry.size, 'is_dir': entry.is_dir}
+                    for entry in reader.listdir_page(path, start, count)
+                ]
+        except Exception as e:
+            self.logger.error(f"读取ISO目录 {path} 时出错: {str(e)}")
+            return []
+    
+    def _get_iso_reader(self, iso_path):
+        """获取浏览中的ISO的读取器，文件被替换或修改后重新打开"""
+        st = os.stat(iso_path)
+        version = (st.st_size, st.st_mtime_ns)
+        reader, opened = self._iso_readers.get(iso_path, (None, None))
+        if reader is not None and opened != version:
+            reader.close()
+            reader = None
+        if reader is None:
+            reader = ISOReader(iso_path)
+            self._iso_readers[iso_path] = (reader, version)
+        return reader
+    
+    def close_iso_contents(self, iso_path=None):
+        """
+        浏览窗口关闭时释放ISO读取器
+        :param iso_path: ISO文件路径，None表示全部
+        """
+        with self._iso_readers_lock:
+            paths = list(self._iso_readers) if iso_path is None else [iso_path]
+            for path in paths:
+                reader, _ = self._iso_readers.pop(path, (None, None))
+                if reader is not None:
+                    reader.close()
+    
     def monitor_iso_directories(self, directories=None):
         """
         监控目录变化，自动检测新的ISO文件
@@ -1802,37 +2553,90 @@ class USBMaker(QObject):
                 os.path.join(home, 'Desktop')
             ]
         
-        def watch_thread():
+        try:
+            # 停止之前的监控；管理器需要一直被引用，被回收时监控流也会停止
+            self.stop_iso_monitor()
+            
+            # 事件源：Linux inotify，macOS fswatch，其他情况轮询
+            backend_name = fs_events.default_backend().name
+            # 合并事件，下载中的ISO在写完后才通知一次
+            self.iso_coalescer = EventCoalescer(
+                self._handle_fs_batch,
+                ready_filter=lambda path: path.lower().endswith('.iso'),
+                close_events=backend_name == 'inotify'
+            )
+            
+            # 每个目录一个监控流，异常退出时自动重启，卷卸载后重新挂载时恢复监控
+            self.iso_monitor = MonitorManager(
+                directories,
+                self.iso_coalescer.feed,
+                pending=self.iso_coalescer.pending
+            )
+            
+            # 启动监控
+            self.iso_coalescer.start()
+            self.iso_monitor.start()
+            self.logger.info(f"正在监控ISO目录（{backend_name}）: {', '.join(directories)}")
+            
+        except Exception as e:
+            self.logger.error(f"监控目录时出错: {str(e)}")
+    
+    def stop_iso_monitor(self):
+        """停止ISO目录监控"""
+        if self.iso_monitor:
+            self.iso_monitor.stop()
+            self.iso_monitor = None
+        if self.iso_coalescer:
+            self.iso_coalescer.stop()
+            self.iso_coalescer = None
+    
+    def get_iso_monitor_status(self):
+        """
+        获取ISO目录监控的状态
+        :return: 每个目录的状态字典列表（状态、后端、事件数、事件速率、待处理数、最后事件时间、重启次数）
+        """
+        return self.iso_monitor.status() if self.iso_monitor else []
+    
+    def _rescan_iso_roots(self, roots):
+        """
+        监控中断期间没有事件的目录（如重新挂载的卷）重新扫描，报告新出现的ISO
+        在后台线程中运行，不阻塞事件处理
+        """
+        def rescan():
             try:
-                # 创建FSEvents流
-                stream = FSEventStream(
-                    directories,
-                    self._handle_fs_event,
-                    file_events=True
-                )
-                
-                # 启动监控
-                stream.start()
-                
+                index = self.get_iso_index()
+                known = set(index.isos(roots))
+                found = [entry.path for entry in index.scan_iter(roots, **self.get_iso_scan_options())
+                         if entry.path not in known]
+                for path in found:
+                    self.iso_found_signal.emit(path)
+                if found:
+                    self.iso_ready_signal.emit(found)
             except Exception as e:
-                self.logger.error(f"监控目录时出错: {str(e)}")
+                self.logger.error(f"重新扫描 {', '.join(roots)} 时出错: {str(e)}")
         
-        # 在后台线程中启动监控
-        threading.Thread(target=watch_thread, daemon=True).start()
+        threading.Thread(target=rescan, daemon=True).start()
     
-    def _handle_fs_event(self, event):
+    def _handle_fs_batch(self, events):
         """
-        处理文件系统事件
-        :param event: FSEvents事件
+        处理合并后的一批文件系统事件
+        :param events: FSEvent 列表
         """
         try:
-            path = event.name
+            # 运行期间直接更新索引，下次扫描不必重新列出这些目录
+            if getattr(self, '_iso_index', None) is not None:
+                self._iso_index.apply_events(events)
             
-            # 检查是否是新增的ISO文件
-            if (event.mask & FSEvents.Create and
-                path.lower().endswith('.iso')):
-                # 发出信号通知找到新的ISO
+            # 下载或复制完成的ISO文件
+            ready = [event.name for event in events if event.mask == FSEvents.Ready]
+            for path in ready:
                 self.iso_found_signal.emit(path)
+            if ready:
+                self.iso_ready_signal.emit(ready)
+            
+            rescans = [event.name for event in events if event.mask == FSEvents.Rescan and event.name]
+            if rescans:
+                self._rescan_iso_roots(rescans)
                 
         except Exception as e:
             self.logger.error(f"处理文件系统事件时出错: {str(e)}")
@@ -1844,12 +2648,13 @@ class USBMaker(QObject):
             self.should_cancel = False
             
             # 获取文件大小
-            total_size = os.path.getsize(iso_path)
+            total_size = self.get_image_size(iso_path)
+            self.forget_flash_manifest(device_path)
             
             # 打开源文件和目标设备
-            with open(iso_path, 'rb') as src, open(device_path, 'wb') as dst:
+            with self.open_image_source(iso_path) as src, open(device_path, 'wb') as dst:
                 written = 0
-                buffer_size = 1024 * 1024  # 1MB缓冲区
+                buffer_size = self.get_io_size(device_path)
                 start_time = time.time()
                 
                 while written < total_size:
@@ -1893,6 +2698,7 @@ class USBMaker(QObject):
         finally:
             self.is_writing = False
             self.should_cancel = False
+            self.invalidate_device_metadata(device_path)
     
     def cancel_writing(self):
         """取消写入操作"""